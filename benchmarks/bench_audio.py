@@ -0,0 +1,170 @@
+"""Measures audio-to-light latency, driven by a WAV file.
+
+A file of decaying tone bursts (or any WAV with --hits giving their times)
+is played in real time through a WavSource, so each block arrives when it
+would from a capture device. The AudioInput analyses it on the Engine's
+input thread and its level CC drives a light, streamed over DTLS to a
+local FakeBridge. For each hit, the latency is the time from the hit's
+first sample to the arrival of the first frame showing the light above
+half level; it is also reported from the end of the block holding the
+first sample, leaving out the wait for the block to fill.
+
+The target is one frame at 50 Hz (20 ms) for every hit with --immediate.
+On the frame clock a hit also waits for the next tick, up to one more
+frame period, so the worst case there is checked against the target plus
+a period.
+
+Run with: python benchmarks/bench_audio.py [--immediate]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+import numpy as np
+from midihue.audio import AudioInput, WavSource, DEFAULT_HOP
+from midihue.engine import Engine, DEFAULT_FRAME_RATE
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueClient, HueStream
+from midihue.mapping import Mapping
+
+TARGET = 1.0 / 50
+RATE = 44100
+CHANNEL = 15
+CONTROL = 20
+BANDS = 8
+THRESHOLD = 0x8000
+
+
+def generate(path, count, interval):
+    """Writes `count` decaying 1 kHz hits, `interval` seconds apart"""
+    t = np.arange(int((count + 1) * interval * RATE)) / RATE
+    signal = np.zeros_like(t)
+    hits = [interval * (i + 0.5) for i in range(count)]
+    for start in hits:
+        after = t >= start
+        signal[after] += 0.5 * np.exp(-(t[after] - start) / 0.03) * \
+            np.sin(2 * np.pi * 1000.0 * t[after])
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(RATE)
+        file.writeframes((signal * 32767).astype('<i2').tobytes())
+    return hits
+
+
+def make_mapping():
+    # The level CC follows the band CCs
+    return Mapping({
+        'lights': [{'id': 1, 'colorspace': 'rgb', 'rgb': [0, 0, 0]}],
+        'mappings': [{'type': 'control_change', 'channel': CHANNEL,
+                      'control': CONTROL + BANDS, 'light': 1,
+                      'param': 'r'}],
+    })
+
+
+def run(path, rate, immediate, hop):
+    arrivals = []
+    mapping = make_mapping()
+    with FakeBridge() as bridge, tempfile.TemporaryDirectory() as tmp:
+        client = HueClient(credentials_path=os.path.join(tmp, 'creds'),
+                           bridge_ip=bridge.host,
+                           bridge_port=bridge.http_port)
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port)
+        engine = Engine(stream, mapping.lights, mapping.dispatch,
+                        rate=rate, immediate=immediate)
+        source = WavSource(path, block=hop)
+        audio = AudioInput(source, bands=BANDS, channel=CHANNEL,
+                           control=CONTROL, hop=hop)
+        stream.start()
+        bridge.on_frame = lambda received, data: arrivals.append(
+            (received, HueStream.Message.decode(data)[1][0]))
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+        cpu_start = time.process_time()
+        # Read on this thread, as the engine's input thread would
+        for msg in audio:
+            engine.submit(msg)
+        cpu = time.process_time() - cpu_start
+        elapsed = time.perf_counter() - source.started
+        time.sleep(2 * engine.period)
+        engine.stop()
+        thread.join()
+        stream.stop()
+    return source.started, arrivals, cpu / elapsed
+
+
+def latencies(started, arrivals, hits, hop):
+    """Latency of each hit from its first sample and from the end of its
+    block, or None for a hit no frame showed
+    """
+    results = []
+    for hit in hits:
+        block_end = (int(hit * RATE) // hop + 1) * hop / RATE
+        lit = [received for received, level in arrivals
+               if received > started + hit and level >= THRESHOLD]
+        if not lit:
+            results.append(None)
+            continue
+        results.append((lit[0] - started - hit,
+                        lit[0] - started - block_end))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--file', help='WAV file to play, by default '
+                        'generated hits')
+    parser.add_argument('--hits', help='Comma separated hit times (s) in '
+                        '--file')
+    parser.add_argument('--count', type=int, default=20,
+                        help='Number of generated hits')
+    parser.add_argument('--interval', type=float, default=0.25,
+                        help='Seconds between generated hits')
+    parser.add_argument('--hop', type=int, default=DEFAULT_HOP)
+    parser.add_argument('--frame-rate', type=float,
+                        default=DEFAULT_FRAME_RATE)
+    parser.add_argument('--immediate', action='store_true')
+    args = parser.parse_args()
+    if (args.file is None) != (args.hits is None):
+        parser.error('--file and --hits go together')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.file is None:
+            path = os.path.join(tmp, 'hits.wav')
+            hits = generate(path, args.count, args.interval)
+        else:
+            path = args.file
+            hits = [float(hit) for hit in args.hits.split(',')]
+        started, arrivals, cpu = run(path, args.frame_rate, args.immediate,
+                                     args.hop)
+    results = latencies(started, arrivals, hits, args.hop)
+
+    found = [result for result in results if result is not None]
+    mode = 'immediate' if args.immediate else 'clocked'
+    print(f'{len(hits)} hits, {len(arrivals)} frames ({mode}, '
+          f'{args.frame_rate:g} Hz, hop {args.hop} samples = '
+          f'{args.hop / RATE * 1000:.1f} ms)')
+    if not found:
+        print('no hit reached the light')
+        sys.exit(1)
+    for label, index in (('from hit  ', 0), ('from block', 1)):
+        values = [result[index] * 1000 for result in found]
+        print(f'{label} ms  mean {statistics.mean(values):6.2f}  '
+              f'median {statistics.median(values):6.2f}  '
+              f'max {max(values):6.2f}')
+    print(f'process cpu {cpu * 100:5.1f}% of real time (including the bridge)')
+    missed = len(results) - len(found)
+    worst = max(result[0] for result in found)
+    target = TARGET if args.immediate else TARGET + 1.0 / args.frame_rate
+    print(f'{missed} hits missed; worst {worst * 1000:.2f} ms, target '
+          f'{target * 1000:.0f} ms: {"ok" if worst < target else "MISSED"}')
+    if missed or worst >= target:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
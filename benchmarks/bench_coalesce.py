@@ -0,0 +1,59 @@
+"""Frame time while a fader is slammed: a burst of CCs per frame applied
+one by one on the input thread, compared with coalescing them to the
+latest value per controller before the frame is rendered. Reports the
+time spent on the frame thread (flush) and in total, including submit.
+
+Run with: python benchmarks/bench_coalesce.py
+"""
+import time
+from mido import Message
+from midihue.engine import Engine
+from midihue.hue import HueStream
+from midihue.mapping import Mapping, DEFAULT_MAPPING
+
+FRAMES = 200
+CONTROLS = (77, 78, 79)
+
+
+class NullSocket:
+
+    def send(self, data):
+        pass
+
+    def recv(self, bufsize, flags=0):
+        raise BlockingIOError
+
+
+def bench(burst, coalesce):
+    mapping = Mapping(DEFAULT_MAPPING)
+    stream = HueStream(1, client=None)
+    stream._socket = NullSocket()
+    engine = Engine(stream, mapping.lights, mapping.dispatch,
+                    coalesce=coalesce)
+    messages = [Message('control_change', control=CONTROLS[i % 3],
+                        value=i % 128) for i in range(burst)]
+    flush = total = 0.0
+    for _ in range(FRAMES):
+        start = time.perf_counter()
+        for msg in messages:
+            engine.submit(msg)
+        submitted = time.perf_counter()
+        engine.flush()
+        end = time.perf_counter()
+        flush += end - submitted
+        total += end - start
+    return flush / FRAMES, total / FRAMES
+
+
+def main():
+    print('                 per message (us/frame)   coalesced (us/frame)')
+    print('CCs/frame         flush        total       flush        total')
+    for burst in (3, 30, 300, 3000):
+        each = bench(burst, coalesce=False)
+        coalesced = bench(burst, coalesce=True)
+        print(f'{burst:>9}   ' + ''.join(f'{t * 1e6:>12.1f}'
+                                         for t in each + coalesced))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Conversion throughput of a 20 light bank to stream values: the linear
+rgb_int of LightBank.convert, against the ColorPipeline's RGB curve and
+xy + brightness encodings, and xy computed directly without tables.
+
+Run with: python benchmarks/bench_color.py
+"""
+import random
+import time
+from array import array
+from midihue.color import ColorPipeline, GAMUTS, clamp_to_gamut, \
+    rgb_to_xyb
+from midihue.light import LightBank
+
+N_LIGHTS = 20
+FRAMES = 2000
+
+
+def make_bank():
+    rng = random.Random(1)
+    bank = LightBank()
+    for light_id in range(1, N_LIGHTS + 1):
+        bank.add(light_id).hsv = (rng.random(), rng.random(), rng.random())
+    return bank
+
+
+def direct_xy(bank, output):
+    gamut = GAMUTS['C']
+    rgb = bank.rgb
+    for slot in range(len(bank)):
+        i = slot * 3
+        x, y, luminance = rgb_to_xyb(rgb[i], rgb[i + 1], rgb[i + 2])
+        x, y = clamp_to_gamut(x, y, gamut)
+        output[i] = int(x * 0xffff + 0.5)
+        output[i + 1] = int(y * 0xffff + 0.5)
+        output[i + 2] = int(min(luminance, 1.0) ** 2.2 * 0xffff + 0.5)
+
+
+def bench(convert):
+    bank = make_bank()
+    output = array('H', bank.rgb_int)
+    times = []
+    for frame in range(FRAMES):
+        bank[frame % N_LIGHTS].h = (frame % 97) / 97
+        start = time.perf_counter()
+        bank.convert()
+        if convert is not None:
+            convert(bank, output)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times):
+    ordered = sorted(times)
+    mean = sum(times) / len(times)
+    p99 = ordered[int(0.99 * len(ordered))]
+    return f'mean {mean * 1e6:6.1f} us  p99 {p99 * 1e6:6.1f} us  ' \
+           f'({mean / N_LIGHTS * 1e9:5.0f} ns/light)'
+
+
+def main():
+    started = time.perf_counter()
+    rgb = ColorPipeline(gamma=2.2)
+    xy = ColorPipeline('xy', gamma=2.2)
+    built = time.perf_counter() - started
+    print(f'{N_LIGHTS} lights, {FRAMES} frames '
+          f'(tables built in {built * 1000:.0f} ms)')
+    cases = (
+        ('linear rgb_int', None),
+        ('pipeline rgb', rgb.convert),
+        ('pipeline xy', xy.convert),
+        ('direct xy', direct_xy),
+    )
+    bench(rgb.convert)  # Warm up
+    for label, convert in cases:
+        print(f'  {label:15} {summary(bench(convert))}')
+
+
+if __name__ == '__main__':
+    main()
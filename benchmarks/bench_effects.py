@@ -0,0 +1,84 @@
+"""Frame render cost of 50 concurrent effects across 20 lights, with
+waveforms from lookup tables and computed directly, against the 20 ms
+period of a 50 Hz frame clock.
+
+Run with: python benchmarks/bench_effects.py
+"""
+import random
+import time
+from midihue.effects import Effects, LFO, Chase, Strobe, Fade, WAVEFORMS
+from midihue.hue import HueStream
+from midihue.light import LightBank
+
+N_LIGHTS = 20
+N_EFFECTS = 50
+FRAMES = 2000
+PERIOD = 0.02
+
+
+def make_effects(bank, lookup):
+    rng = random.Random(1)
+    effects = Effects(budget=PERIOD)
+    lights = list(bank)
+    waveforms = sorted(WAVEFORMS)
+    for i in range(N_EFFECTS):
+        targets = rng.sample(lights, rng.randrange(4, N_LIGHTS + 1))
+        param = rng.choice('hsv')
+        kind = i % 5
+        if kind < 2:
+            effect = LFO(targets, param, waveform=rng.choice(waveforms),
+                         rate=rng.uniform(0.1, 4.0), depth=rng.random(),
+                         spread=rng.random(), lookup=lookup)
+        elif kind == 2:
+            effect = Chase(targets, param, rate=rng.uniform(0.5, 4.0))
+        elif kind == 3:
+            effect = Strobe(targets, param, rate=rng.uniform(2.0, 15.0))
+        else:
+            effect = Fade(targets, param, duration=FRAMES * PERIOD * 2)
+        effects.add(effect)
+    return effects
+
+
+def bench(lookup):
+    bank = LightBank()
+    for light_id in range(1, N_LIGHTS + 1):
+        bank.add(light_id)
+    effects = make_effects(bank, lookup)
+    stream = HueStream(1, client=None)
+
+    effect_times = []
+    frame_times = []
+    for frame in range(FRAMES):
+        now = frame * PERIOD
+        start = time.perf_counter()
+        effects.render(now)
+        rendered = time.perf_counter()
+        stream.render(bank, now)
+        end = time.perf_counter()
+        effect_times.append(rendered - start)
+        frame_times.append(end - start)
+    return effect_times, frame_times, effects.overruns
+
+
+def summary(times):
+    ordered = sorted(times)
+    mean = sum(times) / len(times)
+    p99 = ordered[int(0.99 * len(ordered))]
+    return f'mean {mean * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us  ' \
+           f'({mean / PERIOD:.1%} of frame)'
+
+
+def main():
+    print(f'{N_EFFECTS} effects, {N_LIGHTS} lights, {FRAMES} frames')
+    bench(True)  # Warm up
+    for lookup in (True, False):
+        effect_times, frame_times, overruns = bench(lookup)
+        label = 'lookup tables' if lookup else 'computed waves'
+        print(f'{label}:')
+        print(f'  effects         {summary(effect_times)}')
+        print(f'  effects+encode  {summary(frame_times)}')
+        print(f'  budget overruns {overruns}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Compares Light channel write + rgb_int read throughput against the
+original __getattr__/__setattr__ implementation.
+
+Run with: python benchmarks/bench_light.py
+"""
+import timeit
+from collections import namedtuple
+from colorsys import rgb_to_hsv, hsv_to_rgb
+from midihue import Light
+
+
+def _clampunit(i):
+    return max(0., min(1.0, i))
+
+
+RGB = namedtuple('RGB', ['r', 'g', 'b'])
+HSV = namedtuple('HSV', ['h', 's', 'v'])
+
+
+class LegacyLight:
+    """Light as originally implemented"""
+
+    def __init__(self, light_id, colorspace='hsv', bits_per_channel=16):
+        assert colorspace in ('rgb', 'hsv')
+        self.light_id = light_id
+        self._colorspace = colorspace
+        self._bits_per_channel = bits_per_channel
+        if colorspace == 'hsv':
+            self._hsv = HSV(0, 0, 0)
+        else:
+            self._rgb = RGB(0, 0, 0)
+
+    def __getattr__(self, name):
+        if name in ('h', 's', 'v'):
+            return getattr(self.hsv, name)
+        elif name in ('r', 'g', 'b'):
+            return getattr(self.rgb, name)
+        else:
+            raise AttributeError(f'Attribute {name} not found')
+
+    def __setattr__(self, name, value):
+        if name in ('r', 'g', 'b'):
+            rgb = list(self.rgb)
+            rgb['rgb'.index(name)] = _clampunit(value)
+            self.rgb = rgb
+        elif name in ('h', 's', 'v'):
+            hsv = list(self.hsv)
+            hsv['hsv'.index(name)] = _clampunit(value)
+            self.hsv = hsv
+        else:
+            object.__setattr__(self, name, value)
+
+    @property
+    def rgb(self):
+        if self._colorspace == 'hsv':
+            return RGB(*hsv_to_rgb(*self._hsv))
+        else:
+            return self._rgb
+
+    @rgb.setter
+    def rgb(self, value):
+        rgb = RGB(_clampunit(value[0]), _clampunit(value[1]),
+                  _clampunit(value[2]))
+        if self._colorspace == 'hsv':
+            self._hsv = HSV(*rgb_to_hsv(*rgb))
+        else:
+            self._rgb = rgb
+
+    @property
+    def rgb_int(self):
+        max_int = (1 << self._bits_per_channel) - 1
+        rgb = self.rgb
+        return (int(rgb.r * max_int), int(rgb.g * max_int),
+                int(rgb.b * max_int))
+
+    @property
+    def hsv(self):
+        if self._colorspace == 'hsv':
+            return self._hsv
+        else:
+            return HSV(*rgb_to_hsv(*self._rgb))
+
+    @hsv.setter
+    def hsv(self, value):
+        hsv = HSV(_clampunit(value[0]), _clampunit(value[1]),
+                  _clampunit(value[2]))
+        if self._colorspace == 'hsv':
+            self._hsv = hsv
+        else:
+            self._rgb = RGB(*hsv_to_rgb(*hsv))
+
+
+def bench(cls, colorspace, channel, number=200000):
+    light = cls(1, colorspace=colorspace)
+    values = [i / 127.0 for i in range(128)]
+
+    def write_read():
+        for value in values:
+            setattr(light, channel, value)
+            light.rgb_int
+
+    def read_only():
+        for _ in values:
+            light.rgb_int
+
+    n = number // len(values)
+    per_op = n * len(values)
+    return (timeit.timeit(write_read, number=n) / per_op,
+            timeit.timeit(read_only, number=n) / per_op)
+
+
+def main():
+    print(f'{"case":<16} {"legacy (us)":>12} {"slots (us)":>11} '
+          f'{"speedup":>8}')
+    for colorspace, channel in (('hsv', 'h'), ('hsv', 'r'),
+                                ('rgb', 'r'), ('rgb', 'h')):
+        legacy = bench(LegacyLight, colorspace, channel)
+        current = bench(Light, colorspace, channel)
+        for label, old, new in (('set+read', legacy[0], current[0]),
+                                ('read', legacy[1], current[1])):
+            case = f'{colorspace}.{channel} {label}'
+            print(f'{case:<16} {old * 1e6:>12.3f} {new * 1e6:>11.3f} '
+                  f'{old / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Dispatches a dense stream of CC messages through a Mapping with 512
+mappings, compared with scanning the mapping list for each message.
+
+Run with: python benchmarks/bench_mapping.py
+"""
+import random
+import time
+from mido import Message
+from midihue.mapping import Mapping
+
+N_LIGHTS = 20
+PARAMS = ('h', 's', 'v')
+
+
+def make_config():
+    mappings = []
+    for channel in range(16):
+        for control in range(32):
+            mappings.append({
+                'type': 'control_change',
+                'channel': channel,
+                'control': control,
+                'light': (channel * 32 + control) % N_LIGHTS + 1,
+                'param': PARAMS[control % len(PARAMS)],
+            })
+    return {'mappings': mappings}
+
+
+def linear_dispatch(config, mapping):
+    # The equivalent of an if/elif chain over every configured mapping
+    specs = [(spec['channel'], spec['control'],
+              mapping.light(spec['light']), spec['param'])
+             for spec in config['mappings']]
+
+    def dispatch(msg):
+        for channel, control, light, param in specs:
+            if msg.channel == channel and msg.control == control:
+                setattr(light, param, msg.value / 127.0)
+                return True
+        return False
+    return dispatch
+
+
+def bench(dispatch, messages):
+    start = time.perf_counter()
+    for msg in messages:
+        dispatch(msg)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main():
+    config = make_config()
+    mapping = Mapping(config)
+    rng = random.Random(1)
+    messages = [Message('control_change', channel=rng.randrange(16),
+                        control=rng.randrange(32), value=rng.randrange(128))
+                for _ in range(100000)]
+
+    t_table = bench(mapping.dispatch, messages)
+    t_linear = bench(linear_dispatch(config, mapping), messages)
+    print(f'{len(config["mappings"])} mappings, {len(messages)} messages')
+    print(f'table dispatch:  {t_table * 1e6:8.3f} us/msg '
+          f'({1 / t_table:,.0f} msg/s)')
+    print(f'linear dispatch: {t_linear * 1e6:8.3f} us/msg '
+          f'({1 / t_linear:,.0f} msg/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Compares HueStream.Message encoding against the original encoder: adding
+lights one by one, and a whole LightBank per frame as the stream renders
+one when every light changed. Also times the stream API v2 format with a
+channel per light, light by light and a whole LightBank at once.
+
+Run with: python benchmarks/bench_message.py
+"""
+import timeit
+from array import array
+from midihue.hue import HueStream
+from midihue.light import LightBank
+
+HEADER = HueStream.Message._HEADER
+CONFIGURATION_ID = '1a8d99cc-967b-44f2-9202-43f976c0fa6b'
+
+
+def legacy_bytes(lightdata):
+    # Encoder as originally implemented, concatenating per light
+    b = HEADER
+    for light_id, rgb in lightdata.items():
+        b += b'\x00' + light_id.to_bytes(2, byteorder='big')
+        b += rgb[0].to_bytes(2, byteorder='big')
+        b += rgb[1].to_bytes(2, byteorder='big')
+        b += rgb[2].to_bytes(2, byteorder='big')
+    return b
+
+
+def bench(n_lights, number=20000):
+    lights = [(i + 1, (i * 1000, 65535 - i * 1000, 32768))
+              for i in range(n_lights)]
+
+    def legacy():
+        lightdata = {}
+        for light_id, rgb in lights:
+            lightdata[light_id] = rgb
+        return legacy_bytes(lightdata)
+
+    message = HueStream.Message()
+    bank = LightBank()
+    for light_id, _ in lights:
+        bank.add(light_id)
+    bank.rgb_int[:] = array('H', [c for _, rgb in lights for c in rgb])
+    bank_message = HueStream.Message()
+
+    def whole_bank():
+        bank_message.add_bank(bank)
+        return bank_message.buffer
+
+    def preallocated():
+        for light_id, rgb in lights:
+            message.add(light_id, rgb)
+        return message.buffer
+
+    message_v2 = HueStream.Message(configuration=(
+        CONFIGURATION_ID,
+        {light_id: (channel,) for channel, (light_id, _) in enumerate(lights)}
+    ))
+
+    def channels():
+        for light_id, rgb in lights:
+            message_v2.add(light_id, rgb)
+        return message_v2.buffer
+
+    bank_message_v2 = HueStream.Message(
+        configuration=message_v2.configuration
+    )
+
+    def whole_bank_v2():
+        bank_message_v2.add_bank(bank)
+        return bank_message_v2.buffer
+
+    assert legacy() == preallocated() == whole_bank()
+    assert HueStream.Message.decode(channels()) == \
+        HueStream.Message.decode(whole_bank_v2())
+    assert len(HueStream.Message.decode(channels())) == n_lights
+    t_legacy = timeit.timeit(legacy, number=number) / number
+    t_new = timeit.timeit(preallocated, number=number) / number
+    t_bank = timeit.timeit(whole_bank, number=number) / number
+    t_v2 = timeit.timeit(channels, number=number) / number
+    t_bank_v2 = timeit.timeit(whole_bank_v2, number=number) / number
+    return t_legacy, t_new, t_bank, t_v2, t_bank_v2
+
+
+def main():
+    print(f'{"lights":>6} {"legacy (us)":>12} {"prealloc (us)":>14} '
+          f'{"speedup":>8} {"bank (us)":>10} {"speedup":>8} {"v2 (us)":>8} '
+          f'{"v2 bank (us)":>13}')
+    for n_lights in (1, 2, 5, 10, 15, 20):
+        t_legacy, t_new, t_bank, t_v2, t_bank_v2 = bench(n_lights)
+        print(f'{n_lights:>6} {t_legacy * 1e6:>12.2f} {t_new * 1e6:>14.2f} '
+              f'{t_legacy / t_new:>7.1f}x {t_bank * 1e6:>10.2f} '
+              f'{t_legacy / t_bank:>7.1f}x {t_v2 * 1e6:>8.2f} '
+              f'{t_bank_v2 * 1e6:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Frame rate and staleness of paced stream output.
+
+The engine renders a new state every frame at --frame-rate (by default
+well above what the bridge takes) and streams it over DTLS to a local
+FakeBridge, unpaced and then through a Pacer at --send-rate, fixed and
+adaptive. Each state is numbered in a light's red channel, so the
+staleness of every frame the bridge receives is the time since its state
+was rendered. Pacing should bring the bridge's rate down to the limit
+while keeping frames within about one send period of their state, as the
+newest state is sent rather than a queue of them.
+
+Run with: python benchmarks/bench_pacing.py [--frame-rate 100]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from midihue import LightBank
+from midihue.engine import Engine
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueClient, HueStream
+from midihue.pacing import Pacer, DEFAULT_RATE
+
+
+def run(frame_rate, duration, pacer):
+    bank = LightBank()
+    light = bank.add(1)
+    rendered = []
+    arrivals = []
+
+    def handle(index):
+        light.rgb = (index / 0xffff, 0.0, 0.0)
+        rendered.append(time.perf_counter())
+
+    with FakeBridge() as bridge, tempfile.TemporaryDirectory() as tmp:
+        client = HueClient(credentials_path=os.path.join(tmp, 'creds'),
+                           bridge_ip=bridge.host,
+                           bridge_port=bridge.http_port)
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port,
+                           pacer=pacer)
+        engine = Engine(stream, bank, handle, rate=frame_rate)
+        stream.start()
+        bridge.on_frame = lambda received, data: arrivals.append(
+            (received, HueStream.Message.decode(data)[1][0]))
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+        start = time.perf_counter()
+        index = 1
+        while time.perf_counter() - start < duration:
+            engine.submit(index)
+            index += 1
+            time.sleep(engine.period)
+        engine.stop()
+        thread.join()
+        stream.stop()
+
+    # Age of each state received, from when it was rendered
+    staleness = [received - rendered[value - 1]
+                 for received, value in arrivals
+                 if 0 < value <= len(rendered)]
+    return len(arrivals) / duration, staleness
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frame-rate', type=float, default=100.0)
+    parser.add_argument('--send-rate', type=float, default=DEFAULT_RATE)
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f'{"pacing":>9} {"bridge Hz":>10} {"stale ms":>9} {"max":>7} '
+          f'{"held":>6} {"dropped":>8}')
+    for name, pacer in (
+            ('none', None),
+            ('fixed', Pacer(args.send_rate)),
+            ('adaptive', Pacer(args.send_rate, adaptive=True))):
+        rate, staleness = run(args.frame_rate, args.duration, pacer)
+        values = [s * 1000 for s in staleness] or [float('nan')]
+        held = pacer.held if pacer else 0
+        dropped = pacer.dropped if pacer else 0
+        print(f'{name:>9} {rate:10.1f} {statistics.mean(values):9.2f} '
+              f'{max(values):7.2f} {held:6d} {dropped:8d}')
+
+
+if __name__ == '__main__':
+    main()
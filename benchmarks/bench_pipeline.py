@@ -0,0 +1,158 @@
+"""End-to-end benchmark of the MIDI to bridge pipeline.
+
+Synthetic control changes are fed into the same Mapping, Engine and
+HueStream that `midi-hue` runs, streaming over DTLS to a local FakeBridge.
+Reports MIDI-to-packet latency percentiles (from queueing a message to the
+bridge decrypting the first frame that reflects it), the jitter of frame
+arrival and the CPU time spent per frame.
+
+Run with: python benchmarks/bench_pipeline.py [--immediate] [--duration 5]
+"""
+import argparse
+import os
+import queue
+import statistics
+import tempfile
+import threading
+import time
+from mido import Message
+from midihue.engine import Engine, DEFAULT_FRAME_RATE
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueClient, HueStream
+from midihue.mapping import Mapping
+
+# Light 1 carries the measured value, the rest make up a full frame
+MEASURED_LIGHT = 1
+CONTROL = 1
+
+
+class SyntheticInput:
+    """A mido-style input port fed from a queue"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            yield msg
+
+    def put(self, msg):
+        self._queue.put(msg)
+
+    def close(self):
+        self._queue.put(None)
+
+
+def make_mapping(n_lights):
+    lights = [{'id': light_id, 'colorspace': 'rgb', 'rgb': [0, 0, 0]}
+              for light_id in range(1, n_lights + 1)]
+    mappings = [{'type': 'control_change', 'channel': 0, 'control': CONTROL,
+                 'light': MEASURED_LIGHT, 'param': 'r'}]
+    return Mapping({'lights': lights, 'mappings': mappings})
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(duration, rate, msg_rate, immediate, n_lights):
+    injected = {}
+    latencies = []
+    arrivals = []
+    last_value = [None]
+
+    def on_frame(received, data):
+        arrivals.append(received)
+        r = HueStream.Message.decode(data).get(MEASURED_LIGHT, (0,))[0]
+        value = round(r / 65535 * 127)
+        if value != last_value[0] and value in injected:
+            latencies.append(received - injected[value])
+        last_value[0] = value
+
+    with FakeBridge() as bridge, tempfile.TemporaryDirectory() as tmp:
+        client = HueClient(credentials_path=os.path.join(tmp, 'creds'),
+                           bridge_ip=bridge.host,
+                           bridge_port=bridge.http_port)
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port)
+        mapping = make_mapping(n_lights)
+        engine = Engine(stream, mapping.lights, mapping.dispatch,
+                        rate=rate, immediate=immediate)
+        inport = SyntheticInput()
+        engine_cpu = []
+
+        def run_engine():
+            start = time.thread_time()
+            engine.run(inport)
+            engine_cpu.append(time.thread_time() - start)
+
+        stream.start()
+        bridge.on_frame = on_frame
+        thread = threading.Thread(target=run_engine)
+        cpu_start = time.process_time()
+        thread.start()
+
+        # Values 1-127 in turn so consecutive messages always differ
+        period = 1.0 / msg_rate
+        deadline = time.perf_counter()
+        end = deadline + duration
+        value = 0
+        while deadline < end:
+            value = value % 127 + 1
+            deadline += period
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            injected[value] = time.perf_counter()
+            inport.put(Message('control_change', channel=0,
+                               control=CONTROL, value=value))
+
+        engine.stop()
+        thread.join()
+        inport.close()
+        process_cpu = time.process_time() - cpu_start
+        stream.stop()
+
+    intervals = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    return {
+        'frames': stream.frames_sent,
+        'latencies': latencies,
+        'intervals': intervals,
+        'engine_cpu': engine_cpu[0] / max(1, stream.frames_sent),
+        'process_cpu': process_cpu / max(1, stream.frames_sent),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--frame-rate', type=float,
+                        default=DEFAULT_FRAME_RATE)
+    parser.add_argument('--msg-rate', type=float, default=200.0,
+                        help='Synthetic MIDI messages per second')
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--immediate', action='store_true')
+    args = parser.parse_args()
+
+    result = run(args.duration, args.frame_rate, args.msg_rate,
+                 args.immediate, args.lights)
+    latencies = [t * 1000 for t in result['latencies']]
+    intervals = [t * 1000 for t in result['intervals']]
+    mode = 'immediate' if args.immediate else 'clocked'
+    print(f'{result["frames"]} frames in {args.duration:.1f}s '
+          f'({mode}, {args.frame_rate:g} Hz, {args.msg_rate:g} msg/s, '
+          f'{args.lights} lights)')
+    print(f'latency ms   p50 {percentile(latencies, 0.5):6.2f}  '
+          f'p90 {percentile(latencies, 0.9):6.2f}  '
+          f'p99 {percentile(latencies, 0.99):6.2f}  '
+          f'max {max(latencies):6.2f}  (n={len(latencies)})')
+    print(f'interval ms  mean {statistics.mean(intervals):6.2f}  '
+          f'jitter (stdev) {statistics.pstdev(intervals):6.2f}  '
+          f'p99 {percentile(intervals, 0.99):6.2f}')
+    print(f'cpu us/frame engine thread {result["engine_cpu"] * 1e6:7.1f}  '
+          f'whole process {result["process_cpu"] * 1e6:7.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Replays a recorded MIDI session through the full pipeline.
+
+A session recorded with `midi-hue --record-midi` (or a synthetic one made
+with --generate) is fed into the same Mapping, Engine and HueStream that
+`midi-hue` runs, streaming over DTLS to a local FakeBridge, so the same
+load can be measured again after every change. Reports throughput, frame
+intervals and CPU time per frame.
+
+With --deterministic, each message is instead rendered and sent as its
+own frame, which makes the frame output repeatable: record a reference
+with --deterministic --frames REFERENCE, then compare later runs with it
+using --check REFERENCE.
+
+Run with: python benchmarks/bench_replay.py SESSION [--speed 0]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from mido import Message
+from midihue.engine import Engine, DEFAULT_FRAME_RATE
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueClient, HueStream
+from midihue.mapping import Mapping
+from midihue.recording import Recorder, Recording, ReplayPort, FRAMES
+
+
+def make_mapping(n_lights):
+    lights = [{'id': light_id, 'colorspace': 'rgb', 'rgb': [0, 0, 0]}
+              for light_id in range(1, n_lights + 1)]
+    mappings = [{'type': 'control_change', 'channel': 0,
+                 'control': light_id, 'light': light_id, 'param': 'r'}
+                for light_id in range(1, n_lights + 1)]
+    return {'lights': lights, 'mappings': mappings}
+
+
+def generate(path, duration, msg_rate, n_lights):
+    """Writes a session sweeping the control of each light in turn"""
+    period = 1.0 / msg_rate
+    with Recorder(path) as recorder:
+        for i in range(int(duration * msg_rate)):
+            control = i % n_lights + 1
+            recorder.record(Message('control_change', channel=0,
+                                    control=control, value=i % 128),
+                            now=i * period)
+
+
+def run(path, mapping, rate, speed, immediate, coalesce, frames=None,
+        deterministic=False):
+    arrivals = []
+    with FakeBridge() as bridge, tempfile.TemporaryDirectory() as tmp:
+        client = HueClient(credentials_path=os.path.join(tmp, 'creds'),
+                           bridge_ip=bridge.host,
+                           bridge_port=bridge.http_port)
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port)
+        if frames is not None:
+            stream.recorder = Recorder(frames, FRAMES)
+        engine = Engine(stream, mapping.lights, mapping.dispatch,
+                        rate=rate, immediate=immediate, coalesce=coalesce)
+        port = ReplayPort(path, speed=0 if deterministic else speed)
+        stream.start()
+        bridge.on_frame = lambda received, data: arrivals.append(received)
+        cpu_start = time.process_time()
+        started = time.perf_counter()
+        count = 0
+        if deterministic:
+            for msg in port:
+                engine.submit(msg)
+                engine.flush()
+                count += 1
+        else:
+            thread = threading.Thread(target=engine.run)
+            thread.start()
+            for msg in port:
+                engine.submit(msg)
+                count += 1
+            # Let the last messages reach a frame
+            time.sleep(2 * engine.period)
+            engine.stop()
+            thread.join()
+        elapsed = time.perf_counter() - started
+        process_cpu = time.process_time() - cpu_start
+        stream.stop()
+        if stream.recorder is not None:
+            stream.recorder.close()
+
+    intervals = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    return {
+        'messages': count,
+        'frames': stream.frames_sent,
+        'elapsed': elapsed,
+        'intervals': intervals or [0.0],
+        'process_cpu': process_cpu / max(1, stream.frames_sent),
+    }
+
+
+def compare(path, reference):
+    """Returns the index of the first differing light state, or None"""
+    with Recording(path) as frames, Recording(reference) as expected:
+        states, expected_states = list(frames.states()), \
+            list(expected.states())
+    for index, (state, expected_state) in \
+            enumerate(zip(states, expected_states)):
+        if state != expected_state:
+            return index
+    if len(states) != len(expected_states):
+        return min(len(states), len(expected_states))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('session', help='MIDI recording to replay')
+    parser.add_argument('--generate', action='store_true',
+                        help='Write a synthetic session first')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='Length of a generated session')
+    parser.add_argument('--msg-rate', type=float, default=500.0,
+                        help='Messages per second of a generated session')
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--mapping', help='Mapping file, by default one '
+                        'CC per light')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed, 0 for as fast as possible')
+    parser.add_argument('--frame-rate', type=float,
+                        default=DEFAULT_FRAME_RATE)
+    parser.add_argument('--immediate', action='store_true')
+    parser.add_argument('--coalesce', action='store_true')
+    parser.add_argument('--frames', help='Record the frames sent')
+    parser.add_argument('--deterministic', action='store_true',
+                        help='Send one frame per message')
+    parser.add_argument('--check', metavar='REFERENCE',
+                        help='Compare deterministic frame output with a '
+                             'reference frame recording')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.session, args.duration, args.msg_rate, args.lights)
+    if args.mapping is None:
+        mapping = Mapping(make_mapping(args.lights))
+    else:
+        mapping = Mapping.load(args.mapping)
+
+    deterministic = args.deterministic or args.check is not None
+    if args.check is not None and args.frames == args.check:
+        parser.error('--frames would overwrite the --check reference')
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = args.frames
+        if args.check and frames is None:
+            frames = os.path.join(tmp, 'frames.mhr')
+        result = run(args.session, mapping, args.frame_rate, args.speed,
+                     args.immediate, args.coalesce, frames,
+                     deterministic)
+        mismatch = compare(frames, args.check) if args.check else None
+
+    intervals = [t * 1000 for t in result['intervals']]
+    mode = 'deterministic' if deterministic else \
+        ('immediate' if args.immediate else 'clocked')
+    print(f'{result["messages"]} messages, {result["frames"]} frames in '
+          f'{result["elapsed"]:.2f}s ({mode}, speed {args.speed:g})')
+    print(f'throughput   {result["messages"] / result["elapsed"]:9.0f} '
+          f'msg/s  {result["frames"] / result["elapsed"]:7.1f} frames/s')
+    print(f'interval ms  mean {statistics.mean(intervals):6.2f}  '
+          f'jitter (stdev) {statistics.pstdev(intervals):6.2f}  '
+          f'max {max(intervals):6.2f}')
+    print(f'cpu us/frame whole process {result["process_cpu"] * 1e6:7.1f}')
+    if args.check:
+        if mismatch is None:
+            print(f'frames match {args.check}')
+        else:
+            print(f'frames differ from {args.check} at state {mismatch}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Recalls scenes from a store of hundreds, for a full stream of lights.
+
+Compares recalling a look from a SceneStore (a program change, then
+rendering the frame) with re-sending one CC per light parameter, and
+reports the cost of opening a store file, of each crossfade frame and the
+bytes stored per scene.
+
+Run with: python benchmarks/bench_scenes.py [--scenes 500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from mido import Message
+from midihue.hue import HueStream, MAX_STREAM_LIGHTS
+from midihue.mapping import Mapping
+from midihue.scenes import SceneStore
+
+PARAMS = ('h', 's', 'v')
+
+
+def make_config(path, capacity):
+    lights = [{'id': light_id} for light_id in range(1, MAX_STREAM_LIGHTS + 1)]
+    # One CC per light parameter, the way a look is restored without scenes
+    mappings = [{'type': 'control_change', 'channel': i // 60,
+                 'control': i % 60, 'light': i // 3 % MAX_STREAM_LIGHTS + 1,
+                 'param': PARAMS[i % 3]}
+                for i in range(3 * MAX_STREAM_LIGHTS)]
+    mappings.append({'type': 'program_change', 'scene': 0})
+    return {'lights': lights, 'mappings': mappings,
+            'scenes': {'path': path, 'capacity': capacity}}
+
+
+def look_messages(rng):
+    return [Message('control_change', channel=i // 60, control=i % 60,
+                    value=rng.randrange(128))
+            for i in range(3 * MAX_STREAM_LIGHTS)]
+
+
+def bench(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenes', type=int, default=500)
+    parser.add_argument('--recalls', type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scenes.mhs')
+        mapping = Mapping(make_config(path, args.scenes))
+        stream = HueStream(0, client=None)
+        scenes = mapping.scenes
+
+        def save(scene):
+            for msg in look_messages(rng):
+                mapping.dispatch(msg)
+            scenes.save(scene)
+        t_save = bench(save, range(args.scenes))
+        scenes.close()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        scenes = SceneStore(mapping.lights, path)
+        t_open = time.perf_counter() - start
+        open_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        mapping.scenes = scenes
+        size = os.path.getsize(path)
+
+        programs = [Message('program_change', program=rng.randrange(128))
+                    for _ in range(args.recalls)]
+
+        def recall(msg):
+            mapping.dispatch(msg)
+            stream.render(mapping.lights)
+        t_program = bench(recall, programs)
+
+        numbers = [rng.randrange(args.scenes) for _ in range(args.recalls)]
+        t_recall = bench(scenes.recall, numbers)
+
+        looks = [look_messages(rng) for _ in range(args.recalls // 10)]
+
+        def resend(messages):
+            for msg in messages:
+                mapping.dispatch(msg)
+            stream.render(mapping.lights)
+        t_resend = bench(resend, looks)
+
+        def fade(frame):
+            if not scenes.fading:
+                scenes.recall(rng.randrange(args.scenes), fade=1.0)
+            scenes.update(frame * 0.02)
+            stream.render(mapping.lights)
+        t_fade = bench(fade, range(args.recalls))
+        scenes.close()
+
+    print(f'{args.scenes} scenes of {MAX_STREAM_LIGHTS} lights, '
+          f'{scenes.record_size} bytes each ({size / 1024:.1f} KiB file)')
+    print(f'open store          {t_open * 1e6:8.1f} us  '
+          f'({open_memory / 1024:.1f} KiB allocated)')
+    print(f'save scene          {t_save * 1e6:8.1f} us  '
+          f'(including {3 * MAX_STREAM_LIGHTS} CCs to set the look)')
+    print(f'recall              {t_recall * 1e6:8.1f} us')
+    print(f'program change      {t_program * 1e6:8.1f} us  '
+          f'(recall and render a frame)')
+    print(f'resend every CC     {t_resend * 1e6:8.1f} us  '
+          f'({3 * MAX_STREAM_LIGHTS} CCs and render a frame, '
+          f'{t_resend / t_program:.1f}x)')
+    print(f'crossfade frame     {t_fade * 1e6:8.1f} us  (update and render)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Frame cost of spatial effects over hundreds of light positions.
+
+For each number of (virtual) lights at random positions, times a
+Gradient, a Wipe and a Pulse over all of them: evaluating their values
+from the precomputed weights (with NumPy's matrix-vector product, and
+interpolating in Python), rendering them into the lights, and for
+comparison evaluating each light's value directly from its position every
+frame. Also reports the one-off cost of placing the effect.
+
+Run with: python benchmarks/bench_spatial.py [--lights 20,100,250,500,1000]
+"""
+import argparse
+import math
+import random
+import time
+from midihue.light import LightBank, _import_numpy
+from midihue.spatial import Gradient, Layout, Pulse, Wipe
+
+FRAMES = 500
+PERIOD = 0.02
+
+
+def make_lights(n, rng):
+    bank = LightBank()
+    layout = Layout()
+    for light_id in range(n):
+        bank.add(light_id)
+        layout.set(light_id, (rng.uniform(-1, 1), rng.uniform(-1, 1),
+                              rng.uniform(0, 1)))
+    return bank, layout
+
+
+def make_effects(bank, layout):
+    return {
+        'gradient': Gradient(bank, layout, direction=(1.0, 0.5, 0.0)),
+        'wipe': Wipe(bank, layout, direction=(0.0, 1.0, 0.0),
+                     duration=FRAMES * PERIOD, softness=0.2),
+        'pulse': Pulse(bank, layout, center=(0.0, 0.0, 0.5), rate=1.0),
+    }
+
+
+def direct(effect, positions, t):
+    """The effect's values computed per light from its position"""
+    if isinstance(effect, Pulse):
+        cx, cy, cz = effect.center
+        distances = [math.sqrt((x - cx) ** 2 + (y - cy) ** 2 +
+                               (z - cz) ** 2) for x, y, z in positions]
+        farthest = max(distances)
+        return effect.profile([d / farthest for d in distances], t)
+    dx, dy, dz = effect.direction
+    along = [x * dx + y * dy + z * dz for x, y, z in positions]
+    low, high = min(along), max(along)
+    return effect.profile([(a - low) / (high - low) for a in along], t)
+
+
+def bench(func, frames=FRAMES):
+    start = time.perf_counter()
+    for frame in range(frames):
+        func(frame * PERIOD)
+    return (time.perf_counter() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lights', default='20,100,250,500,1000')
+    args = parser.parse_args()
+    rng = random.Random(1)
+    # Not counted in the first placement
+    _import_numpy()
+
+    print(f'{"lights":>6} {"effect":>9} {"place":>9} {"numpy":>9} '
+          f'{"python":>9} {"render":>9} {"direct":>9}  (us per frame)')
+    for n in (int(n) for n in args.lights.split(',')):
+        bank, layout = make_lights(n, rng)
+        positions = [layout[light.light_id] for light in bank]
+        for name, effect in make_effects(bank, layout).items():
+            start = time.perf_counter()
+            effect.place()
+            t_place = time.perf_counter() - start
+            numpy = effect._weights is not None
+            t_numpy = bench(effect.values) if numpy else float('nan')
+            weights, effect._weights = effect._weights, None
+            t_python = bench(effect.values)
+            effect._weights = weights
+            t_render = bench(effect.render)
+            t_direct = bench(lambda t: direct(effect, positions, t))
+            print(f'{n:6d} {name:>9} {t_place * 1e6:9.1f} '
+                  f'{t_numpy * 1e6:9.1f} {t_python * 1e6:9.1f} '
+                  f'{t_render * 1e6:9.1f} {t_direct * 1e6:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
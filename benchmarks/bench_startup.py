@@ -0,0 +1,92 @@
+"""Benchmark of `midi-hue` startup, from exec to the first frame.
+
+Launches the command line tool non-interactively against a local
+FakeBridge, configured through environment variables as on a show
+machine, and replaying a one message session instead of a MIDI input. The
+time from starting the process to the bridge receiving the first frame is
+reported, along with the time spent importing midihue.cli.
+
+Run with: python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from mido import Message
+from midihue.fakebridge import FakeBridge
+from midihue.hue import STREAM_PORT
+from midihue.recording import Recorder
+
+IMPORT = ('import time; started = time.perf_counter(); '
+          'import midihue.cli; print(time.perf_counter() - started)')
+RUN = 'from midihue.cli import main; main()'
+
+
+def import_time():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT])
+    return float(output)
+
+
+def first_frame_time(bridge, env):
+    received = threading.Event()
+    first = []
+
+    def on_frame(now, data):
+        if not first:
+            first.append(now)
+            received.set()
+
+    bridge.on_frame = on_frame
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', RUN], env=env,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL)
+    try:
+        if not received.wait(10.0):
+            raise RuntimeError('No frame received')
+    finally:
+        process.wait(10.0)
+        bridge.on_frame = None
+    if process.returncode:
+        raise RuntimeError(f'midi-hue exited with {process.returncode}')
+    return first[0] - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with FakeBridge(stream_port=STREAM_PORT) as bridge, \
+            tempfile.TemporaryDirectory() as tmp:
+        credentials = os.path.join(tmp, 'credentials')
+        with open(credentials, 'w') as file:
+            json.dump({'username': bridge.username,
+                       'clientkey': bridge.clientkey}, file)
+        session = os.path.join(tmp, 'session.mhr')
+        with Recorder(session) as recorder:
+            recorder.record(Message('control_change', control=79, value=64))
+        env = dict(os.environ,
+                   MIDIHUE_BRIDGE_IP=f'{bridge.host}:{bridge.http_port}',
+                   MIDIHUE_GROUP_ID=str(bridge.group_id),
+                   MIDIHUE_CREDENTIALS_PATH=credentials,
+                   MIDIHUE_REPLAY=session,
+                   MIDIHUE_INTERACTIVE='false')
+
+        imports = [import_time() for _ in range(args.runs)]
+        frames = [first_frame_time(bridge, env) for _ in range(args.runs)]
+
+    for name, times in (('import midihue.cli', imports),
+                        ('exec to first frame', frames)):
+        times = [t * 1000 for t in times]
+        print(f'{name:20} ms  median {statistics.median(times):7.1f}  '
+              f'min {min(times):7.1f}  max {max(times):7.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,13 @@ setup(
         'requests>=2.26'
     ],
     extras_require={
+        'numpy': [
+            'numpy>=1.15'
+        ],
+        'audio': [
+            'numpy>=1.15',
+            'sounddevice>=0.4'
+        ],
         'dev': [
             'flake8',
             'autopep8',
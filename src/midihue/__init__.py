@@ -1,2 +1,11 @@
-from . import cli, hue
-from .light import Light
+from .light import Light, LightBank
+
+
+def __getattr__(name):
+    # cli and hue import the HTTP, TLS and MIDI libraries, which are slow
+    # to import and not needed by every process, so they are imported on
+    # first access
+    if name in ('cli', 'hue'):
+        import importlib
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,242 @@
+"""asyncio variants of HueClient and HueStream.
+
+REST calls still use HueClient but run in an executor, and the DTLS
+handshake waits for the socket without blocking, so MIDI input, frame
+output, REST calls and handshake retries can share one event loop.
+"""
+import asyncio
+import threading
+import time
+from functools import partial
+import requests
+from mbedtls import tls
+from mbedtls.exceptions import TLSError
+from .hue import HueClient, HueStream, HueClientError, HueStreamError, \
+    MIN_RECONNECT_DELAY, MAX_RECONNECT_DELAY
+from .engine import DEFAULT_FRAME_RATE
+
+# The loop of the calling coroutine. asyncio.get_event_loop is deprecated
+# there, but Python 3.6 has nothing else.
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class AsyncHueClient:
+    """Asyncio front end for a HueClient.
+
+    Use `create` to construct one without blocking on credential setup.
+    """
+
+    def __init__(self, client, executor=None):
+        self.client = client
+        self._executor = executor
+
+    @classmethod
+    async def create(cls, executor=None, **kwargs):
+        """Creates a HueClient from kwargs in the executor and wraps it"""
+        loop = _running_loop()
+        client = await loop.run_in_executor(executor,
+                                            partial(HueClient, **kwargs))
+        return cls(client, executor)
+
+    @property
+    def username(self):
+        return self.client.username
+
+    @property
+    def clientkey(self):
+        return self.client.clientkey
+
+    async def get_bridge_ip(self):
+        return await self._run(lambda: self.client.bridge_ip)
+
+    async def get_entertainment_groups(self):
+        return await self._run(self.client.get_entertainment_groups)
+
+    async def get_entertainment_configuration(self, group_id):
+        return await self._run(self.client.get_entertainment_configuration,
+                               group_id)
+
+    async def get_application_id(self):
+        return await self._run(self.client.get_application_id)
+
+    async def set_entertainment_stream(self, configuration_id, active):
+        return await self._run(self.client.set_entertainment_stream,
+                               configuration_id, active)
+
+    async def set_stream_mode(self, group_id, active):
+        return await self._run(self.client.set_stream_mode, group_id, active)
+
+    async def reset(self):
+        return await self._run(self.client.reset)
+
+    # Private
+
+    def _run(self, func, *args):
+        loop = _running_loop()
+        return loop.run_in_executor(self._executor, partial(func, *args))
+
+
+class AsyncHueStream(HueStream):
+    """HueStream driven from an asyncio event loop.
+
+    `start` and `stop` are coroutines and the client must be an
+    AsyncHueClient. Frames are sent on a non-blocking socket, and a lost
+    connection is re-established by a task on the loop.
+    """
+
+    async def start(self):
+        self._stopped.clear()
+        if self.stream_version != 1:
+            configuration = self.configuration
+            identity = None
+            try:
+                if configuration is None:
+                    configuration = await \
+                        self.client.get_entertainment_configuration(
+                            self.group_id
+                        )
+                if configuration is not None:
+                    identity = await self.client.get_application_id()
+                    await self.client.set_entertainment_stream(
+                        configuration[0], True
+                    )
+            except (HueClientError, requests.RequestException,
+                    ValueError) as e:
+                self._v2_failed(e)
+            else:
+                self._configure(configuration, identity)
+        if self.stream_version == 1:
+            await self.client.set_stream_mode(self.group_id, True)
+        delay = MIN_RECONNECT_DELAY
+        for attempt in range(1, self.handshake_tries + 1):
+            try:
+                await self._connect_async()
+                return
+            except HueStreamError as e:
+                print(f'[HueStream] {e} (attempt {attempt})')
+                if attempt == self.handshake_tries:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def stop(self):
+        self._stopped.set()
+        await self._set_active_async(False)
+        self._disconnect()
+
+    async def run(self, lights, rate=DEFAULT_FRAME_RATE):
+        """Sends frames of lights (see `update`) at `rate` Hz until
+        cancelled.
+        """
+        loop = _running_loop()
+        period = 1.0 / rate
+        deadline = loop.time()
+        while True:
+            self.update(lights)
+            deadline += period
+            delay = deadline - loop.time()
+            if delay < 0:
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    # Private
+
+    async def _connect_async(self):
+        if self._socket is not None:
+            self._disconnect()
+
+        address = (await self.client.get_bridge_ip(), self.port)
+        dtls_cli = self._wrap_socket()
+        dtls_cli.setblocking(False)
+        dtls_cli.connect(address)
+        try:
+            await asyncio.wait_for(_handshake(dtls_cli),
+                                   self.handshake_timeout)
+        except (asyncio.TimeoutError, OSError, TLSError) as e:
+            dtls_cli.close()
+            raise HueStreamError(
+                f'DTLS handshake failed: {str(e) or "timed out"}'
+            )
+        print('[HueStream] DTLS handshake succeeded')
+        self._socket = dtls_cli
+
+    def _connection_lost(self, error):
+        if self._reconnecting:
+            return
+        if not self.auto_reconnect:
+            raise HueStreamError(f'Connection lost: {error}')
+        self._reconnecting = True
+        print(f'[HueStream] Connection lost ({error}), reconnecting...')
+        asyncio.ensure_future(self._reconnect_async())
+
+    async def _reconnect_async(self):
+        started = time.monotonic()
+        delay = MIN_RECONNECT_DELAY
+        while True:
+            if self._stopped.is_set():
+                return
+            try:
+                await self._set_active_async(True)
+                await self._connect_async()
+                break
+            except (HueStreamError, HueClientError,
+                    requests.RequestException, OSError) as e:
+                print(f'[HueStream] Reconnect failed ({e}), '
+                      f'retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._reconnected(started)
+
+    async def _set_active_async(self, active):
+        if self.stream_version == 2:
+            await self.client.set_entertainment_stream(
+                self.configuration[0], active
+            )
+        else:
+            await self.client.set_stream_mode(self.group_id, active)
+
+
+async def receive_midi(inport, handler):
+    """Calls handler on the event loop for each message from a mido port.
+
+    The port is read on a daemon thread; returns when the port closes.
+    """
+    loop = _running_loop()
+    queue = asyncio.Queue()
+
+    def read():
+        for msg in inport:
+            loop.call_soon_threadsafe(queue.put_nowait, msg)
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    threading.Thread(target=read, name='midihue-input', daemon=True).start()
+    while True:
+        msg = await queue.get()
+        if msg is None:
+            return
+        handler(msg)
+
+
+async def _handshake(dtls_cli):
+    loop = _running_loop()
+    while True:
+        try:
+            dtls_cli.do_handshake()
+            return
+        except (BlockingIOError, tls.WantReadError):
+            await _readable(loop, dtls_cli.fileno())
+
+
+async def _readable(loop, fd):
+    ready = loop.create_future()
+
+    def on_ready():
+        if not ready.done():
+            ready.set_result(None)
+
+    loop.add_reader(fd, on_ready)
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fd)
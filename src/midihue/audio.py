@@ -0,0 +1,349 @@
+"""Audio-reactive input: light control from the analysis of an audio stream.
+
+An Analyzer runs a windowed FFT over each hop of incoming samples and
+follows, per hop:
+
+- the energy of `bands` log-spaced frequency bands
+- the overall level
+- onsets, where the spectral flux (the rise of the band energies) jumps
+  above its recent average
+
+Energies and the level are in dB between `floor` and full scale, scaled
+to 0-1, and smoothed by envelope followers with separate attack and
+release times.
+
+An AudioInput reads blocks from a source (a WAV file, or a capture device
+with the optional sounddevice package) and yields the analysis as MIDI
+messages, like a mido input port: a CC per band and one for the level on
+`channel`, starting at `control`, and a note on of `onset_note` for every
+onset, with its strength as the velocity. They are mapped like any other
+MIDI, and can be read on the Engine's input thread, off the frame thread.
+
+Requires NumPy.
+"""
+import os
+import queue
+import time
+import wave
+import numpy as np
+import mido
+
+DEFAULT_SAMPLE_RATE = 44100
+# A hop of 256 samples (5.8 ms at 44.1 kHz) keeps the analysis well within
+# a 50 Hz frame, while the 1024 sample window resolves the low bands
+DEFAULT_HOP = 256
+DEFAULT_WINDOW = 1024
+DEFAULT_BANDS = 8
+MIN_FREQUENCY = 40.0
+MAX_FREQUENCY = 16000.0
+DEFAULT_FLOOR = -60.0
+DEFAULT_ATTACK = 0.005
+DEFAULT_RELEASE = 0.15
+# Onsets: flux above this multiple of its recent average (plus a minimum),
+# at most one per interval
+ONSET_THRESHOLD = 1.5
+ONSET_MIN_FLUX = 0.1
+ONSET_INTERVAL = 0.05
+ONSET_HISTORY = 0.5
+DEFAULT_CHANNEL = 15
+DEFAULT_CONTROL = 20
+DEFAULT_ONSET_NOTE = 36
+# How long a capture source waits for a block before checking for close
+CAPTURE_TIMEOUT = 0.1
+
+
+class AudioError(Exception):
+    pass
+
+
+class Analyzer:
+    """Streaming spectral analysis of mono audio.
+
+    After `process` returns True, `bands` and `level` hold the envelope
+    followed values (0-1) and `onset` the strength (0-1) of an onset in
+    the hops just processed, or 0.
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, bands=DEFAULT_BANDS,
+                 window=DEFAULT_WINDOW, hop=DEFAULT_HOP,
+                 min_frequency=MIN_FREQUENCY, max_frequency=MAX_FREQUENCY,
+                 floor=DEFAULT_FLOOR, attack=DEFAULT_ATTACK,
+                 release=DEFAULT_RELEASE):
+        if not 0 < hop <= window:
+            raise ValueError('Hop must be between 1 and the window size')
+        if bands < 1:
+            raise ValueError('At least one band is required')
+        if floor >= 0:
+            raise ValueError('Floor must be negative (dB)')
+        self.sample_rate = sample_rate
+        self.hop = hop
+        self.floor = floor
+        self.bands = np.zeros(bands)
+        self.level = 0.0
+        self.onset = 0.0
+        self._window = np.hanning(window)
+        self._samples = np.zeros(window)
+        self._pending = np.zeros(hop)
+        self._filled = 0
+        self._starts, self._end = _band_bins(
+            sample_rate, window, bands, min_frequency,
+            min(max_frequency, sample_rate / 2)
+        )
+        # Power of a full scale sine in its bin, so that it reads 0 dB
+        self._reference = (self._window.sum() / 2) ** 2
+        hop_time = hop / sample_rate
+        self._attack = np.exp(-hop_time / attack) if attack > 0 else 0.0
+        self._release = np.exp(-hop_time / release) if release > 0 else 0.0
+        self._raw = np.zeros(bands)
+        self._flux = np.zeros(max(1, int(ONSET_HISTORY / hop_time)))
+        self._flux_index = 0
+        self._interval = int(ONSET_INTERVAL / hop_time)
+        self._since_onset = self._interval
+
+    def process(self, samples):
+        """Adds mono samples (floats, full scale 1.0). Returns True if at
+        least one hop was analysed.
+        """
+        analysed = False
+        self.onset = 0.0
+        pending, hop = self._pending, self.hop
+        offset, count = 0, len(samples)
+        while offset < count:
+            take = min(hop - self._filled, count - offset)
+            pending[self._filled:self._filled + take] = \
+                samples[offset:offset + take]
+            self._filled += take
+            offset += take
+            if self._filled == hop:
+                self._filled = 0
+                self._analyse(pending)
+                analysed = True
+        return analysed
+
+    # Private
+
+    def _analyse(self, hop_samples):
+        samples, hop = self._samples, self.hop
+        samples[:-hop] = samples[hop:]
+        samples[-hop:] = hop_samples
+        spectrum = np.fft.rfft(samples * self._window)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        energy = np.add.reduceat(power[:self._end], self._starts)
+        raw = self._scale(10.0 * np.log10(energy / self._reference + 1e-20))
+        rms = np.sqrt(np.mean(hop_samples * hop_samples))
+        level = self._scale(20.0 * np.log10(rms * np.sqrt(2.0) + 1e-10))
+
+        bands = self.bands
+        rising = raw > bands
+        bands[:] = raw + np.where(rising, self._attack, self._release) * \
+            (bands - raw)
+        coeff = self._attack if level > self.level else self._release
+        self.level = float(level + coeff * (self.level - level))
+        self._detect_onset(raw)
+
+    def _scale(self, db):
+        return np.clip((db - self.floor) / -self.floor, 0.0, 1.0)
+
+    def _detect_onset(self, raw):
+        flux = float(np.maximum(raw - self._raw, 0.0).sum())
+        self._raw[:] = raw
+        history = self._flux
+        threshold = ONSET_THRESHOLD * history.mean() + ONSET_MIN_FLUX
+        history[self._flux_index] = flux
+        self._flux_index = (self._flux_index + 1) % len(history)
+        self._since_onset += 1
+        if flux > threshold and self._since_onset >= self._interval:
+            self._since_onset = 0
+            # The mean rise of the bands: 1.0 for silence to full scale
+            self.onset = max(self.onset, min(1.0, flux / len(raw)))
+
+
+class AudioInput:
+    """Yields the analysis of the blocks of `source` as MIDI messages.
+
+    `source` is an iterable of mono sample blocks with a `sample_rate`,
+    e.g. a WavSource or CaptureSource. CCs are only sent when their 7 bit
+    value changes. Other keyword arguments are passed to the Analyzer.
+    """
+
+    def __init__(self, source, bands=DEFAULT_BANDS, channel=DEFAULT_CHANNEL,
+                 control=DEFAULT_CONTROL, onset_note=DEFAULT_ONSET_NOTE,
+                 **analysis):
+        if control + bands > 127:
+            raise ValueError(f'Controls {control}-{control + bands} are '
+                             f'out of range')
+        self.source = source
+        self.channel = channel
+        self.control = control
+        self.onset_note = onset_note
+        self.analyzer = Analyzer(source.sample_rate, bands=bands,
+                                 **analysis)
+        self._values = [None] * (bands + 1)
+
+    def __iter__(self):
+        analyzer = self.analyzer
+        for block in self.source:
+            if not analyzer.process(block):
+                continue
+            yield from self._messages()
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Private
+
+    def _messages(self):
+        analyzer, channel = self.analyzer, self.channel
+        if analyzer.onset > 0.0:
+            yield mido.Message('note_on', channel=channel,
+                               note=self.onset_note,
+                               velocity=max(1, round(analyzer.onset * 127)))
+        values = self._values
+        scaled = np.rint(np.append(analyzer.bands, analyzer.level) * 127)
+        for index, value in enumerate(scaled.astype(int).tolist()):
+            if values[index] != value:
+                values[index] = value
+                yield mido.Message('control_change', channel=channel,
+                                   control=self.control + index,
+                                   value=value)
+
+
+class WavSource:
+    """Mono blocks of `block` samples from a PCM WAV file.
+
+    With `realtime`, each block is yielded when its last sample would have
+    been captured, as from a live input.
+    """
+
+    live = False
+
+    def __init__(self, path, block=DEFAULT_HOP, realtime=True, loop=False):
+        try:
+            self._wave = wave.open(path, 'rb')
+        except (OSError, EOFError, wave.Error) as e:
+            raise AudioError(f'Failed to open {path}: {e}')
+        self.path = path
+        self.block = block
+        self.realtime = realtime
+        self.loop = loop
+        self.sample_rate = self._wave.getframerate()
+        self._channels = self._wave.getnchannels()
+        self._width = self._wave.getsampwidth()
+        if self._width not in (1, 2, 3, 4):
+            raise AudioError(f'Unsupported sample width {self._width}')
+        self.closed = False
+        # Capture time of the first sample, set when iteration starts
+        self.started = None
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        position = 0
+        while not self.closed:
+            data = self._wave.readframes(self.block)
+            if not data:
+                if not self.loop:
+                    return
+                self._wave.rewind()
+                continue
+            samples = _decode(data, self._width, self._channels)
+            position += len(samples)
+            if self.realtime:
+                delay = self.started + position / self.sample_rate - \
+                    time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield samples
+
+    def close(self):
+        self.closed = True
+        self._wave.close()
+
+
+class CaptureSource:
+    """Mono blocks of `block` samples from an audio capture device (by
+    name or index, or the default), read with sounddevice.
+    """
+
+    live = True
+
+    def __init__(self, device=None, sample_rate=DEFAULT_SAMPLE_RATE,
+                 block=DEFAULT_HOP):
+        try:
+            import sounddevice
+        except ImportError:
+            raise AudioError('Audio capture requires the sounddevice '
+                             'package')
+        self.device = device
+        self.sample_rate = sample_rate
+        self.block = block
+        self.closed = False
+        self._sounddevice = sounddevice
+        self._blocks = queue.Queue()
+
+    def __iter__(self):
+        def callback(data, frames, time_info, status):
+            self._blocks.put(data[:, 0].astype(np.float64))
+
+        with self._sounddevice.InputStream(
+                device=self.device, channels=1, samplerate=self.sample_rate,
+                blocksize=self.block, latency='low', callback=callback):
+            while not self.closed:
+                try:
+                    yield self._blocks.get(timeout=CAPTURE_TIMEOUT)
+                except queue.Empty:
+                    continue
+
+    def close(self):
+        self.closed = True
+
+
+def open_source(name, block=DEFAULT_HOP, realtime=True):
+    """A WavSource if `name` is a file, otherwise a CaptureSource of the
+    device with that name or index
+    """
+    if os.path.isfile(name):
+        return WavSource(name, block, realtime=realtime)
+    return CaptureSource(int(name) if name.isdigit() else name,
+                         block=block)
+
+
+# Private
+
+def _band_bins(sample_rate, window, bands, low, high):
+    """First FFT bin of each band, and the bin after the last one. Every
+    band gets at least one bin.
+    """
+    frequencies = np.fft.rfftfreq(window, 1.0 / sample_rate)
+    edges = np.searchsorted(frequencies,
+                            np.geomspace(low, high, bands + 1))
+    starts = []
+    for edge in edges[:-1]:
+        start = max(int(edge), starts[-1] + 1 if starts else 0)
+        starts.append(start)
+    end = max(int(edges[-1]), starts[-1] + 1)
+    if end > len(frequencies):
+        raise ValueError(f'Too many bands for a window of {window} samples')
+    return np.array(starts, dtype=np.intp), end
+
+
+def _decode(data, width, channels):
+    if width == 3:
+        # 24 bit samples, widened to 32 bits
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view('<i4').ravel() / 2.0 ** 31
+    elif width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8) - 128.0) / 128.0
+    else:
+        dtype = '<i2' if width == 2 else '<i4'
+        samples = np.frombuffer(data, dtype=dtype) / 2.0 ** (8 * width - 1)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
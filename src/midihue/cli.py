@@ -1,11 +1,218 @@
+import os
+import re
+import sys
+import functools
 import time
 import click
-import mido
-from .light import Light
-from .hue import HueClient, HueStream, DEFAULT_CREDENTIALS_PATH
+from .mapping import Mapping, MappingError, DEFAULT_MAPPING, _read_config
+from .hue import HueClient, HueClientError, HueStream, HueStreamError, \
+    DEFAULT_CREDENTIALS_PATH
+from .engine import Engine, DEFAULT_FRAME_RATE
+from .clock import BeatScheduler, DEFAULT_LOOKAHEAD
+from .color import COLORSPACES
 
+# Every option can also be set with an environment variable named after it,
+# e.g. MIDIHUE_GROUP_ID for --group-id
+ENVVAR_PREFIX = 'MIDIHUE'
 
-@click.command()
+
+def find_input(pattern, names):
+    """Returns the one MIDI input name in `names` that is `pattern`, or
+    else contains it or matches it as a regular expression, ignoring case.
+    Raises click.UsageError if there is no such input or more than one.
+    """
+    if pattern in names:
+        return pattern
+    try:
+        regex = re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        regex = None
+    matches = [name for name in names
+               if pattern.lower() in name.lower() or
+               (regex is not None and regex.search(name))]
+    if len(matches) != 1:
+        found = 'No MIDI input' if not matches else 'Several MIDI inputs'
+        available = '\n'.join(f'  {name}' for name in (matches or names))
+        raise click.UsageError(f'{found} matching {pattern!r}. Inputs:\n'
+                               f'{available}')
+    return matches[0]
+
+
+def _load_config(ctx, param, value):
+    if value is None:
+        return None
+    path = os.path.expanduser(value)
+    try:
+        config = _read_config(path)
+    except MappingError as e:
+        raise click.BadParameter(str(e))
+    if not isinstance(config, dict):
+        raise click.BadParameter(f'{value} must contain a table of options')
+
+    # Keys are long option names, with dashes or underscores
+    params = {}
+    for option in ctx.command.params:
+        for opt in option.opts:
+            if opt.startswith('--') and option is not param:
+                params[opt[2:].replace('-', '_')] = option
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = dict(ctx.default_map or {})
+    for key, option_value in config.items():
+        option = params.get(str(key).replace('-', '_'))
+        if option is None:
+            raise click.BadParameter(f'Unknown option {key!r} in {value}')
+        if isinstance(option.type, click.Path) and \
+                isinstance(option_value, str):
+            # Relative to the config file, not the working directory
+            option_value = os.path.join(base,
+                                        os.path.expanduser(option_value))
+        defaults[option.name] = option_value
+    ctx.default_map = defaults
+    return value
+
+
+def _parse_bridge_ip(ctx, param, value):
+    if value is None:
+        return None
+    host, _, port = value.partition(':')
+    if not host or (port and not port.isdigit()):
+        raise click.BadParameter('Expected an address, optionally with a '
+                                 'port, e.g. 192.168.1.2 or 127.0.0.1:8080')
+    return host, int(port) if port else None
+
+
+def _load_streams(ctx, param, value):
+    if value is None:
+        return []
+    path = os.path.expanduser(value)
+    try:
+        config = _read_config(path)
+    except MappingError as e:
+        raise click.BadParameter(str(e))
+    entries = config.get('streams') if isinstance(config, dict) else None
+    if not isinstance(entries, list):
+        raise click.BadParameter(f'{value} must contain a list of streams')
+    base = os.path.dirname(os.path.abspath(path))
+    streams = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or \
+                not isinstance(entry.get('group_id'), int):
+            raise click.BadParameter(f'streams[{index}] in {value} must be '
+                                     f'a table with an integer group_id')
+        bridge = entry.get('bridge_ip')
+        bridge_ip, bridge_port = (None, None) if bridge is None else \
+            _parse_bridge_ip(ctx, param, str(bridge))
+        credentials_path = entry.get('credentials_path')
+        if credentials_path is not None:
+            credentials_path = os.path.join(
+                base, os.path.expanduser(str(credentials_path))
+            )
+        streams.append({'group_id': entry['group_id'],
+                        'bridge_ip': bridge_ip, 'bridge_port': bridge_port,
+                        'credentials_path': credentials_path})
+    return streams
+
+
+def _parse_cpus(ctx, param, value):
+    if value is None:
+        return None
+    from .multiproc import STAGES
+    try:
+        cpus = tuple(int(cpu) for cpu in value.split(','))
+    except ValueError:
+        cpus = ()
+    if len(cpus) != len(STAGES):
+        raise click.BadParameter(
+            f'Expected {len(STAGES)} comma separated CPU numbers '
+            f'({",".join(STAGES)})'
+        )
+    return cpus
+
+
+def _open_audio(name, options):
+    try:
+        from .audio import AudioInput, AudioError, open_source, DEFAULT_HOP
+    except ImportError:
+        raise click.UsageError('--audio requires numpy')
+    options = dict(options)
+    hop = options.pop('hop', DEFAULT_HOP)
+    try:
+        source = open_source(name, block=hop)
+    except AudioError as e:
+        raise click.BadParameter(str(e), param_hint='--audio')
+    try:
+        return AudioInput(source, hop=hop, **options)
+    except (TypeError, ValueError) as e:
+        source.close()
+        raise click.ClickException(f'Invalid audio options: {e}')
+
+
+def _group_lights(client, group_id):
+    import requests
+    try:
+        group = client.get_groups().get(str(group_id))
+    except (requests.RequestException, ValueError) as e:
+        raise click.ClickException(f'Failed to get groups from the bridge '
+                                   f'at {client.bridge_ip}: {e}')
+    if group is None:
+        raise click.ClickException(f'Group {group_id} not found on the '
+                                   f'bridge at {client.bridge_ip}')
+    return {int(light_id) for light_id in group.get('lights', [])}
+
+
+def _open_streams(stream, streams, lights, credentials_path, open_stream):
+    """Returns a StreamManager sending to `stream` and to a stream opened
+    with `open_stream(group_id, client)` for each entry of --streams. Each
+    light goes to the first of them whose group has it, or else to
+    `stream`. Entries without a bridge_ip are on the bridge of `stream`.
+    """
+    from .manager import StreamManager
+    manager = StreamManager()
+    manager.add(stream)
+    routed = _group_lights(stream.client, stream.group_id)
+    for entry in streams:
+        client = stream.client
+        if entry['bridge_ip'] is not None:
+            client = HueClient(
+                credentials_path=entry['credentials_path'] or
+                credentials_path,
+                bridge_ip=entry['bridge_ip'],
+                bridge_port=entry['bridge_port']
+            )
+        try:
+            extra = manager.add(open_stream(entry['group_id'], client))
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--streams')
+        members = _group_lights(client, entry['group_id'])
+        for light in lights:
+            if light.light_id in members and light.light_id not in routed:
+                manager.route(light, extra)
+        routed |= members
+    return manager
+
+
+def _until_replayed(port, engine):
+    yield from port
+    # Give the last messages a frame to be sent before stopping
+    time.sleep(2 * engine.period)
+    engine.stop()
+
+
+@click.command(context_settings={'auto_envvar_prefix': ENVVAR_PREFIX})
+@click.option('--config',
+              default=None,
+              is_eager=True,
+              expose_value=False,
+              callback=_load_config,
+              type=click.Path(exists=True, dir_okay=False),
+              help="Path to a JSON, TOML or YAML file of option values, "
+                   "keyed by option name, e.g. group_id = 1. Command line "
+                   "options and environment variables take precedence.")
+@click.option('--bridge-ip',
+              default=None,
+              callback=_parse_bridge_ip,
+              help="Address of the Hue bridge, optionally with the port of "
+                   "its REST API. Skips bridge discovery.")
 @click.option('--credentials-path',
               default=DEFAULT_CREDENTIALS_PATH,
               show_default=True,
@@ -17,15 +224,203 @@ from .hue import HueClient, HueStream, DEFAULT_CREDENTIALS_PATH
               type=int,
               help="The ID of the light group you want to control "
                    "on your Hue bridge. Must be an Entertainment group. ")
+@click.option('--streams',
+              default=None,
+              callback=_load_streams,
+              type=click.Path(exists=True, dir_okay=False),
+              help="Path to a JSON, TOML or YAML file listing more "
+                   "Entertainment groups to stream to at once, as "
+                   "'streams', each with a group_id and, for another "
+                   "bridge, its bridge_ip and credentials_path. Each light "
+                   "is sent to the group that has it.")
 @click.option('--input-name',
               default=None,
               type=str,
-              help="The name of the MIDI input from which to "
-                   "observe messages.")
-def main(group_id, input_name, credentials_path):
+              help="The MIDI input from which to observe messages: its "
+                   "name, or a unique part of it or regular expression "
+                   "matching it (ignoring case).")
+@click.option('--frame-rate',
+              default=DEFAULT_FRAME_RATE,
+              show_default=True,
+              type=click.FloatRange(min=1.0),
+              help="Rate in Hz at which frames are sent to the bridge.")
+@click.option('--send-rate',
+              default=None,
+              type=click.FloatRange(min=1.0),
+              help="Limit frames sent to the bridge to this rate in Hz, "
+                   "sending the newest frame whenever the limit allows "
+                   "(the bridge takes about 25).")
+@click.option('--adaptive-rate/--no-adaptive-rate',
+              default=False,
+              show_default=True,
+              help="Lower the --send-rate limit while sends fail or the "
+                   "socket backs up, and raise it back as they succeed.")
+@click.option('--immediate/--no-immediate',
+              default=False,
+              show_default=True,
+              help="Send a frame as soon as a MIDI message changes a light "
+                   "instead of waiting for the next frame clock tick.")
+@click.option('--coalesce/--no-coalesce',
+              default=False,
+              show_default=True,
+              help="Apply only the latest value of each CC, pitch wheel or "
+                   "aftertouch received between frames.")
+@click.option('--clock-sync/--no-clock-sync',
+              default=False,
+              show_default=True,
+              help="Follow MIDI clock from the input: align frames to the "
+                   "beat and run effects in beats while it is playing.")
+@click.option('--lookahead',
+              default=DEFAULT_LOOKAHEAD,
+              show_default=True,
+              type=click.FloatRange(min=0.0),
+              help="Seconds each beat-aligned frame is sent early, to "
+                   "compensate for bridge and network latency.")
+@click.option('--colorspace',
+              default='rgb',
+              show_default=True,
+              type=click.Choice(sorted(COLORSPACES)),
+              help="Stream color space. 'xy' sends xy and brightness, "
+                   "mapped into the gamut of each light.")
+@click.option('--stream-version',
+              default='auto',
+              show_default=True,
+              type=click.Choice(['auto', '1', '2']),
+              help="Entertainment stream API version. 'auto' uses v2 (up "
+                   "to 20 channels) if the bridge supports it and has an "
+                   "entertainment configuration for the group.")
+@click.option('--gamma',
+              default=1.0,
+              show_default=True,
+              type=click.FloatRange(min=0.1, max=10.0),
+              help="Exponent of the output brightness curve.")
+@click.option('--brightness',
+              default=1.0,
+              show_default=True,
+              type=click.FloatRange(min=0.0, max=1.0),
+              help="Scale of the output brightness.")
+@click.option('--mapping',
+              'mapping_path',
+              default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              envvar=f'{ENVVAR_PREFIX}_MAPPING',
+              help="Path to a JSON, TOML or YAML file mapping MIDI "
+                   "messages to light parameters.")
+@click.option('--metrics/--no-metrics',
+              default=False,
+              show_default=True,
+              help="Time each stage of the pipeline. Send SIGUSR1 to print "
+                   "a report.")
+@click.option('--metrics-port',
+              default=None,
+              type=click.IntRange(min=0, max=65535),
+              help="Serve metrics in the Prometheus text format on this "
+                   "local port (implies --metrics).")
+@click.option('--multiprocess/--no-multiprocess',
+              default=False,
+              show_default=True,
+              help="Run MIDI input, rendering and stream output in separate "
+                   "processes, so a stall in one does not delay the others.")
+@click.option('--cpus',
+              default=None,
+              callback=_parse_cpus,
+              help="With --multiprocess, pin the input, render and output "
+                   "processes to these CPUs, e.g. 1,2,3.")
+@click.option('--record-midi',
+              default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help="Record the MIDI input, with timing, to this file. "
+                   "With --audio, the MIDI published by the analysis is "
+                   "recorded too.")
+@click.option('--replay',
+              'replay_path',
+              default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              envvar=f'{ENVVAR_PREFIX}_REPLAY',
+              help="Replay a file recorded with --record-midi instead of "
+                   "reading a MIDI input, then exit.")
+@click.option('--replay-speed',
+              default=1.0,
+              show_default=True,
+              type=click.FloatRange(min=0.0),
+              help="Speed of the replay relative to the recording, or 0 to "
+                   "replay as fast as possible.")
+@click.option('--record-frames',
+              default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help="Record every frame sent to the bridge to this file.")
+@click.option('--audio',
+              default=None,
+              help="Analyse audio from a capture device (name or index, "
+                   "requires sounddevice) or a WAV file, sending band "
+                   "energies, level and onsets as MIDI on the channel set "
+                   "in the mapping's audio options. Without --input-name, "
+                   "no MIDI input is read.")
+@click.option('--interactive/--no-interactive',
+              default=lambda: sys.stdin.isatty(),
+              show_default='if run from a terminal',
+              help="Prompt for the group and MIDI input when not given. "
+                   "Otherwise the only Entertainment group and MIDI input "
+                   "are used, if there is just one.")
+def main(bridge_ip, group_id, streams, input_name, credentials_path,
+         frame_rate, send_rate, adaptive_rate, immediate, coalesce, clock_sync,
+         lookahead, colorspace, stream_version, gamma, brightness,
+         mapping_path, metrics, metrics_port, multiprocess, cpus,
+         record_midi, replay_path, replay_speed, record_frames, audio,
+         interactive):
     """Programmable MIDI control over Philips Hue lights"""
 
-    client = HueClient(credentials_path=credentials_path)
+    if multiprocess and (metrics or metrics_port is not None):
+        raise click.UsageError('--metrics is not supported with '
+                               '--multiprocess')
+    if multiprocess and (record_midi or record_frames):
+        raise click.UsageError('Recording is not supported with '
+                               '--multiprocess')
+    if replay_path is not None and (input_name or record_midi):
+        raise click.UsageError('--replay cannot be combined with '
+                               '--input-name or --record-midi')
+    if streams and (multiprocess or metrics or metrics_port is not None
+                    or record_frames):
+        raise click.UsageError('--streams cannot be combined with '
+                               '--multiprocess, --metrics or '
+                               '--record-frames')
+    if multiprocess and audio is not None:
+        raise click.UsageError('--audio is not supported with '
+                               '--multiprocess')
+    if adaptive_rate and send_rate is None:
+        raise click.UsageError('--adaptive-rate requires --send-rate')
+    if replay_path is not None:
+        from .recording import ReplayPort, RecordingError
+        try:
+            ReplayPort(replay_path).close()
+        except RecordingError as e:
+            raise click.BadParameter(str(e), param_hint='--replay')
+
+    try:
+        if mapping_path is None:
+            mapping = Mapping(DEFAULT_MAPPING)
+        else:
+            mapping = Mapping.load(mapping_path)
+    except MappingError as e:
+        raise click.ClickException(str(e))
+
+    # Audio replaces the MIDI input unless one is named
+    midi_input = replay_path is None and \
+        (audio is None or input_name is not None)
+    if midi_input:
+        import mido
+        inputs = mido.get_input_names()
+        if input_name is not None:
+            input_name = find_input(input_name, inputs)
+        elif len(inputs) == 1 and not interactive:
+            input_name = inputs[0]
+        elif not interactive:
+            raise click.UsageError('--input-name is required, as there is '
+                                   'not exactly one MIDI input')
+
+    bridge_ip, bridge_port = bridge_ip or (None, None)
+    client = HueClient(credentials_path=credentials_path,
+                       bridge_ip=bridge_ip, bridge_port=bridge_port)
 
     if group_id is None:
         groups = client.get_entertainment_groups()
@@ -34,51 +429,171 @@ def main(group_id, input_name, credentials_path):
                   "Please use the Hue app to create one and try again.")
             exit(0)
 
-        groups_formatted = '\n'.join([f'{gid}. {desc}' for gid, desc
-                                     in groups])
-        group_id = click.prompt('\nEnter ID of light group to control\n\n'
-                                f'{groups_formatted}\n\nGroup ID',
-                                type=int)
+        if len(groups) == 1 and not interactive:
+            group_id = int(groups[0][0])
+        elif not interactive:
+            raise click.UsageError('--group-id is required, as there is '
+                                   'more than one Entertainment group')
+        else:
+            groups_formatted = '\n'.join([f'{gid}. {desc}' for gid, desc
+                                          in groups])
+            group_id = click.prompt('\nEnter ID of light group to '
+                                    f'control\n\n{groups_formatted}\n\n'
+                                    'Group ID', type=int)
 
-    if input_name is None:
-        inputs = mido.get_input_names()
+    if input_name is None and midi_input:
         inputs_formatted = '\n'.join([f'{idx}. {name}' for idx, name
                                       in enumerate(inputs)])
         input_index = click.prompt(f'\nChoose a MIDI input\n\n'
                                    f'{inputs_formatted}\n\nInput', type=int)
         input_name = inputs[input_index]
 
-    stream = HueStream(group_id, client)
-    inport = mido.open_input(input_name)
+    locations = None
+    if mapping.spatial:
+        # Lights without a position in the mapping take the group's
+        import requests
+        try:
+            locations = client.get_light_locations(group_id)
+        except HueClientError as e:
+            raise click.ClickException(str(e))
+        except (requests.RequestException, ValueError, TypeError) as e:
+            raise click.ClickException(f'Failed to get the light locations '
+                                       f'of group {group_id}: {e}')
+        mapping.layout.update(locations, replace=False)
+
+    pipeline = None
+    if colorspace != 'rgb' or gamma != 1.0 or brightness != 1.0:
+        from .color import ColorPipeline, GAMUTS
+        pipeline = ColorPipeline(colorspace, gamma=gamma,
+                                 brightness=brightness)
+        if colorspace == 'xy':
+            for light_id, gamut in client.get_gamut_types().items():
+                if gamut in GAMUTS:
+                    pipeline.set_gamut(light_id, gamut)
 
-    stream.start()
-    _loop(inport, stream)
+    pacer = None
+    if send_rate is not None:
+        from .pacing import Pacer
+        pacer = Pacer(send_rate, adaptive=adaptive_rate)
 
+    stream_version = None if stream_version == 'auto' else int(stream_version)
 
-# Temporary hard coded mapping
-# Next big TODO: make this configurable
-def _loop(inport, stream):
-    l1 = Light(3)
-    l2 = Light(4)
-    l3 = Light(10)
+    source = None
+    if replay_path is not None:
+        source = functools.partial(ReplayPort, replay_path,
+                                   speed=replay_speed)
 
-    for light in (l1, l2, l3):
-        light.hsv = (0.0, 1.0, 1.0)
-        print(light.s)
+    if multiprocess:
+        from .multiproc import MultiprocessRunner
+        # Frames are rendered apart from the stream, so the version is
+        # decided here
+        configuration = None
+        if stream_version != 1:
+            import requests
+            try:
+                configuration = \
+                    client.get_entertainment_configuration(group_id)
+            except (HueClientError, requests.RequestException,
+                    ValueError) as e:
+                if stream_version == 2:
+                    raise click.ClickException(
+                        f'Failed to get the stream API v2 configuration: {e}'
+                    )
+                print(f'[HueStream] Stream API v2 unavailable ({e}), '
+                      f'using v1')
+            if configuration is None and stream_version == 2:
+                raise click.ClickException(
+                    f'The bridge has no stream API v2 configuration for '
+                    f'group {group_id}'
+                )
+        runner = MultiprocessRunner(
+            group_id, {'credentials_path': credentials_path,
+                       'bridge_ip': client.bridge_ip,
+                       'bridge_port': bridge_port},
+            mapping=mapping_path, input_name=input_name, source=source,
+            rate=frame_rate, immediate=immediate, coalesce=coalesce,
+            clock_sync=clock_sync, lookahead=lookahead, pipeline=pipeline,
+            stream={'pacer': pacer,
+                    'stream_version': 1 if configuration is None else 2,
+                    'configuration': configuration},
+            locations=locations, configuration=configuration, cpus=cpus
+        )
+        runner.start()
+        if not runner.wait():
+            raise click.ClickException('A pipeline process failed')
+        return
 
-    while True:
-        for msg in inport.iter_pending():
-            if msg.type == 'control_change':
-                if msg.control == 77:
-                    l1.h = msg.value / 127.0
-                elif msg.control == 78:
-                    l1.s = msg.value / 127.0
-                elif msg.control == 79:
-                    l1.v = msg.value / 127.0
+    audio_input = None
+    if audio is not None:
+        audio_input = _open_audio(audio, mapping.audio_options)
 
-        streammsg = HueStream.Message()
-        for light in (l1, l2, l3):
-            streammsg.add(light.light_id, light.rgb_int)
+    stream = HueStream(group_id, client, pipeline=pipeline, pacer=pacer,
+                       stream_version=stream_version)
+    if record_frames is not None or record_midi is not None:
+        from .recording import Recorder, FRAMES
+    if record_frames is not None:
+        stream.recorder = Recorder(record_frames, FRAMES)
+    output = stream
+    if streams:
+        def open_stream(stream_group_id, stream_client):
+            # Each bridge gets its own rate limit
+            return HueStream(stream_group_id, stream_client,
+                             pipeline=pipeline,
+                             pacer=pacer and Pacer(send_rate,
+                                                   adaptive=adaptive_rate),
+                             stream_version=stream_version)
+        output = _open_streams(stream, streams, mapping.lights,
+                               credentials_path, open_stream)
+    midi_recorder = None
+    if record_midi is not None:
+        midi_recorder = Recorder(record_midi)
+    inport = None
+    if source is not None:
+        inport = source()
+    elif midi_input:
+        inport = mido.open_input(input_name)
+        if midi_recorder is not None:
+            inport = midi_recorder.tee(inport)
 
-        stream.send(streammsg)
-        time.sleep(0.01)
+    try:
+        output.start()
+    except HueStreamError as e:
+        raise click.ClickException(str(e))
+    scheduler = BeatScheduler(lookahead=lookahead) if clock_sync else None
+    engine = Engine(output, mapping.lights, mapping.dispatch,
+                    rate=frame_rate, immediate=immediate, coalesce=coalesce,
+                    effects=mapping.effects, scheduler=scheduler,
+                    smoother=mapping.smoother,
+                    scenes=mapping.scenes)
+    if metrics or metrics_port is not None:
+        from .metrics import Metrics
+        stats = Metrics()
+        stats.watch_engine(engine)
+        stats.watch_stream(stream)
+        stats.install_signal_handler()
+        if metrics_port is not None:
+            port = stats.serve(metrics_port)
+            print(f'Serving metrics at http://127.0.0.1:{port}/metrics')
+    # Replays, and audio files when they are the only input, end the run
+    finite = source is not None
+    if audio_input is not None:
+        live = audio_input.source.live
+        if midi_recorder is not None:
+            audio_input = midi_recorder.tee(audio_input)
+        if inport is None and not live:
+            finite = True
+            audio_input = _until_replayed(audio_input, engine)
+        engine.start_input(audio_input)
+    if source is not None:
+        inport = _until_replayed(inport, engine)
+    try:
+        engine.run(inport)
+    finally:
+        if finite:
+            output.stop()
+        for each in getattr(output, 'streams', [output]):
+            if each.pacer is not None:
+                print(f'[HueStream] Sent {each.pacer.report()}')
+        for recorder in (midi_recorder, stream.recorder):
+            if recorder is not None:
+                recorder.close()
@@ -0,0 +1,162 @@
+"""MIDI clock tracking and beat-aligned frame scheduling.
+
+TempoTracker follows MIDI clock (24 pulses per quarter note) and the
+start/stop/continue transport messages. The tempo and beat phase are
+estimated by a least-squares fit over a window of recent pulses, which
+smooths the jitter of clock sources and USB/driver delivery.
+
+BeatScheduler uses a tracker to place frames on even subdivisions of the
+beat, sending each one `lookahead` seconds early so it lands on the beat
+after the bridge and network latency.
+"""
+import math
+from collections import deque
+from .engine import LatencyStats
+
+PPQN = 24
+DEFAULT_WINDOW = 48
+# Pulses needed before the tempo estimate is used
+MIN_PULSES = 6
+# The clock is considered lost after this many missing pulses
+MAX_MISSED_PULSES = 6
+DEFAULT_LOOKAHEAD = 0.04
+
+
+class TempoTracker:
+    """Tempo and beat position from MIDI clock messages.
+
+    Positions are counted in pulses since the last start message, so beat
+    0 is the downbeat the sequencer started on.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        assert window >= 2
+        self.running = False
+        self.pulses = 0
+        self._times = deque(maxlen=window)
+        self._fit = None
+
+    @property
+    def bpm(self):
+        """The estimated tempo, or None before the clock is locked"""
+        if self._fit is None or len(self._times) < MIN_PULSES:
+            return None
+        return 60.0 / (self._fit[1] * PPQN)
+
+    @property
+    def beat_period(self):
+        if self._fit is None:
+            return None
+        return self._fit[1] * PPQN
+
+    def locked(self, now):
+        """True if running with a recent, settled tempo estimate"""
+        if not self.running or self.bpm is None:
+            return False
+        return now - self._times[-1][1] < self._fit[1] * MAX_MISSED_PULSES
+
+    def feed(self, msg, now):
+        """Consumes a clock or transport message received at `now`.
+        Returns False for any other message.
+        """
+        msg_type = msg.type
+        if msg_type == 'clock':
+            if self.running:
+                self._times.append((self.pulses, now))
+                self.pulses += 1
+                self._refit()
+        elif msg_type == 'start':
+            self.running = True
+            self.pulses = 0
+            self._times.clear()
+            self._fit = None
+        elif msg_type == 'stop':
+            self.running = False
+        elif msg_type == 'continue':
+            self.running = True
+            # The pause breaks the pulse timeline
+            self._times.clear()
+            self._fit = None
+        else:
+            return False
+        return True
+
+    def position(self, now):
+        """The position at time `now` in pulses (fractional)"""
+        intercept, period = self._fit
+        return (now - intercept) / period
+
+    def beats(self, now):
+        """The position at time `now` in beats (fractional)"""
+        return self.position(now) / PPQN
+
+    def time_at(self, pulse):
+        """The estimated time of a pulse position"""
+        intercept, period = self._fit
+        return intercept + period * pulse
+
+    # Private
+
+    def _refit(self):
+        times = self._times
+        n = len(times)
+        if n < 2:
+            return
+        mean_x = sum(x for x, _ in times) / n
+        mean_y = sum(y for _, y in times) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in times)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in times)
+        if sxx <= 0 or sxy <= 0:
+            return
+        period = sxy / sxx
+        self._fit = (mean_y - period * mean_x, period)
+
+
+class BeatScheduler:
+    """Frame deadlines aligned to the beat of a TempoTracker.
+
+    While the clock is locked, frames are spaced by the beat divided into
+    the whole number of frames nearest the nominal frame period, and each
+    is due `lookahead` seconds before its subdivision. Otherwise frames run
+    on the free clock.
+    """
+
+    def __init__(self, tracker=None, lookahead=DEFAULT_LOOKAHEAD):
+        self.tracker = TempoTracker() if tracker is None else tracker
+        self.lookahead = lookahead
+        # Distance of each locked frame's arrival from its subdivision
+        self.offset = LatencyStats()
+        self._target = None
+
+    def locked(self, now):
+        return self.tracker.locked(now)
+
+    def next_frame(self, now, period):
+        """The time to send the frame after one sent at `now`"""
+        tracker = self.tracker
+        if not tracker.locked(now):
+            self._target = None
+            return now + period
+        pulses_per_frame = PPQN / max(1, round(tracker.beat_period / period))
+        arrival = tracker.position(now + self.lookahead)
+        target = (math.floor(arrival / pulses_per_frame + 1e-6) + 1) * \
+            pulses_per_frame
+        self._target = target
+        return tracker.time_at(target) - self.lookahead
+
+    def frame_sent(self, now):
+        """Records the offset of a frame sent at `now` from the
+        subdivision it was scheduled for.
+        """
+        if self._target is not None and self.tracker.locked(now):
+            arrival = now + self.lookahead
+            self.offset.record(abs(arrival -
+                                   self.tracker.time_at(self._target)))
+
+    def effect_time(self, now):
+        """The effect clock at `now`, in beats as the frame will be seen,
+        or None if not locked.
+        """
+        if not self.tracker.locked(now):
+            return None
+        return self.tracker.beats(now + self.lookahead)
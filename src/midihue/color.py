@@ -0,0 +1,230 @@
+"""Output color pipeline for entertainment streams.
+
+Turns light colors into the stream's 16 bit channel values, either as
+RGB or as CIE xy plus brightness. Brightness is shaped by a gamma curve
+and scale, and xy colors are mapped into each light's color gamut (A, B
+or C, as reported by the bridge). Per-channel math that would otherwise
+need a power function per light per frame (the brightness curve and sRGB
+linearization) is precomputed into tables indexed by the 16 bit value,
+and RGB banks are converted with NumPy when it is installed.
+"""
+from array import array
+from collections import namedtuple
+from .light import _NUMPY_MIN_SLOTS, _import_numpy
+
+LUT_BITS = 16
+LUT_MAX = (1 << LUT_BITS) - 1
+MAX_OUTPUT = 0xffff
+
+XY = namedtuple('XY', ['x', 'y'])
+Gamut = namedtuple('Gamut', ['red', 'green', 'blue'])
+
+# Color gamuts of Hue lights, by the bridge's colorgamuttype
+GAMUTS = {
+    'A': Gamut(XY(0.704, 0.296), XY(0.2151, 0.7106), XY(0.138, 0.08)),
+    'B': Gamut(XY(0.675, 0.322), XY(0.409, 0.518), XY(0.167, 0.04)),
+    'C': Gamut(XY(0.6915, 0.3083), XY(0.17, 0.7), XY(0.1532, 0.0475)),
+}
+
+# Value of the stream header's color space byte
+COLORSPACES = {'rgb': 0x00, 'xy': 0x01}
+
+# xy of black, where the color is undefined
+WHITE_POINT = XY(0.3127, 0.3290)
+
+# Wide gamut RGB (D65) to XYZ, as recommended for Hue lights
+_RGB_TO_XYZ = (
+    (0.664511, 0.154324, 0.162028),
+    (0.283881, 0.668433, 0.047685),
+    (0.000088, 0.072310, 0.986039),
+)
+
+
+def srgb_to_linear(value):
+    """Removes the sRGB transfer curve from a channel value in [0, 1]"""
+    if value > 0.04045:
+        return ((value + 0.055) / 1.055) ** 2.4
+    return value / 12.92
+
+
+def rgb_to_xyb(r, g, b):
+    """Converts sRGB in [0, 1] to CIE (x, y, Y), without gamut mapping"""
+    r, g, b = srgb_to_linear(r), srgb_to_linear(g), srgb_to_linear(b)
+    return _xyz_to_xyb(*_rgb_to_xyz(r, g, b))
+
+
+def in_gamut(x, y, gamut):
+    """True if (x, y) is inside the gamut triangle"""
+    red, green, blue = gamut
+    d1 = _cross(x, y, red, green)
+    d2 = _cross(x, y, green, blue)
+    d3 = _cross(x, y, blue, red)
+    negative = d1 < 0 or d2 < 0 or d3 < 0
+    positive = d1 > 0 or d2 > 0 or d3 > 0
+    return not (negative and positive)
+
+
+def clamp_to_gamut(x, y, gamut):
+    """Returns (x, y), or the closest point to it on the gamut triangle
+    if it is outside.
+    """
+    if in_gamut(x, y, gamut):
+        return x, y
+    red, green, blue = gamut
+    best = None
+    for a, b in ((red, green), (green, blue), (blue, red)):
+        point = _closest_on_segment(x, y, a, b)
+        distance = (point[0] - x) ** 2 + (point[1] - y) ** 2
+        if best is None or distance < best[0]:
+            best = (distance, point)
+    return best[1]
+
+
+class ColorPipeline:
+    """Converts colors to a stream color space.
+
+    `colorspace` is 'rgb' or 'xy' (xy plus brightness). Output brightness
+    (each channel for RGB, luminance for xy) is `brightness * v ** gamma`.
+    In xy mode colors are clamped to the gamut of each light set with
+    `set_gamut`, or to `gamut` for other lights (None disables clamping).
+    In RGB mode the bridge maps colors to the light's gamut itself.
+    """
+
+    def __init__(self, colorspace='rgb', gamma=1.0, brightness=1.0,
+                 gamut='C'):
+        if colorspace not in COLORSPACES:
+            raise ValueError(f'Invalid colorspace {colorspace!r}, must be '
+                             f'one of {", ".join(COLORSPACES)}')
+        assert gamma > 0, 'Gamma must be positive'
+        assert 0.0 <= brightness <= 1.0, 'Brightness must be in [0, 1]'
+        self.colorspace = colorspace
+        self.gamma = gamma
+        self.brightness = brightness
+        self.gamut = _gamut(gamut)
+        self._gamuts = {}
+        scale = brightness * MAX_OUTPUT
+        self._curve = array('H', (
+            int(scale * (i / LUT_MAX) ** gamma + 0.5)
+            for i in range(LUT_MAX + 1)
+        ))
+        self._linear = None
+        if colorspace == 'xy':
+            self._linear = array('d', (
+                srgb_to_linear(i / LUT_MAX) for i in range(LUT_MAX + 1)
+            ))
+        self._np_curve = None
+
+    @property
+    def colorspace_id(self):
+        """The stream header's color space byte"""
+        return COLORSPACES[self.colorspace]
+
+    def set_gamut(self, light_id, gamut):
+        """Sets a light's gamut: 'A', 'B', 'C', a Gamut or None"""
+        self._gamuts[int(light_id)] = _gamut(gamut)
+
+    def encode(self, light_id, r, g, b):
+        """Returns the stream channel values for an RGB color"""
+        if self._linear is None:
+            curve = self._curve
+            return (curve[int(r * LUT_MAX)], curve[int(g * LUT_MAX)],
+                    curve[int(b * LUT_MAX)])
+        return self._encode_xy(light_id, r, g, b)
+
+    def encode_light(self, light):
+        rgb = light.rgb
+        return self.encode(light.light_id, rgb[0], rgb[1], rgb[2])
+
+    def convert(self, bank, output, slots=None):
+        """Writes the channel values of a converted LightBank's slots (see
+        LightBank.convert) into `output`, an array laid out like
+        `bank.rgb_int`.
+        """
+        ids, rgb = bank.ids, bank.rgb
+        if slots is None:
+            slots = range(len(ids))
+        if self._linear is None:
+            if len(slots) >= _NUMPY_MIN_SLOTS and \
+                    _import_numpy() is not None:
+                self._convert_numpy(bank, output, slots)
+                return
+            curve = self._curve
+            for slot in slots:
+                i = slot * 3
+                output[i] = curve[int(rgb[i] * LUT_MAX)]
+                output[i + 1] = curve[int(rgb[i + 1] * LUT_MAX)]
+                output[i + 2] = curve[int(rgb[i + 2] * LUT_MAX)]
+            return
+        for slot in slots:
+            i = slot * 3
+            output[i], output[i + 1], output[i + 2] = self._encode_xy(
+                ids[slot], rgb[i], rgb[i + 1], rgb[i + 2]
+            )
+
+    # Private
+
+    def _encode_xy(self, light_id, r, g, b):
+        linear = self._linear
+        r = linear[int(r * LUT_MAX)]
+        g = linear[int(g * LUT_MAX)]
+        b = linear[int(b * LUT_MAX)]
+        (xr, xg, xb), (yr, yg, yb), (zr, zg, zb) = _RGB_TO_XYZ
+        X = r * xr + g * xg + b * xb
+        Y = r * yr + g * yg + b * yb
+        total = X + Y + r * zr + g * zg + b * zb
+        if total <= 0.0:
+            x, y = WHITE_POINT
+        else:
+            x, y = X / total, Y / total
+        # Most colors are in gamut, and are not clamped
+        gamut = self._gamuts.get(light_id, self.gamut)
+        if gamut is not None and not in_gamut(x, y, gamut):
+            x, y = clamp_to_gamut(x, y, gamut)
+        if Y > 1.0:
+            Y = 1.0
+        return (int(x * MAX_OUTPUT + 0.5), int(y * MAX_OUTPUT + 0.5),
+                self._curve[int(Y * LUT_MAX)])
+
+    def _convert_numpy(self, bank, output, slots):
+        np = _import_numpy()
+        if self._np_curve is None:
+            self._np_curve = np.frombuffer(self._curve, dtype=np.uint16)
+        slots = np.asarray(slots, dtype=np.intp)
+        rgb = np.frombuffer(bank.rgb, dtype=np.float64).reshape(-1, 3)
+        out = np.frombuffer(output, dtype=np.uint16).reshape(-1, 3)
+        out[slots] = self._np_curve[(rgb[slots] * LUT_MAX).astype(np.intp)]
+
+
+def _gamut(gamut):
+    if gamut is None or isinstance(gamut, Gamut):
+        return gamut
+    try:
+        return GAMUTS[gamut]
+    except KeyError:
+        raise ValueError(f'Invalid gamut {gamut!r}, must be one of '
+                         f'{", ".join(GAMUTS)}')
+
+
+def _rgb_to_xyz(r, g, b):
+    (xr, xg, xb), (yr, yg, yb), (zr, zg, zb) = _RGB_TO_XYZ
+    return (r * xr + g * xg + b * xb,
+            r * yr + g * yg + b * yb,
+            r * zr + g * zg + b * zb)
+
+
+def _xyz_to_xyb(X, Y, Z):
+    total = X + Y + Z
+    if total <= 0.0:
+        return WHITE_POINT.x, WHITE_POINT.y, 0.0
+    return X / total, Y / total, Y
+
+
+def _cross(x, y, a, b):
+    return (x - b[0]) * (a[1] - b[1]) - (a[0] - b[0]) * (y - b[1])
+
+
+def _closest_on_segment(x, y, a, b):
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    t = ((x - a[0]) * dx + (y - a[1]) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return a[0] + t * dx, a[1] + t * dy
@@ -0,0 +1,294 @@
+"""Time-based effects, rendered into light state once per frame.
+
+An effect drives one parameter of a set of lights from a periodic wave
+(LFO, Chase, Strobe) or a ramp (Fade). Periodic effects share the
+parameters `rate` (cycles per second), `depth` (how far the wave swings
+below `level`, 0-1) and `phase` (offset in cycles), which can be changed
+at any time, e.g. by MIDI mappings. Waveforms are read from precomputed
+lookup tables unless created with `lookup=False`.
+"""
+import math
+import time
+from array import array
+from functools import partial
+from .light import Light
+
+# Seconds of effect evaluation allowed per frame
+DEFAULT_BUDGET = 0.005
+TABLE_SIZE = 1024
+
+# Functions of phase in [0, 1) with values in [0, 1], all starting at 0
+WAVEFORMS = {
+    'sine': lambda p: 0.5 - 0.5 * math.cos(2.0 * math.pi * p),
+    'triangle': lambda p: 1.0 - abs(1.0 - 2.0 * p),
+    'saw': lambda p: p,
+    'square': lambda p: 0.0 if p < 0.5 else 1.0,
+}
+
+_tables = {}
+
+
+def make_wave(name, lookup=True):
+    """Returns the function of phase for a named waveform, reading from a
+    table of TABLE_SIZE samples if lookup is True.
+    """
+    try:
+        func = WAVEFORMS[name]
+    except KeyError:
+        raise ValueError(f'Unknown waveform {name!r}, must be one of '
+                         f'{", ".join(WAVEFORMS)}')
+    if not lookup:
+        return func
+    table = _table(name)
+    return lambda p: table[int(p * TABLE_SIZE)]
+
+
+class Effect:
+    """Base class of effects on parameter `param` of `lights`.
+
+    Subclasses implement `values(t)`, returning one value per light for
+    `t` seconds after the effect started.
+    """
+
+    # Attributes that can be set from MIDI mappings
+    PARAMETERS = ()
+
+    def __init__(self, lights, param='v'):
+        self.lights = list(lights)
+        self.param = param
+        self.started = None
+        self.done = False
+        self._targets = [_target(light, param) for light in self.lights]
+
+    def restart(self):
+        self.started = None
+        self.done = False
+
+    def render(self, now):
+        """Writes the effect's values for time `now` into its lights"""
+        if self.started is None:
+            self.started = now
+        values = self.values(now - self.started)
+        for target, value in zip(self._targets, values):
+            if value < 0.0:
+                value = 0.0
+            elif value > 1.0:
+                value = 1.0
+            if type(target) is tuple:
+                array_, index, versions, slot = target
+                if array_[index] != value:
+                    array_[index] = value
+                    versions[slot] += 1
+            else:
+                target(value)
+
+    def values(self, t):
+        raise NotImplementedError
+
+
+class LFO(Effect):
+    """A waveform applied to every light, optionally shifted in phase by
+    up to `spread` cycles across the lights (1.0 makes a rolling wave).
+    """
+
+    PARAMETERS = ('rate', 'depth', 'phase', 'level', 'spread')
+
+    def __init__(self, lights, param='v', waveform='sine', rate=1.0,
+                 depth=1.0, phase=0.0, level=1.0, spread=0.0, lookup=True):
+        super().__init__(lights, param)
+        self.rate = rate
+        self.depth = depth
+        self.phase = phase
+        self.level = level
+        self.spread = spread
+        self._wave = make_wave(waveform, lookup=False)
+        self._table = _table(waveform) if lookup else None
+
+    def values(self, t):
+        n = len(self._targets)
+        base = self.rate * t + self.phase
+        step = self.spread / n if n else 0.0
+        low = self.level * (1.0 - self.depth)
+        swing = self.level * self.depth
+        table = self._table
+        if table is None:
+            wave = self._wave
+            return [low + swing * wave((base - i * step) % 1.0)
+                    for i in range(n)]
+        # Index the table directly rather than calling a function per light
+        size = TABLE_SIZE
+        start = (base % 1.0) * size
+        step *= size
+        return [low + swing * table[int(start - i * step) % size]
+                for i in range(n)]
+
+
+class Chase(Effect):
+    """A pulse moving across the lights in order, `rate` times a second.
+    Each light is on for `width` of a cycle (by default 1 / len(lights)).
+    """
+
+    PARAMETERS = ('rate', 'depth', 'phase', 'level', 'width')
+
+    def __init__(self, lights, param='v', rate=1.0, depth=1.0, phase=0.0,
+                 level=1.0, width=None):
+        super().__init__(lights, param)
+        self.rate = rate
+        self.depth = depth
+        self.phase = phase
+        self.level = level
+        self.width = 1.0 / max(1, len(self.lights)) if width is None \
+            else width
+
+    def values(self, t):
+        n = len(self._targets)
+        base = self.rate * t + self.phase
+        width = self.width
+        high = self.level
+        low = high * (1.0 - self.depth)
+        return [high if (base - i / n) % 1.0 < width else low
+                for i in range(n)]
+
+
+class Strobe(Effect):
+    """All lights flashing together, on for `duty` of each cycle"""
+
+    PARAMETERS = ('rate', 'depth', 'phase', 'level', 'duty')
+
+    def __init__(self, lights, param='v', rate=10.0, depth=1.0, phase=0.0,
+                 level=1.0, duty=0.1):
+        super().__init__(lights, param)
+        self.rate = rate
+        self.depth = depth
+        self.phase = phase
+        self.level = level
+        self.duty = duty
+
+    def values(self, t):
+        on = (self.rate * t + self.phase) % 1.0 < self.duty
+        value = self.level if on else self.level * (1.0 - self.depth)
+        return [value] * len(self._targets)
+
+
+class Fade(Effect):
+    """A linear ramp from `start` to `end` over `duration` seconds, after
+    which the effect is done. Setting `trigger` above 0 restarts it.
+    """
+
+    PARAMETERS = ('start', 'end', 'duration', 'trigger')
+
+    def __init__(self, lights, param='v', start=0.0, end=1.0,
+                 duration=1.0):
+        super().__init__(lights, param)
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    @property
+    def trigger(self):
+        return 0.0
+
+    @trigger.setter
+    def trigger(self, value):
+        if value > 0:
+            self.restart()
+
+    def values(self, t):
+        if self.duration <= 0 or t >= self.duration:
+            self.done = True
+            value = self.end
+        else:
+            value = self.start + (self.end - self.start) * t / self.duration
+        return [value] * len(self._targets)
+
+
+EFFECTS = {'lfo': LFO, 'chase': Chase, 'strobe': Strobe, 'fade': Fade}
+
+
+class Effects:
+    """The effects running on a set of lights, rendered once per frame.
+
+    Effects are rendered in the order they were added, so a later effect on
+    the same parameter wins. Rendering stops once `budget` seconds have
+    been spent; the next frame resumes with the effects that were skipped,
+    which keep their previous values meanwhile. Finished effects (see
+    Fade) are skipped until restarted.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        # Frames on which the budget ran out before all effects rendered
+        self.overruns = 0
+        self._effects = []
+        self._next = 0
+
+    def __len__(self):
+        return len(self._effects)
+
+    def __iter__(self):
+        return iter(self._effects)
+
+    def add(self, effect):
+        self._effects.append(effect)
+        return effect
+
+    def remove(self, effect):
+        self._effects.remove(effect)
+        self._next = 0
+
+    def restart(self):
+        """Restarts every effect that has not finished"""
+        for effect in self._effects:
+            if not effect.done:
+                effect.restart()
+
+    def render(self, now=None):
+        """Renders effects for time `now` (perf_counter seconds by default).
+        Returns the number of effects visited.
+        """
+        effects = self._effects
+        n = len(effects)
+        if not n:
+            return 0
+        clock = time.perf_counter
+        if now is None:
+            now = clock()
+        deadline = clock() + self.budget
+        first = self._next % n
+        rendered = 0
+        while rendered < n:
+            effect = effects[(first + rendered) % n]
+            rendered += 1
+            if effect.done:
+                continue
+            effect.render(now)
+            if rendered < n and clock() > deadline:
+                self.overruns += 1
+                break
+        self._next = (first + rendered) % n
+        return rendered
+
+
+def _table(name):
+    table = _tables.get(name)
+    if table is None:
+        func = WAVEFORMS[name]
+        # One extra sample, as phase % 1.0 can round up to 1.0
+        table = array('d', (func(i / TABLE_SIZE)
+                            for i in range(TABLE_SIZE + 1)))
+        _tables[name] = table
+    return table
+
+
+def _target(light, param):
+    # Where a parameter is stored natively, effects write straight into the
+    # light's bank; otherwise they go through the Light's setter
+    if param not in ('h', 's', 'v', 'r', 'g', 'b'):
+        raise ValueError(f'Invalid param {param!r}')
+    space = 'hsv' if param in 'hsv' else 'rgb'
+    if light.colorspace != space:
+        return partial(getattr(Light, param).fset, light)
+    bank = light.bank
+    values = bank.hsv if space == 'hsv' else bank.rgb
+    return (values, light.slot * 3 + space.index(param), bank.versions,
+            light.slot)
@@ -0,0 +1,304 @@
+import threading
+import time
+
+# The bridge renders entertainment streams at roughly 25 Hz, sending at
+# twice that rate keeps output smooth without flooding the network.
+DEFAULT_FRAME_RATE = 50
+
+# CCs selecting an (N)RPN and entering its value, which only mean something
+# in sequence (see mapping.PARAMETER_CONTROLS)
+_PARAMETER_CONTROLS = frozenset((6, 38, 98, 99, 100, 101))
+
+# Continuous messages that only matter for their latest value, and the
+# key identifying what each one controls (None if this one is ordered)
+_COALESCED = {
+    'control_change': lambda m: None if m.control in _PARAMETER_CONTROLS
+    else ('control_change', m.channel, m.control),
+    'pitchwheel': lambda m: ('pitchwheel', m.channel),
+    'aftertouch': lambda m: ('aftertouch', m.channel),
+    'polytouch': lambda m: ('polytouch', m.channel, m.note),
+}
+
+# System realtime messages, which don't change parameters and so don't end
+# a run of continuous messages
+_REALTIME = frozenset(('clock', 'start', 'continue', 'stop',
+                       'active_sensing'))
+
+
+class LatencyStats:
+    """Running statistics of MIDI-to-send latency, in seconds."""
+
+    def __init__(self):
+        self.reset()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, latency):
+        self.count += 1
+        self.total += latency
+        self.last = latency
+        if latency > self.max:
+            self.max = latency
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+
+class Coalescer:
+    """MIDI messages pending until the next frame.
+
+    A continuous message (CC, pitch wheel, aftertouch) drops a pending
+    one for the same channel and controller and is queued at the end, so
+    messages apply in the order of their last arrival: a 14 bit MSB still
+    follows the LSB it resets, and of two CCs mapped to one parameter the
+    one received last still wins. Any other message, e.g. a note, program
+    change or NRPN data entry, is queued in order and ends the run that
+    can be collapsed, so no message moves past it. System realtime
+    messages (clock, start, stop, active sensing) are queued without
+    ending the run, so a clock stream does not stop CCs from collapsing.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.collapsed = 0
+        # Dropped messages are left as None until drained
+        self._pending = []
+        self._dropped = 0
+        self._latest = {}
+
+    def __len__(self):
+        return len(self._pending) - self._dropped
+
+    def put(self, msg):
+        self.received += 1
+        key_func = _COALESCED.get(msg.type)
+        key = None if key_func is None else key_func(msg)
+        if key is None:
+            if msg.type not in _REALTIME:
+                self._latest.clear()
+        else:
+            index = self._latest.get(key)
+            if index is not None:
+                self._pending[index] = None
+                self._dropped += 1
+                self.collapsed += 1
+            self._latest[key] = len(self._pending)
+        self._pending.append(msg)
+
+    def drain(self):
+        """Returns the pending messages in order and clears them"""
+        pending, self._pending = self._pending, []
+        if self._dropped:
+            pending = [msg for msg in pending if msg is not None]
+            self._dropped = 0
+        self._latest.clear()
+        return pending
+
+
+class Engine:
+    """Drives a HueStream from MIDI input.
+
+    Messages are received on a dedicated thread and applied to light state
+    by `handler` as soon as they arrive. Frames are rendered and sent from
+    `run` on a fixed clock of `rate` Hz. In immediate mode a frame is also
+    flushed as soon as a message has been handled, so latency is bounded by
+    the render and send time instead of the frame period.
+
+    With `coalesce`, messages are instead queued in a Coalescer and applied
+    on the frame thread just before rendering, so a burst of CCs costs one
+    handler call per controller per frame.
+
+    `effects` (see midihue.effects.Effects) are rendered into the lights at
+    the start of every frame, after the parameters of a `smoother` (see
+    midihue.smoothing.Smoother) are moved towards their targets and a
+    crossfade of `scenes` (see midihue.scenes.SceneStore) is moved on.
+
+    With a `scheduler` (see midihue.clock.BeatScheduler), MIDI clock
+    messages go to its tempo tracker instead of the handler. While the
+    clock is locked, frames are scheduled on subdivisions of the beat and
+    effects run in beats rather than seconds.
+    """
+
+    def __init__(self, stream, lights, handler,
+                 rate=DEFAULT_FRAME_RATE, immediate=False, coalesce=False,
+                 effects=None, scheduler=None, smoother=None, scenes=None):
+        assert rate > 0, 'Frame rate must be positive'
+        self.stream = stream
+        self.lights = lights
+        self.period = 1.0 / rate
+        self.immediate = immediate
+        self.coalescer = Coalescer() if coalesce else None
+        self.effects = effects
+        self.scheduler = scheduler
+        self.smoother = smoother
+        self.scenes = scenes
+        self.latency = LatencyStats()
+        # Messages applied since the last frame was rendered
+        self.backlog = 0
+        # A metrics.Metrics to record stage timings into, if set
+        self.metrics = None
+        self._handler = handler
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._pending_since = None
+        self._last_frame = None
+        self._beat_locked = False
+        self._running = False
+
+    def start_input(self, inport):
+        """Starts a daemon thread delivering messages from inport."""
+        thread = threading.Thread(target=self._read, args=(inport,),
+                                  name='midihue-input', daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, msg):
+        """Applies a MIDI message to light state. Thread safe."""
+        received = time.perf_counter()
+        if self.scheduler is not None:
+            with self._lock:
+                if self.scheduler.tracker.feed(msg, received):
+                    return
+        with self._lock:
+            if self.coalescer is not None:
+                self.coalescer.put(msg)
+            else:
+                self._handler(msg)
+            self.backlog += 1
+            if self._pending_since is None:
+                self._pending_since = received
+        if self.metrics is not None and self.coalescer is None:
+            self.metrics.record('midi', time.perf_counter() - received)
+        if self.immediate:
+            self._changed.set()
+
+    def flush(self):
+        """Renders the current light state and sends it as one frame,
+        unless nothing changed and the stream suppresses it. Returns the
+        time the frame was sent, or None.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        with self._lock:
+            if self.coalescer is not None and len(self.coalescer):
+                self._apply(self.coalescer.drain())
+            if self.smoother is not None and len(self.smoother):
+                self._smooth()
+            if self.scenes is not None and self.scenes.fading:
+                self._fade()
+            if self.effects is not None and len(self.effects):
+                self._render_effects()
+            message = self.stream.render(self.lights)
+            pending_since = self._pending_since
+            self._pending_since = None
+            self.backlog = 0
+
+        if message is None:
+            return None
+
+        self.stream.send(message)
+        sent = time.perf_counter()
+        if pending_since is not None:
+            self.latency.record(sent - pending_since)
+        if metrics is not None:
+            metrics.record('frame', sent - started)
+            if self._last_frame is not None:
+                metrics.record('interval', sent - self._last_frame)
+            self._last_frame = sent
+        return sent
+
+    def run(self, inport=None):
+        """Runs the frame clock until `stop` is called."""
+        if inport is not None:
+            self.start_input(inport)
+
+        self._running = True
+        deadline = time.perf_counter()
+        while self._running:
+            sent = self.flush()
+            if self.scheduler is not None:
+                deadline = self._next_beat_frame(sent)
+            else:
+                deadline += self.period
+            now = time.perf_counter()
+            if deadline < now:
+                # Fell behind (e.g. a slow send): skip the missed frames
+                # rather than bursting to catch up.
+                deadline = now
+            self._wait_until(deadline)
+
+    def stop(self):
+        self._running = False
+        self._changed.set()
+
+    # Private
+
+    def _apply(self, messages):
+        if self.metrics is None:
+            for msg in messages:
+                self._handler(msg)
+        else:
+            started = time.perf_counter()
+            for msg in messages:
+                self._handler(msg)
+            self.metrics.record('midi', time.perf_counter() - started)
+
+    def _smooth(self):
+        if self.metrics is None:
+            self.smoother.update()
+        else:
+            started = time.perf_counter()
+            if self.smoother.update(started):
+                self.metrics.record('smoothing',
+                                    time.perf_counter() - started)
+
+    def _fade(self):
+        if self.metrics is None:
+            self.scenes.update()
+        else:
+            started = time.perf_counter()
+            self.scenes.update(started)
+            self.metrics.record('scenes', time.perf_counter() - started)
+
+    def _render_effects(self):
+        started = time.perf_counter()
+        now = started
+        if self.scheduler is not None:
+            beats = self.scheduler.effect_time(started)
+            locked = beats is not None
+            if locked != self._beat_locked:
+                # Effect times switch between seconds and beats
+                self._beat_locked = locked
+                self.effects.restart()
+            if locked:
+                now = beats
+        self.effects.render(now)
+        if self.metrics is not None:
+            self.metrics.record('effects', time.perf_counter() - started)
+
+    def _next_beat_frame(self, sent):
+        with self._lock:
+            if sent is not None:
+                self.scheduler.frame_sent(sent)
+            return self.scheduler.next_frame(time.perf_counter(),
+                                             self.period)
+
+    def _read(self, inport):
+        for msg in inport:
+            self.submit(msg)
+
+    def _wait_until(self, deadline):
+        while self._running:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            if self._changed.wait(remaining):
+                self._changed.clear()
+                if self._running:
+                    self.flush()
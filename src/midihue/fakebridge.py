@@ -0,0 +1,443 @@
+"""A local stand-in for a Hue bridge, for tests and benchmarks.
+
+Serves the REST endpoints midi-hue uses (user creation, config, groups and
+stream mode) over HTTP, and accepts entertainment streams over DTLS-PSK,
+recording every frame received with its arrival time. With an
+`api_version` of 1.42.0 or later it also serves the entertainment
+configurations and services of the v2 API and the user's application ID,
+for stream API v2, and streams started through their configuration take
+the application ID as their PSK identity.
+
+    bridge = FakeBridge()
+    bridge.start()
+    client = HueClient(credentials_path, bridge_ip=bridge.host,
+                       bridge_port=bridge.http_port)
+    stream = HueStream(bridge.group_id, client, port=bridge.stream_port)
+"""
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from mbedtls import tls
+from mbedtls.exceptions import TLSError
+
+DEFAULT_USERNAME = 'midihue-fake-bridge-user'
+DEFAULT_CLIENTKEY = '0123456789abcdef0123456789abcdef'
+DEFAULT_APPLICATION_ID = '6a5d8f4e-2b1c-4d7e-9f30-8c1b2a3d4e5f'
+BRIDGE_ID = '001788FFFE000000'
+DEFAULT_API_VERSION = '1.16.0'
+
+_RESOURCE_PATH = re.compile(
+    r'^/api/([^/]+)/(groups|lights)(?:/([^/]+))?/?$'
+)
+_CLIP_PATH = re.compile(
+    r'^/clip/v2/resource/(entertainment_configuration|entertainment)'
+    r'(?:/([^/]+))?/?$'
+)
+
+
+def default_groups(light_ids=range(1, 11)):
+    """An entertainment group '1' of the given lights, placed in a row from
+    left to right
+    """
+    lights = [str(light_id) for light_id in light_ids]
+    step = 2.0 / max(1, len(lights) - 1)
+    return {
+        '1': {
+            'name': 'Fake entertainment area',
+            'type': 'Entertainment',
+            'lights': lights,
+            'locations': {light_id: [round(-1.0 + i * step, 4), 0.5, 0.0]
+                          for i, light_id in enumerate(lights)},
+            'stream': {'active': False, 'owner': None},
+        },
+    }
+
+
+def default_lights(light_ids=range(1, 11), gamut='C'):
+    """Color lights of the given IDs, all with the same gamut type"""
+    return {
+        str(light_id): {
+            'name': f'Fake light {light_id}',
+            'type': 'Extended color light',
+            'capabilities': {'control': {'colorgamuttype': gamut}},
+        }
+        for light_id in light_ids
+    }
+
+
+class FakeBridge:
+    """Hue bridge REST API and entertainment stream on localhost.
+
+    Both listeners bind ephemeral ports unless given. Frames are appended
+    to `frames` as (perf_counter time, bytes) and passed to `on_frame`
+    if set, which is called on the stream thread. The PSK identity of each
+    handshake is appended to `identities`.
+
+    Setting `clip_response` to (HTTP status, body bytes) answers every v2
+    API request with it, to stand in for a bridge whose v2 API fails.
+    """
+
+    def __init__(self, username=DEFAULT_USERNAME, clientkey=DEFAULT_CLIENTKEY,
+                 groups=None, host='127.0.0.1', http_port=0, stream_port=0,
+                 link_button=True, lights=None,
+                 api_version=DEFAULT_API_VERSION,
+                 application_id=DEFAULT_APPLICATION_ID):
+        self.username = username
+        self.clientkey = clientkey
+        self.application_id = application_id
+        self.groups = default_groups() if groups is None else groups
+        self.lights = default_lights() if lights is None else lights
+        self.host = host
+        self.link_button = link_button
+        self.api_version = api_version
+        self.frames = []
+        self.on_frame = None
+        self.handshakes = 0
+        self.identities = []
+        self.clip_response = None
+        self._http_port = http_port
+        self._stream_port = stream_port
+        self._http = None
+        self._listener = None
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    @property
+    def http_port(self):
+        return self._http.server_address[1]
+
+    @property
+    def stream_port(self):
+        return self._listener.getsockname()[1]
+
+    @property
+    def group_id(self):
+        """ID of the first entertainment group"""
+        for gid, info in self.groups.items():
+            if info['type'] == 'Entertainment':
+                return int(gid)
+        return None
+
+    def start(self):
+        self._closed.clear()
+        self._http = _HTTPServer((self.host, self._http_port), _Handler)
+        self._http.bridge = self
+        # v1 streams identify with the username, v2 streams with the
+        # application ID
+        key = bytes.fromhex(self.clientkey)
+        store = _KeyStore(self.identities, {self.username: key})
+        if self.streams_v2:
+            store[self.application_id] = key
+        conf = tls.DTLSConfiguration(pre_shared_key_store=store,
+                                     validate_certificates=False)
+        self._listener = tls.ServerContext(conf).wrap_socket(
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        )
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self._stream_port))
+        for target, name in ((self._serve_http, 'http'),
+                             (self._accept, 'stream')):
+            threading.Thread(target=target, name=f'fakebridge-{name}',
+                             daemon=True).start()
+
+    def stop(self):
+        self._closed.set()
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+        self.drop_streams()
+        if self._listener is not None:
+            self._listener.close()
+
+    def drop_streams(self):
+        """Ends all stream sessions with a close notify, as the bridge
+        does when it leaves streaming mode.
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for conn in sessions:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except (OSError, TLSError):
+                pass
+            conn.close()
+
+    def configuration_id(self, group_id):
+        """ID of the v2 entertainment configuration of a group"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL,
+                              f'{BRIDGE_ID}/groups/{group_id}'))
+
+    @property
+    def streams_v2(self):
+        """True if the bridge serves entertainment configurations"""
+        version = tuple(int(part) for part in self.api_version.split('.'))
+        return version >= (1, 42)
+
+    def stream_active(self, group_id):
+        return self.groups[str(group_id)]['stream']['active']
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Private
+
+    def _serve_http(self):
+        # A short poll interval so that stop() returns promptly
+        self._http.serve_forever(poll_interval=0.05)
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn, address = self._listener.accept()
+                conn.setcookieparam(address[0].encode())
+                try:
+                    conn.do_handshake()
+                except tls.HelloVerifyRequest:
+                    # accept() leaves the old wrapper bound to the port
+                    verified, address = conn.accept()
+                    conn.close()
+                    conn = verified
+                    conn.setcookieparam(address[0].encode())
+                    conn.do_handshake()
+            except (OSError, TLSError):
+                # A failed handshake, or the listener was closed
+                continue
+            with self._lock:
+                self.handshakes += 1
+                self._sessions.append(conn)
+            threading.Thread(target=self._receive, args=(conn,),
+                             name='fakebridge-session', daemon=True).start()
+
+    def _receive(self, conn):
+        while not self._closed.is_set():
+            try:
+                data = conn.recv(4096)
+            except (OSError, TLSError):
+                break
+            if not data:
+                break
+            received = time.perf_counter()
+            self.frames.append((received, data))
+            if self.on_frame is not None:
+                self.on_frame(received, data)
+        with self._lock:
+            if conn in self._sessions:
+                self._sessions.remove(conn)
+
+    def _create_user(self, body):
+        if not self.link_button:
+            return [_error(101, '', 'link button not pressed')]
+        success = {'username': self.username}
+        if body.get('generateclientkey'):
+            success['clientkey'] = self.clientkey
+        return [{'success': success}]
+
+    def _entertainment_configurations(self):
+        """A configuration per entertainment group, with a channel per
+        light in the group's order
+        """
+        return [{
+            'id': self.configuration_id(gid),
+            'id_v1': f'/groups/{gid}',
+            'type': 'entertainment_configuration',
+            'name': info['name'],
+            'channels': [{
+                'channel_id': channel,
+                'members': [{'service': {'rid': _service_id(light_id),
+                                         'rtype': 'entertainment'},
+                             'index': 0}],
+            } for channel, light_id in enumerate(info['lights'])],
+        } for gid, info in self.groups.items()
+            if info['type'] == 'Entertainment']
+
+    def _entertainment(self):
+        return [{'id': _service_id(light_id), 'id_v1': f'/lights/{light_id}',
+                 'type': 'entertainment', 'renderer': True}
+                for light_id in self.lights]
+
+    def _set_group(self, group_id, body):
+        group = self.groups.get(group_id)
+        if group is None:
+            return [_error(3, f'/groups/{group_id}',
+                           f'resource, /groups/{group_id}, not available')]
+        active = body.get('stream', {}).get('active')
+        if not isinstance(active, bool):
+            return [_error(7, f'/groups/{group_id}/stream',
+                           'invalid value for parameter, active')]
+        if group['type'] != 'Entertainment':
+            return [_error(307, f'/groups/{group_id}/stream',
+                           'Streaming is only supported by entertainment '
+                           'groups')]
+        self._set_streaming(group, active)
+        return [{'success': {f'/groups/{group_id}/stream/active': active}}]
+
+    def _set_configuration(self, configuration_id, body):
+        """Starts or stops streaming to an entertainment configuration.
+        Returns (HTTP status, response).
+        """
+        for gid, group in self.groups.items():
+            if group['type'] == 'Entertainment' and \
+                    self.configuration_id(gid) == configuration_id:
+                break
+        else:
+            return 404, _clip_error('Not Found')
+        action = body.get('action')
+        if action not in ('start', 'stop'):
+            return 400, _clip_error('invalid value for action')
+        self._set_streaming(group, action == 'start')
+        return 200, {'errors': [],
+                     'data': [{'rid': configuration_id,
+                               'rtype': 'entertainment_configuration'}]}
+
+    def _set_streaming(self, group, active):
+        group['stream'] = {'active': active,
+                           'owner': self.username if active else None}
+        if not active:
+            self.drop_streams()
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        bridge = self.server.bridge
+        if self.path == '/api/config':
+            return self._reply({'name': 'midi-hue fake bridge',
+                                'bridgeid': BRIDGE_ID,
+                                'apiversion': bridge.api_version})
+        if self.path == '/auth/v1' and bridge.streams_v2:
+            if not self._clip_authorized():
+                return
+            return self._reply({}, headers={
+                'hue-application-id': bridge.application_id
+            })
+        match = _CLIP_PATH.match(self.path)
+        if match is not None and match.group(2) is None and \
+                bridge.streams_v2:
+            if not self._clip_authorized():
+                return
+            if match.group(1) == 'entertainment':
+                data = bridge._entertainment()
+            else:
+                data = bridge._entertainment_configurations()
+            return self._reply({'errors': [], 'data': data})
+        match = _RESOURCE_PATH.match(self.path)
+        if match is None:
+            return self._reply([_error(4, self.path, 'method, GET, not '
+                                       'available for resource')], 404)
+        username, kind, resource_id = match.groups()
+        if username != bridge.username:
+            return self._reply([_error(1, self.path, 'unauthorized user')])
+        resources = getattr(bridge, kind)
+        if resource_id is None:
+            return self._reply(resources)
+        if resource_id not in resources:
+            return self._reply([_error(3, self.path, 'resource not '
+                                       'available')])
+        return self._reply(resources[resource_id])
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/api':
+            return self._reply([_error(4, self.path, 'method, POST, not '
+                                       'available for resource')], 404)
+        self._reply(self.server.bridge._create_user(self._body()))
+
+    def do_PUT(self):
+        bridge = self.server.bridge
+        match = _CLIP_PATH.match(self.path)
+        if match is not None and match.group(1) == \
+                'entertainment_configuration' and match.group(2) and \
+                bridge.streams_v2:
+            if not self._clip_authorized():
+                return
+            status, response = bridge._set_configuration(match.group(2),
+                                                         self._body())
+            return self._reply(response, status)
+        match = _RESOURCE_PATH.match(self.path)
+        if match is None or match.group(2) != 'groups' or \
+                match.group(3) is None:
+            return self._reply([_error(4, self.path, 'method, PUT, not '
+                                       'available for resource')], 404)
+        username, _, group_id = match.groups()
+        if username != bridge.username:
+            return self._reply([_error(1, self.path, 'unauthorized user')])
+        self._reply(bridge._set_group(group_id, self._body()))
+
+    def log_message(self, format, *args):
+        pass
+
+    # Private
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = None
+        return body if isinstance(body, dict) else {}
+
+    def _clip_authorized(self):
+        # Replies with the bridge's clip_response or an authorization error
+        # and returns False unless the v2 API request should be served
+        bridge = self.server.bridge
+        if bridge.clip_response is not None:
+            status, data = bridge.clip_response
+            self._send(status, data)
+            return False
+        if self.headers.get('hue-application-key') != bridge.username:
+            self._reply(_clip_error('unauthorized user'), 403)
+            return False
+        return True
+
+    def _reply(self, content, status=200, headers=None):
+        self._send(status, json.dumps(content).encode(), headers)
+
+    def _send(self, status, data, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _KeyStore(dict):
+    """Pre-shared keys by identity, noting each identity looked up"""
+
+    def __init__(self, identities, keys):
+        super().__init__(keys)
+        self._identities = identities
+
+    def __getitem__(self, identity):
+        self._identities.append(identity)
+        return super().__getitem__(identity)
+
+
+def _service_id(light_id):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL,
+                          f'{BRIDGE_ID}/entertainment/{light_id}'))
+
+
+def _error(errtype, address, description):
+    return {'error': {'type': errtype, 'address': address,
+                      'description': description}}
+
+
+def _clip_error(description):
+    return {'errors': [{'description': description}], 'data': []}
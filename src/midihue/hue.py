@@ -1,25 +1,89 @@
 import os
 import json
+import time
 import socket
-import requests
+import struct
+import sys
+import threading
+import warnings
+from array import array
 from mbedtls import tls
+from mbedtls.exceptions import TLSError
+from .color import COLORSPACES
+from .light import LightBank
 
 DEFAULT_CREDENTIALS_PATH = '~/.midihue'
 DISCOVERY_URI = 'https://discovery.meethue.com'
 DEVICETYPE = 'midi-hue'
+STREAM_PORT = 2100
+MAX_STREAM_LIGHTS = 20
+# Bridges from this REST API version on also take stream API v2 messages,
+# addressed to the channels of an entertainment configuration
+STREAM_V2_API_VERSION = (1, 42)
+# The bridge leaves streaming mode after ~10 s without data, so unchanged
+# frames are still re-sent at this interval (which also repairs lost
+# packets, since UDP delivery is not guaranteed).
+DEFAULT_KEEPALIVE_INTERVAL = 1.0
+DEFAULT_HANDSHAKE_TIMEOUT = 1.0
+DEFAULT_HANDSHAKE_TRIES = 3
+# Bounds of the exponential backoff between reconnection attempts
+MIN_RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5.0
+# How often the stream checks for alerts (e.g. close notify) from the bridge
+BRIDGE_POLL_INTERVAL = 1.0
+# Bridge IP and group metadata are cached next to the credentials file
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 1
+DEFAULT_CACHE_TTL = 3600
+BRIDGE_CHECK_TIMEOUT = 2.0
+
+
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+# From this many lights a whole bank is packed with strided copies rather
+# than light by light, which costs more for a few lights
+_BULK_MIN_LIGHTS = 5
 
 
 class HueClientError(Exception):
     pass
 
 
+class HueStreamError(Exception):
+    pass
+
+
+def discover_bridges(session=None):
+    """Returns the local IP addresses of all bridges on the network"""
+    if session is None:
+        import requests as session
+    req = session.get(DISCOVERY_URI)
+    return [bridge.get('internalipaddress') for bridge in req.json()]
+
+
 class HueClient:
+    """REST client for a Hue bridge.
+
+    All requests share one keep-alive session. The discovered bridge IP and
+    group metadata are cached on disk next to the credentials file for
+    `cache_ttl` seconds; after that a cached bridge IP is re-used only if
+    the bridge still answers there, before falling back to discovery.
+    """
 
     def __init__(self,
                  credentials_path=DEFAULT_CREDENTIALS_PATH,
-                 bridge_ip=None):
+                 bridge_ip=None,
+                 cache_ttl=DEFAULT_CACHE_TTL,
+                 bridge_port=None):
+        # Imported here, as it is slow to import and only needed by the
+        # process talking to the bridge
+        import requests
         self._credentials_path = os.path.expanduser(credentials_path)
+        self._cache_path = self._credentials_path + CACHE_SUFFIX
+        self._cache_ttl = cache_ttl
+        self._cache = None
+        self._session = requests.Session()
         self._bridge_ip = bridge_ip
+        self._bridge_port = bridge_port
         self._username = None
         self._clientkey = None
         self._find_or_create_user()
@@ -28,8 +92,16 @@ class HueClient:
     def bridge_ip(self):
         if self._bridge_ip is not None:
             return self._bridge_ip
-        req = requests.get(DISCOVERY_URI)
-        self._bridge_ip = req.json()[0].get('internalipaddress')
+
+        bridge_ip, fresh = self._cached('bridge_ip')
+        if bridge_ip is not None and (fresh or self._check_bridge(bridge_ip)):
+            if not fresh:
+                self._store('bridge_ip', bridge_ip)
+            self._bridge_ip = bridge_ip
+            return bridge_ip
+
+        self._bridge_ip = discover_bridges(self._session)[0]
+        self._store('bridge_ip', self._bridge_ip)
         return self._bridge_ip
 
     @property
@@ -40,23 +112,142 @@ class HueClient:
     def clientkey(self):
         return self._clientkey
 
-    def get_entertainment_groups(self):
+    def get_groups(self, refresh=False):
+        """Returns the bridge's group metadata, keyed by group ID. Served
+        from the cache unless it is stale or refresh is True.
+        """
+        key = f'groups@{self.bridge_ip}'
+        groups, fresh = self._cached(key)
+        if groups is None or not fresh or refresh:
+            req = self._session.get(f'{self._base_uri}/groups')
+            groups = req.json()
+            self._store(key, groups)
+        return groups
+
+    def get_lights(self, refresh=False):
+        """Returns the bridge's light metadata, keyed by light ID. Served
+        from the cache unless it is stale or refresh is True.
+        """
+        key = f'lights@{self.bridge_ip}'
+        lights, fresh = self._cached(key)
+        if lights is None or not fresh or refresh:
+            req = self._session.get(f'{self._base_uri}/lights')
+            lights = req.json()
+            self._store(key, lights)
+        return lights
+
+    def get_gamut_types(self, refresh=False):
+        """Returns the color gamut type ('A', 'B' or 'C') of each color
+        light, keyed by integer light ID
+        """
+        gamuts = {}
+        for lid, info in self.get_lights(refresh).items():
+            control = info.get('capabilities', {}).get('control', {})
+            gamut = control.get('colorgamuttype')
+            if gamut is not None:
+                gamuts[int(lid)] = gamut
+        return gamuts
+
+    def get_light_locations(self, group_id, refresh=False):
+        """Returns the (x, y, z) position of each light of an entertainment
+        group, keyed by integer light ID, from the group's metadata
+        """
+        group = self.get_groups(refresh).get(str(group_id))
+        if group is None:
+            raise HueClientError(f'Group {group_id} not found')
+        return {int(lid): tuple(float(c) for c in location)
+                for lid, location in group.get('locations', {}).items()}
+
+    def get_api_version(self, refresh=False):
+        """Returns the bridge's REST API version as a tuple of integers"""
+        key = f'config@{self.bridge_ip}'
+        config, fresh = self._cached(key)
+        if config is None or not fresh or refresh:
+            req = self._session.get(
+                f'{self._bridge_uri(self.bridge_ip)}/api/config'
+            )
+            config = req.json()
+            self._store(key, config)
+        try:
+            return tuple(int(part) for part in
+                         config.get('apiversion', '').split('.'))
+        except (AttributeError, ValueError):
+            return (1, 0)
+
+    def get_entertainment_configuration(self, group_id, refresh=False):
+        """Returns the stream API v2 entertainment configuration of an
+        entertainment group as (configuration ID, channels), where channels
+        maps each integer light ID to a tuple of its channel IDs. Returns
+        None if the bridge only takes v1 streams or has no configuration
+        for the group.
+        """
+        if self.get_api_version(refresh) < STREAM_V2_API_VERSION:
+            return None
+        id_v1 = f'/groups/{group_id}'
+        for configuration in self._get_resource('entertainment_configuration',
+                                                refresh):
+            if configuration.get('id_v1') == id_v1:
+                break
+        else:
+            return None
+        # Channel members are entertainment services of lights
+        lights = {}
+        for service in self._get_resource('entertainment', refresh):
+            light = service.get('id_v1', '')
+            if light.startswith('/lights/'):
+                lights[service['id']] = int(light[len('/lights/'):])
+        channels = {}
+        for channel in configuration.get('channels', []):
+            for member in channel.get('members', []):
+                light_id = lights.get(member.get('service', {}).get('rid'))
+                if light_id is not None:
+                    channels.setdefault(light_id, []).append(
+                        channel['channel_id']
+                    )
+        return configuration['id'], {light_id: tuple(ids) for light_id, ids
+                                     in channels.items()}
+
+    def get_entertainment_groups(self, refresh=False):
         """Returns an array of available entertainment groups in the format
         of a tuple: (id, description)
         """
-        uri = f'{self._base_uri}/groups'
-        req = requests.get(uri)
         groups = []
-        for gid, info in req.json().items():
+        for gid, info in self.get_groups(refresh).items():
             if info['type'] == 'Entertainment':
                 name = info['name']
                 n_lights = len(info['lights'])
                 groups.append((gid, f'{name} ({n_lights} lights)'))
         return groups
 
+    def get_application_id(self, refresh=False):
+        """Returns the bridge's application ID for the user, which is the
+        PSK identity of stream API v2 streams
+        """
+        key = f'application_id@{self.bridge_ip}'
+        application_id, fresh = self._cached(key)
+        if application_id is None or not fresh or refresh:
+            req = self._clip_request('get', f'{self._https_uri}/auth/v1')
+            application_id = req.headers.get('hue-application-id')
+            if req.status_code != 200 or not application_id:
+                raise HueClientError(f'Failed to get the application ID '
+                                     f'(HTTP {req.status_code})')
+            self._store(key, application_id)
+        return application_id
+
+    def set_entertainment_stream(self, configuration_id, active):
+        """Starts or stops streaming to a v2 entertainment configuration,
+        the stream API v2 counterpart of `set_stream_mode`
+        """
+        action = 'start' if active else 'stop'
+        req = self._clip_request(
+            'put', f'{self._clip_uri}/resource/entertainment_configuration/'
+                   f'{configuration_id}', json={'action': action}
+        )
+        self._clip_data(req, f'{action} streaming')
+
     def set_stream_mode(self, group_id, active):
         uri = f'{self._base_uri}/groups/{group_id}'
-        req = requests.put(uri, json={'stream': {'active': active}})
+        req = self._session.put(uri, json={'stream': {'active': active}})
         response = req.json()[0]
         if 'error' in response:
             errtype, errdesc = self._error_info(response)
@@ -73,7 +264,63 @@ class HueClient:
 
     @property
     def _base_uri(self):
-        return f'http://{self.bridge_ip}/api/{self.username}'
+        return f'{self._bridge_uri(self.bridge_ip)}/api/{self.username}'
+
+    def _bridge_uri(self, bridge_ip):
+        # bridge_port is only needed for bridges not on the default HTTP
+        # port, such as a FakeBridge
+        if self._bridge_port is None:
+            return f'http://{bridge_ip}'
+        return f'http://{bridge_ip}:{self._bridge_port}'
+
+    @property
+    def _https_uri(self):
+        # Bridges only serve the v2 API over HTTPS, except a FakeBridge on
+        # its own port
+        if self._bridge_port is None:
+            return f'https://{self.bridge_ip}'
+        return self._bridge_uri(self.bridge_ip)
+
+    @property
+    def _clip_uri(self):
+        return f'{self._https_uri}/clip/v2'
+
+    def _clip_request(self, method, uri, **kwargs):
+        with warnings.catch_warnings():
+            # The bridge's certificate is signed by the bridge vendor's own
+            # CA, so it is not verified
+            warnings.simplefilter('ignore')
+            return self._session.request(
+                method, uri, headers={'hue-application-key': self.username},
+                verify=False, **kwargs
+            )
+
+    def _clip_data(self, req, what):
+        """Returns the data of a v2 API response, raising HueClientError
+        for its errors. Raises ValueError if it is not JSON.
+        """
+        response = req.json()
+        if not isinstance(response, dict):
+            raise HueClientError(f'Failed to {what}: unexpected response '
+                                 f'(HTTP {req.status_code})')
+        errors = response.get('errors')
+        if errors:
+            raise HueClientError(f'Failed to {what}: '
+                                 f'{errors[0].get("description")}')
+        if req.status_code != 200:
+            raise HueClientError(f'Failed to {what}: HTTP {req.status_code}')
+        return response.get('data', [])
+
+    def _get_resource(self, kind, refresh=False):
+        """Returns the v2 API resources of a type, cached like the groups"""
+        key = f'{kind}@{self.bridge_ip}'
+        resources, fresh = self._cached(key)
+        if resources is None or not fresh or refresh:
+            req = self._clip_request('get',
+                                     f'{self._clip_uri}/resource/{kind}')
+            resources = self._clip_data(req, f'get {kind}')
+            self._store(key, resources)
+        return resources
 
     def _find_or_create_user(self):
         if self._read_credentials():
@@ -81,9 +328,9 @@ class HueClient:
 
         # Else need to create an authorized user with API
         print(self.bridge_ip)
-        uri = f'http://{self.bridge_ip}/api'
+        uri = f'{self._bridge_uri(self.bridge_ip)}/api'
         body = {'devicetype': DEVICETYPE, 'generateclientkey': True}
-        req = requests.post(uri, json=body)
+        req = self._session.post(uri, json=body)
         response = req.json()[0]
 
         try:
@@ -120,6 +367,48 @@ class HueClient:
         with open(self._credentials_path, 'w+') as file:
             json.dump(content, file)
 
+    def _check_bridge(self, bridge_ip):
+        import requests
+        try:
+            req = self._session.get(
+                f'{self._bridge_uri(bridge_ip)}/api/config',
+                timeout=BRIDGE_CHECK_TIMEOUT
+            )
+            return 'bridgeid' in req.json()
+        except (requests.RequestException, ValueError, TypeError):
+            return False
+
+    def _load_cache(self):
+        if self._cache is None:
+            try:
+                with open(self._cache_path, 'r') as file:
+                    self._cache = json.load(file)
+            except (OSError, ValueError):
+                self._cache = None
+            if not isinstance(self._cache, dict) or \
+                    self._cache.get('version') != CACHE_VERSION:
+                self._cache = {'version': CACHE_VERSION}
+        return self._cache
+
+    def _cached(self, key):
+        """Returns (value, fresh) from the cache, or (None, False)"""
+        entry = self._load_cache().get(key)
+        try:
+            value, stored = entry['value'], float(entry['time'])
+        except (TypeError, KeyError, ValueError):
+            return None, False
+        return value, 0 <= time.time() - stored < self._cache_ttl
+
+    def _store(self, key, value):
+        cache = self._load_cache()
+        cache[key] = {'value': value, 'time': time.time()}
+        try:
+            with open(self._cache_path, 'w+') as file:
+                json.dump(cache, file)
+        except OSError:
+            # The cache is only an optimization
+            pass
+
     def _error_info(self, response):
         error = response.get('error')
         return (error.get('type'), error.get('description'))
@@ -133,7 +422,7 @@ class HueStream:
         # 2. Stream API version (1.0) - 2 bytes
         # 3. Sequence ID (ignored) - 1 Byte
         # 4. Reserved (must be 0) - 2 bytes
-        # 5. Color space (RGB) - 1 byte
+        # 5. Color space (0 = RGB, 1 = xy + brightness) - 1 byte
         # 6. Reserved (must be 0) 1 byte
         _HEADER = \
             b'HueStream' + \
@@ -143,79 +432,648 @@ class HueStream:
             b'\x00' + \
             b'\x00'
 
-        def __init__(self):
-            self._lightdata = {}
+        # Stream API v2 (2.0): the same, followed by the 36 character
+        # ID of the entertainment configuration
+        _HEADER_V2 = _HEADER[:9] + b'\x02\x00' + _HEADER[11:]
+        _CONFIGURATION_ID_SIZE = 36
+
+        _COLORSPACE_OFFSET = 14
+
+        # Per light: address type (0 = light), light ID, then R, G, B or
+        # x, y, brightness
+        _LIGHT = struct.Struct('>BHHHH')
+        # Per channel in v2: channel ID, then R, G, B or x, y, brightness
+        _CHANNEL = struct.Struct('>BHHH')
+
+        def __init__(self, capacity=MAX_STREAM_LIGHTS, colorspace='rgb',
+                     configuration=None):
+            # The packet is preallocated and light slots are packed in
+            # place, so re-adding the same lights every frame does not
+            # allocate.
+            #
+            # With an entertainment configuration (see
+            # HueClient.get_entertainment_configuration) the message is in
+            # the v2 format, and each light is packed into its channels
+            # (capacity is then the number of channels).
+            if configuration is None:
+                header, entry = self._HEADER, self._LIGHT
+                self._channels = None
+            else:
+                config_id, channels = configuration
+                config_id = str(config_id).encode('ascii')
+                if len(config_id) != self._CONFIGURATION_ID_SIZE:
+                    raise ValueError(f'Invalid entertainment configuration '
+                                     f'ID {configuration[0]!r}')
+                header, entry = self._HEADER_V2 + config_id, self._CHANNEL
+                self._channels = {int(light_id): tuple(ids)
+                                  for light_id, ids in channels.items()}
+                self._pack = self._pack_channels
+            self._header = header
+            self._entry = entry
+            self._capacity = capacity
+            self._buffer = bytearray(len(header) + capacity * entry.size)
+            self._buffer[:len(header)] = header
+            self._buffer[self._COLORSPACE_OFFSET] = COLORSPACES[colorspace]
+            self.colorspace = colorspace
+            self.configuration = configuration
+            self._view = memoryview(self._buffer)
+            self._offsets = {}
+            # Light (v1) or channel (v2) IDs in the order of their slots,
+            # and big-endian values of a whole bank, for packing all of a
+            # bank at once
+            self._order = array('H')
+            self._swapped = array('H')
+            # The bank and layout last checked for packing at once, and
+            # the runs of slots it fills (see _runs), or None if it doesn't
+            self._bulk_bank = None
+            self._bulk_layout = None
+            self._bulk_runs = None
+            self._length = len(header)
+            self._frame = self._view[:self._length]
 
         @property
         def bytes(self):
-            b = self._HEADER
-            for light_id, rgb in self._lightdata.items():
-                b += b'\x00' + light_id.to_bytes(2, byteorder='big')
-                b += rgb[0].to_bytes(2, byteorder='big')
-                b += rgb[1].to_bytes(2, byteorder='big')
-                b += rgb[2].to_bytes(2, byteorder='big')
-            return b
+            return bytes(self._frame)
+
+        @property
+        def buffer(self):
+            """A zero-copy view of the encoded packet"""
+            return self._frame
 
         def add(self, light_id, rgb):
             assert len(rgb) == 3
-            self._lightdata[int(light_id)] = rgb
+            self._pack(int(light_id), rgb[0], rgb[1], rgb[2])
+
+        def add_bank(self, bank, slots=None, values=None):
+            """Adds lights from a LightBank using its converted output
+            values (see LightBank.convert), or `values` laid out like them.
+            All slots are added unless an iterable of slot indices is given.
+            """
+            ids = bank.ids
+            if values is None:
+                values = bank.rgb_int
+            if slots is None:
+                n = len(ids)
+                if n >= _BULK_MIN_LIGHTS and (
+                        bank is not self._bulk_bank or
+                        bank.layout != self._bulk_layout):
+                    self._check_bulk(bank)
+                if n >= _BULK_MIN_LIGHTS and self._bulk_runs is not None:
+                    # The bank's lights (or their channels) fill the first
+                    # slots in a known order, so only values need writing
+                    self._pack_values(values)
+                    return
+                slots = range(n)
+            for slot in slots:
+                i = slot * 3
+                self._pack(ids[slot], values[i], values[i + 1], values[i + 2])
+
+        @classmethod
+        def decode(cls, data):
+            """Decodes an encoded packet into {light ID: (r, g, b)}, or
+            {channel ID: (r, g, b)} if it is in the v2 format
+            """
+            version = bytes(data[9:11])
+            if version == cls._HEADER_V2[9:11]:
+                header = len(cls._HEADER_V2) + cls._CONFIGURATION_ID_SIZE
+                entry = cls._CHANNEL
+            else:
+                header, entry = len(cls._HEADER), cls._LIGHT
+            if bytes(data[:9]) != cls._HEADER[:9] or \
+                    version not in (cls._HEADER[9:11],
+                                    cls._HEADER_V2[9:11]) or \
+                    len(data) < header or (len(data) - header) % entry.size:
+                raise ValueError('Not a HueStream message')
+            lights = {}
+            for offset in range(header, len(data), entry.size):
+                *_, address, r, g, b = entry.unpack_from(data, offset)
+                lights[address] = (r, g, b)
+            return lights
+
+        def clear(self):
+            self._bulk_bank = None
+            self._offsets.clear()
+            del self._order[:]
+            self._length = len(self._header)
+            self._frame = self._view[:self._length]
 
-    def __init__(self, group_id, client):
+        # Private
+
+        def _pack(self, light_id, r, g, b):
+            offset = self._offsets.get(light_id)
+            if offset is None:
+                offset = self._allocate(light_id)
+            self._LIGHT.pack_into(self._buffer, offset, 0, light_id, r, g, b)
+
+        def _pack_channels(self, light_id, r, g, b):
+            # Lights outside the entertainment configuration are left out
+            for channel in self._channels.get(light_id, ()):
+                offset = self._offsets.get(channel)
+                if offset is None:
+                    offset = self._allocate(channel)
+                self._CHANNEL.pack_into(self._buffer, offset, channel, r, g, b)
+
+        def _check_bulk(self, bank):
+            # Checked again only when the slots or the bank's layout change.
+            # An empty message is laid out for the bank first.
+            self._bulk_bank = bank
+            self._bulk_layout = bank.layout
+            self._bulk_runs = None
+            layout = self._layout(bank.ids)
+            if layout is None:
+                return
+            addresses, runs = layout
+            if not self._offsets and len(addresses) <= self._capacity:
+                for address in addresses:
+                    offset = self._allocate(address)
+                    if self._channels is None:
+                        self._LIGHT.pack_into(self._buffer, offset, 0,
+                                              address, 0, 0, 0)
+                    else:
+                        self._CHANNEL.pack_into(self._buffer, offset,
+                                                address, 0, 0, 0)
+            if list(self._order[:len(addresses)]) != addresses:
+                return
+            header, size = len(self._header), self._entry.size
+            self._bulk_runs = [
+                (header + (entry + 1) * size - 6,
+                 header + (entry + count) * size, slot * 6,
+                 (slot + count) * 6)
+                for entry, slot, count in runs
+            ]
+
+        def _layout(self, ids):
+            """Returns the addresses of the slots of a bank in order, and
+            the runs of consecutive bank slots they take, as (first slot,
+            first bank slot, count). Returns None if slots would share an
+            address.
+
+            A v1 message takes the lights of the bank in order, in one
+            run. A v2 message takes the first channel of each light, then
+            the second channel of lights with several and so on, so each
+            round of channels is as few runs as possible.
+            """
+            if self._channels is None:
+                addresses = list(ids)
+                runs = [(0, 0, len(ids))]
+            else:
+                channels = [self._channels.get(light_id, ())
+                            for light_id in ids]
+                addresses, runs = [], []
+                for k in range(max(map(len, channels), default=0)):
+                    for slot, light_channels in enumerate(channels):
+                        if len(light_channels) <= k:
+                            continue
+                        if runs and runs[-1][0] + runs[-1][2] == \
+                                len(addresses) and \
+                                runs[-1][1] + runs[-1][2] == slot:
+                            entry, first, count = runs[-1]
+                            runs[-1] = (entry, first, count + 1)
+                        else:
+                            runs.append((len(addresses), slot, 1))
+                        addresses.append(light_channels[k])
+            if len(set(addresses)) != len(addresses):
+                return None
+            return addresses, runs
+
+        def _pack_values(self, values):
+            # Each byte of the values goes to its place in every slot of a
+            # run with one strided copy, rather than packing slot by slot
+            swapped = self._swapped
+            swapped[:] = values
+            if sys.byteorder == 'little':
+                swapped.byteswap()
+            size = self._entry.size
+            view = self._view
+            with memoryview(swapped) as source, source.cast('B') as raw:
+                for start, end, first, last in self._bulk_runs:
+                    for k in range(6):
+                        view[start + k:end:size] = raw[first + k:last:6]
+
+        def _allocate(self, address):
+            assert len(self._offsets) < self._capacity, \
+                f'Message is limited to {self._capacity} lights'
+            offset = self._length
+            self._order.append(address)
+            self._offsets[address] = offset
+            self._length += self._entry.size
+            self._frame = self._view[:self._length]
+            return offset
+
+    def __init__(self, group_id, client,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL,
+                 port=STREAM_PORT,
+                 handshake_timeout=DEFAULT_HANDSHAKE_TIMEOUT,
+                 handshake_tries=DEFAULT_HANDSHAKE_TRIES,
+                 auto_reconnect=True,
+                 pipeline=None,
+                 pacer=None,
+                 stream_version=None,
+                 configuration=None):
         self.group_id = group_id
         self.client = client
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self.handshake_timeout = handshake_timeout
+        self.handshake_tries = handshake_tries
+        self.auto_reconnect = auto_reconnect
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+        # Frames not sent because the socket would block or the stream
+        # was reconnecting
+        self.frames_dropped = 0
+        self.reconnects = 0
+        # Duration in seconds of the last completed reconnection
+        self.last_reconnect_time = None
+        # A metrics.Metrics to record stage timings into, if set
+        self.metrics = None
+        # A recording.Recorder to write each sent frame to, if set
+        self.recorder = None
+        # A color.ColorPipeline that encodes colors for the stream, or None
+        # to send each light's linear rgb_int
+        self.pipeline = pipeline
+        # A pacing.Pacer limiting the rate of sends, or None to send every
+        # frame
+        self.pacer = pacer
+        # The stream API version: 1, 2, or None to use 2 if the bridge
+        # takes it (see HueClient.get_entertainment_configuration) and 1
+        # otherwise, decided on start. Given an entertainment
+        # configuration, the stream is in v2 from the outset.
+        self.stream_version = 2 if configuration is not None \
+            else stream_version
+        self.configuration = configuration
+        # PSK identity of a v2 stream, the user's application ID
+        self._identity = None
         self._socket = None
+        self._message = HueStream.Message(
+            colorspace='rgb' if pipeline is None else pipeline.colorspace,
+            configuration=configuration
+        )
+        self._output = array('H')
+        self._versions = []
+        self._last_sent = None
+        self._last_poll = time.monotonic()
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reconnecting = False
+        self._held = None
+        # The frame waiting for the pacer, and a copy of its contents in a
+        # buffer reused from frame to frame
+        self._paced = None
+        self._paced_data = memoryview(bytearray())
+        self._paced_length = 0
+
+    @property
+    def reconnecting(self):
+        return self._reconnecting
 
     def start(self):
-        self.client.set_stream_mode(self.group_id, True)
-        self._connect()
+        self._stopped.clear()
+        if self.stream_version != 1:
+            import requests
+            configuration = self.configuration
+            identity = None
+            try:
+                if configuration is None:
+                    configuration = \
+                        self.client.get_entertainment_configuration(
+                            self.group_id
+                        )
+                if configuration is not None:
+                    identity = self.client.get_application_id()
+                    self.client.set_entertainment_stream(configuration[0],
+                                                         True)
+            except (HueClientError, requests.RequestException,
+                    ValueError) as e:
+                self._v2_failed(e)
+            else:
+                self._configure(configuration, identity)
+        if self.stream_version == 1:
+            self.client.set_stream_mode(self.group_id, True)
+        self._connect_with_retries()
 
     def stop(self):
-        self.client.set_stream_mode(self.group_id, False)
+        self._stopped.set()
+        self._set_active(False)
         self._disconnect()
 
     def send(self, message):
+        """Sends a message. If the connection is lost, the stream
+        reconnects in the background (unless auto_reconnect is False, in
+        which case HueStreamError is raised) and meanwhile holds on to only
+        the latest message, which is sent once reconnected.
+
+        With a pacer, a message sent faster than it allows is held instead,
+        replacing any held before it, and `render` returns the stream's
+        message until the held one can be sent.
+        """
+        if self._reconnecting:
+            self._hold(message)
+            return
         assert self._socket is not None, \
             'Must start stream before sending data'
-        self._socket.send(message.bytes)
+        pacer = self.pacer
+        if pacer is not None:
+            if not pacer.acquire():
+                self._pace(message)
+                return
+            self._paced = None
+        try:
+            with self._send_lock:
+                started = time.perf_counter()
+                self._socket.send(message.buffer)
+                duration = time.perf_counter() - started
+                if self.metrics is not None:
+                    self.metrics.record('send', duration)
+                now = time.monotonic()
+                if _MSG_DONTWAIT and \
+                        now - self._last_poll >= BRIDGE_POLL_INTERVAL:
+                    self._last_poll = now
+                    self._poll_bridge()
+        except BlockingIOError:
+            self.frames_dropped += 1
+            if pacer is not None:
+                pacer.backoff()
+            return
+        except (OSError, TLSError) as e:
+            if pacer is not None:
+                pacer.backoff()
+            self._hold(message)
+            self._connection_lost(e)
+            return
+        self.frames_sent += 1
+        self._last_sent = now
+        if pacer is not None:
+            pacer.sent(now, duration)
+        if self.recorder is not None:
+            self.recorder.write(message.buffer)
+
+    def render(self, lights, now=None, slots=None):
+        """Encodes the lights that changed since the last call and returns
+        the stream's message if it should be sent: when any light changed
+        or the keep-alive interval elapsed. Returns None otherwise.
+
+        `lights` is a sequence of Light or a LightBank, which is converted
+        in one batch when any of its slots changed. `slots` limits the
+        stream to some slots of a bank that the caller has converted, e.g.
+        a StreamManager sharing one bank between its streams.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        message = self._message
+        versions = self._versions
+        if len(versions) != len(lights):
+            message.clear()
+            versions[:] = [None] * len(lights)
+
+        if isinstance(lights, LightBank):
+            changed = self._render_bank(lights, slots)
+        else:
+            changed = False
+            pipeline = self.pipeline
+            for index, light in enumerate(lights):
+                version = light.version
+                if versions[index] != version:
+                    versions[index] = version
+                    if pipeline is None:
+                        message.add(light.light_id, light.rgb_int)
+                    else:
+                        message.add(light.light_id,
+                                    pipeline.encode_light(light))
+                    changed = True
+
+        # A frame held by the pacer is due whether or not anything changed
+        if not changed and self._last_sent is not None and \
+                self._paced is None:
+            if now is None:
+                now = time.monotonic()
+            if now - self._last_sent < self.keepalive_interval:
+                self.frames_suppressed += 1
+                return None
+        if metrics is not None:
+            metrics.record('encode', time.perf_counter() - started)
+        return message
+
+    def update(self, lights):
+        """Sends the state of lights unless it is unchanged and no
+        keep-alive is due. Returns True if a frame was sent.
+        """
+        message = self.render(lights)
+        if message is None:
+            return False
+        self.send(message)
+        return True
 
     # Private
 
+    def _configure(self, configuration, identity=None):
+        """Selects the stream API version given the group's entertainment
+        configuration, or None if the bridge has none, and the application
+        ID of a v2 stream
+        """
+        if configuration is None:
+            if self.stream_version == 2:
+                raise HueStreamError(f'The bridge has no stream API v2 '
+                                     f'configuration for group '
+                                     f'{self.group_id}')
+            self.stream_version = 1
+            return
+        self.stream_version = 2
+        self._identity = identity
+        if configuration is self.configuration:
+            return
+        self.configuration = configuration
+        self._message = HueStream.Message(
+            colorspace=self._message.colorspace, configuration=configuration
+        )
+        # Every light is encoded again into the new message
+        self._versions = []
+        print(f'[HueStream] Streaming to entertainment configuration '
+              f'{configuration[0]} (API v2)')
+
+    def _v2_failed(self, error):
+        # Starting a v2 stream failed: fatal if v2 was asked for, else the
+        # stream falls back to v1
+        if self.stream_version == 2:
+            raise HueStreamError(f'Failed to start a stream API v2 '
+                                 f'stream: {error}')
+        print(f'[HueStream] Stream API v2 unavailable ({error}), '
+              f'using v1')
+        self.stream_version = 1
+
+    def _set_active(self, active):
+        # v2 streams are started and stopped through their entertainment
+        # configuration, v1 streams through their group
+        if self.stream_version == 2:
+            self.client.set_entertainment_stream(self.configuration[0],
+                                                 active)
+        else:
+            self.client.set_stream_mode(self.group_id, active)
+
     def _connect(self):
         if self._socket is not None:
             self._disconnect()
 
+        dtls_cli = self._wrap_socket()
+        # A blocking handshake with a timeout, rather than spinning on
+        # WantReadError
+        dtls_cli.settimeout(self.handshake_timeout)
+        dtls_cli.connect((self.client.bridge_ip, self.port))
+        print('[HueStream] Socket connected, starting DTLS handshake...')
+
+        try:
+            dtls_cli.do_handshake()
+        except (OSError, TLSError) as e:
+            dtls_cli.close()
+            raise HueStreamError(f'DTLS handshake failed: {e}')
+
+        # Back to blocking mode, as with a timeout set the bridge poll's
+        # MSG_DONTWAIT recv would still wait out the timeout
+        dtls_cli.settimeout(None)
+        print('[HueStream] DTLS handshake succeeded')
+        self._socket = dtls_cli
+
+    def _connect_with_retries(self):
+        delay = MIN_RECONNECT_DELAY
+        for attempt in range(1, self.handshake_tries + 1):
+            try:
+                self._connect()
+                return
+            except HueStreamError as e:
+                print(f'[HueStream] {e} (attempt {attempt})')
+                if attempt == self.handshake_tries or \
+                        self._stopped.wait(delay):
+                    raise
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _connection_lost(self, error):
+        with self._send_lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        if not self.auto_reconnect:
+            self._reconnecting = False
+            raise HueStreamError(f'Connection lost: {error}')
+        print(f'[HueStream] Connection lost ({error}), reconnecting...')
+        threading.Thread(target=self._reconnect, name='midihue-reconnect',
+                         daemon=True).start()
+
+    def _reconnect(self):
+        import requests
+        started = time.monotonic()
+        delay = MIN_RECONNECT_DELAY
+        while True:
+            if self._stopped.is_set():
+                return
+            try:
+                # The bridge may have left streaming mode in the meantime
+                self._set_active(True)
+                self._connect()
+                break
+            except (HueStreamError, HueClientError,
+                    requests.RequestException, OSError) as e:
+                print(f'[HueStream] Reconnect failed ({e}), '
+                      f'retrying in {delay:.1f}s')
+                if self._stopped.wait(delay):
+                    return
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._reconnected(started)
+
+    def _reconnected(self, started):
+        self.reconnects += 1
+        self.last_reconnect_time = time.monotonic() - started
+        print(f'[HueStream] Reconnected in {self.last_reconnect_time:.2f}s')
+        with self._send_lock:
+            held, self._held = self._held, None
+            self._reconnecting = False
+        if held is not None:
+            self.send(held)
+
+    def _pace(self, message):
+        pacer = self.pacer
+        data = message.buffer
+        length = len(data)
+        if length > len(self._paced_data):
+            self._paced_data = memoryview(bytearray(length))
+        held = self._paced_data[:length]
+        if self._paced is None:
+            pacer.held += 1
+        elif length != self._paced_length or held != data:
+            # The held frame's state is replaced before it was sent
+            pacer.dropped += 1
+            pacer.held += 1
+        held[:] = data
+        self._paced = message
+        self._paced_length = length
+
+    def _hold(self, message):
+        with self._send_lock:
+            if self._held is not None:
+                self.frames_dropped += 1
+            self._held = message
+
+    def _poll_bridge(self):
+        # The bridge sends nothing on the stream except alerts, e.g. close
+        # notify when it leaves streaming mode, which raise TLSError here
+        try:
+            self._socket.recv(4096, _MSG_DONTWAIT)
+        except (BlockingIOError, socket.timeout):
+            pass
+
+    def _wrap_socket(self):
+        # The PSK identity is the username for v1 streams
         cli_conf = tls.DTLSConfiguration(
             pre_shared_key=(
-                self.client.username,
+                self._identity or self.client.username,
                 bytes.fromhex(self.client.clientkey)
             )
         )
         cli_ctx = tls.ClientContext(cli_conf)
-        dtls_cli = cli_ctx.wrap_socket(
+        return cli_ctx.wrap_socket(
             socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
             server_hostname=None
         )
 
-        dtls_cli.connect((self.client.bridge_ip, 2100))
-        print('[HueStream] Socket connected, starting DTLS handshake...')
+    def _render_bank(self, bank, slots=None):
+        versions, bank_versions = self._versions, bank.versions
+        converted = slots is not None
+        if slots is None:
+            slots = range(len(bank_versions))
+        changed = [slot for slot in slots
+                   if versions[slot] != bank_versions[slot]]
+        if not changed:
+            return False
+        values = self._convert(bank, changed, converted)
+        for slot in changed:
+            versions[slot] = bank_versions[slot]
+        self._message.add_bank(
+            bank, None if len(changed) == len(bank_versions) else changed,
+            values
+        )
+        return True
 
-        handshook = False
-        handshake_tries = 0
-        while handshake_tries < 3:
-            try:
-                dtls_cli.do_handshake()
-            except tls.WantReadError:
-                handshake_tries += 1
-                continue
-            handshook = True
-            break
-
-        if handshook:
-            print('[HueStream] DTLS handshake succeeded')
-        else:
-            print('[HueStream] DTLS handshake failed')
+    def _convert(self, bank, slots, converted=False):
+        """Converts a bank unless it is already `converted`, returning
+        the output values of `slots` if they are not the bank's own rgb_int
+        """
+        if self.metrics is None:
+            return self._convert_bank(bank, slots, converted)
+        started = time.perf_counter()
+        values = self._convert_bank(bank, slots, converted)
+        self.metrics.record('convert', time.perf_counter() - started)
+        return values
 
-        self._socket = dtls_cli
+    def _convert_bank(self, bank, slots, converted):
+        if not converted:
+            bank.convert()
+        if self.pipeline is None:
+            return None
+        output = self._output
+        if len(output) != len(bank.rgb_int):
+            output = self._output = array('H', bytes(len(bank.rgb_int) * 2))
+        self.pipeline.convert(bank, output, slots)
+        return output
 
     def _disconnect(self):
         if self._socket is not None:
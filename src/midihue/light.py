@@ -1,6 +1,12 @@
+from array import array
 from collections import namedtuple
 from colorsys import rgb_to_hsv, hsv_to_rgb
 
+# NumPy is optional, and only imported once a bank is large enough to use
+# it (see _import_numpy), as importing it takes longer than starting up
+np = None
+_numpy_imported = False
+
 
 def _clampunit(i):
     return max(0., min(1.0, i))
@@ -9,88 +15,359 @@ def _clampunit(i):
 RGB = namedtuple('RGB', ['r', 'g', 'b'])
 HSV = namedtuple('HSV', ['h', 's', 'v'])
 
+# Below this many slots NumPy's per-call overhead outweighs vectorizing
+_NUMPY_MIN_SLOTS = 16
+_SECTOR_CHANNELS = None
+
+
+def _import_numpy():
+    """Imports NumPy on first call. Returns the module, or None if it is
+    not installed.
+    """
+    global np, _numpy_imported, _SECTOR_CHANNELS
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+        # For each hue sector, the index of the (v, t, p, q) term that
+        # becomes the R, G and B channel respectively
+        _SECTOR_CHANNELS = np.array([
+            [0, 1, 2],
+            [3, 0, 2],
+            [2, 0, 1],
+            [2, 3, 0],
+            [1, 2, 0],
+            [0, 2, 3],
+        ])
+    return np
+
+
+class LightBank:
+    """Color state for a set of lights, held in contiguous arrays.
+
+    Slot `n` of the bank occupies `ids[n]` and `hsv`/`rgb`/`rgb_int`
+    `[3 * n:3 * n + 3]`. Each slot stores its color natively in one of the
+    two spaces (see Light); `convert` derives RGB and integer output values
+    for every slot in a single batch, vectorized with NumPy if installed.
+    """
+
+    def __init__(self):
+        self.ids = array('H')
+        self.hsv = array('d')
+        self.rgb = array('d')
+        self.rgb_int = array('H')
+        # 64 bit, as 'L' is only 32 bit on some platforms (e.g. Windows)
+        self.versions = array('Q')
+        # Incremented when a slot is added or its light ID changes
+        self.layout = 0
+        self._native_hsv = array('B')
+        self._max_int = array('d')
+        self._lights = []
+        self._np_views = None
+
+    def __len__(self):
+        return len(self._lights)
+
+    def __iter__(self):
+        return iter(self._lights)
+
+    def __getitem__(self, slot):
+        return self._lights[slot]
+
+    def add(self, light_id, colorspace='hsv', bits_per_channel=16):
+        """Adds a slot to the bank and returns a Light viewing it"""
+        return Light(light_id, colorspace=colorspace,
+                     bits_per_channel=bits_per_channel, bank=self)
+
+    def convert(self):
+        """Updates `rgb` and `rgb_int` from the native values of all slots"""
+        if len(self._lights) >= _NUMPY_MIN_SLOTS and \
+                _import_numpy() is not None:
+            self._convert_numpy()
+        else:
+            self._convert_python()
+
+    # Private
+
+    def _allocate(self, light, light_id, colorspace, bits_per_channel):
+        assert 0 < bits_per_channel <= 16, \
+            'Up to 16 bits per channel are supported'
+        # Buffers exported to NumPy can't be resized
+        self._np_views = None
+        slot = len(self._lights)
+        self._lights.append(light)
+        self.ids.append(light_id)
+        self.layout += 1
+        self.hsv.extend((0., 0., 0.))
+        self.rgb.extend((0., 0., 0.))
+        self.rgb_int.extend((0, 0, 0))
+        self.versions.append(0)
+        self._native_hsv.append(colorspace == 'hsv')
+        self._max_int.append((1 << bits_per_channel) - 1)
+        return slot
+
+    def _convert_python(self):
+        hsv, rgb, rgb_int = self.hsv, self.rgb, self.rgb_int
+        native_hsv, max_int = self._native_hsv, self._max_int
+        for slot in range(len(self._lights)):
+            i = slot * 3
+            if native_hsv[slot]:
+                rgb[i], rgb[i + 1], rgb[i + 2] = \
+                    hsv_to_rgb(hsv[i], hsv[i + 1], hsv[i + 2])
+            scale = max_int[slot]
+            rgb_int[i] = int(rgb[i] * scale)
+            rgb_int[i + 1] = int(rgb[i + 1] * scale)
+            rgb_int[i + 2] = int(rgb[i + 2] * scale)
+
+    def _convert_numpy(self):
+        if self._np_views is None:
+            self._np_views = (
+                np.frombuffer(self.hsv, dtype=np.float64).reshape(-1, 3),
+                np.frombuffer(self.rgb, dtype=np.float64).reshape(-1, 3),
+                np.frombuffer(self.rgb_int, dtype=np.uint16).reshape(-1, 3),
+                np.frombuffer(self._native_hsv, dtype=np.uint8) != 0,
+                np.frombuffer(self._max_int, dtype=np.float64)[:, None],
+            )
+        hsv, rgb, rgb_int, native_hsv, max_int = self._np_views
+
+        # Same sector decomposition as colorsys.hsv_to_rgb, selecting each
+        # channel from (v, t, p, q) by sector
+        h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+        h6 = h * 6.0
+        sector = h6.astype(np.intp)
+        f = h6 - sector
+        sector %= 6
+        candidates = np.empty((len(hsv), 4))
+        candidates[:, 0] = v
+        candidates[:, 1] = v * (1.0 - s * (1.0 - f))
+        candidates[:, 2] = v * (1.0 - s)
+        candidates[:, 3] = v * (1.0 - s * f)
+        converted = np.take_along_axis(candidates, _SECTOR_CHANNELS[sector],
+                                       axis=1)
+        rgb[native_hsv] = converted[native_hsv]
+        rgb_int[:] = rgb * max_int
+
 
 class Light:
+    """A single light's color, stored in a slot of a LightBank.
+
+    A Light created without a bank gets a private single-slot bank.
+    Conversions to the non-native color space and to integer output are
+    cached until the slot's version changes.
+    """
+
+    __slots__ = (
+        '_bank', '_slot', '_offset', '_colorspace', '_native_hsv',
+        '_bits_per_channel', '_max_int',
+        '_converted', '_converted_version', '_rgb_int', '_rgb_int_version'
+    )
 
     # Colorspace must be 'hsv' or 'rgb'. Either option supports conversion
     # between the two spaces but the value passed here determines how color
     # data is stored natively.
-    def __init__(self, light_id, colorspace='hsv', bits_per_channel=16):
+    def __init__(self, light_id, colorspace='hsv', bits_per_channel=16,
+                 bank=None):
         assert colorspace in ('rgb', 'hsv')
-        self.light_id = light_id
+        if bank is None:
+            bank = LightBank()
         self._colorspace = colorspace
+        self._native_hsv = colorspace == 'hsv'
         self._bits_per_channel = bits_per_channel
-        if colorspace == 'hsv':
-            self._hsv = HSV(0, 0, 0)
-        else:
-            self._rgb = RGB(0, 0, 0)
+        self._max_int = (1 << bits_per_channel) - 1
+        self._bank = bank
+        self._slot = bank._allocate(self, light_id, colorspace,
+                                    bits_per_channel)
+        self._offset = self._slot * 3
+        self._converted = None
+        self._converted_version = None
+        self._rgb_int = None
+        self._rgb_int_version = None
 
-    def __getattr__(self, name):
-        if name in ('h', 's', 'v'):
-            return getattr(self.hsv, name)
-        elif name in ('r', 'g', 'b'):
-            return getattr(self.rgb, name)
-        else:
-            raise AttributeError(f'Attribute {name} not found')
+    @property
+    def light_id(self):
+        return self._bank.ids[self._slot]
 
-    def __setattr__(self, name, value):
-        if name in ('r', 'g', 'b'):
-            rgb = list(self.rgb)
-            rgb['rgb'.index(name)] = _clampunit(value)
-            self.rgb = rgb
-        elif name in ('h', 's', 'v'):
-            hsv = list(self.hsv)
-            hsv['hsv'.index(name)] = _clampunit(value)
-            self.hsv = hsv
-        else:
-            object.__setattr__(self, name, value)
+    @light_id.setter
+    def light_id(self, value):
+        self._bank.ids[self._slot] = value
+        self._bank.layout += 1
+
+    @property
+    def colorspace(self):
+        """The space ('hsv' or 'rgb') the color is stored in natively"""
+        return self._colorspace
+
+    @property
+    def bank(self):
+        return self._bank
+
+    @property
+    def slot(self):
+        return self._slot
+
+    @property
+    def version(self):
+        """Incremented on every change to the light's color"""
+        return self._bank.versions[self._slot]
+
+    # --- RGB ---
 
     @property
     def rgb(self):
-        if self._colorspace == 'hsv':
-            return RGB(*hsv_to_rgb(*self._hsv))
-        else:
-            return self._rgb
+        if self._native_hsv:
+            return self._other()
+        rgb, i = self._bank.rgb, self._offset
+        return RGB(rgb[i], rgb[i + 1], rgb[i + 2])
 
     @rgb.setter
     def rgb(self, value):
         assert len(value) == 3
-        rgb = RGB(
+        rgb = (
             _clampunit(value[0]),
             _clampunit(value[1]),
             _clampunit(value[2])
         )
-        if self._colorspace == 'hsv':
-            self._hsv = HSV(*rgb_to_hsv(*rgb))
+        if self._native_hsv:
+            self._store(self._bank.hsv, rgb_to_hsv(*rgb))
         else:
-            self._rgb = rgb
+            self._store(self._bank.rgb, rgb)
+
+    @property
+    def r(self):
+        return self._rgb_channel(0)
+
+    @r.setter
+    def r(self, value):
+        self._set_rgb_channel(0, value)
+
+    @property
+    def g(self):
+        return self._rgb_channel(1)
+
+    @g.setter
+    def g(self, value):
+        self._set_rgb_channel(1, value)
+
+    @property
+    def b(self):
+        return self._rgb_channel(2)
+
+    @b.setter
+    def b(self, value):
+        self._set_rgb_channel(2, value)
 
     @property
     def rgb_int(self):
-        max_int = (1 << self._bits_per_channel) - 1
-        rgb = self.rgb
-        return (
-            int(rgb.r * max_int),
-            int(rgb.g * max_int),
-            int(rgb.b * max_int)
-        )
+        version = self._bank.versions[self._slot]
+        if self._rgb_int_version != version:
+            max_int = self._max_int
+            rgb = self.rgb
+            self._rgb_int = (
+                int(rgb[0] * max_int),
+                int(rgb[1] * max_int),
+                int(rgb[2] * max_int)
+            )
+            self._rgb_int_version = version
+        return self._rgb_int
+
+    # --- HSV ---
 
     @property
     def hsv(self):
-        if self._colorspace == 'hsv':
-            return self._hsv
-        else:
-            return HSV(*rgb_to_hsv(*self._rgb))
+        if not self._native_hsv:
+            return self._other()
+        hsv, i = self._bank.hsv, self._offset
+        return HSV(hsv[i], hsv[i + 1], hsv[i + 2])
 
     @hsv.setter
     def hsv(self, value):
         assert len(value) == 3
-        hsv = HSV(
+        hsv = (
             _clampunit(value[0]),
             _clampunit(value[1]),
             _clampunit(value[2])
         )
-        if self._colorspace == 'hsv':
-            self._hsv = hsv
+        if self._native_hsv:
+            self._store(self._bank.hsv, hsv)
+        else:
+            self._store(self._bank.rgb, hsv_to_rgb(*hsv))
+
+    @property
+    def h(self):
+        return self._hsv_channel(0)
+
+    @h.setter
+    def h(self, value):
+        self._set_hsv_channel(0, value)
+
+    @property
+    def s(self):
+        return self._hsv_channel(1)
+
+    @s.setter
+    def s(self, value):
+        self._set_hsv_channel(1, value)
+
+    @property
+    def v(self):
+        return self._hsv_channel(2)
+
+    @v.setter
+    def v(self, value):
+        self._set_hsv_channel(2, value)
+
+    # Private
+
+    def _other(self):
+        # The color in the non-native space, converted once per version
+        version = self._bank.versions[self._slot]
+        if self._converted_version != version:
+            i = self._offset
+            if self._native_hsv:
+                hsv = self._bank.hsv
+                self._converted = RGB(
+                    *hsv_to_rgb(hsv[i], hsv[i + 1], hsv[i + 2])
+                )
+            else:
+                rgb = self._bank.rgb
+                self._converted = HSV(
+                    *rgb_to_hsv(rgb[i], rgb[i + 1], rgb[i + 2])
+                )
+            self._converted_version = version
+        return self._converted
+
+    def _rgb_channel(self, channel):
+        if self._native_hsv:
+            return self._other()[channel]
+        return self._bank.rgb[self._offset + channel]
+
+    def _set_rgb_channel(self, channel, value):
+        if self._native_hsv:
+            rgb = list(self._other())
+            rgb[channel] = value
+            self.rgb = rgb
+        else:
+            self._bank.rgb[self._offset + channel] = _clampunit(value)
+            self._bank.versions[self._slot] += 1
+
+    def _hsv_channel(self, channel):
+        if not self._native_hsv:
+            return self._other()[channel]
+        return self._bank.hsv[self._offset + channel]
+
+    def _set_hsv_channel(self, channel, value):
+        if not self._native_hsv:
+            hsv = list(self._other())
+            hsv[channel] = value
+            self.hsv = hsv
         else:
-            self._rgb = RGB(*hsv_to_rgb(*hsv))
+            self._bank.hsv[self._offset + channel] = _clampunit(value)
+            self._bank.versions[self._slot] += 1
+
+    def _store(self, values, color):
+        i = self._offset
+        values[i], values[i + 1], values[i + 2] = color
+        self._bank.versions[self._slot] += 1
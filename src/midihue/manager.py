@@ -0,0 +1,137 @@
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from .engine import LatencyStats
+from .light import LightBank
+
+
+class StreamManager:
+    """Fans light output out to several HueStreams.
+
+    Streams may belong to different bridges and entertainment groups, each
+    with its own DTLS session. Lights are routed to a stream with `route`;
+    unrouted lights go to the first stream added. The manager has the same
+    render/send interface as HueStream, so it can drive an Engine. A
+    LightBank is converted once per frame for all streams, which then
+    encode their own slots of it. Frames
+    for one tick are sent to all streams in parallel, so a slow bridge
+    doesn't delay the others, and per-stream send durations are recorded in
+    `timings`, keyed by (bridge IP, group ID).
+    """
+
+    def __init__(self):
+        self.streams = []
+        self.timings = {}
+        self._keys = {}
+        self._routes = {}
+        self._partitioned = None
+        self._partitions = []
+        # Bank versions at its last conversion
+        self._versions = array('Q')
+        self._frame = []
+        self._executor = None
+
+    @staticmethod
+    def key(stream):
+        return (stream.client.bridge_ip, stream.group_id)
+
+    def add(self, stream):
+        key = self.key(stream)
+        if key in self.timings:
+            raise ValueError(f'Already streaming to group {key[1]} '
+                             f'on bridge {key[0]}')
+        self.streams.append(stream)
+        self.timings[key] = LatencyStats()
+        self._keys[stream] = key
+        self._partitioned = None
+        self._restart_executor()
+        return stream
+
+    def route(self, light, stream):
+        """Sends the light's state to the given stream"""
+        assert stream in self._keys, 'Stream must be added first'
+        self._routes[light] = stream
+        self._partitioned = None
+
+    def start(self):
+        self._each(lambda stream: stream.start())
+
+    def stop(self):
+        self._each(lambda stream: stream.stop())
+
+    def render(self, lights, now=None):
+        """Renders each stream's share of lights. Returns the frames to
+        send as a list of (stream, message), or None if all streams
+        suppressed their frame.
+        """
+        if self._partitioned != (id(lights), len(lights)):
+            self._partition(lights)
+        bank = isinstance(lights, LightBank)
+        if bank:
+            self._convert(lights)
+        frame = self._frame
+        frame.clear()
+        for stream, share in self._partitions:
+            if bank:
+                message = stream.render(lights, now, share)
+            else:
+                message = stream.render(share, now)
+            if message is not None:
+                frame.append((stream, message))
+        return frame or None
+
+    def send(self, frame):
+        if len(frame) == 1:
+            self._send(*frame[0])
+            return
+        futures = [self._executor.submit(self._send, stream, message)
+                   for stream, message in frame]
+        for future in futures:
+            future.result()
+
+    def update(self, lights):
+        frame = self.render(lights)
+        if frame is None:
+            return False
+        self.send(frame)
+        return True
+
+    # Private
+
+    def _send(self, stream, message):
+        start = time.perf_counter()
+        stream.send(message)
+        self.timings[self._keys[stream]].record(time.perf_counter() - start)
+
+    def _convert(self, bank):
+        versions = self._versions
+        if versions != bank.versions:
+            bank.convert()
+            versions[:] = bank.versions
+
+    def _each(self, func):
+        futures = [self._executor.submit(func, stream)
+                   for stream in self.streams]
+        for future in futures:
+            future.result()
+
+    def _partition(self, lights):
+        assert self.streams, 'No streams added'
+        # Lights of a sequence, or slots of a bank
+        bank = isinstance(lights, LightBank)
+        by_stream = {stream: [] for stream in self.streams}
+        for slot, light in enumerate(lights):
+            stream = self._routes.get(light, self.streams[0])
+            by_stream[stream].append(slot if bank else light)
+        self._partitions = [(stream, by_stream[stream])
+                            for stream in self.streams if by_stream[stream]]
+        self._partitioned = (id(lights), len(lights))
+        del self._versions[:]
+
+    def _restart_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.streams),
+            thread_name_prefix='midihue-stream'
+        )
@@ -0,0 +1,485 @@
+import os
+import json
+from functools import partial
+from .light import Light, LightBank
+from .effects import Effects, EFFECTS
+from .smoothing import Smoother, DEFAULT_MODE, DEFAULT_DURATION
+from .scenes import SceneStore, SceneError, DEFAULT_CAPACITY
+from .spatial import Layout, SPATIAL_EFFECTS
+
+# Equivalent of the original hard coded mapping: CCs 77-79 on any channel
+# control hue, saturation and value of light 3.
+DEFAULT_MAPPING = {
+    'lights': [
+        {'id': 3, 'hsv': [0.0, 1.0, 1.0]},
+        {'id': 4, 'hsv': [0.0, 1.0, 1.0]},
+        {'id': 10, 'hsv': [0.0, 1.0, 1.0]},
+    ],
+    'mappings': [
+        {'type': 'control_change', 'control': 77, 'light': 3, 'param': 'h'},
+        {'type': 'control_change', 'control': 78, 'light': 3, 'param': 's'},
+        {'type': 'control_change', 'control': 79, 'light': 3, 'param': 'v'},
+    ]
+}
+
+PARAMS = ('h', 's', 'v', 'r', 'g', 'b')
+MIDI_CHANNELS = range(16)
+MIDI_PROGRAMS = range(128)
+SCENE_ACTIONS = ('recall', 'save')
+
+# Controllers 0-31 pair with an LSB controller 32 higher for 14 bit values
+FINE_CONTROLS = range(32)
+LSB_OFFSET = 32
+# Controllers that select an NRPN (or RPN) parameter and enter its value
+NRPN_MSB, NRPN_LSB = 99, 98
+RPN_MSB, RPN_LSB = 101, 100
+DATA_MSB, DATA_LSB = 6, 38
+PARAMETER_CONTROLS = (NRPN_MSB, NRPN_LSB, RPN_MSB, RPN_LSB, DATA_MSB,
+                      DATA_LSB)
+MAX_14BIT = 16383
+
+
+class MappingError(Exception):
+    pass
+
+
+# For each supported message type: the config key naming the mapped
+# number (None if the type has no number) and a function extracting
+# (number, value normalized to 0-1) from a message.
+_MESSAGE_TYPES = {
+    'control_change': ('control', lambda m: (m.control, m.value / 127.0)),
+    'note_on': ('note', lambda m: (m.note, m.velocity / 127.0)),
+    'note_off': ('note', lambda m: (m.note, 0.0)),
+    'polytouch': ('note', lambda m: (m.note, m.value / 127.0)),
+    'aftertouch': (None, lambda m: (None, m.value / 127.0)),
+    'pitchwheel': (None, lambda m: (None, (m.pitch + 8192) / 16383.0)),
+    'program_change': ('program', lambda m: (m.program, 1.0)),
+}
+
+# Types mapped from sequences of CCs rather than single messages, and
+# their number key
+_DECODED_TYPES = {'nrpn': 'nrpn'}
+
+
+class Mapping:
+    """MIDI to light parameter mappings.
+
+    The configuration declares lights (optional, for initial state) and a
+    list of mappings, each from a message type, channel (0-15, or all
+    channels if omitted) and CC/note number to a parameter of one or more
+    lights, scaled into [min, max]. Mappings are compiled into a table
+    keyed by (type, channel, number), so dispatching a message costs a
+    single lookup however many mappings there are.
+
+    Effects (see midihue.effects) are declared under `effects` with an
+    `id`, and a mapping can target an effect's parameters (e.g. its rate)
+    instead of a light. Spatial effects (see midihue.spatial) act on the
+    positions of their lights in `layout`, declared as each light's
+    `position`; `spatial` is set if there are any, so that positions can
+    be filled in from the bridge.
+
+    A CC mapping with `fine` set combines the controller (0-31) with its
+    LSB controller into a 14 bit value, and `nrpn` mappings take 14 bit
+    values from NRPN parameter numbers. With `smooth` (a mode from
+    midihue.smoothing, or true for the default) a light parameter glides
+    to each new value over `smooth_time` seconds, moved by `smoother`.
+
+    A mapping with a `scene` number recalls (or with `action: save`,
+    saves) that scene of `scenes` (see midihue.scenes), optionally fading
+    over `fade` seconds. A program change mapping without a `program`
+    maps every program, recalling the scene `scene` higher (programs
+    past the last scene are left unmapped). Options of the
+    scene store (`path`, `capacity` and `fade`) are declared under
+    `scenes`.
+
+    Options of the audio analysis (see midihue.audio), such as the
+    `channel` and first `control` its CCs are sent on, are declared under
+    `audio` and kept as `audio_options`; its messages are mapped like any
+    other.
+    """
+
+    def __init__(self, config):
+        self.lights = LightBank()
+        self.effects = Effects()
+        self.smoother = Smoother()
+        self.scenes = None
+        self.layout = Layout()
+        # Whether any effect needs light positions
+        self.spatial = False
+        self._scene_options = dict(config.get('scenes') or {})
+        self.audio_options = dict(config.get('audio') or {})
+        self._lights_by_id = {}
+        self._effects_by_id = {}
+        self._table = {}
+        # Decoders of 14 bit CC pairs and NRPNs, by (channel, control)
+        self._decoders = {}
+        for index, spec in enumerate(config.get('lights', ())):
+            self._declare_light(spec, f'lights[{index}]')
+        for index, spec in enumerate(config.get('effects', ())):
+            self._declare_effect(spec, f'effects[{index}]')
+        for index, spec in enumerate(config.get('mappings', ())):
+            self._compile(spec, f'mappings[{index}]')
+        # After all lights are declared, as scenes snapshot every light
+        try:
+            self.scenes = SceneStore(self.lights, **self._scene_options)
+        except (SceneError, TypeError, ValueError) as e:
+            raise MappingError(f'Invalid scenes: {e}')
+
+    def __len__(self):
+        """Number of compiled (type, channel, number) keys"""
+        return len(self._table)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a mapping from a JSON, TOML or YAML file"""
+        return cls(_read_config(os.path.expanduser(path)))
+
+    def light(self, light_id):
+        return self._lights_by_id[light_id]
+
+    def effect(self, effect_id):
+        return self._effects_by_id[effect_id]
+
+    def dispatch(self, msg):
+        """Applies a MIDI message to the mapped light parameters.
+        Returns True if the message was mapped.
+        """
+        msg_type = msg.type
+        if msg_type == 'control_change' and self._decoders:
+            decoder = self._decoders.get((msg.channel, msg.control))
+            if decoder is not None:
+                decoded = decoder.feed(msg.control, msg.value)
+                if decoded is None:
+                    return True
+                return self._run((decoded[0], msg.channel, decoded[1]),
+                                 decoded[2])
+        message_type = _MESSAGE_TYPES.get(msg_type)
+        if message_type is None:
+            return False
+        number, value = message_type[1](msg)
+        actions = self._table.get((msg_type, msg.channel, number))
+        if actions is None:
+            return False
+        for setter, low, span in actions:
+            setter(low + span * value)
+        return True
+
+    # Private
+
+    def _run(self, key, value):
+        actions = self._table.get(key)
+        if actions is None:
+            return False
+        for setter, low, span in actions:
+            setter(low + span * value)
+        return True
+
+    def _declare_light(self, spec, path):
+        if not isinstance(spec, dict):
+            spec = {'id': spec}
+        try:
+            light_id = int(spec['id'])
+        except (KeyError, TypeError, ValueError):
+            raise MappingError(f'Invalid light declaration at {path}: '
+                               f'{spec}')
+        if light_id in self._lights_by_id:
+            raise MappingError(f'Light {light_id} declared twice')
+
+        light = self.lights.add(light_id,
+                                colorspace=spec.get('colorspace', 'hsv'))
+        for key in ('hsv', 'rgb'):
+            if key in spec:
+                try:
+                    setattr(light, key, spec[key])
+                except (TypeError, ValueError):
+                    raise MappingError(f'Invalid {path}.{key}: '
+                                       f'{spec[key]!r}')
+                break
+        if 'position' in spec:
+            try:
+                self.layout.set(light_id, spec['position'])
+            except (TypeError, ValueError):
+                raise MappingError(f'Invalid position of light {light_id}: '
+                                   f'{spec["position"]}')
+        self._lights_by_id[light_id] = light
+        return light
+
+    def _declare_effect(self, spec, path):
+        if not isinstance(spec, dict):
+            raise MappingError(f'Invalid effect at {path}: {spec!r}')
+        spec = dict(spec)
+        effect_id = spec.pop('id', None)
+        effect_type = spec.pop('type', None)
+        if effect_id is None:
+            raise MappingError(f'Effect has no id: {spec}')
+        if effect_id in self._effects_by_id:
+            raise MappingError(f'Effect {effect_id!r} declared twice')
+        types = dict(EFFECTS, **SPATIAL_EFFECTS)
+        if effect_type not in types:
+            raise MappingError(f'Invalid effect type {effect_type!r}, '
+                               f'must be one of {", ".join(types)}')
+        lights = self._target_lights(spec, 'Effect', path)
+        spec.pop('light', None)
+        spec.pop('lights', None)
+        try:
+            if effect_type in SPATIAL_EFFECTS:
+                self.spatial = True
+                effect = types[effect_type](lights, self.layout, **spec)
+            else:
+                effect = types[effect_type](lights, **spec)
+        except (TypeError, ValueError) as e:
+            raise MappingError(f'Invalid effect {effect_id!r}: {e}')
+        self._effects_by_id[effect_id] = self.effects.add(effect)
+
+    def _setters(self, spec, path):
+        param = spec.get('param')
+        if 'scene' in spec:
+            return [self._scene_setter(spec, path)]
+        if 'effect' in spec:
+            if spec.get('smooth'):
+                raise MappingError('Only light parameters can be smoothed')
+            effect = self._effects_by_id.get(spec['effect'])
+            if effect is None:
+                raise MappingError(f'Unknown effect {spec["effect"]!r}')
+            if param not in effect.PARAMETERS:
+                raise MappingError(
+                    f'Invalid effect param {param!r}, must be one of '
+                    f'{", ".join(effect.PARAMETERS)}'
+                )
+            return [partial(setattr, effect, param)]
+
+        if param not in PARAMS:
+            raise MappingError(f'Invalid param {param!r}, '
+                               f'must be one of {", ".join(PARAMS)}')
+        lights = self._target_lights(spec, 'Mapping', path)
+        smooth = spec.get('smooth', False)
+        if smooth is False or smooth is None:
+            return [partial(getattr(Light, param).fset, light)
+                    for light in lights]
+        mode = DEFAULT_MODE if smooth is True else smooth
+        duration = _convert(float, spec.get('smooth_time', DEFAULT_DURATION),
+                            f'{path}.smooth_time')
+        try:
+            return [self.smoother.setter(self.smoother.add(light, param,
+                                                           mode, duration))
+                    for light in lights]
+        except (TypeError, ValueError) as e:
+            raise MappingError(f'Invalid smoothing: {e}')
+
+    def _scene_setter(self, spec, path):
+        action = spec.get('action', 'recall')
+        if action not in SCENE_ACTIONS:
+            raise MappingError(f'Invalid scene action {action!r}, must be '
+                               f'one of {", ".join(SCENE_ACTIONS)}')
+        capacity = self._scene_options.get('capacity', DEFAULT_CAPACITY)
+        scene = _convert(int, spec['scene'], f'{path}.scene')
+        fade = spec.get('fade')
+        if fade is not None:
+            fade = _convert(float, fade, f'{path}.fade')
+        if not 0 <= scene < capacity:
+            raise MappingError(f'Invalid scene {scene}, must be '
+                               f'0-{capacity - 1}')
+        return partial(self._scene, action, scene, fade)
+
+    def _scene(self, action, scene, fade, value):
+        # Note offs (and note ons of velocity 0) do nothing
+        if value <= 0.0:
+            return
+        if action == 'save':
+            self.scenes.save(scene)
+        else:
+            self.scenes.recall(scene, fade)
+
+    def _target_lights(self, spec, kind, path):
+        """The lights of a mapping or effect, declared if need be"""
+        if 'lights' in spec:
+            light_ids = spec['lights']
+            if not isinstance(light_ids, (list, tuple)):
+                raise MappingError(f'Invalid {path}.lights: {light_ids!r}')
+            return [self._light_or_declare(light_id,
+                                           f'{path}.lights[{index}]')
+                    for index, light_id in enumerate(light_ids)]
+        elif 'light' in spec:
+            return [self._light_or_declare(spec['light'], f'{path}.light')]
+        raise MappingError(f'{kind} has no target light: {spec}')
+
+    def _light_or_declare(self, light_id, path):
+        light = self._lights_by_id.get(_convert(int, light_id, path))
+        if light is None:
+            light = self._declare_light({'id': light_id}, path)
+        return light
+
+    def _compile(self, spec, path):
+        if not isinstance(spec, dict):
+            raise MappingError(f'Invalid mapping at {path}: {spec!r}')
+        msg_type = spec.get('type', 'control_change')
+        if msg_type == 'program_change' and 'program' not in spec and \
+                'scene' in spec:
+            offset = spec['scene']
+            if not isinstance(offset, int):
+                raise MappingError(f'Invalid scene mapping: {spec}')
+            capacity = self._scene_options.get('capacity', DEFAULT_CAPACITY)
+            for program in MIDI_PROGRAMS:
+                if 0 <= offset + program < capacity:
+                    self._compile(dict(spec, program=program,
+                                       scene=offset + program), path)
+            return
+        if msg_type in _MESSAGE_TYPES:
+            number_key = _MESSAGE_TYPES[msg_type][0]
+        elif msg_type in _DECODED_TYPES:
+            number_key = _DECODED_TYPES[msg_type]
+        else:
+            raise MappingError(f'Unsupported message type: {msg_type}')
+        if number_key is None:
+            number = None
+        elif number_key in spec:
+            number = _convert(int, spec[number_key], f'{path}.{number_key}')
+        else:
+            raise MappingError(f'Mapping is missing "{number_key}": {spec}')
+
+        channel = spec.get('channel')
+        if channel is None:
+            channels = MIDI_CHANNELS
+        elif _convert(int, channel, f'{path}.channel') in MIDI_CHANNELS:
+            channels = (int(channel),)
+        else:
+            raise MappingError(f'Invalid channel {channel}, must be 0-15')
+
+        low = _convert(float, spec.get('min', 0.0), f'{path}.min')
+        span = _convert(float, spec.get('max', 1.0), f'{path}.max') - low
+        actions = [(setter, low, span)
+                   for setter in self._setters(spec, path)]
+
+        for channel in channels:
+            if msg_type == 'nrpn':
+                self._decode_nrpn(channel, number)
+            elif spec.get('fine'):
+                self._decode_fine(channel, number)
+            key = (msg_type, channel, number)
+            self._table[key] = self._table.get(key, ()) + tuple(actions)
+
+    def _decode_fine(self, channel, control):
+        if control not in FINE_CONTROLS:
+            raise MappingError(f'Only controls 0-31 can be fine, '
+                               f'not {control}')
+        decoder = self._decoders.get((channel, control))
+        if decoder is None:
+            decoder = _FineControl(control)
+        elif not isinstance(decoder, _FineControl):
+            raise MappingError(f'Control {control} on channel {channel} '
+                               f'is used for NRPN data entry')
+        self._add_decoder(channel, (control, control + LSB_OFFSET), decoder)
+
+    def _decode_nrpn(self, channel, number):
+        if not 0 <= number <= MAX_14BIT:
+            raise MappingError(f'Invalid NRPN {number}, must be '
+                               f'0-{MAX_14BIT}')
+        decoder = self._decoders.get((channel, NRPN_MSB))
+        if decoder is None:
+            decoder = _ParameterNumber()
+        self._add_decoder(channel, PARAMETER_CONTROLS, decoder)
+
+    def _add_decoder(self, channel, controls, decoder):
+        for control in controls:
+            existing = self._decoders.get((channel, control))
+            if existing is not None and existing is not decoder:
+                raise MappingError(f'Control {control} on channel {channel} '
+                                   f'is used by both a fine CC and NRPN')
+            self._decoders[(channel, control)] = decoder
+
+
+class _FineControl:
+    """Joins a controller and its LSB controller into a 14 bit value.
+    The MSB resets the LSB, so senders of only the MSB still work.
+    """
+
+    def __init__(self, control):
+        self.control = control
+        self.msb = 0
+        self.lsb = 0
+
+    def feed(self, control, value):
+        if control == self.control:
+            self.msb = value
+            self.lsb = 0
+        else:
+            self.lsb = value
+        return ('control_change', self.control,
+                ((self.msb << 7) | self.lsb) / MAX_14BIT)
+
+
+class _ParameterNumber:
+    """The NRPN selected on a channel and values entered for it.
+
+    Data entry while no NRPN is selected (or an RPN is) is passed on as a
+    plain CC.
+    """
+
+    def __init__(self):
+        self.msb = None
+        self.lsb = None
+        self.data = 0
+
+    @property
+    def number(self):
+        if self.msb is None or self.lsb is None:
+            return None
+        return (self.msb << 7) | self.lsb
+
+    def feed(self, control, value):
+        if control == NRPN_MSB:
+            self.msb = value
+        elif control == NRPN_LSB:
+            self.lsb = value
+        elif control in (RPN_MSB, RPN_LSB):
+            self.msb = self.lsb = None
+        else:
+            number = self.number
+            if number is None:
+                return ('control_change', control, value / 127.0)
+            if control == DATA_MSB:
+                self.data = value << 7
+            else:
+                self.data = (self.data & 0x3f80) | value
+            return ('nrpn', number, self.data / MAX_14BIT)
+        self.data = 0
+        return None
+
+
+def _convert(convert, value, path):
+    """Converts a config value with int or float, raising MappingError
+    naming its key path if it is not a number
+    """
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise MappingError(f'Invalid {path}: {value!r}')
+
+
+def _read_config(path):
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.json':
+            with open(path, 'r') as file:
+                return json.load(file)
+        elif ext == '.toml':
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+            with open(path, 'rb') as file:
+                return tomllib.load(file)
+        elif ext in ('.yaml', '.yml'):
+            import yaml
+            with open(path, 'r') as file:
+                try:
+                    return yaml.safe_load(file)
+                except yaml.YAMLError as e:
+                    raise ValueError(e)
+    except ImportError as e:
+        raise MappingError(
+            f'Reading {ext} mapping files requires the {e.name} package'
+        )
+    except (OSError, ValueError) as e:
+        raise MappingError(f'Failed to read mapping file {path}: {e}')
+    raise MappingError(f'Unsupported mapping file type: {ext or path}')
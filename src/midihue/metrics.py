@@ -0,0 +1,225 @@
+"""Timing of the hot path, for live diagnostics.
+
+Instrumented objects (Engine, HueStream) have a `metrics` attribute that
+is None unless a Metrics instance is attached, so when disabled the cost
+is one attribute check per stage. Each stage records durations into a
+fixed-size ring buffer, and percentiles are computed only when a report
+is requested: on SIGUSR1 (see `install_signal_handler`) or from the
+Prometheus text endpoint started by `serve`.
+"""
+import signal
+import sys
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DEFAULT_HISTOGRAM_SIZE = 1024
+DEFAULT_METRICS_PORT = 9100
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# Stages recorded by the engine and stream, in pipeline order
+STAGES = (
+    ('midi', 'Applying a MIDI message, or a coalesced batch, to lights'),
+    ('smoothing', 'Moving smoothed parameters towards their targets'),
+    ('scenes', 'Crossfading between scenes'),
+    ('effects', 'Rendering effects into light state'),
+    ('convert', 'Converting a LightBank to output values'),
+    ('encode', 'Rendering a frame, including conversion'),
+    ('send', 'Sending one frame over DTLS'),
+    ('frame', 'Rendering and sending one frame'),
+    ('interval', 'Time between consecutive frames'),
+)
+
+
+class Histogram:
+    """The last `size` samples of a duration, in seconds, plus running
+    totals since creation.
+    """
+
+    def __init__(self, size=DEFAULT_HISTOGRAM_SIZE):
+        assert size > 0
+        self._samples = array('d', bytes(8 * size))
+        self._size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self._samples[self.count % self._size] = value
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def samples(self):
+        """The samples currently held, oldest first"""
+        if self.count <= self._size:
+            return self._samples[:self.count].tolist()
+        start = self.count % self._size
+        return (self._samples[start:] + self._samples[:start]).tolist()
+
+    def summary(self):
+        """Returns (mean, stdev, {percentile: value}) of the held samples"""
+        samples = sorted(self.samples())
+        if not samples:
+            return 0.0, 0.0, {p: 0.0 for p in PERCENTILES}
+        n = len(samples)
+        mean = sum(samples) / n
+        stdev = (sum((s - mean) ** 2 for s in samples) / n) ** 0.5
+        return mean, stdev, {p: samples[min(n - 1, int(p * n))]
+                             for p in PERCENTILES}
+
+
+class Metrics:
+    """Per-stage histograms and gauges for one running pipeline."""
+
+    def __init__(self, size=DEFAULT_HISTOGRAM_SIZE):
+        self.stages = {name: Histogram(size) for name, _ in STAGES}
+        self._gauges = {}
+        self._server = None
+
+    def record(self, stage, duration):
+        self.stages[stage].record(duration)
+
+    def gauge(self, name, func, description=''):
+        """Registers a value read by calling func when reporting"""
+        self._gauges[name] = (func, description)
+
+    def watch_stream(self, stream):
+        """Attaches to a HueStream and reports its frame counters, and its
+        send rate if it is paced
+        """
+        stream.metrics = self
+        for name in ('frames_sent', 'frames_suppressed', 'frames_dropped',
+                     'reconnects'):
+            self.gauge(name, lambda name=name: getattr(stream, name))
+        pacer = getattr(stream, 'pacer', None)
+        if pacer is not None:
+            self.gauge('send_rate_hz', lambda: pacer.effective_rate,
+                       'Frames sent per second over the last second')
+            self.gauge('send_rate_limit_hz', lambda: pacer.rate,
+                       'Frames per second allowed by the pacer')
+            self.gauge('frames_paced', lambda: pacer.held,
+                       'Frames held back until the pacer allowed them')
+            self.gauge('frames_superseded', lambda: pacer.dropped,
+                       'Held frames replaced by a newer frame unsent')
+            self.gauge('pacing_backoffs', lambda: pacer.backoffs,
+                       'Failed or blocked sends that slowed the pacer')
+
+    def watch_engine(self, engine):
+        """Attaches to an Engine and reports its MIDI backlog, collapsed
+        messages if it coalesces, and tempo if it follows MIDI clock
+        """
+        engine.metrics = self
+        self.gauge('midi_backlog', lambda: engine.backlog,
+                   'MIDI messages received since the last frame')
+        if engine.coalescer is not None:
+            self.gauge('midi_collapsed', lambda: engine.coalescer.collapsed,
+                       'MIDI messages replaced by a later value')
+        if engine.scheduler is not None:
+            self.gauge('tempo_bpm',
+                       lambda: engine.scheduler.tracker.bpm or 0.0,
+                       'Tempo estimated from MIDI clock')
+            self.gauge('beat_offset_seconds',
+                       lambda: engine.scheduler.offset.mean,
+                       'Mean distance of beat-aligned frames from the beat')
+
+    @property
+    def frame_rate(self):
+        interval = self.stages['interval']
+        mean = interval.summary()[0]
+        return 1.0 / mean if mean else 0.0
+
+    def report(self):
+        """A human readable summary, durations in milliseconds"""
+        lines = ['stage        count    mean     p50     p90     p99     '
+                 'max']
+        for name, _ in STAGES:
+            histogram = self.stages[name]
+            mean, _, percentiles = histogram.summary()
+            values = [mean] + [percentiles[p] for p in PERCENTILES] + \
+                [histogram.max]
+            lines.append(f'{name:<10} {histogram.count:>7} ' +
+                         ' '.join(f'{v * 1000:7.3f}' for v in values))
+        jitter = self.stages['interval'].summary()[1]
+        lines.append(f'frame rate {self.frame_rate:.1f} Hz, '
+                     f'jitter {jitter * 1000:.3f} ms')
+        for name, (func, _) in self._gauges.items():
+            lines.append(f'{name} {func()}')
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, description in STAGES:
+            histogram = self.stages[name]
+            metric = f'midihue_{name}_seconds'
+            _, _, percentiles = histogram.summary()
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} summary')
+            for p in PERCENTILES:
+                lines.append(f'{metric}{{quantile="{p}"}} {percentiles[p]}')
+            lines.append(f'{metric}_sum {histogram.total}')
+            lines.append(f'{metric}_count {histogram.count}')
+        lines.append('# TYPE midihue_frame_rate_hz gauge')
+        lines.append(f'midihue_frame_rate_hz {self.frame_rate}')
+        lines.append('# TYPE midihue_frame_jitter_seconds gauge')
+        lines.append('midihue_frame_jitter_seconds '
+                     f'{self.stages["interval"].summary()[1]}')
+        for name, (func, description) in self._gauges.items():
+            if description:
+                lines.append(f'# HELP midihue_{name} {description}')
+            lines.append(f'# TYPE midihue_{name} gauge')
+            lines.append(f'midihue_{name} {func()}')
+        return '\n'.join(lines) + '\n'
+
+    def install_signal_handler(self, file=None):
+        """Writes `report` to file (stderr by default) on SIGUSR1.
+        Returns False where SIGUSR1 is not available.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return False
+
+        def dump(signum, frame):
+            (file or sys.stderr).write(self.report())
+        signal.signal(signal.SIGUSR1, dump)
+        return True
+
+    def serve(self, port=DEFAULT_METRICS_PORT, host='127.0.0.1'):
+        """Serves `prometheus` at /metrics on a daemon thread. Returns
+        the bound port.
+        """
+        self._server = _HTTPServer((host, port), _Handler)
+        self._server.metrics = self
+        threading.Thread(target=self._server.serve_forever,
+                         kwargs={'poll_interval': 0.1},
+                         name='midihue-metrics', daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
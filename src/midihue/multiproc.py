@@ -0,0 +1,346 @@
+"""Running MIDI input, rendering and stream output in separate processes.
+
+In a single process all three stages share the GIL, so a slow effect or a
+blocking bridge request delays both MIDI intake and frame sends. A
+MultiprocessRunner instead starts:
+
+- an input process, reading MIDI and forwarding it to the renderer
+- a render process, running an Engine (mappings, smoothing, effects) that
+  publishes each encoded frame to a shared FrameBuffer
+- an output process, owning the HueStream and sending the latest frame
+  from the buffer on its own frame clock
+
+The FrameBuffer holds only the latest frame and is guarded by a sequence
+lock rather than a mutex, so neither side ever waits for the other. A
+stall in rendering repeats the last frame instead of delaying output, and
+each process can be pinned to its own core.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import mido
+from .engine import Engine, DEFAULT_FRAME_RATE
+from .hue import HueClient, HueStream, HueStreamError, MAX_STREAM_LIGHTS
+from .mapping import Mapping, DEFAULT_MAPPING
+from .clock import BeatScheduler, DEFAULT_LOOKAHEAD
+
+# Largest encoded frame: header and a full set of lights, in either stream
+# API version
+MAX_FRAME_SIZE = max(
+    len(HueStream.Message._HEADER) +
+    MAX_STREAM_LIGHTS * HueStream.Message._LIGHT.size,
+    len(HueStream.Message._HEADER_V2) +
+    HueStream.Message._CONFIGURATION_ID_SIZE +
+    MAX_STREAM_LIGHTS * HueStream.Message._CHANNEL.size
+)
+STAGES = ('input', 'render', 'output')
+# How often child processes check for the stop event while otherwise idle
+STOP_POLL_INTERVAL = 0.1
+
+
+class FrameBuffer:
+    """The latest encoded frame, shared between processes.
+
+    There must be a single writer. `publish` bumps the sequence number to
+    odd before writing and to even after, and `read` retries a copy that
+    overlapped a write, so readers never block the writer.
+    """
+
+    def __init__(self, size=MAX_FRAME_SIZE):
+        self.size = size
+        # Sequence number and frame length
+        self._header = RawArray('Q', 2)
+        self._data = RawArray('B', size)
+        self._view = None
+
+    @property
+    def sequence(self):
+        return self._header[0]
+
+    def publish(self, data):
+        length = len(data)
+        assert length <= self.size, 'Frame is larger than the buffer'
+        header = self._header
+        sequence = header[0]
+        header[0] = sequence + 1
+        self._memoryview()[:length] = data
+        header[1] = length
+        header[0] = sequence + 2
+
+    def read(self, out, last_sequence=None):
+        """Copies the frame into bytearray `out` if it changed since
+        `last_sequence`. Returns (sequence, length), where length is None
+        if the frame did not change.
+        """
+        header = self._header
+        view = self._memoryview()
+        while True:
+            sequence = header[0]
+            if sequence == last_sequence:
+                return sequence, None
+            if sequence & 1:
+                # Mid-write; the writer finishes in microseconds
+                time.sleep(0)
+                continue
+            length = header[1]
+            out[:length] = view[:length]
+            if header[0] == sequence:
+                return sequence, length
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None
+        return state
+
+    # Private
+
+    def _memoryview(self):
+        if self._view is None:
+            self._view = memoryview(self._data).cast('B')
+        return self._view
+
+
+class FramePublisher:
+    """Stands in for a HueStream in the render process: frames are
+    rendered as usual but published to a FrameBuffer rather than sent.
+    """
+
+    def __init__(self, buffer, pipeline=None, configuration=None):
+        self.buffer = buffer
+        self.frames_published = 0
+        # Every rendered frame is published, as the output process does
+        # the keep-alive
+        self._stream = HueStream(0, client=None, pipeline=pipeline,
+                                 keepalive_interval=float('inf'),
+                                 configuration=configuration)
+
+    def render(self, lights, now=None):
+        return self._stream.render(lights, now)
+
+    def send(self, message):
+        self.buffer.publish(message.buffer)
+        self.frames_published += 1
+
+
+class MultiprocessRunner:
+    """Runs the input, render and output stages in their own processes.
+
+    `mapping` is a mapping file path or config (see Mapping), `client` the
+    keyword arguments of the output process's HueClient and `stream` any
+    extra ones of its HueStream. MIDI is read from the input named
+    `input_name`, or from the iterable returned by calling `source`.
+    `configure`, if given, is called with the Engine in the render
+    process before it runs. `locations` are light positions (see
+    HueClient.get_light_locations) for lights the mapping places nowhere.
+    Frames are rendered in the stream API v2 format for an entertainment
+    `configuration` (see HueClient.get_entertainment_configuration), and
+    in v1 without one.
+    `cpus` optionally pins the input, render and output process to a CPU
+    each.
+
+    Everything passed must be picklable, and functions importable, as the
+    processes are spawned.
+    """
+
+    def __init__(self, group_id, client, mapping=None, input_name=None,
+                 source=None, rate=DEFAULT_FRAME_RATE, immediate=False,
+                 coalesce=False, clock_sync=False,
+                 lookahead=DEFAULT_LOOKAHEAD, pipeline=None, stream=None,
+                 configure=None, locations=None, configuration=None,
+                 cpus=None, context='spawn'):
+        assert (input_name is None) != (source is None), \
+            'Exactly one of input_name and source is required'
+        if cpus is not None:
+            cpus = tuple(cpus)
+            assert len(cpus) == len(STAGES), \
+                f'One CPU is needed for each of {", ".join(STAGES)}'
+        self.group_id = group_id
+        self.rate = rate
+        self.cpus = cpus
+        self._client = client
+        self._stream = stream or {}
+        self._render = {
+            'mapping': DEFAULT_MAPPING if mapping is None else mapping,
+            'rate': rate, 'immediate': immediate, 'coalesce': coalesce,
+            'clock_sync': clock_sync, 'lookahead': lookahead,
+            'pipeline': pipeline, 'configure': configure,
+            'locations': locations, 'configuration': configuration,
+        }
+        self._input = (input_name, source)
+        self._context = multiprocessing.get_context(context)
+        self.buffer = FrameBuffer()
+        self._stop = self._context.Event()
+        self._processes = []
+
+    @property
+    def processes(self):
+        return list(self._processes)
+
+    def start(self):
+        ctx = self._context
+        self._stop.clear()
+        receiver, sender = ctx.Pipe(duplex=False)
+        targets = (
+            (_input_main, (self._input, sender)),
+            (_render_main, (self._render, receiver, self.buffer)),
+            (_output_main, (self.group_id, self._client, self._stream,
+                            self.rate, self.buffer)),
+        )
+        for index, (target, args) in enumerate(targets):
+            cpu = None if self.cpus is None else self.cpus[index]
+            process = ctx.Process(target=target,
+                                  args=args + (self._stop, cpu),
+                                  name=f'midihue-{STAGES[index]}',
+                                  daemon=True)
+            process.start()
+            self._processes.append(process)
+        receiver.close()
+        sender.close()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
+
+    def wait(self):
+        """Waits until a process exits, then stops the rest. Returns False
+        if any exited with an error.
+        """
+        try:
+            while not self._stop.is_set():
+                if any(not p.is_alive() for p in self._processes):
+                    break
+                time.sleep(STOP_POLL_INTERVAL)
+        finally:
+            codes = [p.exitcode for p in self._processes]
+            self.stop()
+        return all(code in (None, 0) for code in codes)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def pin_to_cpu(cpu):
+    """Pins the calling process to a CPU, where supported"""
+    if cpu is None or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, {cpu})
+    return True
+
+
+# Private
+
+def _input_main(midi_input, sender, stop, cpu):
+    pin_to_cpu(cpu)
+    input_name, source = midi_input
+    inport = mido.open_input(input_name) if source is None else source()
+    try:
+        for msg in inport:
+            if stop.is_set():
+                break
+            sender.send_bytes(bytes(msg.bytes()))
+    except (BrokenPipeError, EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        sender.close()
+
+
+def _messages(receiver, stop):
+    while not stop.is_set():
+        try:
+            if not receiver.poll(STOP_POLL_INTERVAL):
+                continue
+            data = receiver.recv_bytes()
+        except (EOFError, OSError):
+            return
+        yield mido.Message.from_bytes(data)
+
+
+def _render_main(options, receiver, buffer, stop, cpu):
+    pin_to_cpu(cpu)
+    mapping = options['mapping']
+    mapping = Mapping.load(mapping) if isinstance(mapping, str) else \
+        Mapping(mapping)
+    if options['locations']:
+        mapping.layout.update(options['locations'], replace=False)
+    scheduler = BeatScheduler(lookahead=options['lookahead']) \
+        if options['clock_sync'] else None
+    publisher = FramePublisher(buffer, options['pipeline'],
+                               options['configuration'])
+    engine = Engine(publisher, mapping.lights, mapping.dispatch,
+                    rate=options['rate'], immediate=options['immediate'],
+                    coalesce=options['coalesce'], effects=mapping.effects,
+                    scheduler=scheduler, smoother=mapping.smoother,
+                    scenes=mapping.scenes)
+    if options['configure'] is not None:
+        options['configure'](engine)
+
+    engine.start_input(_messages(receiver, stop))
+    threading.Thread(target=_stop_when_set, args=(stop, engine.stop),
+                     daemon=True).start()
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def _stop_when_set(stop, callback):
+    stop.wait()
+    callback()
+
+
+class _Frame:
+    """A frame copied out of the FrameBuffer, sendable by HueStream"""
+
+    def __init__(self, size):
+        self.data = bytearray(size)
+        self.buffer = memoryview(self.data)[:0]
+
+    def resize(self, length):
+        self.buffer = memoryview(self.data)[:length]
+
+
+def _output_main(group_id, client_args, stream_args, rate, buffer, stop,
+                 cpu):
+    pin_to_cpu(cpu)
+    stream = HueStream(group_id, HueClient(**client_args), **stream_args)
+    try:
+        stream.start()
+    except HueStreamError as e:
+        print(f'[HueStream] {e}')
+        raise SystemExit(1)
+    period = 1.0 / rate
+    frame = _Frame(buffer.size)
+    sequence = None
+    deadline = time.perf_counter()
+    try:
+        while not stop.is_set():
+            sequence, length = buffer.read(frame.data, sequence)
+            if length is not None:
+                frame.resize(length)
+            # The latest frame goes out on every tick, so the bridge keeps
+            # a steady stream however rendering is doing
+            if len(frame.buffer):
+                stream.send(frame)
+            deadline += period
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                deadline = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.stop()
+        if stream.pacer is not None:
+            print(f'[HueStream] Sent {stream.pacer.report()}')
@@ -0,0 +1,111 @@
+"""Pacing of stream frames to the rate the bridge can take.
+
+The bridge renders entertainment frames at roughly 25 Hz, and the Zigbee
+updates to the lights lag behind that, so frames sent faster only queue
+up on the way, adding latency. A Pacer limits a HueStream's sends with a
+token bucket: tokens accrue at `rate` per second, up to `burst`, and each
+frame sent takes one. A frame that finds no token is held rather than
+queued, replacing any frame held before it, and sent as soon as a token
+is available, so the bridge always gets the newest state.
+
+In adaptive mode the rate follows what the link achieves: it is halved
+whenever a send fails or the socket pushes back (it would block, or a
+send takes longer than `slow_send`), and otherwise climbs back by about
+RECOVERY Hz per second, up to `max_rate` (additive increase,
+multiplicative decrease).
+"""
+import time
+from collections import deque
+
+DEFAULT_RATE = 25.0
+DEFAULT_BURST = 2.0
+MIN_RATE = 5.0
+# Multiplicative decrease on pressure, additive increase in Hz per second
+BACKOFF = 0.5
+RECOVERY = 2.0
+# A send taking longer than this means the socket buffer is filling up
+SLOW_SEND = 0.005
+# Window over which the effective rate is measured, in seconds
+RATE_WINDOW = 1.0
+
+
+class Pacer:
+    """A token bucket of `rate` frames per second and `burst` frames,
+    which in `adaptive` mode varies its rate between `min_rate` and
+    `max_rate` (by default the initial rate).
+
+    `held` counts frames that had to wait for a token and `dropped` those
+    of them replaced by a newer frame before being sent.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 adaptive=False, min_rate=MIN_RATE, max_rate=None,
+                 slow_send=SLOW_SEND):
+        if rate <= 0:
+            raise ValueError('Pacing rate must be positive')
+        if burst < 1:
+            raise ValueError('Pacing burst must be at least one frame')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.adaptive = adaptive
+        self.max_rate = self.rate if max_rate is None else float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.slow_send = slow_send
+        self.held = 0
+        self.dropped = 0
+        self.backoffs = 0
+        self._tokens = self.burst
+        self._refilled = None
+        self._sent = deque()
+
+    @property
+    def effective_rate(self):
+        """Frames sent per second over the last RATE_WINDOW seconds"""
+        self._expire(time.monotonic())
+        return len(self._sent) / RATE_WINDOW
+
+    def acquire(self, now=None):
+        """Takes a token if one is available. Returns True if a frame may
+        be sent at time `now` (monotonic seconds).
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._refilled is not None:
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def sent(self, now, duration=0.0):
+        """Records a frame sent at `now` that took `duration` seconds"""
+        self._sent.append(now)
+        self._expire(now)
+        if not self.adaptive:
+            return
+        if duration > self.slow_send:
+            self.backoff()
+        elif self.rate < self.max_rate:
+            # About `RECOVERY` Hz more per second at the current rate
+            self.rate = min(self.max_rate, self.rate + RECOVERY / self.rate)
+
+    def backoff(self):
+        """Records pressure from the link: a failed or blocked send"""
+        self.backoffs += 1
+        if self.adaptive:
+            self.rate = max(self.min_rate, self.rate * BACKOFF)
+            self._tokens = min(self._tokens, 0.0)
+
+    def report(self):
+        return f'{self.effective_rate:.1f} Hz (limit {self.rate:.1f} Hz), ' \
+            f'{self.held} held, {self.dropped} dropped, ' \
+            f'{self.backoffs} backoffs'
+
+    # Private
+
+    def _expire(self, now):
+        sent = self._sent
+        while sent and now - sent[0] > RATE_WINDOW:
+            sent.popleft()
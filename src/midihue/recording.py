@@ -0,0 +1,240 @@
+"""Recording and replay of MIDI sessions and stream frames.
+
+Recordings are compact binary files: a header naming what was recorded
+(MIDI messages or HueStream frames) followed by records of
+
+- the time since the previous record, in microseconds (uint32)
+- the length of the data (uint32, uint16 in version 1 recordings)
+- the raw MIDI message or encoded frame
+
+Replay memory-maps the file, so records are read one at a time without
+loading the whole session. A ReplayPort yields the messages of a MIDI
+recording like a mido input port, in real time or faster, so a recorded
+show drives the same pipeline as live input.
+"""
+import mmap
+import struct
+import threading
+import time
+import mido
+
+MAGIC = b'MIDIHUE'
+VERSION = 2
+MIDI = b'M'
+FRAMES = b'F'
+KINDS = (MIDI, FRAMES)
+# Magic, version and kind
+_HEADER = struct.Struct(f'<{len(MAGIC)}sBc')
+# Time delta and data length, by version
+_RECORDS = {1: struct.Struct('<IH'), 2: struct.Struct('<II')}
+_RECORD = _RECORDS[VERSION]
+_MAX_DELTA = 0xffffffff
+_MAX_LENGTH = 0xffffffff
+
+
+class RecordingError(Exception):
+    pass
+
+
+class Recorder:
+    """Writes timestamped records to a recording file.
+
+    Times are perf_counter() values unless given, and only their
+    differences are stored. Records may be written from several threads,
+    e.g. MIDI and audio input.
+    """
+
+    def __init__(self, path, kind=MIDI):
+        assert kind in KINDS, f'Invalid kind {kind!r}'
+        self.path = path
+        self.kind = kind
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, kind))
+        self._last = None
+        self._lock = threading.Lock()
+
+    def write(self, data, now=None):
+        if len(data) > _MAX_LENGTH:
+            raise RecordingError(f'Record of {len(data)} bytes is too large')
+        if now is None:
+            now = time.perf_counter()
+        with self._lock:
+            if self._last is None:
+                delta = 0
+            else:
+                delta = min(_MAX_DELTA,
+                            max(0, round((now - self._last) * 1e6)))
+            # Accumulate from the stored (rounded) deltas, so rounding
+            # errors do not add up over a long session
+            self._last = now if self._last is None else \
+                self._last + delta / 1e6
+            self._file.write(_RECORD.pack(delta, len(data)))
+            self._file.write(data)
+            self.count += 1
+
+    def record(self, msg, now=None):
+        """Writes a mido message"""
+        self.write(bytes(msg.bytes()), now)
+
+    def tee(self, port):
+        """Yields the messages of an input port, recording each one as it
+        is received.
+        """
+        for msg in port:
+            self.record(msg)
+            yield msg
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Recording:
+    """A memory-mapped recording. Iterating yields (time, data) for each
+    record, with times in seconds from the first record and data as bytes
+    copied out of the map, so they outlive the recording.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                raise RecordingError(f'{path} is empty or not a file')
+        try:
+            magic, version, kind = _HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = version = kind = None
+        if magic != MAGIC or kind not in KINDS:
+            self.close()
+            raise RecordingError(f'{path} is not a midi-hue recording')
+        if version not in _RECORDS:
+            self.close()
+            raise RecordingError(f'Unsupported recording version {version}')
+        self.kind = kind
+        self.version = version
+
+    def __iter__(self):
+        record = _RECORDS[self.version]
+        map_, size = self._map, len(self._map)
+        offset = _HEADER.size
+        now = 0
+        while offset + record.size <= size:
+            delta, length = record.unpack_from(map_, offset)
+            offset += record.size
+            if offset + length > size:
+                # A truncated final record, e.g. from an interrupted session
+                return
+            now += delta
+            yield now / 1e6, map_[offset:offset + length]
+            offset += length
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @property
+    def duration(self):
+        last = 0.0
+        for last, _ in self:
+            pass
+        return last
+
+    def messages(self):
+        """Yields (time, mido message) for a MIDI recording"""
+        assert self.kind == MIDI, 'Not a MIDI recording'
+        for now, data in self:
+            yield now, mido.Message.from_bytes(data)
+
+    def states(self):
+        """Yields each distinct light state of a frame recording, as
+        decoded by HueStream.Message.decode, skipping repeated frames
+        (e.g. keep-alives).
+        """
+        from .hue import HueStream
+        assert self.kind == FRAMES, 'Not a frame recording'
+        last = None
+        for _, data in self:
+            if data != last:
+                last = data
+                yield HueStream.Message.decode(data)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayPort:
+    """An input port replaying a MIDI recording.
+
+    Messages are yielded at their recorded times divided by `speed`, or
+    as fast as possible with a speed of 0. With `loop` the recording
+    repeats until the port is closed. Closing the port releases the
+    recording, once any iteration in progress (e.g. on an input thread)
+    has stopped.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        assert speed >= 0, 'Speed must not be negative'
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.closed = False
+        self._recording = Recording(path)
+        if self._recording.kind != MIDI:
+            self._recording.close()
+            raise RecordingError(f'{path} is not a MIDI recording')
+        self._lock = threading.Lock()
+        self._readers = 0
+
+    def __iter__(self):
+        with self._lock:
+            if self.closed:
+                return
+            self._readers += 1
+        try:
+            while not self.closed:
+                start = time.perf_counter()
+                for now, msg in self._recording.messages():
+                    if self.closed:
+                        return
+                    if self.speed:
+                        delay = start + now / self.speed - \
+                            time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    yield msg
+                if not self.loop:
+                    return
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self.closed and not self._readers:
+                    self._recording.close()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            if not self._readers:
+                self._recording.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
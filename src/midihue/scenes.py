@@ -0,0 +1,272 @@
+"""Scenes: snapshots of every light's color, recalled in one frame.
+
+A SceneStore saves the native color values of each light of a LightBank
+into numbered scenes, packed as 16 bit integers (6 bytes per light), and
+recalls a scene by writing all of them back at once, so the next frame
+carries the whole look. A recall can instead crossfade from the current
+colors: the start values and distances are computed once when the fade
+starts, and each frame only evaluates start + distance * progress for
+every channel, with hues taking the short way around the color wheel.
+
+With a `path`, scenes are kept in a memory-mapped file, so opening a
+store reads nothing until a scene is recalled, and saved scenes are
+written straight through to the file. The file starts with a header and
+the ID and color space of each light it was created for; lights are
+matched to the bank by ID, so lights can be added to a mapping without
+losing its scenes.
+"""
+import mmap
+import os
+import struct
+import time
+from array import array
+
+MAGIC = b'MIDIHUES'
+VERSION = 1
+DEFAULT_CAPACITY = 128
+MAX_VALUE = 0xffff
+# Magic, version, number of lights and number of scenes
+_HEADER = struct.Struct(f'<{len(MAGIC)}sHHI')
+# Light ID and color space
+_LIGHT = struct.Struct('<HH')
+_COLORSPACES = ('hsv', 'rgb')
+_WORD = array('H').itemsize
+
+
+class SceneError(Exception):
+    pass
+
+
+class SceneStore:
+    """Numbered scenes of the lights of `bank`, 0 to `capacity` - 1.
+
+    Recalls crossfade over `fade` seconds unless given another duration;
+    fades are moved along by `update`, once per frame.
+    """
+
+    def __init__(self, bank, path=None, capacity=DEFAULT_CAPACITY,
+                 fade=0.0):
+        if fade < 0:
+            raise ValueError('Scene fade time must not be negative')
+        self.bank = bank
+        self.path = path
+        self.fade = fade
+        # The scene recalled last, if any
+        self.recalled = None
+        self._map = None
+        if path is None:
+            layout = self._layout()
+            self._buffer = self._create_buffer(layout, capacity)
+        else:
+            path = os.path.expanduser(path)
+            if os.path.exists(path):
+                self._buffer = self._open(path)
+            else:
+                self._buffer = self._create_file(path, self._layout(),
+                                                 capacity)
+        _, _, n_lights, self.capacity = _HEADER.unpack_from(self._buffer)
+        layout = [_LIGHT.unpack_from(self._buffer,
+                                     _HEADER.size + i * _LIGHT.size)
+                  for i in range(n_lights)]
+        # A flag word followed by three values per light
+        self._record = 1 + 3 * n_lights
+        offset = _HEADER.size + n_lights * _LIGHT.size
+        self._data = memoryview(self._buffer)[offset:].cast('H')
+        self._lights = self._match(layout)
+        # Per channel start values and distances of a crossfade, and its
+        # start time and duration while running
+        self._start = array('d', bytes(8 * 3 * len(self._lights)))
+        self._delta = array('d', self._start)
+        self._fading = None
+
+    def __len__(self):
+        """Number of saved scenes"""
+        data, record = self._data, self._record
+        return sum(1 for scene in range(self.capacity)
+                   if data[scene * record])
+
+    def __contains__(self, scene):
+        return 0 <= scene < self.capacity and \
+            bool(self._data[scene * self._record])
+
+    @property
+    def record_size(self):
+        """Bytes stored per scene"""
+        return self._record * _WORD
+
+    @property
+    def fading(self):
+        return self._fading is not None
+
+    def save(self, scene):
+        """Saves the current color of every light as `scene`"""
+        base = self._base(scene)
+        data = self._data
+        for array_, offset, _, word, _ in self._lights:
+            i = base + word
+            data[i] = int(array_[offset] * MAX_VALUE + 0.5)
+            data[i + 1] = int(array_[offset + 1] * MAX_VALUE + 0.5)
+            data[i + 2] = int(array_[offset + 2] * MAX_VALUE + 0.5)
+        data[base] = 1
+
+    def delete(self, scene):
+        self._data[self._base(scene)] = 0
+
+    def recall(self, scene, fade=None):
+        """Recalls `scene`, crossfading to it over `fade` seconds (by
+        default the store's fade time). Returns False if the scene was
+        never saved.
+        """
+        base = self._base(scene)
+        data = self._data
+        if not data[base]:
+            return False
+        if fade is None:
+            fade = self.fade
+        self.recalled = scene
+        self._fading = None
+        versions = self.bank.versions
+        if fade <= 0:
+            scale = 1.0 / MAX_VALUE
+            for array_, offset, slot, word, _ in self._lights:
+                i = base + word
+                c0 = data[i] * scale
+                c1 = data[i + 1] * scale
+                c2 = data[i + 2] * scale
+                if array_[offset] != c0 or array_[offset + 1] != c1 or \
+                        array_[offset + 2] != c2:
+                    array_[offset] = c0
+                    array_[offset + 1] = c1
+                    array_[offset + 2] = c2
+                    versions[slot] += 1
+            return True
+
+        start, delta = self._start, self._delta
+        for n, (array_, offset, _, word, hsv) in enumerate(self._lights):
+            i = base + word
+            for channel in range(3):
+                value = array_[offset + channel]
+                distance = data[i + channel] / MAX_VALUE - value
+                if hsv and channel == 0:
+                    # The short way around, e.g. from 0.9 to 0.1 via 1.0
+                    distance = (distance + 0.5) % 1.0 - 0.5
+                start[3 * n + channel] = value
+                delta[3 * n + channel] = distance
+        # Started on the next update, like effects
+        self._fading = [None, fade]
+        return True
+
+    def update(self, now=None):
+        """Moves a running crossfade on to time `now`. Returns the number
+        of lights updated.
+        """
+        fading = self._fading
+        if fading is None:
+            return 0
+        if now is None:
+            now = time.perf_counter()
+        if fading[0] is None:
+            fading[0] = now
+        progress = (now - fading[0]) / fading[1]
+        if progress >= 1.0:
+            progress = 1.0
+            self._fading = None
+        start, delta = self._start, self._delta
+        versions = self.bank.versions
+        i = 0
+        for array_, offset, slot, _, hsv in self._lights:
+            c0 = start[i] + delta[i] * progress
+            if hsv:
+                c0 %= 1.0
+            c1 = start[i + 1] + delta[i + 1] * progress
+            c2 = start[i + 2] + delta[i + 2] * progress
+            i += 3
+            if array_[offset] != c0 or array_[offset + 1] != c1 or \
+                    array_[offset + 2] != c2:
+                array_[offset] = c0
+                array_[offset + 1] = c1
+                array_[offset + 2] = c2
+                versions[slot] += 1
+        return len(self._lights)
+
+    def stop_fade(self):
+        self._fading = None
+
+    def close(self):
+        self._data.release()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Private
+
+    def _layout(self):
+        return [(light.light_id, _COLORSPACES.index(light.colorspace))
+                for light in self.bank]
+
+    def _create_buffer(self, layout, capacity):
+        buffer = bytearray(_size(len(layout), capacity))
+        _HEADER.pack_into(buffer, 0, MAGIC, VERSION, len(layout), capacity)
+        for i, (light_id, colorspace) in enumerate(layout):
+            _LIGHT.pack_into(buffer, _HEADER.size + i * _LIGHT.size,
+                             light_id, colorspace)
+        return buffer
+
+    def _create_file(self, path, layout, capacity):
+        with open(path, 'wb') as file:
+            file.write(self._create_buffer(layout, capacity))
+        return self._open(path)
+
+    def _open(self, path):
+        with open(path, 'r+b') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0)
+            except (ValueError, OSError):
+                raise SceneError(f'{path} is empty or not a file')
+        try:
+            magic, version, n_lights, capacity = \
+                _HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self._map.close()
+            raise SceneError(f'{path} is not a midi-hue scene file')
+        if version != VERSION or len(self._map) != _size(n_lights, capacity):
+            self._map.close()
+            raise SceneError(f'Unsupported or damaged scene file {path}')
+        return self._map
+
+    def _match(self, layout):
+        by_id = {}
+        for index, (light_id, colorspace) in enumerate(layout):
+            by_id[light_id] = (index, _COLORSPACES[colorspace])
+        lights = []
+        for light in self.bank:
+            stored = by_id.get(light.light_id)
+            if stored is None or stored[1] != light.colorspace:
+                print(f'[Scenes] Light {light.light_id} is not in the '
+                      f'scene file, or in another color space; it is left '
+                      f'out of scenes')
+                continue
+            hsv = light.colorspace == 'hsv'
+            lights.append((self.bank.hsv if hsv else self.bank.rgb,
+                           light.slot * 3, light.slot, 1 + 3 * stored[0],
+                           hsv))
+        return lights
+
+    def _base(self, scene):
+        if not 0 <= scene < self.capacity:
+            raise SceneError(f'Invalid scene {scene}, must be '
+                             f'0-{self.capacity - 1}')
+        return scene * self._record
+
+
+def _size(n_lights, capacity):
+    return _HEADER.size + n_lights * _LIGHT.size + \
+        capacity * (1 + 3 * n_lights) * _WORD
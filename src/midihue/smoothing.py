@@ -0,0 +1,209 @@
+"""Smoothing of light parameters between MIDI messages.
+
+A 7 bit CC moves a parameter in steps of 1/127, and sparse messages make
+it jump. A smoothed parameter instead has a target, set by mappings, and
+is moved towards it once per frame at the full resolution of the light:
+
+- 'linear' reaches each new target `duration` seconds after it is set
+- 'exponential' closes 63% of the remaining distance every `duration`
+  seconds
+- 'critical' follows a critically damped spring, which eases in and out
+  without overshooting and covers 90% of a step in `duration` seconds
+
+The state of every smoothed parameter is held in parallel arrays, and only
+the parameters still moving are visited each frame. When something else
+changes a light, e.g. a scene recall, the light's version no longer matches
+the one after the last write, and its parameters carry on from their new
+values.
+"""
+import math
+import time
+from array import array
+from functools import partial
+from .effects import _target
+
+MODES = ('linear', 'exponential', 'critical')
+DEFAULT_MODE = 'exponential'
+DEFAULT_DURATION = 0.08
+# Distance from the target below which a parameter snaps to it, well under
+# one step of 16 bit output
+SETTLED = 1e-6
+
+_LINEAR, _EXPONENTIAL, _CRITICAL = range(len(MODES))
+
+
+class Smoother:
+    """Smoothed parameters of lights, updated together once per frame"""
+
+    def __init__(self):
+        self.value = array('d')
+        self.target = array('d')
+        self.velocity = array('d')
+        self._duration = array('d')
+        self._mode = array('B')
+        self._writes = []
+        self._params = []
+        self._channels = {}
+        # Per light: the light, its channels and its version after the
+        # last write
+        self._light_index = array('L')
+        self._lights = []
+        self._members = []
+        self._seen = array('Q')
+        self._light_indexes = {}
+        self._active = set()
+        self._last = None
+
+    def __len__(self):
+        return len(self._writes)
+
+    @property
+    def active(self):
+        """Number of parameters still moving towards their target"""
+        return len(self._active)
+
+    def add(self, light, param, mode=DEFAULT_MODE,
+            duration=DEFAULT_DURATION):
+        """Smooths parameter `param` of `light` and returns its channel.
+        Adding the same parameter again updates its mode and duration.
+        """
+        if mode not in MODES:
+            raise ValueError(f'Invalid smoothing mode {mode!r}, must be '
+                             f'one of {", ".join(MODES)}')
+        if duration < 0:
+            raise ValueError('Smoothing duration must not be negative')
+        key = (id(light), param)
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = len(self._writes)
+            self._channels[key] = channel
+            self._writes.append(_target(light, param))
+            self._params.append(param)
+            index = self._light_indexes.get(id(light))
+            if index is None:
+                index = self._light_indexes[id(light)] = len(self._lights)
+                self._lights.append(light)
+                self._members.append([])
+                self._seen.append(light.version)
+            self._light_index.append(index)
+            self._members[index].append(channel)
+            value = getattr(light, param)
+            self.value.append(value)
+            self.target.append(value)
+            self.velocity.append(0.0)
+            self._duration.append(duration)
+            self._mode.append(MODES.index(mode))
+        else:
+            self._duration[channel] = duration
+            self._mode[channel] = MODES.index(mode)
+        return channel
+
+    def setter(self, channel):
+        """A function setting the target of a channel"""
+        return partial(self.set, channel)
+
+    def set(self, channel, value):
+        if value < 0.0:
+            value = 0.0
+        elif value > 1.0:
+            value = 1.0
+        self.target[channel] = value
+        index = self._light_index[channel]
+        if self._lights[index].version != self._seen[index]:
+            self._sync(index)
+        duration = self._duration[channel]
+        if self._mode[channel] == _LINEAR and duration > 0:
+            self.velocity[channel] = \
+                (value - self.value[channel]) / duration
+        self._active.add(channel)
+
+    def update(self, now=None):
+        """Moves every active parameter towards its target by the time
+        elapsed since the last update, and writes it into its light.
+        Returns the number of parameters updated.
+        """
+        if now is None:
+            now = time.perf_counter()
+        last, self._last = self._last, now
+        if not self._active:
+            return 0
+        dt = 0.0 if last is None else max(0.0, now - last)
+        values, targets, velocities = self.value, self.target, self.velocity
+        durations, modes = self._duration, self._mode
+        writes = self._writes
+        lights, light_index, seen = self._lights, self._light_index, \
+            self._seen
+        settled = []
+        for channel in self._active:
+            index = light_index[channel]
+            if lights[index].version != seen[index]:
+                self._sync(index)
+            value, target = values[channel], targets[channel]
+            duration = durations[channel]
+            mode = modes[channel]
+            if duration <= 0.0:
+                value = target
+            elif mode == _LINEAR:
+                # At the velocity set with the target, stopping on it
+                value += velocities[channel] * dt
+                if (velocities[channel] > 0) == (value > target):
+                    value = target
+            elif mode == _EXPONENTIAL:
+                value += (target - value) * (1.0 - math.exp(-dt / duration))
+            else:
+                value, velocities[channel] = _spring(
+                    value, target, velocities[channel], duration, dt
+                )
+            if abs(target - value) < SETTLED and \
+                    (mode != _CRITICAL or
+                     abs(velocities[channel]) < SETTLED):
+                value = target
+                velocities[channel] = 0.0
+                settled.append(channel)
+            values[channel] = value
+            write = writes[channel]
+            if type(write) is tuple:
+                array_, offset, versions, slot = write
+                if array_[offset] != value:
+                    array_[offset] = value
+                    versions[slot] += 1
+                    seen[index] = versions[slot]
+            else:
+                write(value)
+                seen[index] = lights[index].version
+        count = len(self._active)
+        self._active.difference_update(settled)
+        return count
+
+    # Private
+
+    def _sync(self, index):
+        # The light changed since it was last written: its parameters
+        # carry on from their current values
+        light = self._lights[index]
+        for channel in self._members[index]:
+            value = getattr(light, self._params[channel])
+            if abs(value - self.value[channel]) <= SETTLED:
+                continue
+            self.value[channel] = value
+            mode = self._mode[channel]
+            if mode == _LINEAR and self._duration[channel] > 0:
+                self.velocity[channel] = \
+                    (self.target[channel] - value) / self._duration[channel]
+            elif mode == _CRITICAL:
+                self.velocity[channel] = 0.0
+        self._seen[index] = light.version
+
+
+def _spring(value, target, velocity, duration, dt):
+    # Critically damped spring, integrated with a stable approximation of
+    # its exact solution. (1 + wt)e^-wt, the remainder of a step, is under
+    # 10% at wt = 4.
+    omega = 4.0 / duration
+    x = omega * dt
+    decay = 1.0 / (1.0 + x + 0.48 * x * x + 0.235 * x * x * x)
+    change = value - target
+    temp = (velocity + omega * change) * dt
+    velocity = (velocity - omega * temp) * decay
+    value = target + (change + temp) * decay
+    return value, velocity
@@ -0,0 +1,294 @@
+"""Spatial effects: light parameters driven by where the lights are.
+
+A Layout holds the 3D position of each light, in the coordinates of an
+entertainment group's `locations` (see HueClient.get_light_locations):
+-1 to 1, x from left to right, y from back to front and z from floor to
+ceiling.
+
+A spatial effect reduces each light's position to a coordinate from 0 to
+1, either along a direction (Gradient, Wipe) or as the distance from a
+center (Pulse), and each frame evaluates its profile at `resolution` + 1
+evenly spaced points of that coordinate. A light's value is interpolated
+between the two points either side of it, with weights computed when the
+effect is placed, so a frame costs one product of the weight matrix with
+the profile however many lights there are. Effects are placed again
+whenever their layout changes.
+"""
+import math
+from .effects import Effect
+from .light import _import_numpy
+
+DEFAULT_RESOLUTION = 64
+ORIGIN = (0.0, 0.0, 0.0)
+# Below this many lights the weights are applied without NumPy, whose
+# per-call overhead would outweigh the product
+_NUMPY_MIN_LIGHTS = 32
+
+
+class Layout:
+    """Positions of lights by light ID. Lights without one are at the
+    origin. `version` changes whenever a position does.
+    """
+
+    def __init__(self, positions=None):
+        self.version = 0
+        self._positions = {}
+        if positions:
+            self.update(positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, light_id):
+        return light_id in self._positions
+
+    def __getitem__(self, light_id):
+        return self._positions[light_id]
+
+    def get(self, light_id, default=ORIGIN):
+        return self._positions.get(light_id, default)
+
+    def set(self, light_id, position):
+        """Sets the position (x, y[, z]) of a light"""
+        position = tuple(float(c) for c in position)
+        if len(position) == 2:
+            position += (0.0,)
+        if len(position) != 3:
+            raise ValueError(f'Invalid position {position}, expected x, y '
+                             f'and optionally z')
+        if self._positions.get(light_id) != position:
+            self._positions[light_id] = position
+            self.version += 1
+
+    def update(self, positions, replace=True):
+        """Sets the positions in a dict of light ID to position. With
+        `replace` False, lights that already have one keep it.
+        """
+        for light_id, position in positions.items():
+            if replace or light_id not in self._positions:
+                self.set(light_id, position)
+
+
+class SpatialEffect(Effect):
+    """Base class of effects evaluated over the positions of `lights` in
+    `layout`.
+
+    Subclasses implement `coordinates(positions)`, returning a coordinate
+    from 0 to 1 per position, and `profile(points, t)`, returning the
+    value at each coordinate in `points` for `t` seconds after the effect
+    started.
+    """
+
+    def __init__(self, lights, layout, param='v',
+                 resolution=DEFAULT_RESOLUTION):
+        super().__init__(lights, param)
+        if resolution < 1:
+            raise ValueError('Resolution must be at least 1')
+        self.layout = layout
+        self.resolution = resolution
+        self.points = [i / resolution for i in range(resolution + 1)]
+        self._version = None
+        self._index = []
+        self._fraction = []
+        self._weights = None
+
+    def values(self, t):
+        if self._version != self.layout.version:
+            self.place()
+        profile = self.profile(self.points, t)
+        weights = self._weights
+        if weights is not None:
+            return weights.dot(profile).tolist()
+        return [profile[i] + f * (profile[i + 1] - profile[i])
+                for i, f in zip(self._index, self._fraction)]
+
+    def place(self):
+        """Computes the interpolation weights of each light from its
+        position
+        """
+        self._version = self.layout.version
+        layout = self.layout
+        coordinates = self.coordinates([layout.get(light.light_id)
+                                        for light in self.lights])
+        n = self.resolution
+        index, fraction = [], []
+        for x in coordinates:
+            x = min(max(x, 0.0), 1.0) * n
+            i = min(int(x), n - 1)
+            index.append(i)
+            fraction.append(x - i)
+        self._index = index
+        self._fraction = fraction
+        self._weights = None
+        if len(index) >= _NUMPY_MIN_LIGHTS:
+            np = _import_numpy()
+            if np is not None:
+                rows = np.arange(len(index))
+                columns = np.array(index)
+                fraction = np.array(fraction)
+                weights = np.zeros((len(index), n + 1))
+                weights[rows, columns] = 1.0 - fraction
+                weights[rows, columns + 1] = fraction
+                self._weights = weights
+
+    def coordinates(self, positions):
+        raise NotImplementedError
+
+    def profile(self, points, t):
+        raise NotImplementedError
+
+
+class Gradient(SpatialEffect):
+    """A linear ramp from `start` to `end` along `direction`, from the
+    first light in that direction to the last
+    """
+
+    PARAMETERS = ('start', 'end')
+
+    def __init__(self, lights, layout, param='v', direction=(1.0, 0.0, 0.0),
+                 start=0.0, end=1.0, resolution=DEFAULT_RESOLUTION):
+        super().__init__(lights, layout, param, resolution)
+        self.direction = _unit(direction)
+        self.start = start
+        self.end = end
+
+    def coordinates(self, positions):
+        return _project(positions, self.direction)
+
+    def profile(self, points, t):
+        start, span = self.start, self.end - self.start
+        return [start + span * x for x in points]
+
+
+class Wipe(SpatialEffect):
+    """An edge crossing the lights along `direction` over `duration`
+    seconds, taking each light from `start` to `end`, after which the
+    effect is done. `softness` is the width of the edge (as a fraction of
+    the distance crossed). Setting `trigger` above 0 restarts it.
+    """
+
+    PARAMETERS = ('start', 'end', 'duration', 'softness', 'trigger')
+
+    def __init__(self, lights, layout, param='v', direction=(1.0, 0.0, 0.0),
+                 start=0.0, end=1.0, duration=1.0, softness=0.1,
+                 resolution=DEFAULT_RESOLUTION):
+        super().__init__(lights, layout, param, resolution)
+        self.direction = _unit(direction)
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.softness = softness
+
+    @property
+    def trigger(self):
+        return 0.0
+
+    @trigger.setter
+    def trigger(self, value):
+        if value > 0:
+            self.restart()
+
+    def coordinates(self, positions):
+        return _project(positions, self.direction)
+
+    def profile(self, points, t):
+        start, span = self.start, self.end - self.start
+        if self.duration <= 0 or t >= self.duration:
+            self.done = True
+            return [self.end] * len(points)
+        soft = max(self.softness, 1e-6)
+        # From fully before the first light to fully past the last
+        edge = -soft / 2 + (1.0 + soft) * t / self.duration
+        values = []
+        for x in points:
+            mix = (edge - x) / soft + 0.5
+            if mix <= 0.0:
+                values.append(start)
+            elif mix >= 1.0:
+                values.append(start + span)
+            else:
+                values.append(start + span * mix)
+        return values
+
+
+class Pulse(SpatialEffect):
+    """Rings expanding from `center` to the farthest light `rate` times a
+    second, `width` wide (as a fraction of that distance). Lights swing
+    from below `level` by `depth` up to it as a ring passes. Setting
+    `trigger` above 0 restarts it.
+    """
+
+    PARAMETERS = ('rate', 'depth', 'phase', 'level', 'width', 'trigger')
+
+    def __init__(self, lights, layout, param='v', center=ORIGIN, rate=1.0,
+                 width=0.2, depth=1.0, phase=0.0, level=1.0,
+                 resolution=DEFAULT_RESOLUTION):
+        super().__init__(lights, layout, param, resolution)
+        self.center = tuple(float(c) for c in center)
+        if len(self.center) != 3:
+            raise ValueError(f'Invalid center {center}')
+        self.rate = rate
+        self.width = width
+        self.depth = depth
+        self.phase = phase
+        self.level = level
+
+    @property
+    def trigger(self):
+        return 0.0
+
+    @trigger.setter
+    def trigger(self, value):
+        if value > 0:
+            self.restart()
+
+    def coordinates(self, positions):
+        cx, cy, cz = self.center
+        distances = [math.sqrt((x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2)
+                     for x, y, z in positions]
+        farthest = max(distances, default=0.0)
+        if farthest == 0.0:
+            return [0.0] * len(distances)
+        return [d / farthest for d in distances]
+
+    def profile(self, points, t):
+        half = max(self.width, 1e-6) / 2
+        # From before the center until past the farthest light
+        radius = ((self.rate * t + self.phase) % 1.0) * (1.0 + 2 * half) - \
+            half
+        low = self.level * (1.0 - self.depth)
+        swing = self.level * self.depth
+        values = []
+        for x in points:
+            ring = 1.0 - abs(x - radius) / half
+            values.append(low + swing * ring if ring > 0.0 else low)
+        return values
+
+
+SPATIAL_EFFECTS = {'gradient': Gradient, 'wipe': Wipe, 'pulse': Pulse}
+
+
+# Private
+
+def _unit(direction):
+    direction = tuple(float(c) for c in direction)
+    if len(direction) == 2:
+        direction += (0.0,)
+    length = math.sqrt(sum(c * c for c in direction))
+    if len(direction) != 3 or length == 0.0:
+        raise ValueError(f'Invalid direction {direction}')
+    return tuple(c / length for c in direction)
+
+
+def _project(positions, direction):
+    """Positions along `direction`, scaled from 0 at the first to 1 at the
+    last
+    """
+    dx, dy, dz = direction
+    along = [x * dx + y * dy + z * dz for x, y, z in positions]
+    if not along:
+        return []
+    low, high = min(along), max(along)
+    if high == low:
+        return [0.5] * len(along)
+    return [(a - low) / (high - low) for a in along]
@@ -0,0 +1,70 @@
+"""Stubs and utilities shared by the tests"""
+import time
+from mido import Message
+
+
+class FakeSocket:
+    """Stands in for a DTLS stream socket, keeping what is sent in `sent`,
+    with the time it was sent if `timestamps` is set. Sends raise `error`
+    if it is set and otherwise take `delay` seconds. The handshake and
+    receives raise `handshake_error` and `recv_error` if they are set.
+    """
+
+    def __init__(self, error=None, timestamps=False, delay=0.0,
+                 handshake_error=None, recv_error=None):
+        self.sent = []
+        self.error = error
+        self.timestamps = timestamps
+        self.delay = delay
+        self.handshake_error = handshake_error
+        self.recv_error = recv_error
+        self.timeout = None
+        self.address = None
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def connect(self, address):
+        self.address = address
+
+    def do_handshake(self):
+        self.handshake_timeout = self.timeout
+        if self.handshake_error is not None:
+            raise self.handshake_error
+
+    def send(self, data):
+        if self.error is not None:
+            raise self.error
+        if self.delay:
+            time.sleep(self.delay)
+        if self.timestamps:
+            self.sent.append((time.perf_counter(), bytes(data)))
+        else:
+            self.sent.append(bytes(data))
+
+    def recv(self, bufsize, flags=0):
+        if self.recv_error is not None:
+            raise self.recv_error
+        # Nothing from the bridge
+        raise BlockingIOError
+
+    def close(self):
+        self.closed = True
+
+
+def cc(control, value, channel=0):
+    return Message('control_change', channel=channel, control=control,
+                   value=value)
+
+
+def wait_for(predicate, timeout=2.0):
+    """Polls `predicate` until it is true or `timeout` seconds pass, and
+    returns whether it became true
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import pytest
+from mbedtls import tls
+from midihue import Light
+from midihue.aio import AsyncHueClient, AsyncHueStream, receive_midi
+from midihue.hue import HueClient, HueStreamError
+from helpers import FakeSocket
+
+USERNAME = 'asdoiga-weg-se9gseglksjg'
+CLIENTKEY = 'a3289feb34248c'
+BRIDGE_IP = '127.0.0.1'
+BASE_URI = f'http://{BRIDGE_IP}/api/{USERNAME}'
+
+
+class DTLSServer:
+    """Accepts one DTLS-PSK client and records the datagrams it sends"""
+
+    def __init__(self):
+        conf = tls.DTLSConfiguration(
+            pre_shared_key_store={USERNAME: bytes.fromhex(CLIENTKEY)},
+            validate_certificates=False
+        )
+        self._sock = tls.ServerContext(conf).wrap_socket(
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        )
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((BRIDGE_IP, 0))
+        self.port = self._sock.getsockname()[1]
+        self.received = []
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._sock.close()
+
+    def _serve(self):
+        conn, address = self._sock.accept()
+        conn.setcookieparam(address[0].encode())
+        try:
+            conn.do_handshake()
+        except tls.HelloVerifyRequest:
+            conn, address = conn.accept()
+            conn.setcookieparam(address[0].encode())
+            conn.do_handshake()
+        while True:
+            try:
+                self.received.append(conn.recv(4096))
+            except OSError:
+                return
+
+
+@pytest.fixture
+def hue_client(tmp_path, requests_mock):
+    creds_path = tmp_path / 'creds'
+    creds_path.write_text(json.dumps({'username': USERNAME,
+                                      'clientkey': CLIENTKEY}))
+    requests_mock.put(f'{BASE_URI}/groups/7', json=[{'success': {}}])
+    requests_mock.get(f'http://{BRIDGE_IP}/api/config',
+                      json={'apiversion': '1.16.0'})
+    return HueClient(credentials_path=str(creds_path), bridge_ip=BRIDGE_IP)
+
+
+@pytest.fixture
+def client(hue_client):
+    return AsyncHueClient(hue_client)
+
+
+class TestAsyncHueClient:
+
+    def test_create(self, hue_client):
+        async def create():
+            return await AsyncHueClient.create(
+                credentials_path=hue_client._credentials_path,
+                bridge_ip=BRIDGE_IP
+            )
+        client = asyncio.run(create())
+        assert client.username == USERNAME
+        assert client.clientkey == CLIENTKEY
+
+    def test_get_bridge_ip(self, client):
+        assert asyncio.run(client.get_bridge_ip()) == BRIDGE_IP
+
+    def test_get_entertainment_groups(self, client, requests_mock):
+        requests_mock.get(f'{BASE_URI}/groups', json={
+            '1': {'type': 'Room', 'name': 'Kitchen', 'lights': ['1']},
+            '7': {'type': 'Entertainment', 'name': 'Desk',
+                  'lights': ['3', '4']},
+        })
+        groups = asyncio.run(client.get_entertainment_groups())
+        assert groups == [('7', 'Desk (2 lights)')]
+
+    def test_set_stream_mode(self, client, requests_mock):
+        asyncio.run(client.set_stream_mode(7, True))
+        assert requests_mock.last_request.json() == \
+            {'stream': {'active': True}}
+
+
+class TestAsyncHueStream:
+
+    @pytest.fixture
+    def server(self):
+        server = DTLSServer()
+        yield server
+        server.close()
+
+    @pytest.fixture
+    def lights(self):
+        return [Light(3), Light(4)]
+
+    def test_start_handshakes_and_sends(self, client, server, lights,
+                                        requests_mock):
+        stream = AsyncHueStream(7, client, port=server.port)
+
+        async def run():
+            await stream.start()
+            lights[0].rgb = (1.0, 0.0, 0.0)
+            stream.update(lights)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        assert requests_mock.last_request.json() == \
+            {'stream': {'active': True}}
+        assert len(server.received) == 1
+        assert server.received[0].startswith(b'HueStream')
+        assert server.received[0][16:25] == \
+            b'\x00\x00\x03\xff\xff\x00\x00\x00\x00'
+
+    def test_handshake_timeout(self, client):
+        # Nothing listens on this port, so no handshake reply arrives
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind((BRIDGE_IP, 0))
+            port = sock.getsockname()[1]
+            stream = AsyncHueStream(7, client, port=port,
+                                    handshake_timeout=0.05,
+                                    handshake_tries=2)
+            start = time.perf_counter()
+            with pytest.raises(HueStreamError):
+                asyncio.run(stream.start())
+            assert time.perf_counter() - start < 1.0
+
+    def test_stalled_rest_call_does_not_block_frames(self, client, lights,
+                                                     requests_mock):
+        def slow_groups(request, context):
+            time.sleep(0.3)
+            return {}
+        requests_mock.get(f'{BASE_URI}/groups', json=slow_groups)
+
+        stream = AsyncHueStream(7, client, keepalive_interval=0.0)
+        stream._socket = FakeSocket()
+
+        async def run():
+            frames = asyncio.ensure_future(stream.run(lights, rate=50))
+            await client.get_entertainment_groups()
+            frames.cancel()
+
+        asyncio.run(run())
+        # ~15 frames are due at 50 Hz while the REST call stalls
+        assert len(stream._socket.sent) >= 10
+
+    def test_reconnects_on_send_error(self, client, lights, mocker):
+        stream = AsyncHueStream(7, client)
+        stream._socket = FakeSocket(error=ConnectionRefusedError())
+
+        async def connect():
+            stream._socket = FakeSocket()
+        mocker.patch.object(stream, '_connect_async', side_effect=connect)
+
+        async def run():
+            stream.update(lights)
+            assert stream.reconnecting
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        assert not stream.reconnecting
+        assert stream.reconnects == 1
+        assert len(stream._socket.sent) == 1
+
+    def test_send_drops_blocked_frames(self, client, lights):
+        class BlockedSocket:
+            def send(self, data):
+                raise BlockingIOError
+
+        stream = AsyncHueStream(7, client)
+        stream._socket = BlockedSocket()
+        stream.update(lights)
+        assert stream.frames_dropped == 1
+
+
+def test_receive_midi():
+    received = []
+    asyncio.run(receive_midi(iter([1, 2, 3]), received.append))
+    assert received == [1, 2, 3]
@@ -0,0 +1,180 @@
+import time
+import wave
+import pytest
+from mido import Message
+from midihue.mapping import Mapping
+
+np = pytest.importorskip('numpy')
+from midihue.audio import (Analyzer, AudioInput, AudioError,  # noqa: E402
+                           CaptureSource, WavSource, MIN_FREQUENCY,
+                           MAX_FREQUENCY)
+
+RATE = 44100
+HITS = (0.25, 0.75, 1.25)
+
+
+def tone(frequency, duration, amplitude=0.5):
+    t = np.arange(int(duration * RATE)) / RATE
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def hits(times=HITS, duration=1.5, frequency=1000.0, decay=0.05):
+    """Decaying tone bursts, like drum hits"""
+    t = np.arange(int(duration * RATE)) / RATE
+    signal = np.zeros_like(t)
+    for start in times:
+        after = t >= start
+        signal[after] += 0.5 * np.exp(-(t[after] - start) / decay) * \
+            np.sin(2 * np.pi * frequency * t[after])
+    return signal
+
+
+def write_wav(path, signal, width=2, channels=1):
+    scale = 2 ** (8 * width - 1) - 1
+    samples = np.repeat(np.rint(signal * scale).astype('<i4'), channels)
+    if width == 1:
+        data = (samples + 128).astype(np.uint8).tobytes()
+    elif width == 3:
+        data = samples.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    else:
+        data = samples.astype(f'<i{width}').tobytes()
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(channels)
+        file.setsampwidth(width)
+        file.setframerate(RATE)
+        file.writeframes(data)
+    return str(path)
+
+
+class TestAnalyzer:
+
+    def test_tone_band(self):
+        analyzer = Analyzer(RATE)
+        analyzer.process(tone(1000.0, 0.5))
+        edges = np.geomspace(MIN_FREQUENCY, MAX_FREQUENCY, 9)
+        band = np.searchsorted(edges, 1000.0) - 1
+        assert analyzer.bands.argmax() == band
+        assert analyzer.bands[band] > 0.8
+
+    def test_level(self):
+        analyzer = Analyzer(RATE)
+        analyzer.process(np.zeros(4096))
+        assert analyzer.level == 0.0
+        analyzer.process(tone(440.0, 0.1, amplitude=1.0))
+        assert analyzer.level == pytest.approx(1.0, abs=0.01)
+        # Released over 0.15 s, not dropped
+        analyzer.process(np.zeros(512))
+        assert 0.5 < analyzer.level < 1.0
+        analyzer.process(np.zeros(RATE))
+        assert analyzer.level < 0.01
+
+    def test_onsets(self):
+        analyzer = Analyzer(RATE)
+        signal = hits()
+        onsets = []
+        for start in range(0, len(signal), analyzer.hop):
+            analyzer.process(signal[start:start + analyzer.hop])
+            if analyzer.onset:
+                onsets.append((start + analyzer.hop) / RATE)
+        assert onsets == pytest.approx(HITS, abs=analyzer.hop / RATE)
+
+    def test_any_block_size(self):
+        signal = hits(duration=0.5)
+        whole, chunked = Analyzer(RATE), Analyzer(RATE)
+        whole.process(signal)
+        for start in range(0, len(signal), 100):
+            chunked.process(signal[start:start + 100])
+        assert not chunked.process(np.zeros(10))
+        np.testing.assert_allclose(whole.bands, chunked.bands)
+
+    @pytest.mark.parametrize('options', [
+        {'hop': 2048}, {'bands': 0}, {'floor': 6.0}, {'bands': 600},
+    ])
+    def test_invalid(self, options):
+        with pytest.raises(ValueError):
+            Analyzer(RATE, **options)
+
+
+class TestWavSource:
+
+    @pytest.mark.parametrize('width', [1, 2, 3, 4])
+    def test_decode(self, tmp_path, width):
+        signal = tone(440.0, 0.05)
+        path = write_wav(tmp_path / 'tone.wav', signal, width=width,
+                         channels=2)
+        source = WavSource(path, block=256, realtime=False)
+        assert source.sample_rate == RATE
+        blocks = list(source)
+        assert {len(block) for block in blocks[:-1]} == {256}
+        np.testing.assert_allclose(np.concatenate(blocks), signal,
+                                   atol=2.0 / 2 ** (8 * width - 1))
+
+    def test_realtime(self, tmp_path):
+        path = write_wav(tmp_path / 'silence.wav', np.zeros(RATE // 10))
+        start = time.perf_counter()
+        list(WavSource(path))
+        assert time.perf_counter() - start >= 0.099
+
+    def test_invalid(self, tmp_path):
+        path = tmp_path / 'noise.wav'
+        path.write_bytes(b'not a wave file')
+        with pytest.raises(AudioError):
+            WavSource(str(path))
+
+
+class TestAudioInput:
+
+    CONFIG = {
+        'lights': [{'id': 1, 'hsv': [0.0, 1.0, 0.0]},
+                   {'id': 2, 'hsv': [0.0, 1.0, 0.0]}],
+        'mappings': [
+            # The level, after 8 bands from control 20
+            {'type': 'control_change', 'channel': 15, 'control': 28,
+             'light': 1, 'param': 'v'},
+            {'type': 'note_on', 'channel': 15, 'note': 36, 'light': 2,
+             'param': 'v'},
+        ],
+    }
+
+    def test_messages(self, tmp_path):
+        path = write_wav(tmp_path / 'hits.wav', hits())
+        audio = AudioInput(WavSource(path, realtime=False))
+        messages = list(audio)
+        notes = [msg for msg in messages if msg.type == 'note_on']
+        assert len(notes) == len(HITS)
+        assert all(msg.channel == 15 and msg.note == 36 for msg in notes)
+        controls = {msg.control for msg in messages
+                    if msg.type == 'control_change'}
+        assert controls == set(range(20, 29))
+
+    def test_sends_changes_only(self, tmp_path):
+        path = write_wav(tmp_path / 'silence.wav', np.zeros(RATE))
+        messages = list(AudioInput(WavSource(path, realtime=False)))
+        # Each CC once, with its initial value
+        assert messages == [Message('control_change', channel=15,
+                                    control=control, value=0)
+                            for control in range(20, 29)]
+
+    def test_mapped(self, tmp_path):
+        mapping = Mapping(self.CONFIG)
+        path = write_wav(tmp_path / 'tone.wav', tone(440.0, 0.2))
+        with AudioInput(WavSource(path, realtime=False)) as audio:
+            for msg in audio:
+                mapping.dispatch(msg)
+        assert mapping.light(1).v > 0.8
+        assert mapping.light(2).v > 0.0
+
+    def test_controls_out_of_range(self, tmp_path):
+        path = write_wav(tmp_path / 'silence.wav', np.zeros(256))
+        with pytest.raises(ValueError):
+            AudioInput(WavSource(path), control=120)
+
+
+def test_capture_requires_sounddevice():
+    try:
+        import sounddevice  # noqa: F401
+    except ImportError:
+        with pytest.raises(AudioError):
+            CaptureSource()
+    else:
+        pytest.skip('sounddevice is installed')
@@ -0,0 +1,220 @@
+import json
+import pytest
+import click
+from click.testing import CliRunner
+from mido import Message
+from midihue.cli import main, find_input
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueStream, STREAM_PORT
+from midihue.recording import Recorder, Recording
+
+INPUTS = ['IAC Driver Bus 1', 'Launch Control XL:Launch Control XL 20:0',
+          'Launch Control XL:Launch Control XL 20:1']
+
+
+class TestFindInput:
+
+    def test_exact(self):
+        assert find_input('IAC Driver Bus 1', INPUTS) == INPUTS[0]
+
+    def test_substring(self):
+        assert find_input('iac driver', INPUTS) == INPUTS[0]
+        assert find_input('XL 20:1', INPUTS) == INPUTS[2]
+
+    def test_regex(self):
+        assert find_input(r'^launch.*:0$', INPUTS) == INPUTS[1]
+
+    def test_invalid_regex_as_substring(self):
+        assert find_input('Bus 1(', INPUTS + ['Bus 1(x)']) == 'Bus 1(x)'
+
+    @pytest.mark.parametrize('pattern', ['Launch Control', 'Keystation'])
+    def test_not_unique(self, pattern):
+        with pytest.raises(click.UsageError):
+            find_input(pattern, INPUTS)
+
+
+class TestHeadless:
+
+    @pytest.fixture
+    def bridge(self):
+        with FakeBridge(stream_port=STREAM_PORT) as bridge:
+            yield bridge
+
+    @pytest.fixture
+    def env(self, bridge, tmp_path):
+        credentials = tmp_path / 'credentials'
+        credentials.write_text(json.dumps({'username': bridge.username,
+                                           'clientkey': bridge.clientkey}))
+        session = str(tmp_path / 'session.mhr')
+        with Recorder(session) as recorder:
+            recorder.record(Message('control_change', control=79, value=0),
+                            now=0.0)
+        return {
+            'MIDIHUE_BRIDGE_IP': f'{bridge.host}:{bridge.http_port}',
+            'MIDIHUE_CREDENTIALS_PATH': str(credentials),
+            'MIDIHUE_REPLAY': session,
+        }
+
+    def test_env(self, bridge, env, tmp_path):
+        frames = str(tmp_path / 'frames.mhr')
+        result = CliRunner().invoke(main, ['--record-frames', frames],
+                                    env=env)
+        assert result.exit_code == 0, result.output
+        assert bridge.frames
+        assert not bridge.stream_active(bridge.group_id)
+        with Recording(frames) as recording:
+            states = list(recording.states())
+        assert states[-1][3] == (0, 0, 0)
+        assert HueStream.Message.decode(bridge.frames[-1][1]) == states[-1]
+
+    def test_send_rate(self, bridge, env):
+        result = CliRunner().invoke(main, ['--send-rate', '10',
+                                           '--adaptive-rate'], env=env)
+        assert result.exit_code == 0, result.output
+        assert bridge.frames
+        assert '[HueStream] Sent' in result.output
+        result = CliRunner().invoke(main, ['--adaptive-rate'], env=env)
+        assert result.exit_code == 2
+
+    def test_stream_version(self, bridge, env):
+        result = CliRunner().invoke(main, ['--stream-version', '1'],
+                                    env=env)
+        assert result.exit_code == 0, result.output
+        # The bridge only takes v1 streams
+        result = CliRunner().invoke(main, ['--stream-version', '2'],
+                                    env=env)
+        assert result.exit_code == 1
+        assert 'no stream API v2 configuration' in result.output
+
+    def test_config(self, bridge, env, tmp_path):
+        config = tmp_path / 'config.toml'
+        config.write_text(f'group-id = {bridge.group_id}\n'
+                          'record_frames = "frames.mhr"\n'
+                          'immediate = true\n')
+        result = CliRunner().invoke(main, ['--config', str(config)],
+                                    env=env)
+        assert result.exit_code == 0, result.output
+        # Relative to the config file
+        assert (tmp_path / 'frames.mhr').exists()
+
+    def test_command_line_overrides_config(self, bridge, env, tmp_path):
+        config = tmp_path / 'config.json'
+        config.write_text(json.dumps({'group_id': 99}))
+        result = CliRunner().invoke(
+            main, ['--config', str(config), '--group-id',
+                   str(bridge.group_id)], env=env
+        )
+        assert result.exit_code == 0, result.output
+
+    def test_unknown_config_option(self, tmp_path):
+        config = tmp_path / 'config.json'
+        config.write_text(json.dumps({'group': 1}))
+        result = CliRunner().invoke(main, ['--config', str(config)])
+        assert result.exit_code == 2
+        assert "Unknown option 'group'" in result.output
+
+    def test_audio_file(self, bridge, env, tmp_path):
+        np = pytest.importorskip('numpy')
+        import wave
+        path = str(tmp_path / 'tone.wav')
+        with wave.open(path, 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(8000)
+            t = np.arange(1600) / 8000
+            file.writeframes((np.sin(2 * np.pi * 440 * t) * 16000)
+                             .astype('<i2').tobytes())
+        mapping = tmp_path / 'mapping.json'
+        mapping.write_text(json.dumps({
+            'lights': [{'id': 3, 'hsv': [0.0, 1.0, 0.0]}],
+            'mappings': [{'type': 'control_change', 'channel': 15,
+                          'control': 24, 'light': 3, 'param': 'v'}],
+            'audio': {'bands': 4, 'max_frequency': 4000},
+        }))
+        del env['MIDIHUE_REPLAY']
+        session = str(tmp_path / 'session.mhr')
+        result = CliRunner().invoke(main, ['--audio', path, '--mapping',
+                                           str(mapping), '--record-midi',
+                                           session], env=env)
+        assert result.exit_code == 0, result.output
+        assert not bridge.stream_active(bridge.group_id)
+        # The level of the tone lit the light
+        assert HueStream.Message.decode(bridge.frames[-1][1])[3][0] > 0
+        # The analysis was recorded as MIDI
+        with Recording(session) as recording:
+            channels = {msg.channel for _, msg in recording.messages()}
+        assert channels == {15}
+
+    def test_spatial_effect_uses_group_locations(self, bridge, env,
+                                                 tmp_path):
+        mapping = tmp_path / 'mapping.json'
+        mapping.write_text(json.dumps({
+            'lights': [{'id': 3, 'hsv': [0.0, 1.0, 1.0]},
+                       {'id': 4, 'hsv': [0.0, 1.0, 1.0]}],
+            'effects': [{'id': 'ramp', 'type': 'gradient',
+                         'lights': [4, 3]}],
+        }))
+        result = CliRunner().invoke(main, ['--mapping', str(mapping)],
+                                    env=env)
+        assert result.exit_code == 0, result.output
+        # Light 3 is left of light 4
+        lights = HueStream.Message.decode(bridge.frames[-1][1])
+        assert lights[3] == (0, 0, 0)
+        assert lights[4] == (0xffff, 0, 0)
+
+    def test_spatial_effect_missing_group(self, bridge, env, tmp_path):
+        mapping = tmp_path / 'mapping.json'
+        mapping.write_text(json.dumps({
+            'effects': [{'id': 'ramp', 'type': 'gradient', 'lights': [3]}],
+        }))
+        result = CliRunner().invoke(main, ['--mapping', str(mapping),
+                                           '--group-id', '99'], env=env)
+        assert result.exit_code == 1
+        assert 'Group 99 not found' in result.output
+
+    def test_several_groups_need_group_id(self, env, tmp_path):
+        groups = {'1': {'name': 'A', 'type': 'Entertainment',
+                        'lights': ['3']},
+                  '2': {'name': 'B', 'type': 'Entertainment',
+                        'lights': ['4']}}
+        with FakeBridge(groups=groups) as bridge:
+            env['MIDIHUE_BRIDGE_IP'] = f'{bridge.host}:{bridge.http_port}'
+            result = CliRunner().invoke(main, [], env=env)
+        assert result.exit_code == 2
+        assert '--group-id is required' in result.output
+
+    def test_streams_file(self, env, tmp_path):
+        groups = {'1': {'name': 'A', 'type': 'Entertainment',
+                        'lights': ['3'], 'stream': {'active': False}},
+                  '2': {'name': 'B', 'type': 'Entertainment',
+                        'lights': ['4'], 'stream': {'active': False}}}
+        mapping = tmp_path / 'mapping.json'
+        mapping.write_text(json.dumps({
+            'lights': [{'id': 3, 'hsv': [0.0, 1.0, 1.0]},
+                       {'id': 4, 'hsv': [0.0, 1.0, 1.0]}],
+        }))
+        streams = tmp_path / 'streams.json'
+        streams.write_text(json.dumps({'streams': [{'group_id': 2}]}))
+        with FakeBridge(groups=groups,
+                        stream_port=STREAM_PORT) as bridge:
+            env['MIDIHUE_BRIDGE_IP'] = f'{bridge.host}:{bridge.http_port}'
+            result = CliRunner().invoke(
+                main, ['--group-id', '1', '--streams', str(streams),
+                       '--mapping', str(mapping)], env=env
+            )
+            assert result.exit_code == 0, result.output
+            assert not bridge.stream_active(1)
+            assert not bridge.stream_active(2)
+            frames = [HueStream.Message.decode(data)
+                      for _, data in bridge.frames]
+        # Each light went to the stream of its group
+        assert {3: (0xffff, 0, 0)} in frames
+        assert {4: (0xffff, 0, 0)} in frames
+
+    def test_streams_file_invalid(self, env, tmp_path):
+        streams = tmp_path / 'streams.json'
+        streams.write_text(json.dumps({'streams': [{'bridge_ip': 'x'}]}))
+        result = CliRunner().invoke(main, ['--streams', str(streams)],
+                                    env=env)
+        assert result.exit_code == 2
+        assert 'integer group_id' in result.output
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+import pytest
+from mido import Message
+from midihue import Light
+from midihue.clock import BeatScheduler, TempoTracker, PPQN
+from midihue.engine import Engine
+from midihue.hue import HueStream
+from helpers import FakeSocket
+
+CLOCK = Message('clock')
+START = Message('start')
+
+
+def pulse_times(bpm, beats, start=100.0, jitter=0.001, seed=1):
+    """Times of MIDI clock pulses at bpm, each delivered up to `jitter`
+    seconds late.
+    """
+    rng = random.Random(seed)
+    period = 60.0 / bpm / PPQN
+    return [start + i * period + rng.uniform(0, jitter)
+            for i in range(int(beats * PPQN))]
+
+
+def feed(tracker, times):
+    for now in times:
+        tracker.feed(CLOCK, now)
+
+
+class TestTempoTracker:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = TempoTracker()
+        tracker.feed(START, 99.0)
+        return tracker
+
+    @pytest.mark.parametrize('bpm', [72.0, 120.0, 174.0])
+    def test_tempo_estimate(self, tracker, bpm):
+        times = pulse_times(bpm, beats=8)
+        feed(tracker, times)
+        error = abs(tracker.bpm - bpm) / bpm
+        assert error < 0.005, f'tempo error {error:.3%} at {bpm} bpm'
+        assert tracker.locked(times[-1])
+
+    def test_beat_position(self, tracker):
+        times = pulse_times(120.0, beats=4, jitter=0.002)
+        feed(tracker, times)
+        # Beat 4 is due 2 s after the first pulse
+        offset = tracker.time_at(4 * PPQN) - 102.0
+        assert abs(offset) < 0.002, f'beat offset {offset * 1000:.2f} ms'
+        assert tracker.beats(101.0) == pytest.approx(2.0, abs=0.01)
+
+    def test_follows_tempo_change(self, tracker):
+        feed(tracker, pulse_times(120.0, beats=4))
+        feed(tracker, pulse_times(140.0, beats=2, start=102.0))
+        assert tracker.bpm == pytest.approx(140.0, rel=0.005)
+
+    def test_needs_pulses_to_lock(self, tracker):
+        times = pulse_times(120.0, beats=1)
+        feed(tracker, times[:3])
+        assert tracker.bpm is None
+        assert not tracker.locked(times[2])
+
+    def test_ignores_clock_until_started(self):
+        tracker = TempoTracker()
+        feed(tracker, pulse_times(120.0, beats=2))
+        assert tracker.bpm is None
+
+    def test_start_resets_position(self, tracker):
+        feed(tracker, pulse_times(120.0, beats=2))
+        tracker.feed(START, 110.0)
+        feed(tracker, pulse_times(120.0, beats=1, start=110.0))
+        assert tracker.pulses == PPQN
+        assert tracker.beats(110.0) == pytest.approx(0.0, abs=0.01)
+
+    def test_stop_and_clock_loss_unlock(self, tracker):
+        times = pulse_times(120.0, beats=2)
+        feed(tracker, times)
+        assert tracker.locked(times[-1] + 0.05)
+        assert not tracker.locked(times[-1] + 1.0)
+        tracker.feed(Message('stop'), times[-1])
+        assert not tracker.locked(times[-1])
+        tracker.feed(Message('continue'), times[-1] + 1.0)
+        assert tracker.running
+        assert tracker.bpm is None
+
+    def test_other_messages(self, tracker):
+        assert not tracker.feed(Message('note_on'), 100.0)
+
+
+class TestBeatScheduler:
+
+    @pytest.fixture
+    def scheduler(self):
+        scheduler = BeatScheduler(lookahead=0.03)
+        scheduler.tracker.feed(START, 99.0)
+        return scheduler
+
+    def test_free_running_until_locked(self, scheduler):
+        assert scheduler.next_frame(100.0, 0.02) == 100.02
+        assert scheduler.effect_time(100.0) is None
+
+    def test_frames_aligned_to_beat(self, scheduler):
+        bpm, period = 126.0, 0.02
+        times = pulse_times(bpm, beats=4)
+        feed(scheduler.tracker, times)
+        beat = 60.0 / bpm
+        # 23.8 frames per beat at 50 Hz rounds to 24
+        subdivision = beat / 24
+
+        # Frames due before the clock counts as lost
+        now = times[-1]
+        offsets = []
+        for _ in range(5):
+            now = scheduler.next_frame(now, period)
+            assert scheduler.locked(now)
+            arrival = now + scheduler.lookahead
+            steps = (arrival - 100.0) / subdivision
+            offsets.append(abs(steps - round(steps)) * subdivision)
+        worst = max(offsets)
+        assert worst < 0.001, f'beat-to-frame offset {worst * 1000:.2f} ms'
+
+    def test_records_offset(self, scheduler):
+        times = pulse_times(120.0, beats=4, jitter=0)
+        feed(scheduler.tracker, times)
+        due = scheduler.next_frame(times[-1], 0.02)
+        scheduler.frame_sent(due + 0.001)
+        assert scheduler.offset.last == pytest.approx(0.001, abs=1e-6)
+
+    def test_effect_time_in_beats(self, scheduler):
+        times = pulse_times(120.0, beats=4, jitter=0)
+        feed(scheduler.tracker, times)
+        assert scheduler.effect_time(101.0 - 0.03) == \
+            pytest.approx(2.0, abs=1e-6)
+
+
+class TestEngineClockSync:
+
+    def test_clock_drives_frames(self):
+        light = Light(3)
+        stream = HueStream(7, client=None, keepalive_interval=0.0)
+        socket = stream._socket = FakeSocket()
+        handled = []
+        scheduler = BeatScheduler(lookahead=0.0)
+        # 300 bpm, rounded to 10 frames per beat at 50 Hz
+        engine = Engine(stream, (light,), handled.append, rate=50,
+                        scheduler=scheduler)
+        thread = threading.Thread(target=engine.run)
+        thread.start()
+        try:
+            engine.submit(START)
+            pulse = 60.0 / 300 / PPQN
+            start = time.perf_counter()
+            for i in range(PPQN * 3):
+                engine.submit(CLOCK)
+                time.sleep(max(0.0, start + (i + 1) * pulse -
+                               time.perf_counter()))
+        finally:
+            engine.stop()
+            thread.join()
+
+        assert handled == []
+        assert scheduler.tracker.bpm == pytest.approx(300, rel=0.05)
+        assert scheduler.offset.count > 10
+        assert scheduler.offset.mean < 0.005
+        assert len(socket.sent) > 20
@@ -0,0 +1,158 @@
+import random
+from array import array
+import pytest
+from midihue import Light, LightBank
+from midihue.color import ColorPipeline, GAMUTS, clamp_to_gamut, in_gamut, \
+    rgb_to_xyb
+from midihue.hue import HueStream
+
+
+def direct_xy(r, g, b, gamut=GAMUTS['C']):
+    x, y, luminance = rgb_to_xyb(r, g, b)
+    x, y = clamp_to_gamut(x, y, gamut)
+    return x * 0xffff, y * 0xffff, min(luminance, 1.0) * 0xffff
+
+
+def random_colors(n, seed=1):
+    rng = random.Random(seed)
+    return [(rng.random(), rng.random(), rng.random()) for _ in range(n)]
+
+
+class TestConversion:
+
+    def test_white_point(self):
+        x, y, luminance = rgb_to_xyb(1.0, 1.0, 1.0)
+        assert (x, y) == pytest.approx((0.3227, 0.3290), abs=1e-4)
+        assert luminance == pytest.approx(1.0, abs=1e-5)
+
+    def test_black(self):
+        assert rgb_to_xyb(0.0, 0.0, 0.0)[2] == 0.0
+
+    def test_primaries_near_gamut_corners(self):
+        gamut = GAMUTS['C']
+        for rgb, corner in (((1, 0, 0), gamut.red),
+                            ((0, 1, 0), gamut.green),
+                            ((0, 0, 1), gamut.blue)):
+            x, y, _ = rgb_to_xyb(*rgb)
+            assert (x, y) == pytest.approx(corner, abs=0.05)
+
+    @pytest.mark.parametrize('name', sorted(GAMUTS))
+    def test_clamp_inside_unchanged(self, name):
+        assert clamp_to_gamut(0.32, 0.33, GAMUTS[name]) == (0.32, 0.33)
+
+    @pytest.mark.parametrize('name', sorted(GAMUTS))
+    def test_clamp_outside_to_nearest_edge(self, name):
+        gamut = GAMUTS[name]
+        for x, y in ((0.8, 0.2), (0.0, 0.9), (0.1, 0.0), (0.5, 0.6)):
+            assert not in_gamut(x, y, gamut)
+            cx, cy = clamp_to_gamut(x, y, gamut)
+            distance = (cx - x) ** 2 + (cy - y) ** 2
+            # On an edge, and no further than any corner
+            nudged = clamp_to_gamut(cx + (0.32 - cx) * 1e-6,
+                                    cy + (0.33 - cy) * 1e-6, gamut)
+            assert in_gamut(*nudged, gamut)
+            for corner in gamut:
+                assert distance <= \
+                    (corner.x - x) ** 2 + (corner.y - y) ** 2 + 1e-12
+
+
+class TestColorPipeline:
+
+    def test_linear_rgb_matches_light(self):
+        pipeline = ColorPipeline()
+        for rgb in random_colors(100):
+            light = Light(1)
+            light.rgb = rgb
+            encoded = pipeline.encode_light(light)
+            for value, expected in zip(encoded, light.rgb_int):
+                assert abs(value - expected) <= 1
+
+    @pytest.mark.parametrize('gamma', [1.0, 2.2, 0.5])
+    def test_curve_accuracy_midi_values(self, gamma):
+        pipeline = ColorPipeline(gamma=gamma, brightness=0.8)
+        for value in range(128):
+            v = value / 127
+            expected = 0.8 * 0xffff * v ** gamma
+            encoded = pipeline.encode(1, v, v, v)
+            assert encoded[0] == encoded[1] == encoded[2]
+            assert abs(encoded[0] - expected) <= 3, f'MIDI value {value}'
+
+    def test_xy_accuracy(self):
+        pipeline = ColorPipeline('xy')
+        for rgb in random_colors(500):
+            encoded = pipeline.encode(1, *rgb)
+            expected = direct_xy(*rgb)
+            for value, exact in zip(encoded, expected):
+                assert abs(value - exact) <= 3, f'color {rgb}'
+
+    def test_xy_clamped_per_light(self):
+        pipeline = ColorPipeline('xy', gamut=None)
+        pipeline.set_gamut(2, 'A')
+        pipeline.set_gamut(3, 'B')
+        unclamped = pipeline.encode(1, 0.0, 1.0, 0.0)
+        gamut_a = pipeline.encode(2, 0.0, 1.0, 0.0)
+        gamut_b = pipeline.encode(3, 0.0, 1.0, 0.0)
+        assert len({unclamped[:2], gamut_a[:2], gamut_b[:2]}) == 3
+        assert gamut_b == pytest.approx(direct_xy(0.0, 1.0, 0.0,
+                                                  GAMUTS['B']), abs=1)
+
+    def test_convert_bank_matches_encode(self):
+        pipeline = ColorPipeline('xy', gamma=2.0)
+        pipeline.set_gamut(2, 'A')
+        bank = LightBank()
+        for light_id, rgb in enumerate(random_colors(4), 1):
+            bank.add(light_id, colorspace='rgb').rgb = rgb
+        bank.add(5).hsv = (0.4, 0.5, 0.6)
+        bank.convert()
+        output = array('H', bank.rgb_int)
+        pipeline.convert(bank, output)
+        for slot, light in enumerate(bank):
+            assert tuple(output[slot * 3:slot * 3 + 3]) == \
+                pipeline.encode_light(light)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            ColorPipeline('cmyk')
+        with pytest.raises(ValueError):
+            ColorPipeline(gamut='D')
+
+
+class TestStreamPipeline:
+
+    @pytest.fixture
+    def socket(self, mocker):
+        return mocker.MagicMock()
+
+    def make_stream(self, socket, pipeline):
+        stream = HueStream(7, client=None, pipeline=pipeline)
+        stream._socket = socket
+        return stream
+
+    def test_header_colorspace(self, socket):
+        assert HueStream.Message().bytes[14] == 0x00
+        stream = self.make_stream(socket, ColorPipeline('xy'))
+        stream.update([Light(1)])
+        assert socket.send.call_args[0][0][14] == 0x01
+
+    def test_lights_encoded(self, socket):
+        pipeline = ColorPipeline('xy', gamma=2.2)
+        stream = self.make_stream(socket, pipeline)
+        lights = [Light(1), Light(2)]
+        lights[0].hsv = (0.6, 1.0, 0.5)
+        stream.update(lights)
+        decoded = HueStream.Message.decode(socket.send.call_args[0][0])
+        assert decoded == {light.light_id: pipeline.encode_light(light)
+                           for light in lights}
+
+    def test_bank_encoded(self, socket):
+        pipeline = ColorPipeline(gamma=2.2)
+        stream = self.make_stream(socket, pipeline)
+        bank = LightBank()
+        bank.add(1).hsv = (0.6, 1.0, 0.5)
+        bank.add(2).rgb = (0.5, 0.25, 1.0)
+        stream.update(bank)
+        bank[1].r = 1.0
+        stream.update(bank)
+        decoded = HueStream.Message.decode(socket.send.call_args[0][0])
+        assert decoded == {light.light_id: pipeline.encode_light(light)
+                           for light in bank}
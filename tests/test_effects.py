@@ -0,0 +1,174 @@
+import pytest
+from midihue import Light, LightBank
+from midihue.effects import Chase, Effect, Effects, Fade, LFO, Strobe, \
+    WAVEFORMS, make_wave
+
+
+@pytest.fixture
+def bank():
+    bank = LightBank()
+    for light_id in range(1, 5):
+        bank.add(light_id).hsv = (0.0, 1.0, 1.0)
+    return bank
+
+
+def values(lights, param='v'):
+    return [pytest.approx(getattr(light, param)) for light in lights]
+
+
+class TestWaveforms:
+
+    @pytest.mark.parametrize('name', sorted(WAVEFORMS))
+    def test_lookup_matches_function(self, name):
+        func = make_wave(name, lookup=False)
+        table = make_wave(name)
+        for i in range(100):
+            p = i / 100
+            assert table(p) == pytest.approx(func(p), abs=0.01)
+        assert 0.0 <= table(1.0) <= 1.0
+
+    def test_shapes(self):
+        assert make_wave('sine', lookup=False)(0.5) == 1.0
+        assert make_wave('triangle', lookup=False)(0.25) == 0.5
+        assert make_wave('saw', lookup=False)(0.75) == 0.75
+        assert make_wave('square', lookup=False)(0.75) == 1.0
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            make_wave('noise')
+
+
+class TestEffects:
+
+    def test_lfo(self, bank):
+        lfo = LFO(bank, waveform='triangle', rate=2.0, lookup=False)
+        lfo.render(10.0)
+        assert values(bank) == [0.0] * 4
+        lfo.render(10.125)
+        assert values(bank) == [0.5] * 4
+        lfo.render(10.25)
+        assert values(bank) == [1.0] * 4
+
+    def test_lfo_depth_and_level(self, bank):
+        lfo = LFO(bank, waveform='square', depth=0.5, level=0.8)
+        lfo.render(0.0)
+        assert values(bank) == [0.4] * 4
+        lfo.render(0.75)
+        assert values(bank) == [0.8] * 4
+
+    def test_lfo_spread(self, bank):
+        lfo = LFO(bank, waveform='saw', spread=1.0, lookup=False)
+        lfo.render(0.0)
+        assert values(bank) == [0.0, 0.75, 0.5, 0.25]
+
+    def test_lfo_phase(self, bank):
+        lfo = LFO(bank, waveform='saw', phase=0.5, lookup=False)
+        lfo.render(0.0)
+        assert values(bank) == [0.5] * 4
+
+    def test_chase(self, bank):
+        chase = Chase(bank, rate=1.0)
+        for step in range(4):
+            chase.render(step / 4 + 0.01)
+            expected = [0.0] * 4
+            expected[step] = 1.0
+            assert values(bank) == expected
+
+    def test_strobe(self, bank):
+        strobe = Strobe(bank, rate=10.0, duty=0.25)
+        strobe.render(0.0)
+        assert values(bank) == [1.0] * 4
+        strobe.render(0.05)
+        assert values(bank) == [0.0] * 4
+
+    def test_fade(self, bank):
+        fade = Fade(bank, param='s', start=1.0, end=0.0, duration=2.0)
+        fade.render(5.0)
+        fade.render(6.0)
+        assert values(bank, 's') == [0.5] * 4
+        assert not fade.done
+        fade.render(7.5)
+        assert values(bank, 's') == [0.0] * 4
+        assert fade.done
+        fade.trigger = 1.0
+        assert not fade.done
+
+    def test_rgb_param_on_hsv_light(self, bank):
+        lfo = LFO(bank, param='r', waveform='square')
+        lfo.render(0.0)
+        assert bank[0].rgb == pytest.approx((0.0, 0.0, 0.0))
+        lfo.render(0.75)
+        assert bank[0].rgb == pytest.approx((1.0, 0.0, 0.0))
+
+    def test_writes_bump_version_only_on_change(self, bank):
+        light = bank[0]
+        strobe = Strobe((light,))
+        strobe.render(0.0)
+        version = light.version
+        strobe.render(0.001)
+        assert light.version == version
+        strobe.render(0.05)
+        assert light.version == version + 1
+
+    def test_values_clamped(self):
+        light = Light(1)
+        LFO((light,), level=2.0, depth=0.0).render(0.0)
+        assert light.v == 1.0
+
+    def test_invalid_param(self, bank):
+        with pytest.raises(ValueError):
+            LFO(bank, param='x')
+
+
+class CountingEffect(Effect):
+
+    def __init__(self, lights, rendered):
+        super().__init__(lights)
+        self.rendered = rendered
+
+    def values(self, t):
+        self.rendered.append(self)
+        return [0.5] * len(self.lights)
+
+
+class TestEffectsRender:
+
+    def test_renders_in_order(self, bank):
+        effects = Effects()
+        effects.add(LFO(bank, waveform='square'))
+        effects.add(Strobe([bank[0]], duty=1.0))
+        assert effects.render(0.0) == 2
+        assert values(bank) == [1.0, 0.0, 0.0, 0.0]
+
+    def test_budget_resumes_skipped(self, bank):
+        rendered = []
+        effects = Effects(budget=0.0)
+        group = [effects.add(CountingEffect(bank, rendered))
+                 for _ in range(3)]
+        for _ in range(3):
+            assert effects.render(0.0) == 1
+        assert rendered == group
+        assert effects.overruns == 3
+
+    def test_done_effects_skipped(self, bank):
+        rendered = []
+        effects = Effects()
+        fade = effects.add(Fade(bank, duration=0.0))
+        counting = effects.add(CountingEffect(bank, rendered))
+        effects.render(0.0)
+        assert fade.done
+        effects.render(1.0)
+        assert rendered == [counting, counting]
+        assert len(effects) == 2
+
+    def test_empty(self):
+        assert Effects().render() == 0
+
+    def test_restart_running(self, bank):
+        effects = Effects()
+        fade = effects.add(Fade(bank, duration=0.0))
+        lfo = effects.add(LFO(bank))
+        effects.render(5.0)
+        effects.restart()
+        assert lfo.started is None
+        assert fade.done
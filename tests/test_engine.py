@@ -0,0 +1,315 @@
+import queue
+import threading
+import time
+import pytest
+from mido import Message
+from midihue import Light
+from midihue.hue import HueStream
+from midihue.effects import Effects, Strobe
+from midihue.engine import Coalescer, Engine, LatencyStats
+from midihue.mapping import Mapping
+from midihue.smoothing import Smoother
+from midihue.scenes import SceneStore
+from helpers import FakeSocket, cc
+
+
+class FakeInput:
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            yield msg
+
+    def put(self, msg):
+        self._queue.put(msg)
+
+    def close(self):
+        self._queue.put(None)
+
+
+class TestLatencyStats:
+
+    def test_record(self):
+        stats = LatencyStats()
+        for latency in (0.002, 0.004, 0.003):
+            stats.record(latency)
+        assert stats.count == 3
+        assert stats.max == 0.004
+        assert stats.last == 0.003
+        assert stats.mean == pytest.approx(0.003)
+
+    def test_empty_mean(self):
+        assert LatencyStats().mean == 0.0
+
+
+class TestCoalescer:
+
+    def test_latest_value_per_controller(self):
+        coalescer = Coalescer()
+        for value in range(10):
+            coalescer.put(cc(1, value))
+            coalescer.put(cc(2, value * 2))
+        assert coalescer.drain() == [cc(1, 9), cc(2, 18)]
+        assert coalescer.received == 20
+        assert coalescer.collapsed == 18
+
+    def test_channels_are_separate(self):
+        coalescer = Coalescer()
+        coalescer.put(cc(1, 10, channel=0))
+        coalescer.put(cc(1, 20, channel=1))
+        coalescer.put(cc(1, 30, channel=0))
+        assert coalescer.drain() == [cc(1, 20, channel=1),
+                                     cc(1, 30, channel=0)]
+
+    def test_continuous_types(self):
+        coalescer = Coalescer()
+        for value in (0, 50, 100):
+            coalescer.put(Message('pitchwheel', pitch=value * 10))
+            coalescer.put(Message('aftertouch', value=value))
+            coalescer.put(Message('polytouch', note=60, value=value))
+        assert coalescer.drain() == [
+            Message('pitchwheel', pitch=1000),
+            Message('aftertouch', value=100),
+            Message('polytouch', note=60, value=100),
+        ]
+
+    def test_notes_keep_order(self):
+        coalescer = Coalescer()
+        messages = [
+            cc(1, 10),
+            Message('note_on', note=60, velocity=100),
+            cc(1, 20),
+            cc(1, 30),
+            Message('note_off', note=60),
+            Message('program_change', program=2),
+            Message('note_on', note=60, velocity=100),
+        ]
+        for msg in messages:
+            coalescer.put(msg)
+        assert coalescer.drain() == messages[:2] + messages[3:]
+        assert coalescer.collapsed == 1
+
+    def test_nrpn_keeps_order(self):
+        coalescer = Coalescer()
+        messages = [cc(99, 0), cc(98, 1), cc(6, 10), cc(99, 0), cc(98, 2),
+                    cc(6, 20), cc(6, 30)]
+        for msg in messages:
+            coalescer.put(msg)
+        assert coalescer.drain() == messages
+        assert coalescer.collapsed == 0
+
+    def test_realtime_keeps_collapsing(self):
+        coalescer = Coalescer()
+        messages = [cc(1, 10), Message('clock'), Message('active_sensing'),
+                    cc(1, 20), Message('start'), cc(1, 30)]
+        for msg in messages:
+            coalescer.put(msg)
+        assert coalescer.drain() == [Message('clock'),
+                                     Message('active_sensing'),
+                                     Message('start'), cc(1, 30)]
+        assert coalescer.collapsed == 2
+
+    @pytest.mark.parametrize('mappings, messages', [
+        # The MSB resets the LSB, so the last MSB must follow the LSB
+        ([{'control': 1, 'fine': True, 'light': 3, 'param': 'h'}],
+         [cc(1, 10), cc(33, 100), cc(1, 20)]),
+        # The CC received last sets the parameter
+        ([{'control': 77, 'light': 3, 'param': 'v'},
+          {'control': 78, 'light': 3, 'param': 'v'}],
+         [cc(77, 10), cc(78, 100), cc(77, 20)]),
+    ])
+    def test_same_state_as_every_message(self, mappings, messages):
+        applied = Mapping({'mappings': mappings})
+        for msg in messages:
+            applied.dispatch(msg)
+        coalesced = Mapping({'mappings': mappings})
+        coalescer = Coalescer()
+        for msg in messages:
+            coalescer.put(msg)
+        for msg in coalescer.drain():
+            coalesced.dispatch(msg)
+        assert coalescer.collapsed == 1
+        assert coalesced.light(3).hsv == applied.light(3).hsv
+
+    def test_sysex_keeps_order(self):
+        coalescer = Coalescer()
+        messages = [cc(1, 10), Message('sysex', data=[1, 2]), cc(1, 20)]
+        for msg in messages:
+            coalescer.put(msg)
+        assert coalescer.drain() == messages
+
+    def test_drain_clears(self):
+        coalescer = Coalescer()
+        coalescer.put(cc(1, 10))
+        coalescer.drain()
+        coalescer.put(cc(1, 20))
+        assert len(coalescer) == 1
+        assert coalescer.drain() == [cc(1, 20)]
+        assert coalescer.collapsed == 0
+
+
+class TestEngine:
+
+    @pytest.fixture
+    def light(self):
+        return Light(3)
+
+    @pytest.fixture
+    def socket(self):
+        return FakeSocket(timestamps=True)
+
+    @pytest.fixture
+    def stream(self, socket):
+        stream = HueStream(7, client=None)
+        stream._socket = socket
+        return stream
+
+    @pytest.fixture
+    def inport(self):
+        inport = FakeInput()
+        yield inport
+        inport.close()
+
+    @pytest.fixture
+    def handled(self):
+        return []
+
+    def make_engine(self, stream, light, handled, **kwargs):
+        def handle(msg):
+            handled.append(msg)
+            light.v = msg.value / 127 if isinstance(msg, Message) else msg
+        return Engine(stream, (light,), handle, **kwargs)
+
+    def run_engine(self, engine, inport, duration, actions=()):
+        thread = threading.Thread(target=engine.run, args=(inport,))
+        thread.start()
+        try:
+            for delay, msg in actions:
+                time.sleep(delay)
+                inport.put(msg)
+            time.sleep(duration)
+        finally:
+            engine.stop()
+            thread.join()
+
+    def test_submit_applies_handler(self, stream, light, handled):
+        engine = self.make_engine(stream, light, handled)
+        engine.submit(0.5)
+        assert handled == [0.5]
+        assert light.v == 0.5
+
+    def test_flush_sends_frame(self, stream, socket, light, handled):
+        engine = self.make_engine(stream, light, handled)
+        light.rgb = (1.0, 0.0, 0.0)
+        engine.flush()
+        assert len(socket.sent) == 1
+        assert socket.sent[0][1][-6:] == b'\xff\xff\x00\x00\x00\x00'
+        assert stream.frames_sent == 1
+
+    def test_flush_suppresses_unchanged(self, stream, socket, light,
+                                        handled):
+        engine = self.make_engine(stream, light, handled)
+        engine.flush()
+        engine.flush()
+        assert len(socket.sent) == 1
+        assert stream.frames_suppressed == 1
+
+    def test_frame_clock(self, stream, socket, light, handled, inport):
+        stream.keepalive_interval = 0.0
+        engine = self.make_engine(stream, light, handled, rate=50)
+        self.run_engine(engine, inport, 0.5)
+        assert 20 <= len(socket.sent) <= 27
+        intervals = [b[0] - a[0] for a, b
+                     in zip(socket.sent, socket.sent[1:])]
+        mean_interval = sum(intervals) / len(intervals)
+        assert mean_interval == pytest.approx(0.02, rel=0.1)
+
+    def test_input_thread_delivers(self, stream, light, handled, inport):
+        engine = self.make_engine(stream, light, handled, rate=50)
+        self.run_engine(engine, inport, 0.05, [(0.01, 0.25), (0.01, 0.75)])
+        assert handled == [0.25, 0.75]
+        assert light.v == 0.75
+        assert engine.latency.count >= 1
+
+    def test_clocked_latency_within_frame(self, stream, light, handled,
+                                          inport):
+        engine = self.make_engine(stream, light, handled, rate=20)
+        actions = [(0.013, i / 10.0) for i in range(10)]
+        self.run_engine(engine, inport, 0.06, actions)
+        assert engine.latency.count >= 1
+        assert engine.latency.max < engine.period * 1.5
+
+    def test_immediate_latency(self, stream, light, handled, inport):
+        # At 5 Hz the clock alone would average ~100 ms latency
+        engine = self.make_engine(stream, light, handled,
+                                  rate=5, immediate=True)
+        actions = [(0.03, i / 10.0) for i in range(8)]
+        self.run_engine(engine, inport, 0.02, actions)
+        assert engine.latency.count == len(actions)
+        assert engine.latency.max < engine.period / 4
+
+    def test_coalesce_applies_on_flush(self, stream, socket, light,
+                                       handled):
+        engine = self.make_engine(stream, light, handled, coalesce=True)
+        engine.submit(cc(1, 0))
+        assert handled == []
+        for value in (10, 20, 127):
+            engine.submit(cc(1, value))
+        engine.flush()
+        assert [msg.value for msg in handled] == [127]
+        assert engine.coalescer.collapsed == 3
+        assert len(socket.sent) == 1
+
+    def test_coalesce_immediate(self, stream, light, handled, inport):
+        engine = self.make_engine(stream, light, handled,
+                                  rate=5, immediate=True, coalesce=True)
+        actions = [(0.03, cc(1, i)) for i in range(5)]
+        self.run_engine(engine, inport, 0.02, actions)
+        assert [msg.value for msg in handled] == list(range(5))
+        assert engine.latency.max < engine.period / 4
+
+    def test_effects_render_each_frame(self, stream, socket, light,
+                                       handled, inport):
+        light.hsv = (0.0, 1.0, 0.0)
+        effects = Effects()
+        effects.add(Strobe((light,), rate=10.0, duty=0.5))
+        engine = self.make_engine(stream, light, handled, rate=50,
+                                  effects=effects)
+        self.run_engine(engine, inport, 0.3)
+        levels = {frame[-6:] for _, frame in socket.sent}
+        assert levels == {b'\xff\xff\x00\x00\x00\x00', bytes(6)}
+        # A frame for each on/off transition of the 10 Hz strobe
+        assert 4 <= len(socket.sent) <= 8
+
+    def test_smoother_updates_each_frame(self, stream, socket, light,
+                                         handled, inport):
+        light.v = 0.0
+        smoother = Smoother()
+        channel = smoother.add(light, 'v', 'linear', duration=0.1)
+        engine = Engine(stream, (light,), handled.append, rate=50,
+                        smoother=smoother)
+        smoother.set(channel, 1.0)
+        self.run_engine(engine, inport, 0.2)
+        assert light.v == 1.0
+        levels = {frame[-6:] for _, frame in socket.sent}
+        # Intermediate levels were sent while the value moved
+        assert len(levels) >= 4
+
+    def test_scene_fades_each_frame(self, stream, socket, light, handled,
+                                    inport):
+        scenes = SceneStore(light.bank, fade=0.1)
+        light.v = 1.0
+        scenes.save(0)
+        light.v = 0.0
+        engine = Engine(stream, (light,), handled.append, rate=50,
+                        scenes=scenes)
+        scenes.recall(0)
+        self.run_engine(engine, inport, 0.2)
+        assert light.v == pytest.approx(1.0, abs=1e-4)
+        levels = {frame[-6:] for _, frame in socket.sent}
+        assert len(levels) >= 4
@@ -0,0 +1,224 @@
+import asyncio
+import time
+import pytest
+from midihue import Light
+from midihue.hue import HueClient, HueClientError, HueStream, \
+    HueStreamError
+from midihue.aio import AsyncHueClient, AsyncHueStream
+from midihue.fakebridge import FakeBridge
+from helpers import wait_for
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge() as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def client(bridge, tmp_path):
+    return HueClient(credentials_path=str(tmp_path / 'creds'),
+                     bridge_ip=bridge.host, bridge_port=bridge.http_port)
+
+
+@pytest.fixture
+def stream(bridge, client):
+    stream = HueStream(bridge.group_id, client, port=bridge.stream_port)
+    yield stream
+    stream.stop()
+
+
+class TestFakeBridgeREST:
+
+    def test_creates_user(self, bridge, client):
+        assert client.username == bridge.username
+        assert client.clientkey == bridge.clientkey
+
+    def test_link_button(self, tmp_path):
+        with FakeBridge(link_button=False) as bridge:
+            with pytest.raises(SystemExit):
+                HueClient(credentials_path=str(tmp_path / 'creds'),
+                          bridge_ip=bridge.host,
+                          bridge_port=bridge.http_port)
+
+    def test_entertainment_groups(self, client):
+        assert client.get_entertainment_groups() == \
+            [('1', 'Fake entertainment area (10 lights)')]
+
+    def test_gamut_types(self, bridge, client):
+        bridge.lights['3']['capabilities']['control']['colorgamuttype'] = 'A'
+        del bridge.lights['4']['capabilities']
+        gamuts = client.get_gamut_types()
+        assert gamuts[3] == 'A'
+        assert gamuts[1] == 'C'
+        assert 4 not in gamuts
+
+    def test_check_bridge(self, bridge, client):
+        assert client._check_bridge(bridge.host)
+
+    def test_stream_mode(self, bridge, client):
+        client.set_stream_mode(1, True)
+        assert bridge.stream_active(1)
+        client.set_stream_mode(1, False)
+        assert not bridge.stream_active(1)
+
+    def test_stream_mode_unknown_group(self, client):
+        with pytest.raises(HueClientError):
+            client.set_stream_mode(9, True)
+
+
+class TestFakeBridgeStream:
+
+    def test_receives_frames(self, bridge, stream):
+        stream.start()
+        light = Light(3, colorspace='rgb')
+        light.rgb = (1.0, 0.0, 0.5)
+        stream.update((light,))
+        assert wait_for(lambda: bridge.frames)
+        assert HueStream.Message.decode(bridge.frames[0][1]) == \
+            {3: light.rgb_int}
+        assert bridge.handshakes == 1
+
+    def test_bridge_poll_does_not_block(self, bridge, stream, monkeypatch):
+        monkeypatch.setattr('midihue.hue.BRIDGE_POLL_INTERVAL', 0.0)
+        stream.start()
+        light = Light(3)
+        start = time.perf_counter()
+        for i in range(5):
+            light.v = i / 5
+            stream.update((light,))
+        assert time.perf_counter() - start < stream.handshake_timeout
+        assert wait_for(lambda: len(bridge.frames) == 5)
+
+    def test_on_frame(self, bridge, stream):
+        received = []
+        bridge.on_frame = lambda now, data: received.append(data)
+        stream.start()
+        stream.update((Light(3),))
+        assert wait_for(lambda: received)
+
+    def test_stream_reconnects_after_drop(self, bridge, stream,
+                                          monkeypatch):
+        monkeypatch.setattr('midihue.hue.BRIDGE_POLL_INTERVAL', 0.0)
+        stream.keepalive_interval = 0.0
+        stream.start()
+        light = Light(3)
+        stream.update((light,))
+        assert wait_for(lambda: bridge.frames)
+
+        bridge.drop_streams()
+        assert wait_for(lambda: stream.update((light,)) and
+                        stream.reconnecting)
+        light.v = 0.5
+        stream.update((light,))
+        assert wait_for(lambda: stream.reconnects == 1)
+        assert wait_for(lambda: bridge.handshakes == 2)
+        assert wait_for(lambda: HueStream.Message.decode(
+            bridge.frames[-1][1]) == {3: light.rgb_int})
+
+
+class TestFakeBridgeStreamV2:
+
+    @pytest.fixture
+    def bridge(self):
+        with FakeBridge(api_version='1.50.0') as bridge:
+            yield bridge
+
+    def test_entertainment_configuration(self, bridge, client):
+        config_id, channels = client.get_entertainment_configuration(1)
+        assert config_id == bridge.configuration_id(1)
+        assert len(config_id) == 36
+        assert channels == {light_id: (light_id - 1,)
+                            for light_id in range(1, 11)}
+        assert client.get_entertainment_configuration(9) is None
+
+    def test_not_supported(self, tmp_path):
+        with FakeBridge() as bridge:
+            client = HueClient(credentials_path=str(tmp_path / 'creds'),
+                               bridge_ip=bridge.host,
+                               bridge_port=bridge.http_port)
+            assert client.get_api_version() == (1, 16, 0)
+            assert client.get_entertainment_configuration(1) is None
+            stream = HueStream(1, client, port=bridge.stream_port,
+                               stream_version=2)
+            with pytest.raises(HueStreamError):
+                stream.start()
+
+    def test_selected_automatically(self, bridge, stream):
+        stream.start()
+        assert stream.stream_version == 2
+        assert bridge.stream_active(1)
+        # v2 streams identify with the application ID
+        assert bridge.identities == [bridge.application_id]
+        light = Light(3, colorspace='rgb')
+        light.rgb = (1.0, 0.0, 0.5)
+        stream.update((light,))
+        assert wait_for(lambda: bridge.frames)
+        data = bridge.frames[0][1]
+        assert data[16:52] == bridge.configuration_id(1).encode()
+        assert HueStream.Message.decode(data) == {2: light.rgb_int}
+        stream.stop()
+        assert not bridge.stream_active(1)
+
+    def test_async_stream(self, bridge, client):
+        stream = AsyncHueStream(bridge.group_id, AsyncHueClient(client),
+                                port=bridge.stream_port)
+
+        async def run():
+            await stream.start()
+            assert bridge.stream_active(1)
+            stream.update((Light(3),))
+            await stream.stop()
+
+        asyncio.run(run())
+        assert stream.stream_version == 2
+        assert bridge.identities == [bridge.application_id]
+        assert not bridge.stream_active(1)
+
+    def test_application_id(self, bridge, client):
+        assert client.get_application_id() == bridge.application_id
+
+    def test_start_and_stop_configuration(self, bridge, client):
+        config_id = bridge.configuration_id(1)
+        client.set_entertainment_stream(config_id, True)
+        assert bridge.stream_active(1)
+        client.set_entertainment_stream(config_id, False)
+        assert not bridge.stream_active(1)
+        with pytest.raises(HueClientError):
+            client.set_entertainment_stream(bridge.configuration_id(9), True)
+
+    @pytest.mark.parametrize('response', [
+        (404, b'<html>Not Found</html>'),
+        (200, b'{"data": ['),
+        (404, b'[{"error": {"type": 4, "description": "not available"}}]'),
+    ])
+    def test_falls_back_to_v1(self, bridge, stream, response):
+        bridge.clip_response = response
+        stream.start()
+        assert stream.stream_version == 1
+        assert bridge.stream_active(1)
+        assert bridge.identities == [bridge.username]
+        stream.update((Light(3),))
+        assert wait_for(lambda: bridge.frames)
+        assert HueStream.Message.decode(bridge.frames[0][1]) == \
+            {3: (0, 0, 0)}
+
+    def test_forced_v2_fails(self, bridge, client):
+        bridge.clip_response = (404, b'<html>Not Found</html>')
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port,
+                           stream_version=2)
+        with pytest.raises(HueStreamError):
+            stream.start()
+        assert not bridge.stream_active(1)
+
+    def test_forced_v1(self, bridge, client):
+        stream = HueStream(bridge.group_id, client, port=bridge.stream_port,
+                           stream_version=1)
+        stream.start()
+        try:
+            stream.update((Light(3),))
+            assert wait_for(lambda: bridge.frames)
+            assert HueStream.Message.decode(bridge.frames[0][1]) == \
+                {3: (0, 0, 0)}
+        finally:
+            stream.stop()
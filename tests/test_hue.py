@@ -1,6 +1,11 @@
 import pytest
 import json
-from midihue.hue import HueClient, HueStream, DISCOVERY_URI
+import time
+from mbedtls.exceptions import TLSError
+from midihue import Light, LightBank
+from midihue.hue import HueClient, HueClientError, HueStream, \
+    HueStreamError, DISCOVERY_URI, discover_bridges
+from helpers import FakeSocket
 
 
 class TestHueClient:
@@ -61,6 +66,12 @@ class TestHueClient:
         assert client_auth.bridge_ip == bridge_ip
         assert requests_mock.call_count == 1
 
+    def test_discover_bridges(self, bridge_ip, requests_mock):
+        requests_mock.get(DISCOVERY_URI,
+                          json=[{'internalipaddress': bridge_ip},
+                                {'internalipaddress': '10.0.0.3'}])
+        assert discover_bridges() == [bridge_ip, '10.0.0.3']
+
     def test_cache_bridge_ip(self, client, bridge_ip, requests_mock):
         # Access once to fetch/cache
         client.bridge_ip
@@ -96,6 +107,137 @@ class TestHueClient:
     # TODO: fetch entertainment groups
 
 
+class TestHueClientCache:
+
+    @pytest.fixture
+    def bridge_ip(self):
+        return '10.0.0.2'
+
+    @pytest.fixture
+    def username(self):
+        return 'asdoiga-weg-se9gseglksjg'
+
+    @pytest.fixture
+    def groups(self):
+        return {
+            '1': {'type': 'Room', 'name': 'Kitchen', 'lights': ['1']},
+            '7': {'type': 'Entertainment', 'name': 'Desk',
+                  'lights': ['3', '4'],
+                  'locations': {'3': [-0.5, 1.0, 0.0],
+                                '4': [0.5, 1.0, 0.25]}},
+        }
+
+    @pytest.fixture
+    def creds_path(self, tmp_path, username):
+        path = tmp_path / 'creds'
+        path.write_text(json.dumps({'username': username,
+                                    'clientkey': 'a3289feb34248c'}))
+        return str(path)
+
+    @pytest.fixture
+    def cache_path(self, creds_path):
+        return creds_path + '.cache'
+
+    def write_cache(self, cache_path, age=0, **entries):
+        cache = {'version': 1}
+        for key, value in entries.items():
+            cache[key] = {'value': value, 'time': time.time() - age}
+        with open(cache_path, 'w') as file:
+            json.dump(cache, file)
+
+    @pytest.fixture(autouse=True)
+    def mock_bridge(self, bridge_ip, username, groups, requests_mock):
+        requests_mock.get(DISCOVERY_URI,
+                          json=[{'internalipaddress': bridge_ip}])
+        requests_mock.get(f'http://{bridge_ip}/api/{username}/groups',
+                          json=groups)
+
+    def test_discovery_populates_cache(self, creds_path, cache_path,
+                                       bridge_ip, groups):
+        client = HueClient(credentials_path=creds_path)
+        client.get_entertainment_groups()
+        with open(cache_path) as file:
+            cache = json.load(file)
+        assert cache['bridge_ip']['value'] == bridge_ip
+        assert cache[f'groups@{bridge_ip}']['value'] == groups
+
+    def test_warm_cache_startup(self, creds_path, cache_path, bridge_ip,
+                                groups, requests_mock, mocker):
+        self.write_cache(cache_path, **{
+            'bridge_ip': bridge_ip, f'groups@{bridge_ip}': groups
+        })
+        start = time.perf_counter()
+        client = HueClient(credentials_path=creds_path)
+        assert client.bridge_ip == bridge_ip
+        assert client.get_entertainment_groups() == \
+            [('7', 'Desk (2 lights)')]
+        elapsed = time.perf_counter() - start
+        assert requests_mock.call_count == 0
+        assert elapsed < 0.05
+
+    def test_stale_bridge_ip_verified(self, creds_path, cache_path,
+                                      bridge_ip, requests_mock):
+        self.write_cache(cache_path, age=7200, bridge_ip=bridge_ip)
+        requests_mock.get(f'http://{bridge_ip}/api/config',
+                          json={'bridgeid': '001788FFFE000000'})
+        client = HueClient(credentials_path=creds_path)
+        assert client.bridge_ip == bridge_ip
+        assert requests_mock.call_count == 1
+        assert requests_mock.last_request.url.endswith('/api/config')
+
+    def test_stale_bridge_ip_rediscovered(self, creds_path, cache_path,
+                                          bridge_ip, requests_mock):
+        self.write_cache(cache_path, age=7200, bridge_ip='10.0.0.99')
+        requests_mock.get('http://10.0.0.99/api/config', status_code=404)
+        client = HueClient(credentials_path=creds_path)
+        assert client.bridge_ip == bridge_ip
+        assert requests_mock.last_request.url.startswith(DISCOVERY_URI)
+
+    def test_stale_groups_refetched(self, creds_path, cache_path, bridge_ip,
+                                    requests_mock):
+        self.write_cache(cache_path, age=7200, **{
+            'bridge_ip': bridge_ip, f'groups@{bridge_ip}': {}
+        })
+        client = HueClient(credentials_path=creds_path, bridge_ip=bridge_ip)
+        assert client.get_entertainment_groups() == \
+            [('7', 'Desk (2 lights)')]
+        assert requests_mock.call_count == 1
+
+    def test_refresh_groups(self, creds_path, cache_path, bridge_ip,
+                            requests_mock):
+        self.write_cache(cache_path, **{f'groups@{bridge_ip}': {}})
+        client = HueClient(credentials_path=creds_path, bridge_ip=bridge_ip)
+        assert client.get_entertainment_groups() == []
+        assert len(client.get_entertainment_groups(refresh=True)) == 1
+
+    def test_light_locations(self, creds_path, bridge_ip, requests_mock):
+        client = HueClient(credentials_path=creds_path, bridge_ip=bridge_ip)
+        assert client.get_light_locations(7) == {3: (-0.5, 1.0, 0.0),
+                                                 4: (0.5, 1.0, 0.25)}
+        assert client.get_light_locations('1') == {}
+        # Served from the cached groups
+        assert requests_mock.call_count == 1
+        with pytest.raises(HueClientError):
+            client.get_light_locations(2)
+
+    @pytest.mark.parametrize('content', [
+        '{', '[]', '{"version": 0, "bridge_ip": {"value": "1.2.3.4"}}',
+        '{"version": 1, "bridge_ip": {"value": "1.2.3.4"}}',
+    ])
+    def test_invalid_cache_ignored(self, creds_path, cache_path, bridge_ip,
+                                   content):
+        with open(cache_path, 'w') as file:
+            file.write(content)
+        assert HueClient(credentials_path=creds_path).bridge_ip == bridge_ip
+
+    def test_uses_session(self, creds_path, bridge_ip, mocker):
+        for method in ('get', 'put', 'post'):
+            mocker.patch(f'requests.{method}', side_effect=AssertionError)
+        client = HueClient(credentials_path=creds_path)
+        client.get_entertainment_groups()
+        assert client.bridge_ip == bridge_ip
+
+
 class TestHueStream:
 
     @pytest.fixture
@@ -106,6 +248,8 @@ class TestHueStream:
     def client_mock(self, mocker):
         mock = mocker.MagicMock()
         type(mock).clientkey = mocker.PropertyMock(return_value='deadbeef')
+        # A bridge that only takes v1 streams
+        mock.get_entertainment_configuration.return_value = None
         return mock
 
     @pytest.fixture
@@ -126,6 +270,175 @@ class TestHueStream:
         stream.client.set_stream_mode.assert_called_with(group_id, False)
 
 
+class TestHueStreamReconnect:
+
+    @pytest.fixture
+    def sockets(self):
+        return []
+
+    @pytest.fixture
+    def stream(self, mocker, sockets):
+        client = mocker.MagicMock()
+        client.bridge_ip = '10.0.0.2'
+        client.get_entertainment_configuration.return_value = None
+        stream = HueStream(7, client, handshake_timeout=0.1)
+
+        def wrap_socket():
+            sock = sockets.pop(0) if sockets else FakeSocket()
+            stream.wrapped = getattr(stream, 'wrapped', []) + [sock]
+            return sock
+        mocker.patch.object(stream, '_wrap_socket', side_effect=wrap_socket)
+        mocker.patch('midihue.hue.MIN_RECONNECT_DELAY', 0.01)
+        yield stream
+        stream._stopped.set()
+
+    @pytest.fixture
+    def lights(self):
+        return [Light(3)]
+
+    def wait_reconnected(self, stream, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while stream.reconnecting and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert not stream.reconnecting
+
+    def test_handshake_uses_socket_timeout(self, stream):
+        stream.start()
+        assert stream.wrapped[0].handshake_timeout == 0.1
+        # Frames are sent in blocking mode
+        assert stream.wrapped[0].timeout is None
+        assert stream.wrapped[0].address == ('10.0.0.2', 2100)
+
+    def test_start_retries_handshake(self, stream, sockets):
+        sockets.extend([FakeSocket(handshake_error=TimeoutError()),
+                        FakeSocket()])
+        stream.start()
+        assert len(stream.wrapped) == 2
+        assert stream.wrapped[0].closed
+
+    def test_start_fails_after_tries(self, stream, sockets):
+        sockets.extend([FakeSocket(handshake_error=TimeoutError())
+                        for _ in range(3)])
+        with pytest.raises(HueStreamError):
+            stream.start()
+        assert len(stream.wrapped) == 3
+        assert all(sock.closed for sock in stream.wrapped)
+
+    def test_send_error_reconnects(self, stream, sockets, lights):
+        sockets.extend([
+            FakeSocket(error=ConnectionRefusedError()),
+            FakeSocket(handshake_error=TimeoutError()),
+            FakeSocket(),
+        ])
+        stream.start()
+        stream.update(lights)
+        assert stream.reconnecting
+        lights[0].v = 0.5
+        stream.update(lights)
+        lights[0].v = 1.0
+        stream.update(lights)
+        self.wait_reconnected(stream)
+
+        assert stream.reconnects == 1
+        assert stream.last_reconnect_time > 0
+        # Only the newest of the three frames is delivered
+        assert stream.frames_dropped == 2
+        assert len(stream.wrapped[2].sent) == 1
+        assert stream.wrapped[2].sent[0][-4:] == b'\xff\xff\xff\xff'
+        stream.client.set_stream_mode.assert_called_with(7, True)
+        assert stream.client.set_stream_mode.call_count == 3
+
+    def test_bridge_alert_reconnects(self, stream, sockets, lights, mocker):
+        mocker.patch('midihue.hue.BRIDGE_POLL_INTERVAL', 0.0)
+        sockets.append(FakeSocket(recv_error=TLSError(0x7880)))
+        stream.start()
+        stream.update(lights)
+        self.wait_reconnected(stream)
+        assert stream.reconnects == 1
+        assert len(stream.wrapped[1].sent) == 1
+
+    def test_no_auto_reconnect(self, stream, sockets, lights):
+        stream.auto_reconnect = False
+        sockets.append(FakeSocket(error=ConnectionRefusedError()))
+        stream.start()
+        with pytest.raises(HueStreamError):
+            stream.update(lights)
+        assert not stream.reconnecting
+
+    def test_stop_cancels_reconnect(self, stream, sockets, lights):
+        sockets.extend([FakeSocket(error=ConnectionRefusedError())]
+                       + [FakeSocket(handshake_error=TimeoutError())
+                          for _ in range(100)])
+        stream.start()
+        stream.update(lights)
+        stream.stop()
+        time.sleep(0.05)
+        attempts = len(stream.wrapped)
+        time.sleep(0.1)
+        assert len(stream.wrapped) == attempts
+        assert stream.reconnects == 0
+
+
+class TestHueStreamDedupe:
+
+    @pytest.fixture
+    def socket(self, mocker):
+        return mocker.MagicMock()
+
+    @pytest.fixture
+    def stream(self, socket):
+        stream = HueStream(7, client=None, keepalive_interval=1.0)
+        stream._socket = socket
+        return stream
+
+    @pytest.fixture
+    def lights(self):
+        return [Light(3), Light(4)]
+
+    def test_first_render_sends(self, stream, lights):
+        assert stream.render(lights, now=0.0) is not None
+
+    def test_unchanged_suppressed(self, stream, socket, lights):
+        assert stream.update(lights)
+        assert not stream.update(lights)
+        assert socket.send.call_count == 1
+        assert stream.frames_sent == 1
+        assert stream.frames_suppressed == 1
+
+    def test_change_sends(self, stream, socket, lights):
+        stream.update(lights)
+        lights[1].v = 0.5
+        assert stream.update(lights)
+        assert stream.frames_sent == 2
+        assert stream.frames_suppressed == 0
+
+    def test_keepalive(self, stream, lights):
+        stream.update(lights)
+        last_sent = stream._last_sent
+        assert stream.render(lights, now=last_sent + 0.5) is None
+        assert stream.render(lights, now=last_sent + 1.0) is not None
+
+    def test_bank_render(self, stream, socket):
+        bank = LightBank()
+        bank.add(3).rgb = (1.0, 0.0, 0.0)
+        bank.add(4)
+        assert stream.update(bank)
+        assert socket.send.call_args[0][0][-18:] == \
+            b'\x00\x00\x03\xff\xff\x00\x00\x00\x00' \
+            b'\x00\x00\x04\x00\x00\x00\x00\x00\x00'
+        assert not stream.update(bank)
+        bank[1].g = 1.0
+        assert stream.update(bank)
+        assert socket.send.call_args[0][0][-6:] == b'\x00\x00\xff\xff\x00\x00'
+
+    def test_only_changed_lights_reencoded(self, stream, lights, mocker):
+        stream.update(lights)
+        add = mocker.spy(stream._message, 'add')
+        lights[0].h = 0.3
+        stream.update(lights)
+        add.assert_called_once_with(3, lights[0].rgb_int)
+
+
 class TestHueStreamMessage:
 
     @pytest.fixture
@@ -157,3 +470,180 @@ class TestHueStreamMessage:
         assert message.bytes[-15:-9] == b'\x27\x09\x08\x00\x72\xd6'
         assert message.bytes[-9:-6] == b'\x00\x00\x09'
         assert message.bytes[-6:] == b'\x00\x10\x00\xff\x40\x01'
+
+    def test_message_readd_light_overwrites(self, message, header):
+        message.add(5, (1, 2, 3))
+        message.add(5, (9865, 2048, 29398))
+        assert len(message.bytes) == len(header) + 9
+        assert message.bytes[-6:] == b'\x26\x89\x08\x00\x72\xd6'
+
+    def test_message_buffer_is_view(self, message):
+        message.add(5, (1, 2, 3))
+        view = message.buffer
+        assert isinstance(view, memoryview)
+        assert view == message.bytes
+        message.add(5, (9865, 2048, 29398))
+        assert view[-6:] == b'\x26\x89\x08\x00\x72\xd6'
+
+    def test_message_capacity(self):
+        message = HueStream.Message(capacity=2)
+        message.add(1, (0, 0, 0))
+        message.add(2, (0, 0, 0))
+        with pytest.raises(AssertionError):
+            message.add(3, (0, 0, 0))
+
+    def test_message_add_bank(self, message):
+        bank = LightBank()
+        bank.add(23).rgb = (1.0, 0.0, 0.0)
+        bank.add(9).rgb = (0.0, 0.0, 1.0)
+        bank.convert()
+        message.add_bank(bank)
+        assert message.bytes[-18:-9] == \
+            b'\x00\x00\x17\xff\xff\x00\x00\x00\x00'
+        assert message.bytes[-9:] == \
+            b'\x00\x00\x09\x00\x00\x00\x00\xff\xff'
+
+    def test_message_add_whole_bank(self, message):
+        bank = LightBank()
+        for light_id in (23, 9, 4, 7, 12, 5):
+            bank.add(light_id).rgb = (0.25, 0.5, 1.0)
+        bank.convert()
+        message.add_bank(bank)
+        bank[1].rgb = (1.0, 0.0, 0.5)
+        bank[2].rgb = (0.0, 0.125, 0.0)
+        bank.convert()
+        # Rewrites the values of the slots in place
+        message.add_bank(bank)
+        expected = HueStream.Message()
+        for light in bank:
+            expected.add(light.light_id, light.rgb_int)
+        assert message.bytes == expected.bytes
+
+    def test_message_add_bank_after_id_change(self, message):
+        bank = LightBank()
+        for light_id in (23, 9, 4, 7, 12, 5):
+            bank.add(light_id).rgb = (0.25, 0.5, 1.0)
+        bank.convert()
+        message.add_bank(bank)
+        message.add_bank(bank)
+        bank[2].light_id = 8
+        message.add_bank(bank)
+        assert HueStream.Message.decode(message.bytes) == \
+            {light_id: bank[0].rgb_int for light_id in (23, 9, 4, 7, 12, 5, 8)}
+
+    def test_message_clear(self, message, header):
+        message.add(5, (1, 2, 3))
+        message.clear()
+        assert message.bytes == header
+
+    def test_message_decode(self, message):
+        message.add(23, (9993, 2048, 29398))
+        message.add(9, (16, 255, 16385))
+        assert HueStream.Message.decode(message.bytes) == \
+            {23: (9993, 2048, 29398), 9: (16, 255, 16385)}
+
+    def test_message_decode_invalid(self, message):
+        with pytest.raises(ValueError):
+            HueStream.Message.decode(b'NotAStream' + bytes(16))
+        message.add(5, (1, 2, 3))
+        with pytest.raises(ValueError):
+            HueStream.Message.decode(message.bytes[:-1])
+
+
+class TestHueStreamMessageV2:
+
+    CONFIGURATION = ('1a8d99cc-967b-44f2-9202-43f976c0fa6b',
+                     {3: (0,), 4: (1, 2)})
+
+    @pytest.fixture
+    def message(self):
+        return HueStream.Message(configuration=self.CONFIGURATION)
+
+    def test_header(self, message):
+        assert message.bytes[:9] == b'HueStream'
+        assert message.bytes[9:11] == b'\x02\x00'
+        assert message.bytes[16:] == self.CONFIGURATION[0].encode()
+
+    def test_message_channels(self, message):
+        message.add(4, (9865, 2048, 29398))
+        assert len(message.bytes) == 52 + 14
+        assert message.bytes[-14:] == \
+            b'\x01\x26\x89\x08\x00\x72\xd6\x02\x26\x89\x08\x00\x72\xd6'
+
+    def test_round_trip(self, message):
+        message.add(3, (1, 2, 3))
+        message.add(4, (9993, 2048, 29398))
+        # Not in the configuration
+        message.add(5, (4, 5, 6))
+        message.add(3, (16, 255, 16385))
+        assert HueStream.Message.decode(message.bytes) == \
+            {0: (16, 255, 16385), 1: (9993, 2048, 29398),
+             2: (9993, 2048, 29398)}
+
+    def test_add_bank(self, message):
+        bank = LightBank()
+        bank.add(4).rgb = (1.0, 0.0, 0.0)
+        bank.add(3).rgb = (0.0, 0.0, 1.0)
+        bank.convert()
+        message.add_bank(bank)
+        assert HueStream.Message.decode(message.bytes) == \
+            {0: (0, 0, 0xffff), 1: (0xffff, 0, 0), 2: (0xffff, 0, 0)}
+
+    def test_add_whole_bank(self, mocker):
+        # Light 6 has three channels, 7 two and 9 none
+        channels = {1: (0,), 2: (1,), 6: (2, 7, 9), 7: (3, 8), 8: (4,),
+                    5: (5,), 3: (6,)}
+        message = HueStream.Message(configuration=(self.CONFIGURATION[0],
+                                                   channels))
+        bank = LightBank()
+        for light_id in (1, 2, 6, 7, 8, 9, 5, 3):
+            bank.add(light_id)
+        # Packed at once, not light by light
+        mocker.patch.object(message, '_pack', side_effect=AssertionError)
+        for frame in range(2):
+            for slot, light in enumerate(bank):
+                light.rgb = (slot / 8, frame / 2, 1.0)
+            bank.convert()
+            message.add_bank(bank)
+            assert HueStream.Message.decode(message.bytes) == {
+                channel: bank[slot].rgb_int
+                for slot, light_id in enumerate(bank.ids)
+                for channel in channels.get(light_id, ())
+            }
+
+    def test_capacity(self):
+        message = HueStream.Message(capacity=2,
+                                    configuration=self.CONFIGURATION)
+        message.add(4, (0, 0, 0))
+        with pytest.raises(AssertionError):
+            message.add(3, (0, 0, 0))
+
+    def test_clear(self, message):
+        header = message.bytes
+        message.add(3, (1, 2, 3))
+        message.clear()
+        assert message.bytes == header
+
+    def test_invalid_configuration_id(self):
+        with pytest.raises(ValueError):
+            HueStream.Message(configuration=('1a8d99cc', {3: (0,)}))
+
+    def test_decode_invalid(self, message):
+        message.add(3, (1, 2, 3))
+        with pytest.raises(ValueError):
+            HueStream.Message.decode(message.bytes[:-1])
+        with pytest.raises(ValueError):
+            HueStream.Message.decode(message.bytes[:40])
+        data = bytearray(message.bytes)
+        data[9] = 3
+        with pytest.raises(ValueError):
+            HueStream.Message.decode(data)
+
+    def test_stream_renders_channels(self):
+        stream = HueStream(7, client=None, configuration=self.CONFIGURATION)
+        assert stream.stream_version == 2
+        lights = [Light(3), Light(4)]
+        lights[1].rgb = (1.0, 0.0, 0.0)
+        message = stream.render(lights)
+        assert HueStream.Message.decode(message.buffer) == \
+            {0: (0, 0, 0), 1: (0xffff, 0, 0), 2: (0xffff, 0, 0)}
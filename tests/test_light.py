@@ -1,6 +1,8 @@
 import pytest
+from array import array
 from math import isclose
-from midihue import Light
+from midihue import Light, LightBank
+from midihue import light as light_module
 
 
 class TestLight:
@@ -59,6 +61,49 @@ class TestLight:
     def test_get_rgb_int(self, light):
         assert light.rgb_int == (9830, 19660, 26214)
 
+    def test_version_increments_on_write(self, light):
+        version = light.version
+        light.rgb = (0.1, 0.2, 0.3)
+        light.h = 0.5
+        assert light.version == version + 2
+
+    def test_rgb_int_cached(self, light):
+        assert light.rgb_int is light.rgb_int
+
+    def test_rgb_int_invalidated_on_write(self, light):
+        light.rgb_int
+        light.r = 1.0
+        assert light.rgb_int[0] == 65535
+
+    def test_cache_invalidated_by_bank_write(self, light):
+        light.hsv
+        light.rgb
+        light.rgb_int
+        bank = light.bank
+        if light._colorspace == 'hsv':
+            bank.hsv[0:3] = array('d', (0.0, 0.0, 1.0))
+        else:
+            bank.rgb[0:3] = array('d', (1.0, 1.0, 1.0))
+        bank.versions[0] += 1
+        assert light.rgb_int == (65535, 65535, 65535)
+        assert isclose(light.v, 1.0)
+
+    def test_bits_per_channel(self):
+        light = Light(1, bits_per_channel=8)
+        light.rgb = (1.0, 0.5, 0.0)
+        assert light.rgb_int == (255, 127, 0)
+
+    def test_no_arbitrary_attributes(self, light):
+        with pytest.raises(AttributeError):
+            light.brightness = 1.0
+
+    def test_version_unchanged_on_read(self, light):
+        version = light.version
+        light.rgb
+        light.h
+        light.rgb_int
+        assert light.version == version
+
     @pytest.mark.parametrize(
         'value,expected',
         [
@@ -150,3 +195,84 @@ class TestLight:
         def test_get_set_v(self, light, value, expected):
             light.v = value
             assert isclose(light.v, expected)
+
+
+class TestLightBank:
+
+    @pytest.fixture(params=['python', 'numpy'])
+    def converter(self, request, monkeypatch):
+        light_module._import_numpy()
+        if request.param == 'python':
+            monkeypatch.setattr(light_module, 'np', None)
+        elif light_module.np is None:
+            pytest.skip('NumPy is not installed')
+        else:
+            monkeypatch.setattr(light_module, '_NUMPY_MIN_SLOTS', 0)
+        return request.param
+
+    @pytest.fixture
+    def bank(self):
+        bank = LightBank()
+        for light_id in range(1, 9):
+            bank.add(light_id)
+        bank.add(20, colorspace='rgb')
+        bank.add(21, bits_per_channel=8)
+        return bank
+
+    def test_len_and_ids(self, bank):
+        assert len(bank) == 10
+        assert list(bank.ids) == [1, 2, 3, 4, 5, 6, 7, 8, 20, 21]
+        assert [light.light_id for light in bank] == list(bank.ids)
+
+    def test_light_is_view(self, bank):
+        light = bank[2]
+        light.hsv = (0.25, 0.5, 0.75)
+        assert tuple(bank.hsv[6:9]) == (0.25, 0.5, 0.75)
+        assert light.bank is bank
+        assert light.slot == 2
+
+    def test_version_per_slot(self, bank):
+        bank[3].v = 0.5
+        assert bank.versions[3] == 1
+        assert bank.versions[4] == 0
+
+    def test_layout(self, bank):
+        layout = bank.layout
+        bank[3].v = 0.5
+        assert bank.layout == layout
+        bank[3].light_id = 42
+        bank.add(43)
+        assert bank.layout == layout + 2
+
+    def test_version_past_32_bits(self, bank):
+        bank.versions[3] = 2 ** 32 - 1
+        bank[3].v = 0.5
+        assert bank[3].version == 2 ** 32
+
+    def test_standalone_light_has_own_bank(self):
+        light = Light(7)
+        assert len(light.bank) == 1
+
+    def test_convert_matches_light(self, bank, converter):
+        for slot, light in enumerate(bank):
+            light.hsv = (slot / 10.0, 1.0 - slot / 20.0, 0.3 + slot / 20.0)
+        bank[9].hsv = (1.0, 1.0, 1.0)
+        bank.convert()
+        for slot, light in enumerate(bank):
+            i = slot * 3
+            for expected, actual in zip(light.rgb, bank.rgb[i:i + 3]):
+                assert isclose(expected, actual, abs_tol=1e-12)
+            assert tuple(bank.rgb_int[i:i + 3]) == light.rgb_int
+
+    def test_convert_keeps_native_rgb(self, bank, converter):
+        bank[8].rgb = (0.1, 0.2, 0.3)
+        bank.convert()
+        assert tuple(bank.rgb[24:27]) == (0.1, 0.2, 0.3)
+        assert tuple(bank.rgb_int[24:27]) == bank[8].rgb_int
+
+    def test_add_after_convert(self, bank, converter):
+        bank.convert()
+        light = bank.add(30)
+        light.rgb = (1.0, 0.0, 0.0)
+        bank.convert()
+        assert tuple(bank.rgb_int[-3:]) == (65535, 0, 0)
@@ -0,0 +1,117 @@
+import time
+import pytest
+from midihue import LightBank
+from midihue.hue import HueStream
+from midihue.engine import Engine
+from midihue.manager import StreamManager
+from helpers import FakeSocket
+
+
+def make_stream(mocker, bridge_ip, group_id, delay=0.0):
+    client = mocker.MagicMock()
+    client.bridge_ip = bridge_ip
+    client.get_entertainment_configuration.return_value = None
+    stream = HueStream(group_id, client)
+    stream._socket = FakeSocket(delay=delay)
+    return stream
+
+
+class TestStreamManager:
+
+    @pytest.fixture
+    def manager(self):
+        return StreamManager()
+
+    @pytest.fixture
+    def bank(self):
+        bank = LightBank()
+        for light_id in (3, 4, 3, 5):
+            bank.add(light_id)
+        return bank
+
+    def test_key(self, mocker, manager):
+        stream = manager.add(make_stream(mocker, '10.0.0.2', 7))
+        assert manager.key(stream) == ('10.0.0.2', 7)
+        assert ('10.0.0.2', 7) in manager.timings
+
+    def test_duplicate_stream(self, mocker, manager):
+        manager.add(make_stream(mocker, '10.0.0.2', 7))
+        with pytest.raises(ValueError):
+            manager.add(make_stream(mocker, '10.0.0.2', 7))
+
+    def test_routes_lights(self, mocker, manager, bank):
+        a = manager.add(make_stream(mocker, '10.0.0.2', 7))
+        b = manager.add(make_stream(mocker, '10.0.0.3', 1))
+        # Light IDs are per bridge, so the same ID may appear on both
+        manager.route(bank[2], b)
+        manager.route(bank[3], b)
+        assert manager.update(bank)
+        assert len(a._socket.sent[0]) == 16 + 2 * 9
+        assert len(b._socket.sent[0]) == 16 + 2 * 9
+        assert b._socket.sent[0][16:19] == b'\x00\x00\x03'
+        assert b._socket.sent[0][25:28] == b'\x00\x00\x05'
+
+    def test_only_changed_streams_send(self, mocker, manager, bank):
+        a = manager.add(make_stream(mocker, '10.0.0.2', 7))
+        b = manager.add(make_stream(mocker, '10.0.0.3', 1))
+        manager.route(bank[3], b)
+        manager.update(bank)
+        bank[3].v = 1.0
+        frame = manager.render(bank)
+        assert [stream for stream, _ in frame] == [b]
+        bank[0].v = 1.0
+        bank[3].v = 0.5
+        manager.render(bank)
+        assert manager.render(bank) is None
+        assert a.frames_suppressed >= 1
+
+    def test_converts_bank_once(self, mocker, manager, bank):
+        a = manager.add(make_stream(mocker, '10.0.0.2', 7))
+        b = manager.add(make_stream(mocker, '10.0.0.3', 1))
+        manager.route(bank[3], b)
+        convert = mocker.spy(bank, 'convert')
+        bank[1].rgb = (1.0, 0.0, 0.0)
+        bank[3].rgb = (0.0, 0.0, 1.0)
+        assert manager.update(bank)
+        assert convert.call_count == 1
+        assert HueStream.Message.decode(a._socket.sent[0])[4] == \
+            (0xffff, 0, 0)
+        assert HueStream.Message.decode(b._socket.sent[0]) == \
+            {5: (0, 0, 0xffff)}
+        # Nothing changed
+        manager.render(bank)
+        assert convert.call_count == 1
+
+    def test_sends_in_parallel(self, mocker, manager, bank):
+        streams = [manager.add(make_stream(mocker, f'10.0.0.{n}', 1, 0.05))
+                   for n in range(4)]
+        for light, stream in zip(bank, streams):
+            manager.route(light, stream)
+        start = time.perf_counter()
+        manager.update(bank)
+        elapsed = time.perf_counter() - start
+        assert all(len(stream._socket.sent) == 1 for stream in streams)
+        assert elapsed < 0.15
+        for timing in manager.timings.values():
+            assert timing.count == 1
+            assert timing.last >= 0.05
+
+    def test_start_stop_all(self, mocker, manager):
+        streams = [manager.add(make_stream(mocker, f'10.0.0.{n}', 1))
+                   for n in range(2)]
+        for stream in streams:
+            mocker.patch.object(stream, '_connect')
+        manager.start()
+        manager.stop()
+        for stream in streams:
+            stream.client.set_stream_mode.assert_any_call(1, True)
+            stream.client.set_stream_mode.assert_called_with(1, False)
+
+    def test_drives_engine(self, mocker, manager, bank):
+        a = manager.add(make_stream(mocker, '10.0.0.2', 7))
+        b = manager.add(make_stream(mocker, '10.0.0.3', 1))
+        manager.route(bank[0], b)
+        engine = Engine(manager, bank, lambda msg: None)
+        engine.flush()
+        assert len(a._socket.sent) == 1
+        assert len(b._socket.sent) == 1
@@ -0,0 +1,287 @@
+import json
+import re
+import pytest
+from math import isclose
+from mido import Message
+from midihue.mapping import Mapping, MappingError, DEFAULT_MAPPING
+from helpers import cc
+
+
+class TestMapping:
+
+    @pytest.fixture
+    def config(self):
+        return {
+            'lights': [
+                {'id': 3, 'hsv': [0.0, 1.0, 1.0]},
+                {'id': 4, 'colorspace': 'rgb', 'rgb': [0.0, 0.0, 0.0]},
+            ],
+            'mappings': [
+                {'type': 'control_change', 'channel': 0, 'control': 20,
+                 'light': 3, 'param': 'h'},
+                {'type': 'control_change', 'channel': 1, 'control': 20,
+                 'lights': [3, 4], 'param': 'v', 'min': 0.5, 'max': 1.0},
+                {'type': 'note_on', 'note': 60, 'light': 4, 'param': 'r'},
+                {'type': 'note_off', 'note': 60, 'light': 4, 'param': 'r'},
+                {'type': 'pitchwheel', 'channel': 2, 'light': 5,
+                 'param': 'g'},
+            ]
+        }
+
+    @pytest.fixture
+    def mapping(self, config):
+        return Mapping(config)
+
+    def test_declares_lights(self, mapping):
+        assert list(mapping.lights.ids) == [3, 4, 5]
+        assert mapping.light(3).hsv == (0.0, 1.0, 1.0)
+        assert mapping.light(4)._colorspace == 'rgb'
+
+    def test_compiled_keys(self, mapping):
+        # 2 channel-specific CCs + 16 channels each for note on/off + 1
+        assert len(mapping) == 2 + 16 + 16 + 1
+
+    def test_dispatch_cc(self, mapping):
+        assert mapping.dispatch(Message('control_change', channel=0,
+                                        control=20, value=127))
+        assert isclose(mapping.light(3).h, 1.0)
+
+    def test_dispatch_scaled_multiple_lights(self, mapping):
+        mapping.dispatch(Message('control_change', channel=1,
+                                 control=20, value=0))
+        assert isclose(mapping.light(3).v, 0.5)
+        assert isclose(mapping.light(4).v, 0.5)
+
+    def test_dispatch_any_channel(self, mapping):
+        mapping.dispatch(Message('note_on', channel=9, note=60,
+                                 velocity=127))
+        assert isclose(mapping.light(4).r, 1.0)
+        mapping.dispatch(Message('note_off', channel=3, note=60,
+                                 velocity=64))
+        assert isclose(mapping.light(4).r, 0.0)
+
+    def test_dispatch_pitchwheel(self, mapping):
+        mapping.dispatch(Message('pitchwheel', channel=2, pitch=8191))
+        assert isclose(mapping.light(5).g, 1.0)
+
+    @pytest.mark.parametrize('msg', [
+        Message('control_change', channel=2, control=20, value=1),
+        Message('control_change', channel=0, control=21, value=1),
+        Message('program_change', channel=0, program=1),
+        Message('clock'),
+    ])
+    def test_dispatch_unmapped(self, mapping, msg):
+        versions = list(mapping.lights.versions)
+        assert not mapping.dispatch(msg)
+        assert list(mapping.lights.versions) == versions
+
+    def test_default_mapping(self):
+        mapping = Mapping(DEFAULT_MAPPING)
+        assert list(mapping.lights.ids) == [3, 4, 10]
+        mapping.dispatch(Message('control_change', control=78, value=0))
+        assert mapping.light(3).s == 0.0
+
+    @pytest.mark.parametrize('spec', [
+        {'type': 'sysex', 'light': 3, 'param': 'h'},
+        {'type': 'control_change', 'light': 3, 'param': 'h'},
+        {'control': 1, 'light': 3, 'param': 'x'},
+        {'control': 1, 'param': 'h'},
+        {'control': 1, 'channel': 16, 'light': 3, 'param': 'h'},
+    ])
+    def test_invalid_mapping(self, spec):
+        with pytest.raises(MappingError):
+            Mapping({'mappings': [spec]})
+
+    @pytest.mark.parametrize('config, path', [
+        ({'mappings': [{'control': 1, 'channel': 'x', 'light': 3,
+                        'param': 'h'}]}, 'mappings[0].channel'),
+        ({'mappings': [{'control': 1, 'light': None, 'param': 'h'}]},
+         'mappings[0].light'),
+        ({'mappings': [{'control': 1, 'light': 3, 'param': 'h'},
+                       {'control': 'x', 'light': 3, 'param': 'h'}]},
+         'mappings[1].control'),
+        ({'mappings': [{'control': 1, 'lights': [3, 'a'], 'param': 'h'}]},
+         'mappings[0].lights[1]'),
+        ({'mappings': [{'control': 1, 'light': 3, 'param': 'h',
+                        'max': 'high'}]}, 'mappings[0].max'),
+        ({'mappings': [{'control': 1, 'light': 3, 'param': 'h',
+                        'smooth': True, 'smooth_time': []}]},
+         'mappings[0].smooth_time'),
+        ({'mappings': [{'note': 36, 'type': 'note_on', 'scene': 1,
+                        'fade': 'slow'}]}, 'mappings[0].fade'),
+        ({'effects': [{'id': 'a', 'type': 'lfo', 'light': {}}]},
+         'effects[0].light'),
+        ({'lights': [{'id': 3, 'hsv': 'red'}]}, 'lights[0].hsv'),
+        ({'mappings': ['cc 1']}, 'mappings[0]'),
+    ])
+    def test_invalid_value_names_key(self, config, path):
+        with pytest.raises(MappingError, match=re.escape(path)):
+            Mapping(config)
+
+    def test_duplicate_light(self):
+        with pytest.raises(MappingError):
+            Mapping({'lights': [1, 1]})
+
+    def test_load_json(self, tmp_path, config):
+        path = tmp_path / 'mapping.json'
+        path.write_text(json.dumps(config))
+        assert len(Mapping.load(str(path))) == 35
+
+    def test_load_yaml(self, tmp_path):
+        yaml = pytest.importorskip('yaml')
+        path = tmp_path / 'mapping.yaml'
+        path.write_text(yaml.safe_dump(DEFAULT_MAPPING))
+        assert list(Mapping.load(str(path)).lights.ids) == [3, 4, 10]
+
+    def test_load_toml(self, tmp_path):
+        pytest.importorskip('tomllib')
+        path = tmp_path / 'mapping.toml'
+        path.write_text('[[mappings]]\n'
+                        'control = 7\n'
+                        'light = 1\n'
+                        'param = "v"\n')
+        assert len(Mapping.load(str(path))) == 16
+
+    def test_load_unsupported(self, tmp_path):
+        path = tmp_path / 'mapping.ini'
+        path.write_text('')
+        with pytest.raises(MappingError):
+            Mapping.load(str(path))
+
+    def test_load_invalid(self, tmp_path):
+        path = tmp_path / 'mapping.json'
+        path.write_text('{')
+        with pytest.raises(MappingError):
+            Mapping.load(str(path))
+
+
+class TestMappingEffects:
+
+    @pytest.fixture
+    def mapping(self):
+        return Mapping({
+            'effects': [
+                {'id': 'wobble', 'type': 'lfo', 'lights': [3, 4],
+                 'param': 'h', 'waveform': 'triangle', 'rate': 0.5},
+                {'id': 'flash', 'type': 'fade', 'light': 3, 'start': 1.0,
+                 'end': 0.0, 'duration': 0.5},
+            ],
+            'mappings': [
+                {'control': 21, 'effect': 'wobble', 'param': 'rate',
+                 'min': 0.1, 'max': 10.0},
+                {'type': 'note_on', 'note': 36, 'effect': 'flash',
+                 'param': 'trigger'},
+            ]
+        })
+
+    def test_declares_effects_and_lights(self, mapping):
+        assert len(mapping.effects) == 2
+        assert list(mapping.lights.ids) == [3, 4]
+        assert mapping.effect('wobble').lights == \
+            [mapping.light(3), mapping.light(4)]
+
+    def test_dispatch_effect_param(self, mapping):
+        mapping.dispatch(Message('control_change', control=21, value=127))
+        assert isclose(mapping.effect('wobble').rate, 10.0)
+
+    def test_dispatch_trigger(self, mapping):
+        fade = mapping.effect('flash')
+        fade.render(0.0)
+        fade.render(1.0)
+        assert fade.done
+        mapping.dispatch(Message('note_on', note=36, velocity=100))
+        assert not fade.done
+
+    @pytest.mark.parametrize('effect, mapping_spec', [
+        ({'type': 'lfo', 'light': 3}, None),
+        ({'id': 'a', 'type': 'sparkle', 'light': 3}, None),
+        ({'id': 'a', 'type': 'lfo'}, None),
+        ({'id': 'a', 'type': 'lfo', 'light': 3, 'speed': 2}, None),
+        ({'id': 'a', 'type': 'lfo', 'light': 3, 'waveform': 'noise'}, None),
+        ({'id': 'a', 'type': 'lfo', 'light': 3},
+         {'control': 1, 'effect': 'b', 'param': 'rate'}),
+        ({'id': 'a', 'type': 'lfo', 'light': 3},
+         {'control': 1, 'effect': 'a', 'param': 'width'}),
+    ])
+    def test_invalid(self, effect, mapping_spec):
+        config = {'effects': [effect],
+                  'mappings': [mapping_spec] if mapping_spec else []}
+        with pytest.raises(MappingError):
+            Mapping(config)
+
+
+class TestMappingHighResolution:
+
+    @pytest.fixture
+    def mapping(self):
+        return Mapping({
+            'mappings': [
+                {'control': 1, 'fine': True, 'light': 3, 'param': 'h'},
+                {'type': 'nrpn', 'nrpn': 300, 'light': 3, 'param': 's'},
+                {'control': 6, 'channel': 1, 'light': 3, 'param': 'v'},
+                {'control': 20, 'light': 4, 'param': 'v',
+                 'smooth': 'linear', 'smooth_time': 0.1},
+            ]
+        })
+
+    def test_fine_cc(self, mapping):
+        light = mapping.light(3)
+        mapping.dispatch(cc(1, 64))
+        assert light.h == pytest.approx(64 * 128 / 16383)
+        mapping.dispatch(cc(33, 100))
+        assert light.h == pytest.approx((64 * 128 + 100) / 16383)
+        mapping.dispatch(cc(1, 127))
+        mapping.dispatch(cc(33, 127))
+        assert light.h == 1.0
+
+    def test_nrpn(self, mapping):
+        light = mapping.light(3)
+        light.s = 0.0
+        messages = [cc(99, 2), cc(98, 44), cc(6, 100), cc(38, 5)]
+        assert all(mapping.dispatch(msg) for msg in messages)
+        assert light.s == pytest.approx((100 * 128 + 5) / 16383)
+
+    def test_other_nrpn_ignored(self, mapping):
+        light = mapping.light(3)
+        light.s = 0.0
+        for msg in (cc(99, 2), cc(98, 45), cc(6, 100)):
+            mapping.dispatch(msg)
+        assert light.s == 0.0
+
+    def test_data_entry_without_nrpn(self, mapping):
+        light = mapping.light(3)
+        # Selecting an RPN deselects the NRPN
+        for msg in (cc(99, 2), cc(98, 44), cc(101, 0), cc(100, 0)):
+            mapping.dispatch(msg)
+        assert not mapping.dispatch(cc(6, 100))
+        # A plain CC on a channel without NRPN mappings
+        assert mapping.dispatch(cc(6, 127, channel=1))
+        assert light.v == 1.0
+
+    def test_smoothed(self, mapping):
+        light = mapping.light(4)
+        light.v = 0.0
+        smoother = mapping.smoother
+        smoother.update(0.0)
+        mapping.dispatch(cc(20, 127))
+        assert light.v == 0.0
+        smoother.update(0.05)
+        assert light.v == pytest.approx(0.5)
+        smoother.update(0.1)
+        assert light.v == 1.0
+
+    @pytest.mark.parametrize('spec', [
+        {'control': 40, 'fine': True, 'light': 3, 'param': 'h'},
+        {'control': 6, 'fine': True, 'light': 3, 'param': 'h'},
+        {'type': 'nrpn', 'nrpn': 20000, 'light': 3, 'param': 'h'},
+        {'type': 'nrpn', 'light': 3, 'param': 'h'},
+        {'control': 1, 'light': 3, 'param': 'h', 'smooth': 'cubic'},
+        {'control': 1, 'light': 3, 'param': 'h', 'smooth': True,
+         'smooth_time': 'slow'},
+    ])
+    def test_invalid(self, spec):
+        config = {'mappings': [
+            {'type': 'nrpn', 'nrpn': 1, 'light': 3, 'param': 'h'}, spec
+        ]}
+        with pytest.raises(MappingError):
+            Mapping(config)
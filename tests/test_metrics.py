@@ -0,0 +1,160 @@
+import io
+import os
+import signal
+import time
+import pytest
+import requests
+from mido import Message
+from midihue import LightBank
+from midihue.clock import BeatScheduler
+from midihue.engine import Engine
+from midihue.hue import HueStream
+from midihue.metrics import Histogram, Metrics
+from helpers import FakeSocket
+
+
+class TestHistogram:
+
+    def test_summary(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.record(value / 1000)
+        mean, stdev, percentiles = histogram.summary()
+        assert mean == pytest.approx(0.0505)
+        assert stdev == pytest.approx(0.02887, rel=1e-3)
+        assert percentiles == {0.5: 0.051, 0.9: 0.091, 0.99: 0.1}
+        assert histogram.count == 100
+        assert histogram.max == 0.1
+
+    def test_ring_keeps_latest(self):
+        histogram = Histogram(size=4)
+        for value in range(10):
+            histogram.record(value)
+        assert histogram.samples() == [6, 7, 8, 9]
+        assert histogram.count == 10
+        assert histogram.total == 45
+
+    def test_empty(self):
+        assert Histogram().summary() == \
+            (0.0, 0.0, {0.5: 0.0, 0.9: 0.0, 0.99: 0.0})
+
+
+class TestMetrics:
+
+    @pytest.fixture
+    def socket(self):
+        return FakeSocket()
+
+    @pytest.fixture
+    def stream(self, socket):
+        stream = HueStream(7, client=None)
+        stream._socket = socket
+        return stream
+
+    @pytest.fixture
+    def bank(self):
+        bank = LightBank()
+        bank.add(3)
+        bank.add(4)
+        return bank
+
+    @pytest.fixture
+    def engine(self, stream, bank):
+        def handle(value):
+            bank[0].v = value
+        return Engine(stream, bank, handle)
+
+    @pytest.fixture
+    def metrics(self, engine, stream):
+        metrics = Metrics()
+        metrics.watch_engine(engine)
+        metrics.watch_stream(stream)
+        yield metrics
+        metrics.close()
+
+    def test_disabled_by_default(self, engine, stream):
+        assert engine.metrics is None
+        assert stream.metrics is None
+        engine.submit(0.5)
+        engine.flush()
+
+    def test_records_stages(self, engine, metrics):
+        for i in range(3):
+            engine.submit(i / 3)
+            engine.flush()
+        for stage in ('midi', 'convert', 'encode', 'send', 'frame'):
+            assert metrics.stages[stage].count == 3
+        assert metrics.stages['interval'].count == 2
+
+    def test_suppressed_frames_not_timed(self, engine, metrics):
+        engine.flush()
+        engine.flush()
+        assert metrics.stages['frame'].count == 1
+        assert metrics.stages['encode'].count == 1
+
+    def test_backlog(self, engine, metrics):
+        engine.submit(0.1)
+        engine.submit(0.2)
+        assert 'midi_backlog 2' in metrics.report()
+        engine.flush()
+        assert 'midi_backlog 0' in metrics.report()
+
+    def test_report(self, engine, metrics):
+        engine.submit(0.5)
+        engine.flush()
+        report = metrics.report()
+        assert report.splitlines()[0].split() == \
+            ['stage', 'count', 'mean', 'p50', 'p90', 'p99', 'max']
+        assert 'frames_sent 1' in report
+        assert 'frame rate' in report
+
+    def test_prometheus(self, engine, metrics):
+        engine.submit(0.5)
+        engine.flush()
+        text = metrics.prometheus()
+        assert '# TYPE midihue_send_seconds summary' in text
+        assert 'midihue_send_seconds{quantile="0.99"}' in text
+        assert 'midihue_send_seconds_count 1' in text
+        assert 'midihue_frames_sent 1' in text
+
+    def test_serve(self, engine, metrics):
+        engine.submit(0.5)
+        engine.flush()
+        port = metrics.serve(0)
+        req = requests.get(f'http://127.0.0.1:{port}/metrics')
+        assert req.status_code == 200
+        assert 'midihue_frame_seconds_count 1' in req.text
+        assert requests.get(f'http://127.0.0.1:{port}/').status_code == 404
+
+    @pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'),
+                        reason='SIGUSR1 is not available')
+    def test_signal_dump(self, metrics):
+        previous = signal.getsignal(signal.SIGUSR1)
+        out = io.StringIO()
+        try:
+            assert metrics.install_signal_handler(out)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            deadline = time.monotonic() + 1.0
+            while not out.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        assert out.getvalue().startswith('stage')
+
+    def test_collapsed_gauge(self, stream, bank):
+        engine = Engine(stream, bank, lambda msg: None, coalesce=True)
+        metrics = Metrics()
+        metrics.watch_engine(engine)
+        for value in range(3):
+            engine.submit(Message('control_change', control=1, value=value))
+        engine.flush()
+        assert 'midi_collapsed 2' in metrics.report()
+        assert metrics.stages['midi'].count == 1
+
+    def test_tempo_gauges(self, stream, bank):
+        engine = Engine(stream, bank, lambda msg: None,
+                        scheduler=BeatScheduler())
+        metrics = Metrics()
+        metrics.watch_engine(engine)
+        assert 'tempo_bpm 0.0' in metrics.report()
+        assert 'midihue_beat_offset_seconds 0.0' in metrics.prometheus()
@@ -0,0 +1,138 @@
+import multiprocessing
+import time
+from multiprocessing.sharedctypes import RawValue
+import pytest
+from mido import Message
+from midihue.effects import Effect
+from midihue.fakebridge import FakeBridge
+from midihue.hue import HueStream
+from midihue.multiproc import FrameBuffer, MultiprocessRunner, pin_to_cpu
+from helpers import wait_for
+
+RATE = 50
+PERIOD = 1.0 / RATE
+
+
+def write_frames(buffer, stop):
+    # Every byte of a frame is the same, so a torn read shows up as mixed
+    # values
+    i = 0
+    while not stop.value:
+        i += 1
+        buffer.publish(bytes([i % 256]) * (1 + i % buffer.size))
+
+
+def midi_source():
+    """A CC sweep, one message every 5 ms"""
+    value = 0
+    while True:
+        value = (value + 1) % 128
+        yield Message('control_change', control=79, value=value)
+        time.sleep(0.005)
+
+
+class Stall(Effect):
+    """Busy-waits `stall` seconds every `every` seconds of rendering"""
+
+    def __init__(self, lights, stall, every, stalls):
+        super().__init__(lights)
+        self.stall = stall
+        self.every = every
+        self.stalls = stalls
+        self._next = None
+
+    def render(self, now):
+        if self._next is None:
+            self._next = now + self.every
+        elif now >= self._next:
+            end = time.perf_counter() + self.stall
+            while time.perf_counter() < end:
+                pass
+            self.stalls.value += 1
+            self._next = time.perf_counter() + self.every
+
+
+class AddStall:
+
+    def __init__(self, stall, every):
+        self.stall = stall
+        self.every = every
+        self.stalls = RawValue('i', 0)
+
+    def __call__(self, engine):
+        engine.effects.add(Stall((), self.stall, self.every, self.stalls))
+
+
+class TestFrameBuffer:
+
+    def test_publish_and_read(self):
+        buffer = FrameBuffer(16)
+        out = bytearray(16)
+        assert buffer.read(out) == (0, 0)
+        buffer.publish(b'frame')
+        sequence, length = buffer.read(out, 0)
+        assert length == 5
+        assert out[:length] == b'frame'
+        assert buffer.read(out, sequence) == (sequence, None)
+
+    def test_too_large(self):
+        with pytest.raises(AssertionError):
+            FrameBuffer(4).publish(b'frame')
+
+    def test_no_torn_reads_across_processes(self):
+        buffer = FrameBuffer(64)
+        stop = RawValue('b', 0)
+        ctx = multiprocessing.get_context('spawn')
+        writer = ctx.Process(target=write_frames, args=(buffer, stop))
+        writer.start()
+        out = bytearray(64)
+        sequence, reads = None, 0
+        # However slowly the writer starts, read until enough distinct
+        # frames were seen
+        deadline = time.monotonic() + 30.0
+        try:
+            assert wait_for(lambda: buffer.sequence > 0, 10.0)
+            while reads < 100 and time.monotonic() < deadline:
+                sequence, length = buffer.read(out, sequence)
+                if length:
+                    reads += 1
+                    assert out[:length] == bytes([out[0]]) * length
+        finally:
+            stop.value = 1
+            writer.join()
+        assert reads == 100
+
+
+class TestMultiprocessRunner:
+
+    def test_output_cadence_holds_during_render_stalls(self, tmp_path):
+        configure = AddStall(stall=0.15, every=0.3)
+        with FakeBridge() as bridge:
+            client = {'credentials_path': str(tmp_path / 'creds'),
+                      'bridge_ip': bridge.host,
+                      'bridge_port': bridge.http_port}
+            runner = MultiprocessRunner(
+                bridge.group_id, client, source=midi_source, rate=RATE,
+                stream={'port': bridge.stream_port}, configure=configure,
+                cpus=(0, 0, 0)
+            )
+            with runner:
+                assert wait_for(lambda: len(bridge.frames) > 10, 20.0)
+                start = len(bridge.frames)
+                time.sleep(1.5)
+                frames = bridge.frames[start:]
+            # The output process leaves streaming mode on the way out
+            assert not bridge.stream_active(bridge.group_id)
+
+        assert configure.stalls.value >= 3
+        intervals = [b[0] - a[0] for a, b in zip(frames, frames[1:])]
+        # The render stalls are 7.5 frames long, but output only ever
+        # waits for its own clock
+        assert max(intervals) < 3 * PERIOD, \
+            f'longest gap {max(intervals) * 1000:.1f} ms'
+        assert len(frames) >= 1.5 * RATE * 0.8
+        values = {HueStream.Message.decode(data)[3] for _, data in frames}
+        assert len(values) > 10
+
+    def test_pin_to_cpu(self):
+        assert pin_to_cpu(None) is False
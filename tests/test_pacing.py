@@ -0,0 +1,143 @@
+import pytest
+from midihue import LightBank
+from midihue.engine import Engine
+from midihue.hue import HueStream
+from midihue.metrics import Metrics
+from midihue.pacing import Pacer, MIN_RATE, RATE_WINDOW
+from helpers import FakeSocket
+
+
+class TestPacer:
+
+    def test_token_bucket(self):
+        pacer = Pacer(rate=10.0, burst=2.0)
+        assert pacer.acquire(now=0.0)
+        assert pacer.acquire(now=0.0)
+        assert not pacer.acquire(now=0.05)
+        assert pacer.acquire(now=0.1)
+        assert not pacer.acquire(now=0.1)
+
+    def test_burst_is_capped(self):
+        pacer = Pacer(rate=10.0, burst=2.0)
+        pacer.acquire(now=0.0)
+        allowed = sum(pacer.acquire(now=10.0) for _ in range(5))
+        assert allowed == 2
+
+    def test_effective_rate(self, monkeypatch):
+        pacer = Pacer()
+        for i in range(30):
+            pacer.sent(now=i * 0.05)
+        monkeypatch.setattr('time.monotonic', lambda: 1.5)
+        assert pacer.effective_rate == pytest.approx(20 / RATE_WINDOW,
+                                                     abs=1.0)
+        monkeypatch.setattr('time.monotonic', lambda: 100.0)
+        assert pacer.effective_rate == 0.0
+
+    def test_backoff_and_recovery(self):
+        pacer = Pacer(rate=20.0, adaptive=True)
+        pacer.backoff()
+        assert pacer.rate == 10.0
+        assert not pacer.acquire(now=0.0)
+        for _ in range(3):
+            pacer.backoff()
+        assert pacer.rate == MIN_RATE
+        assert pacer.backoffs == 4
+        for i in range(1000):
+            pacer.sent(now=i * 0.05)
+        assert pacer.rate == 20.0
+
+    def test_slow_send_backs_off(self):
+        pacer = Pacer(rate=20.0, adaptive=True, slow_send=0.01)
+        pacer.sent(now=0.0, duration=0.001)
+        assert pacer.rate == 20.0
+        pacer.sent(now=0.0, duration=0.02)
+        assert pacer.rate == 10.0
+
+    def test_fixed_rate(self):
+        pacer = Pacer(rate=20.0)
+        pacer.backoff()
+        pacer.sent(now=0.0, duration=1.0)
+        assert pacer.rate == 20.0
+        assert pacer.backoffs == 1
+
+    @pytest.mark.parametrize('options', [{'rate': 0}, {'burst': 0.5}])
+    def test_invalid(self, options):
+        with pytest.raises(ValueError):
+            Pacer(**options)
+
+
+class TestPacedStream:
+
+    @pytest.fixture
+    def pacer(self):
+        return Pacer(rate=1.0, burst=1.0)
+
+    @pytest.fixture
+    def socket(self):
+        return FakeSocket()
+
+    @pytest.fixture
+    def stream(self, socket, pacer):
+        stream = HueStream(7, client=None, pacer=pacer)
+        stream._socket = socket
+        return stream
+
+    @pytest.fixture
+    def bank(self):
+        bank = LightBank()
+        bank.add(3)
+        return bank
+
+    @pytest.fixture
+    def engine(self, stream, bank):
+        def handle(value):
+            bank[0].v = value
+        return Engine(stream, bank, handle)
+
+    def test_sends_newest_frame(self, engine, bank, socket, pacer):
+        for value in (0.25, 0.5, 0.75):
+            engine.submit(value)
+            engine.flush()
+        assert len(socket.sent) == 1
+        assert pacer.held == 2
+        assert pacer.dropped == 1
+        # Nothing changed, but the held frame is still due
+        pacer.rate = 1e9
+        engine.flush()
+        assert len(socket.sent) == 2
+        lights = HueStream.Message.decode(socket.sent[-1])
+        assert lights[3] == bank[0].rgb_int
+        engine.flush()
+        assert len(socket.sent) == 2
+
+    def test_held_frame_unchanged(self, engine, socket, pacer):
+        engine.submit(0.25)
+        engine.flush()
+        engine.submit(0.5)
+        for _ in range(3):
+            engine.flush()
+        assert len(socket.sent) == 1
+        assert pacer.held == 1
+        assert pacer.dropped == 0
+
+    def test_blocked_send_backs_off(self, stream, socket, bank):
+        stream.pacer = Pacer(rate=20.0, adaptive=True)
+        socket.error = BlockingIOError()
+        stream.send(stream.render(bank))
+        assert stream.frames_dropped == 1
+        assert stream.pacer.rate == 10.0
+
+    def test_metrics(self, engine, stream, pacer):
+        metrics = Metrics()
+        try:
+            metrics.watch_stream(stream)
+            engine.submit(0.5)
+            engine.flush()
+            engine.submit(0.75)
+            engine.flush()
+            text = metrics.prometheus()
+        finally:
+            metrics.close()
+        assert 'midihue_send_rate_hz 1.0' in text
+        assert 'midihue_send_rate_limit_hz 1.0' in text
+        assert 'midihue_frames_paced 1' in text
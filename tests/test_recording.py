@@ -0,0 +1,186 @@
+import time
+import pytest
+from mido import Message
+from midihue.hue import HueStream
+from midihue.engine import Engine
+from midihue.mapping import Mapping, DEFAULT_MAPPING
+from midihue.recording import Recorder, Recording, ReplayPort, \
+    RecordingError, MIDI, FRAMES
+from helpers import FakeSocket, cc
+
+SESSION = [
+    (0.0, cc(77, 10)),
+    (0.01, Message('note_on', note=60, velocity=100)),
+    (0.025, cc(78, 127, channel=3)),
+    (0.1, Message('pitchwheel', pitch=-2000)),
+    (0.2, cc(79, 64)),
+]
+
+
+@pytest.fixture
+def session(tmp_path):
+    path = str(tmp_path / 'session.mhr')
+    with Recorder(path) as recorder:
+        for now, msg in SESSION:
+            recorder.record(msg, now=100.0 + now)
+    return path
+
+
+def play(path, stream):
+    """Feeds a recording through the default mapping one frame per
+    message, returning the frames written by the stream's recorder
+    """
+    mapping = Mapping(DEFAULT_MAPPING)
+    engine = Engine(stream, mapping.lights, mapping.dispatch)
+    with ReplayPort(path, speed=0) as port:
+        for msg in port:
+            engine.submit(msg)
+            engine.flush()
+    stream.recorder.close()
+    return Recording(stream.recorder.path)
+
+
+class TestRecording:
+
+    def test_round_trip(self, session):
+        with Recording(session) as recording:
+            assert recording.kind == MIDI
+            assert len(recording) == len(SESSION)
+            for (now, msg), (expected_now, expected) in \
+                    zip(recording.messages(), SESSION):
+                assert now == pytest.approx(expected_now, abs=1e-6)
+                assert msg == expected
+            assert recording.duration == pytest.approx(0.2, abs=1e-6)
+
+    def test_records_are_compact(self, session):
+        size = sum(len(msg.bytes()) + 8 for _, msg in SESSION)
+        with open(session, 'rb') as file:
+            assert len(file.read()) == 9 + size
+
+    def test_truncated_record_ignored(self, session):
+        with open(session, 'ab') as file:
+            file.write(b'\x00\x00\x00\x00\x03\x00\x00\x00\x90')
+        with Recording(session) as recording:
+            assert len(recording) == len(SESSION)
+
+    def test_large_record(self, tmp_path):
+        path = str(tmp_path / 'sysex.mhr')
+        data = bytes([0xf0]) + bytes(70000) + bytes([0xf7])
+        with Recorder(path) as recorder:
+            recorder.write(data, now=0.0)
+        with Recording(path) as recording:
+            assert [record for _, record in recording] == [data]
+
+    def test_version_1(self, tmp_path):
+        path = tmp_path / 'v1.mhr'
+        path.write_bytes(b'MIDIHUE\x01M'
+                         b'\x00\x00\x00\x00\x03\x00\xb0\x4d\x0a'
+                         b'\x10\x27\x00\x00\x03\x00\x90\x3c\x64')
+        with Recording(str(path)) as recording:
+            assert list(recording.messages()) == list(zip(
+                (0.0, 0.01), (cc(77, 10),
+                              Message('note_on', note=60, velocity=100))
+            ))
+
+    def test_records_outlive_recording(self, session):
+        recording = Recording(session)
+        records = list(recording)
+        recording.close()
+        assert records[0][1] == bytes(cc(77, 10).bytes())
+
+    def test_tee(self, tmp_path):
+        path = str(tmp_path / 'tee.mhr')
+        with Recorder(path) as recorder:
+            received = list(recorder.tee(msg for _, msg in SESSION))
+        assert received == [msg for _, msg in SESSION]
+        with Recording(path) as recording:
+            assert [msg for _, msg in recording.messages()] == received
+
+    def test_invalid(self, tmp_path):
+        path = tmp_path / 'invalid.mhr'
+        path.write_bytes(b'')
+        with pytest.raises(RecordingError):
+            Recording(str(path))
+        path.write_bytes(b'MThd\x00\x00\x00\x06\x00\x01')
+        with pytest.raises(RecordingError):
+            Recording(str(path))
+
+    def test_replay_frames_rejected(self, tmp_path):
+        path = str(tmp_path / 'frames.mhr')
+        Recorder(path, FRAMES).close()
+        with pytest.raises(RecordingError):
+            ReplayPort(path)
+
+
+class TestReplayPort:
+
+    def test_accelerated(self, session):
+        started = time.perf_counter()
+        times = []
+        with ReplayPort(session, speed=4.0) as port:
+            for msg in port:
+                times.append(time.perf_counter() - started)
+        assert len(times) == len(SESSION)
+        assert times[-1] == pytest.approx(0.05, abs=0.03)
+        assert times == sorted(times)
+
+    def test_as_fast_as_possible(self, session):
+        started = time.perf_counter()
+        with ReplayPort(session, speed=0) as port:
+            assert len(list(port)) == len(SESSION)
+        assert time.perf_counter() - started < 0.05
+
+    def test_loop(self, session):
+        port = ReplayPort(session, speed=0, loop=True)
+        received = []
+        for msg in port:
+            received.append(msg)
+            if len(received) == 2 * len(SESSION) + 1:
+                port.close()
+        assert received[len(SESSION):2 * len(SESSION)] == \
+            [msg for _, msg in SESSION]
+        assert port._recording._map.closed
+
+    def test_close_releases_recording(self, session):
+        port = ReplayPort(session, speed=0)
+        port.close()
+        assert port._recording._map.closed
+        port.close()
+        assert list(port) == []
+
+    def test_close_while_iterating(self, session):
+        port = ReplayPort(session, speed=0)
+        messages = iter(port)
+        next(messages)
+        port.close()
+        # Released once the iteration stops
+        assert not port._recording._map.closed
+        assert list(messages) == []
+        assert port._recording._map.closed
+
+
+class TestFrameRecording:
+
+    @pytest.fixture
+    def stream(self, tmp_path):
+        stream = HueStream(7, client=None)
+        stream._socket = FakeSocket()
+        stream.recorder = Recorder(str(tmp_path / 'frames.mhr'), FRAMES)
+        return stream
+
+    def test_records_sent_frames(self, session, stream):
+        with play(session, stream) as frames:
+            assert frames.kind == FRAMES
+            assert len(frames) == stream.frames_sent
+            states = list(frames.states())
+        # Only light 3 is mapped: hue, then saturation (on another
+        # channel, so ignored), then value
+        assert states[0][3] != states[-1][3]
+        assert states[-1][4] == (0xffff, 0, 0)
+
+    def test_replay_is_deterministic(self, session, tmp_path, stream):
+        with play(session, stream) as frames:
+            first = list(frames.states())
+        stream.recorder = Recorder(str(tmp_path / 'again.mhr'), FRAMES)
+        with play(session, stream) as frames:
+            assert list(frames.states()) == first
@@ -0,0 +1,182 @@
+import pytest
+from mido import Message
+from midihue import LightBank
+from midihue.mapping import Mapping, MappingError
+from midihue.scenes import SceneStore, SceneError
+
+
+@pytest.fixture
+def bank():
+    bank = LightBank()
+    for light_id in range(1, 4):
+        bank.add(light_id).hsv = (0.0, 1.0, 0.0)
+    bank.add(10, colorspace='rgb').rgb = (0.0, 0.0, 0.0)
+    return bank
+
+
+def look(bank, hue, level):
+    for light in bank:
+        if light.colorspace == 'hsv':
+            light.hsv = (hue, 1.0, level)
+        else:
+            light.rgb = (level, 0.0, 1.0 - level)
+
+
+class TestSceneStore:
+
+    def test_save_and_recall(self, bank):
+        store = SceneStore(bank, capacity=4)
+        look(bank, 0.5, 1.0)
+        store.save(2)
+        look(bank, 0.0, 0.0)
+        versions = list(bank.versions)
+        assert store.recall(2)
+        assert store.recalled == 2
+        assert bank[0].hsv == pytest.approx((0.5, 1.0, 1.0), abs=1e-4)
+        assert bank[3].rgb == pytest.approx((1.0, 0.0, 0.0), abs=1e-4)
+        assert list(bank.versions) == [v + 1 for v in versions]
+        assert not store.fading
+
+    def test_recall_unchanged_keeps_versions(self, bank):
+        store = SceneStore(bank)
+        store.save(0)
+        versions = list(bank.versions)
+        store.recall(0)
+        assert list(bank.versions) == versions
+
+    def test_empty_scene(self, bank):
+        store = SceneStore(bank, capacity=4)
+        assert len(store) == 0
+        assert not store.recall(1)
+        store.save(1)
+        assert 1 in store and len(store) == 1
+        store.delete(1)
+        assert 1 not in store
+
+    def test_invalid_scene(self, bank):
+        store = SceneStore(bank, capacity=4)
+        with pytest.raises(SceneError):
+            store.save(4)
+        with pytest.raises(SceneError):
+            store.recall(-1)
+
+    def test_compact(self, bank):
+        assert SceneStore(bank).record_size == 2 + 6 * len(bank)
+
+    def test_crossfade(self, bank):
+        store = SceneStore(bank, fade=1.0)
+        look(bank, 0.0, 1.0)
+        store.save(0)
+        look(bank, 0.0, 0.0)
+        store.recall(0)
+        assert store.fading
+        assert bank[0].v == 0.0
+        store.update(10.0)
+        store.update(10.25)
+        assert bank[0].v == pytest.approx(0.25, abs=1e-4)
+        assert bank[3].rgb == pytest.approx((0.25, 0.0, 0.75), abs=1e-4)
+        store.update(11.0)
+        assert bank[0].v == pytest.approx(1.0, abs=1e-4)
+        assert not store.fading
+        assert store.update(12.0) == 0
+
+    def test_crossfade_hue_short_way(self, bank):
+        store = SceneStore(bank, fade=1.0)
+        look(bank, 0.1, 1.0)
+        store.save(0)
+        look(bank, 0.9, 1.0)
+        store.recall(0)
+        store.update(0.0)
+        store.update(0.5)
+        assert bank[0].h == pytest.approx(0.0, abs=1e-4) or \
+            bank[0].h == pytest.approx(1.0, abs=1e-4)
+
+    def test_recall_overrides_fade(self, bank):
+        store = SceneStore(bank, fade=1.0)
+        look(bank, 0.0, 1.0)
+        store.save(0)
+        look(bank, 0.0, 0.0)
+        store.recall(0)
+        store.update(0.0)
+        store.save(1)
+        store.recall(1, fade=0.0)
+        assert not store.fading
+
+    def test_file(self, bank, tmp_path):
+        path = str(tmp_path / 'scenes.mhs')
+        look(bank, 0.25, 0.5)
+        with SceneStore(bank, path, capacity=300) as store:
+            store.save(299)
+        look(bank, 0.0, 0.0)
+        with SceneStore(bank, path) as store:
+            assert store.capacity == 300
+            assert len(store) == 1
+            store.recall(299)
+        assert bank[1].hsv == pytest.approx((0.25, 1.0, 0.5), abs=1e-4)
+
+    def test_file_matches_lights_by_id(self, bank, tmp_path):
+        path = str(tmp_path / 'scenes.mhs')
+        look(bank, 0.25, 0.5)
+        with SceneStore(bank, path) as store:
+            store.save(0)
+        other = LightBank()
+        other.add(3).hsv = (0.0, 0.0, 0.0)
+        other.add(7).hsv = (0.0, 0.0, 0.0)
+        with SceneStore(other, path) as store:
+            store.recall(0)
+        assert other[0].hsv == pytest.approx((0.25, 1.0, 0.5), abs=1e-4)
+        assert other[1].hsv == (0.0, 0.0, 0.0)
+
+    def test_invalid_file(self, bank, tmp_path):
+        path = tmp_path / 'scenes.mhs'
+        path.write_bytes(b'not scenes at all')
+        with pytest.raises(SceneError):
+            SceneStore(bank, str(path))
+
+
+class TestSceneMappings:
+
+    CONFIG = {
+        'lights': [{'id': 1, 'hsv': [0.0, 1.0, 1.0]}],
+        'scenes': {'capacity': 8, 'fade': 0.0},
+        'mappings': [
+            {'type': 'control_change', 'control': 1, 'light': 1,
+             'param': 'v'},
+            {'type': 'program_change', 'scene': 0},
+            {'type': 'note_on', 'note': 60, 'scene': 7, 'action': 'save'},
+            {'type': 'note_on', 'note': 61, 'scene': 7, 'fade': 2.0},
+        ],
+    }
+
+    def test_program_change_recall(self):
+        mapping = Mapping(self.CONFIG)
+        mapping.dispatch(Message('control_change', control=1, value=0))
+        mapping.scenes.save(5)
+        mapping.dispatch(Message('control_change', control=1, value=127))
+        assert mapping.dispatch(Message('program_change', program=5))
+        assert mapping.light(1).v == 0.0
+        # Past the last scene
+        assert not mapping.dispatch(Message('program_change', program=8))
+
+    def test_note_save_and_fade(self):
+        mapping = Mapping(self.CONFIG)
+        mapping.dispatch(Message('note_on', note=60, velocity=100))
+        assert 7 in mapping.scenes
+        mapping.dispatch(Message('control_change', control=1, value=0))
+        mapping.dispatch(Message('note_on', note=61, velocity=0))
+        assert not mapping.scenes.fading
+        mapping.dispatch(Message('note_on', note=61, velocity=100))
+        assert mapping.scenes.fading
+
+    @pytest.mark.parametrize('spec', [
+        {'type': 'note_on', 'note': 1, 'scene': 8},
+        {'type': 'note_on', 'note': 1, 'scene': 1, 'action': 'load'},
+        {'type': 'note_on', 'note': 1, 'scene': 'one'},
+    ])
+    def test_invalid(self, spec):
+        with pytest.raises(MappingError):
+            Mapping({'scenes': {'capacity': 8}, 'mappings': [spec]})
+
+    def test_invalid_options(self):
+        with pytest.raises(MappingError):
+            Mapping({'scenes': {'size': 8}})
@@ -0,0 +1,145 @@
+import math
+import pytest
+from midihue import Light, LightBank
+from midihue.smoothing import Smoother, MODES
+
+PERIOD = 0.02
+
+
+@pytest.fixture
+def bank():
+    bank = LightBank()
+    for light_id in range(1, 5):
+        bank.add(light_id).hsv = (0.0, 1.0, 0.0)
+    return bank
+
+
+def run(smoother, frames, start=0.0):
+    """Updates every frame period, returning the times"""
+    times = [start + i * PERIOD for i in range(frames)]
+    for now in times:
+        smoother.update(now)
+    return times
+
+
+class TestSmoother:
+
+    def test_linear(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v', 'linear', duration=0.1)
+        smoother.update(0.0)
+        smoother.set(channel, 1.0)
+        for frame in range(1, 6):
+            smoother.update(frame * PERIOD)
+            assert bank[0].v == pytest.approx(frame * 0.2)
+        assert smoother.active == 0
+
+    def test_exponential(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v', 'exponential', duration=0.1)
+        smoother.update(0.0)
+        smoother.set(channel, 1.0)
+        smoother.update(0.1)
+        assert bank[0].v == pytest.approx(1.0 - math.exp(-1.0))
+
+    def test_critical_no_overshoot(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v', 'critical', duration=0.1)
+        smoother.update(0.0)
+        smoother.set(channel, 1.0)
+        values = []
+        for now in run(smoother, 50, start=PERIOD):
+            values.append(bank[0].v)
+            if now == pytest.approx(0.1):
+                assert bank[0].v > 0.85
+        assert values == sorted(values)
+        assert max(values) <= 1.0
+        assert values[-1] == 1.0
+        assert smoother.active == 0
+
+    @pytest.mark.parametrize('mode', MODES)
+    def test_settles_on_target(self, bank, mode):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'h', mode, duration=0.05)
+        smoother.set(channel, 0.25)
+        run(smoother, 200)
+        assert bank[0].h == 0.25
+        assert smoother.active == 0
+
+    def test_fills_steps_between_messages(self, bank):
+        # A slow 7 bit sweep: each step is spread over several frames
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'h', 'linear', duration=0.1)
+        levels = set()
+        now = 0.0
+        for value in range(16):
+            smoother.set(channel, value / 127)
+            for _ in range(5):
+                smoother.update(now)
+                levels.add(round(bank[0].h * 0xffff))
+                now += PERIOD
+        assert len(levels) > 16 * 4
+
+    def test_batch_update(self, bank):
+        smoother = Smoother()
+        channels = [smoother.add(light, 'v', duration=0.0) for light in bank]
+        for channel in channels[1:3]:
+            smoother.set(channel, 0.5)
+        versions = list(bank.versions)
+        assert smoother.update(0.0) == 2
+        assert [light.v for light in bank] == [0.0, 0.5, 0.5, 0.0]
+        assert list(bank.versions) == \
+            [versions[0], versions[1] + 1, versions[2] + 1, versions[3]]
+        assert smoother.update(PERIOD) == 0
+
+    def test_rgb_param_on_hsv_light(self):
+        light = Light(1)
+        smoother = Smoother()
+        smoother.set(smoother.add(light, 'r', duration=0.0), 1.0)
+        smoother.update(0.0)
+        assert light.rgb == pytest.approx((1.0, 0.0, 0.0))
+
+    def test_follows_outside_changes(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v', 'linear', duration=0.1)
+        smoother.update(0.0)
+        smoother.set(channel, 1.0)
+        smoother.update(PERIOD)
+        # e.g. a scene recall
+        bank[0].v = 0.9
+        smoother.update(2 * PERIOD)
+        assert 0.9 < bank[0].v < 1.0
+        # A new target is approached from where the light is
+        bank[0].v = 0.0
+        smoother.set(channel, 0.5)
+        smoother.update(3 * PERIOD)
+        assert bank[0].v == pytest.approx(0.1)
+
+    def test_params_of_one_light(self, bank):
+        smoother = Smoother()
+        h = smoother.add(bank[0], 'h', duration=0.1)
+        v = smoother.add(bank[0], 'v', duration=0.1)
+        smoother.update(0.0)
+        smoother.set(h, 1.0)
+        smoother.set(v, 1.0)
+        run(smoother, 10, start=PERIOD)
+        # Writing one parameter doesn't reset the other
+        assert bank[0].h == pytest.approx(bank[0].v)
+
+    def test_add_twice_shares_channel(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v')
+        assert smoother.add(bank[0], 'v', 'linear') == channel
+        assert len(smoother) == 1
+
+    def test_targets_clamped(self, bank):
+        smoother = Smoother()
+        channel = smoother.add(bank[0], 'v', duration=0.0)
+        smoother.set(channel, 1.5)
+        assert smoother.target[channel] == 1.0
+
+    def test_invalid(self, bank):
+        with pytest.raises(ValueError):
+            Smoother().add(bank[0], 'v', 'cubic')
+        with pytest.raises(ValueError):
+            Smoother().add(bank[0], 'v', duration=-1.0)
@@ -0,0 +1,153 @@
+import pytest
+from mido import Message
+from midihue import LightBank
+from midihue.mapping import Mapping, MappingError
+from midihue.spatial import Gradient, Layout, Pulse, Wipe
+
+
+@pytest.fixture
+def bank():
+    bank = LightBank()
+    for light_id in range(1, 6):
+        bank.add(light_id).hsv = (0.0, 1.0, 0.0)
+    return bank
+
+
+@pytest.fixture
+def layout():
+    # A row from left to right, with light 5 in the middle at the back
+    return Layout({1: (-1.0, 0.0, 0.0), 2: (-0.5, 0.0, 0.0),
+                   3: (0.0, 0.0, 0.0), 4: (1.0, 0.0, 0.0),
+                   5: (0.0, -1.0)})
+
+
+def levels(lights):
+    return [light.v for light in lights]
+
+
+class TestLayout:
+
+    def test_positions(self, layout):
+        assert layout[5] == (0.0, -1.0, 0.0)
+        assert layout.get(9) == (0.0, 0.0, 0.0)
+        assert 9 not in layout and len(layout) == 5
+
+    def test_version(self, layout):
+        version = layout.version
+        layout.set(1, (-1.0, 0.0, 0.0))
+        assert layout.version == version
+        layout.update({1: (0.0, 0.0, 0.0), 9: (1.0, 1.0, 1.0)},
+                      replace=False)
+        assert layout[1] == (-1.0, 0.0, 0.0)
+        assert layout.version == version + 1
+
+    def test_invalid(self, layout):
+        with pytest.raises(ValueError):
+            layout.set(1, (1.0,))
+
+
+class TestSpatialEffects:
+
+    def test_gradient(self, bank, layout):
+        Gradient(bank, layout, start=0.2, end=1.0).render(0.0)
+        assert levels(bank) == pytest.approx([0.2, 0.4, 0.6, 1.0, 0.6])
+
+    def test_gradient_direction(self, bank, layout):
+        Gradient(bank, layout, direction=(0, 1)).render(0.0)
+        assert levels(bank) == pytest.approx([1.0] * 4 + [0.0])
+
+    def test_interpolates_between_points(self, bank, layout):
+        layout.set(2, (-0.99, 0.0, 0.0))
+        Gradient(bank, layout, resolution=2).render(0.0)
+        assert bank[1].v == pytest.approx(0.005)
+
+    def test_wipe(self, bank, layout):
+        wipe = Wipe(bank, layout, duration=1.0, softness=0.0)
+        wipe.render(0.0)
+        assert levels(bank) == [0.0] * 5
+        wipe.render(0.3)
+        assert levels(bank) == [1.0, 1.0, 0.0, 0.0, 0.0]
+        wipe.render(1.0)
+        assert levels(bank) == [1.0] * 5
+        assert wipe.done
+        wipe.trigger = 1.0
+        assert not wipe.done
+
+    def test_soft_wipe(self, bank, layout):
+        wipe = Wipe(bank, layout, direction=(-1, 0, 0), duration=1.0,
+                    softness=0.5)
+        wipe.render(0.0)
+        wipe.render(0.5)
+        assert levels(bank) == pytest.approx([0.0, 0.0, 0.5, 1.0, 0.5])
+
+    def test_pulse(self, bank, layout):
+        pulse = Pulse(bank, layout, rate=1.0, width=0.5)
+        pulse.render(0.0)
+        # Rings start before the center and end past the farthest lights
+        assert levels(bank) == [0.0] * 5
+        pulse.render(1 / 6)
+        assert levels(bank) == pytest.approx([0.0, 0.0, 1.0, 0.0, 0.0])
+        pulse.render(0.5)
+        assert levels(bank) == pytest.approx([0.0, 1.0, 0.0, 0.0, 0.0])
+        # Lights 1, 4 and 5 are farthest from the center
+        pulse.render(0.75)
+        assert levels(bank) == pytest.approx([0.5, 0.0, 0.0, 0.5, 0.5])
+
+    def test_replaced_when_layout_changes(self, bank, layout):
+        gradient = Gradient(bank, layout)
+        gradient.render(0.0)
+        layout.set(1, (2.0, 0.0, 0.0))
+        gradient.render(0.0)
+        assert bank[0].v == 1.0
+        assert bank[3].v == pytest.approx(0.6)
+
+    def test_numpy_matches(self, layout):
+        pytest.importorskip('numpy')
+        bank = LightBank()
+        for light_id in range(100):
+            bank.add(light_id)
+            layout.set(light_id, (light_id / 50 - 1.0, light_id % 7 / 7))
+        pulse = Pulse(bank, layout, center=(0.2, 0.1, 0.0), width=0.3)
+        pulse.render(0.0)
+        assert pulse._weights is not None
+        pulse.render(0.4)
+        expected = pulse.values(0.4)
+        pulse._weights = None
+        assert pulse.values(0.4) == pytest.approx(expected)
+
+    @pytest.mark.parametrize('options', [
+        {'direction': (0, 0, 0)}, {'direction': (1,)}, {'resolution': 0},
+    ])
+    def test_invalid(self, bank, layout, options):
+        with pytest.raises(ValueError):
+            Gradient(bank, layout, **options)
+
+
+class TestSpatialMappings:
+
+    CONFIG = {
+        'lights': [{'id': 1, 'position': [-1, 0, 0]},
+                   {'id': 2, 'position': [1, 0, 0]}],
+        'effects': [{'id': 'wipe', 'type': 'wipe', 'lights': [1, 2],
+                     'duration': 1.0}],
+        'mappings': [{'type': 'note_on', 'note': 36, 'effect': 'wipe',
+                      'param': 'trigger'}],
+    }
+
+    def test_positions(self):
+        mapping = Mapping(self.CONFIG)
+        assert mapping.spatial
+        assert mapping.layout[2] == (1.0, 0.0, 0.0)
+        effect = mapping.effect('wipe')
+        effect.render(0.0)
+        effect.render(2.0)
+        assert effect.done
+        mapping.dispatch(Message('note_on', note=36, velocity=100))
+        assert not effect.done
+
+    def test_not_spatial(self):
+        assert not Mapping({'lights': [1]}).spatial
+
+    def test_invalid_position(self):
+        with pytest.raises(MappingError):
+            Mapping({'lights': [{'id': 1, 'position': 'left'}]})